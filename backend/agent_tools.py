@@ -0,0 +1,427 @@
+"""Tool catalog and prompts for running agent turns on the server.
+
+Mirrors the tool definitions and prompt that AgentChat.jsx used to assemble in
+the browser, so /agents/{agent_id}/chat produces the same tool calls.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+GOOGLE_INTEGRATIONS = ["gmail", "calendar", "drive", "sheets", "docs"]
+
+TOOL_CATALOG: List[Dict[str, Any]] = [
+    {
+        "name": "manage_crm",
+        "description": "מערכת ניהול לקוחות מקיפה (CRM) - הכלי היחיד שלך לכל פעולה שקשורה ללקוחות. תומך בחיפוש דינמי, ניהול מלא של נתוני לקוחות, עדכון שדות מותאמים אישית, וכל פעולות CRUD. Advanced Customer Relationship Management system - your single tool for all customer-related operations.",
+        "integration": "crm",
+        "arguments": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": [
+                        "search_customers",
+                        "get_customer_by_id",
+                        "create_customer",
+                        "update_customer",
+                        "delete_customer",
+                        "list_recent_customers"
+                    ],
+                    "description": "הפעולה לביצוע / Action to perform. כלל קריטי / CRITICAL RULE: search_customers = לחיפוש עם טקסט/שמות / for searching with text/names, get_customer_by_id = רק כשיש לך ID מספרי ברור / ONLY when you have a clear numeric ID."
+                },
+                "customer_id": {
+                    "type": "string",
+                    "description": "מזהה ייחודי של לקוח. אופציונלי - אם לא ידוע, השתמש ב-name או email לאיתור הלקוח."
+                },
+                "name": {
+                    "type": "string",
+                    "description": "שם הלקוח (מלא או חלקי). לחיפוש: כל חלק משם ימצא התאמות. ליצירה: שם מלא נדרש / Customer name (full or partial). For search: any part of name will find matches. For creation: full name required."
+                },
+                "email": {
+                    "type": "string",
+                    "description": "כתובת מייל של הלקוח. תומך בחיפוש מדויק או חלקי / Customer email address. Supports exact or partial search."
+                },
+                "company": {
+                    "type": "string",
+                    "description": "שם החברה. תומך בחיפוש חלקי - 'גוגל' ימצא 'גוגל ישראל בע״מ' / Company name. Supports partial search - 'Google' will find 'Google Israel Ltd'."
+                },
+                "phone": {
+                    "type": "string",
+                    "description": "מספר טלפון של הלקוח. כל פורמט מקובל (050-1234567, +972-50-1234567) / Customer phone number. Any format accepted (050-1234567, +972-50-1234567, etc.)."
+                },
+                "status": {
+                    "type": "string",
+                    "enum": [
+                        "lead",
+                        "prospect",
+                        "customer",
+                        "churned"
+                    ],
+                    "description": "סטטוס הלקוח: lead=לקוח פוטנציאלי, prospect=בתהליך מכירה, customer=לקוח קיים, churned=נטש / Customer status: lead=potential customer, prospect=in sales process, customer=existing client, churned=left."
+                },
+                "data_to_update": {
+                    "type": "object",
+                    "description": "אובייקט עם כל השדות לעדכון. יכול לכלול: name, email, company, phone, status, notes, custom_field_1-5, או כל שדה קיים. דוגמה: {'phone': '050-9999999', 'status': 'customer', 'custom_field_1': 'VIP'} / Object with all fields to update. Can include: name, email, company, phone, status, notes, custom_field_1-5, or any existing field. Example: {'phone': '050-9999999', 'status': 'customer', 'custom_field_1': 'VIP'}."
+                },
+                "notes": {
+                    "type": "string",
+                    "description": "הערות על הלקוח. יכול להוסיף מידע או להחליף קיים / Notes about the customer. Can add information or replace existing."
+                },
+                "custom_field_1": {
+                    "type": "string",
+                    "description": "שדה מותאם אישית 1 / Custom field 1"
+                },
+                "custom_field_2": {
+                    "type": "string",
+                    "description": "שדה מותאם אישית 2 / Custom field 2"
+                },
+                "custom_field_3": {
+                    "type": "string",
+                    "description": "שדה מותאם אישית 3 / Custom field 3"
+                },
+                "custom_field_4": {
+                    "type": "string",
+                    "description": "שדה מותאם אישית 4 / Custom field 4"
+                },
+                "custom_field_5": {
+                    "type": "string",
+                    "description": "שדה מותאם אישית 5 / Custom field 5"
+                },
+                "limit": {
+                    "type": "integer",
+                    "default": 5,
+                    "description": "מספר תוצאות מקסימלי בחיפוש (1-20). ברירת מחדל: 5 / Maximum number of search results (1-20). Default: 5."
+                }
+            },
+            "required": [
+                "action"
+            ]
+        }
+    },
+    {
+        "name": "manage_gmail",
+        "description": "ניהול חשבון Gmail. מאפשר שליחת מייל, חיפוש מיילים, וקריאת תוכן של מייל ספציפי. תומך בעברית מלאה.",
+        "integration": "gmail",
+        "arguments": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": [
+                        "send_email",
+                        "search_emails",
+                        "read_email"
+                    ],
+                    "description": "הפעולה לביצוע: 'send_email', 'search_emails', 'read_email'."
+                },
+                "to": {
+                    "type": "string",
+                    "description": "כתובת הנמען (עבור שליחה)."
+                },
+                "subject": {
+                    "type": "string",
+                    "description": "נושא המייל (עבור שליחה)."
+                },
+                "body": {
+                    "type": "string",
+                    "description": "גוף המייל (עבור שליחה)."
+                },
+                "query": {
+                    "type": "string",
+                    "description": "שאילתת חיפוש, למשל: 'from:example@email.com subject:חשבונית' (עבור חיפוש)."
+                },
+                "message_id": {
+                    "type": "string",
+                    "description": "מזהה ייחודי של המייל לקריאה (עבור קריאה)."
+                }
+            },
+            "required": [
+                "action"
+            ]
+        }
+    },
+    {
+        "name": "manage_calendar",
+        "description": "ניהול יומן גוגל - יצירת פגישות, בדיקת זמינות, וצפייה באירועים. תומך בעברית ואנגלית לכל הפעולות.",
+        "integration": "calendar",
+        "arguments": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": [
+                        "create_event",
+                        "list_events",
+                        "check_availability"
+                    ],
+                    "description": "סוג הפעולה: create_event (יצירת אירוע), list_events (רשימת אירועים), check_availability (בדיקת זמינות)"
+                },
+                "summary": {
+                    "type": "string",
+                    "description": "כותרת האירוע (נדרש ליצירת אירוע)"
+                },
+                "description": {
+                    "type": "string",
+                    "description": "תיאור האירוע (אופציונלי)"
+                },
+                "start_time": {
+                    "type": "string",
+                    "description": "זמן התחלה בפורמט ISO 8601 (למשל: 2024-01-15T14:00:00)"
+                },
+                "end_time": {
+                    "type": "string",
+                    "description": "זמן סיום בפורמט ISO 8601 (למשל: 2024-01-15T15:00:00)"
+                },
+                "attendee_emails": {
+                    "type": "array",
+                    "items": {
+                        "type": "string"
+                    },
+                    "description": "רשימת כתובות מייל של המשתתפים (אופציונלי)"
+                }
+            },
+            "required": [
+                "action"
+            ]
+        }
+    },
+    {
+        "name": "manage_drive",
+        "description": "ניהול קבצים ב-Google Drive. מאפשר חיפוש, קריאה ויצירה של קבצים.",
+        "integration": "drive",
+        "arguments": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": [
+                        "search_files",
+                        "read_file",
+                        "create_file"
+                    ],
+                    "description": "הפעולה לביצוע: 'search_files' (חיפוש קבצים), 'read_file' (קריאת תוכן מקובץ), 'create_file' (יצירת קובץ חדש)."
+                },
+                "query": {
+                    "type": "string",
+                    "description": "טקסט לחיפוש בשמות הקבצים (עבור search_files)."
+                },
+                "file_id": {
+                    "type": "string",
+                    "description": "מזהה הקובץ לקריאה (עבור read_file)."
+                },
+                "file_name": {
+                    "type": "string",
+                    "description": "שם הקובץ ליצירה (עבור create_file)."
+                },
+                "content": {
+                    "type": "string",
+                    "description": "התוכן שייכתב לקובץ החדש (עבור create_file)."
+                }
+            },
+            "required": [
+                "action"
+            ]
+        }
+    },
+    {
+        "name": "manage_sheets",
+        "description": "עבודה עם Google Sheets. מאפשר קריאת נתונים והוספת שורות חדשות.",
+        "integration": "sheets",
+        "arguments": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": [
+                        "read_range",
+                        "append_row"
+                    ],
+                    "description": "הפעולה לביצוע: 'read_range' (קריאת טווח תאים), 'append_row' (הוספת שורה)."
+                },
+                "spreadsheet_id": {
+                    "type": "string",
+                    "description": "מזהה הגיליון האלקטרוני (חובה)."
+                },
+                "range": {
+                    "type": "string",
+                    "description": "הטווח לקריאה או שם הגיליון להוספה (למשל 'Sheet1!A1:B5' או 'Sheet1')."
+                },
+                "values": {
+                    "type": "array",
+                    "items": {
+                        "type": "string"
+                    },
+                    "description": "מערך של ערכים להוספה כשורה חדשה (עבור append_row)."
+                }
+            },
+            "required": [
+                "action",
+                "spreadsheet_id",
+                "range"
+            ]
+        }
+    },
+    {
+        "name": "manage_docs",
+        "description": "עבודה עם Google Docs. מאפשר יצירת מסמכים חדשים, קריאת תוכן מסמכים קיימים והוספת טקסט למסמכים.",
+        "integration": "docs",
+        "arguments": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": [
+                        "create_document",
+                        "read_document",
+                        "append_text"
+                    ],
+                    "description": "הפעולה לביצוע: 'create_document' (יצירת מסמך חדש), 'read_document' (קריאת תוכן מסמך), 'append_text' (הוספת טקסט למסמך קיים)."
+                },
+                "document_id": {
+                    "type": "string",
+                    "description": "מזהה המסמך (נדרש עבור read_document ו-append_text)."
+                },
+                "title": {
+                    "type": "string",
+                    "description": "כותרת המסמך החדש (נדרש עבור create_document)."
+                },
+                "content": {
+                    "type": "string",
+                    "description": "תוכן ראשוני למסמך החדש (אופציונלי עבור create_document)."
+                },
+                "insert_text": {
+                    "type": "string",
+                    "description": "הטקסט להוספה למסמך (נדרש עבור append_text)."
+                }
+            },
+            "required": [
+                "action"
+            ]
+        }
+    }
+]
+
+TOOL_RULES = """**כללים קריטיים לעבודה עם CRM - חובה לקרוא:**
+1. כשמשתמש נותן שם לקוח (כמו "יוסי כהן", "דנה לוי") - תמיד השתמש ב-search_customers עם name
+2. כשמשתמש נותן מספר ID (כמו "12345") - השתמש ב-get_customer_by_id עם customer_id
+3. למחיקת לקוח - תמיד חפש אותו קודם עם search_customers כדי לקבל ID
+4. אל תעביר שמות לפרמטר customer_id - זה תמיד מספר בלבד
+5. **לעדכון לקוח: השתמש ב-update_customer ישירות עם name במקום customer_id! אין צורך לחפש קודם.**
+
+בהתבסס על בקשת המשתמש, החלט על הצעד הבא. התגובה שלך חייבת להיות אובייקט JSON שמתאים לסכמה הבאה:
+{
+  "response": "הודעה להציג למשתמש. זה יכול להיות אישור, שאלה, או תשובה סופית.",
+  "tool_to_call": { "name": "שם_הכלי", "arguments": { "פרמטר": "ערך" } } או null,
+  "tool_calls": [ { "name": "שם_הכלי", "arguments": { "פרמטר": "ערך" } }, ... ] (במקום tool_to_call, לכמה כלים בלתי תלויים שירוצו במקביל)
+}
+
+דוגמאות נכונות לשימוש בכלי CRM:
+- "מי זה יוסי כהן?" -> search_customers עם {"action": "search_customers", "name": "יוסי כהן"}
+- "חפש לקוחות מחברת ישראטק" -> search_customers עם {"action": "search_customers", "company": "ישראטק"}
+- "מצא לקוח עם מייל dani@levi.com" -> search_customers עם {"action": "search_customers", "email": "dani@levi.com"}
+- "קבל פרטי לקוח 12345" -> get_customer_by_id עם {"action": "get_customer_by_id", "customer_id": "12345"}
+- "צור לקוח חדש: דנה לוי" -> create_customer עם {"action": "create_customer", "name": "דנה לוי", "email": "dana@h.com"}
+- "הצג לקוחות אחרונים" -> list_recent_customers עם {"action": "list_recent_customers"}
+- "הוסף טלפון ליוסי כהן" -> update_customer עם {"action": "update_customer", "name": "יוסי כהן", "data_to_update": {"phone": "050-1234567"}}
+- "עדכן מייל של דנה לוי" -> update_customer עם {"action": "update_customer", "name": "דנה לוי", "data_to_update": {"email": "dana@newmail.com"}}
+
+דוגמאות לשימוש בכלי Gmail:
+- "שלח מייל ל-john@example.com עם נושא 'שלום' וכתוב לו תודה על הרכישה" -> manage_gmail עם {"action": "send_email", "to": "john@example.com", "subject": "שלום", "body": "תודה על הרכישה!"}
+- "חפש לי מיילים שקיבלתי מ'invoices@company.com'" -> manage_gmail עם {"action": "search_emails", "query": "from:invoices@company.com"}
+- "קרא לי את המייל עם ID 'msg12345'" -> manage_gmail עם {"action": "read_email", "message_id": "msg12345"}
+
+דוגמאות לשימוש בכלי יומן:
+- אם המשתמש אומר "תקבע לי פגישה עם יואב מחר ב-10 בבוקר, שתמשך שעה, נושא הפגישה הוא פרויקט X", ויואב ב-yoav@example.com
+- אתה צריך לקרוא לכלי manage_calendar עם: {"action": "create_event", "summary": "פרויקט X", "start_time": "2024-XX-XXT10:00:00", "end_time": "2024-XX-XXT11:00:00", "attendee_emails": ["yoav@example.com"]}
+- אם המשתמש אומר "האם אני פנוי מ tomorrow בין 14:00 ל-15:00?"
+- אתה צריך לקרוא לכלי manage_calendar עם: {"action": "check_availability", "start_time": "2024-XX-XXT14:00:00", "end_time": "2024-XX-XXT15:00:00"}
+- אם המשתמש אומר "תציג לי את האירועים הקרובים שלי ביומן"
+- אתה צריך לקרוא לכלי manage_calendar עם: {"action": "list_events"}
+
+דוגמאות לשימוש בכלי Google Drive:
+- "חפש לי בדרייב קבצים עם המילה 'חשבונית'" -> manage_drive עם {"action": "search_files", "query": "חשבונית"}
+- "מה התוכן של קובץ עם ID '123xyz'?" -> manage_drive עם {"action": "read_file", "file_id": "123xyz"}
+- "צור קובץ חדש בשם 'סיכום.txt' עם התוכן 'זהו סיכום הפגישה'" -> manage_drive עם {"action": "create_file", "file_name": "סיכום.txt", "content": "זהו סיכום הפגישה"}
+
+דוגמאות לשימוש בכלי Google Sheets:
+- "קרא את 5 השורות הראשונות בגיליון בשם 'לקוחות' בקובץ עם ID 'abc123'" -> manage_sheets עם {"action": "read_range", "spreadsheet_id": "abc123", "range": "לקוחות!A1:E5"}
+- "הוסף שורה עם הפרטים 'אבי כהן', 'avi@email.com' לגיליון 'לידים' בקובץ 'abc123'" -> manage_sheets עם {"action": "append_row", "spreadsheet_id": "abc123", "range": "לידים", "values": ["אבי כהן", "avi@email.com"]}
+
+דוגמאות לשימוש בכלי Google Docs:
+- "צור מסמך חדש בשם 'דוח פרויקט' עם התוכן 'זהו דוח הפרויקט הראשוני'" -> manage_docs עם {"action": "create_document", "title": "דוח פרויקט", "content": "זהו דוח הפרויקט הראשוני"}
+- "מה הכתוב במסמך עם ID 'doc123'?" -> manage_docs עם {"action": "read_document", "document_id": "doc123"}
+- "הוסף למסמך 'doc123' את הטקסט 'זוהי תוספת חדשה'" -> manage_docs עם {"action": "append_text", "document_id": "doc123", "insert_text": "זוהי תוספת חדשה"}
+"""
+
+
+def select_tools(names: Optional[List[str]] = None, integrations: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Catalog entries enabled by tool name and/or active UI integrations.
+
+    As in the chat UI, the 'gmail' integration switches on every Google tool.
+    With neither filter the whole catalog is returned.
+    """
+    selected = TOOL_CATALOG
+    if names is not None:
+        selected = [t for t in selected if t["name"] in names]
+    if integrations is not None:
+        def enabled(tool):
+            if tool["integration"] in GOOGLE_INTEGRATIONS:
+                return "gmail" in integrations
+            return tool["integration"] in integrations
+        selected = [t for t in selected if enabled(t)]
+    return selected
+
+
+def format_history(history: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{m.get('sender', 'user')}: {m.get('text', '')}" for m in history)
+
+
+def build_agent_system_prompt(agent: Dict[str, Any], tools: List[Dict[str, Any]]) -> str:
+    """The part of the agent prompt that stays the same for every turn."""
+    knowledge_base = agent.get("knowledge_base") or []
+    knowledge_base_content = "\n---\n".join(
+        f"File: {kb.get('file_name')}\nContent: {kb.get('content')}" for kb in knowledge_base
+    ) or "No knowledge base provided."
+    return f"""אתה {agent.get('name')}, עוזר AI עם האישיות של: {agent.get('personality')}.
+הוראות הבסיס שלך: {agent.get('system_prompt') or 'אתה עוזר מועיל.'}
+
+יש לך גישה לכלים. כשאתה צריך להשתמש בכלי, אתה חייב לפרמט את התגובה שלך כאובייקט JSON.
+
+הכלים הזמינים לך למשימה זו:
+---
+{json.dumps(tools, ensure_ascii=False, indent=2)}
+---
+{TOOL_RULES}
+
+---
+בסיס ידע:
+{knowledge_base_content}
+---"""
+
+
+def build_agent_prompt(
+    agent: Dict[str, Any], history: List[Dict[str, Any]], message: str, summary: Optional[str] = None
+) -> str:
+    """Per-turn prompt: the summary of older turns, the recent ones and the new message."""
+    conversation_history = format_history([*history, {"sender": "user", "text": message}])
+    earlier = f"סיכום השיחה עד כה:\n{summary}\n\n" if summary else ""
+
+    return f"""{earlier}היסטוריית השיחה:
+{conversation_history}
+
+עכשיו, עבד על הבקשה האחרונה של המשתמש: "{message}"
+התגובה JSON שלך:"""
+
+
+def build_followup_prompt(agent: Dict[str, Any], message: str, tool_runs: List[Dict[str, Any]]) -> str:
+    """Prompt after tool execution: answer the user or ask for one more tool."""
+    results = "\n".join(
+        f"הכלי '{run['name']}' ({json.dumps(run['arguments'], ensure_ascii=False)}):\n---\n{run['result']}\n---"
+        for run in tool_runs
+    )
+    return f"""אתה {agent.get('name')}. המשתמש ביקש: "{message}"
+
+ביצעתי את הכלים הבאים וקיבלתי את התוצאות האלה:
+{results}
+
+אם נדרש כלי נוסף כדי להשלים את הבקשה, החזר אותו ב-tool_to_call (או כמה כלים בלתי תלויים ב-tool_calls).
+אחרת החזר tool_to_call: null ו-response עם תגובה מועילת וידידותית למשתמש בעברית בהתבסס על התוצאות האלה. היה שיחתי וטבעי."""
@@ -0,0 +1,294 @@
+"""Dashboard aggregates, kept up to date on every write.
+
+``Analytics`` subscribes to collections, the way the search index does,
+and keeps per tenant:
+
+- the number of records, in total and by the fields the dashboard groups
+  by (customers by status and segment, activities by type, status and
+  agent, ...);
+- for collections attached with ``series=True``, the same counts per hour
+  and per day of ``created_date`` (UTC). Hour buckets are dropped after
+  ANALYTICS_HOURLY_DAYS; the day buckets hold the same counts and are kept
+  for ANALYTICS_DAILY_DAYS.
+
+A write moves the record's contribution from its old values to its new
+ones, so ``summary()`` reads counters and never scans records. The
+contribution of every record is remembered by id, since deletes carry only
+an id.
+
+A collection attached with ``retention_days`` is also indexed by day.
+``expire()`` deletes whole days of its records older than that. Their day
+counts are added to the rollups collection (one record per collection,
+tenant and day), in the same transaction as the delete when both live in
+one SQLite database, and loaded back on start, so the history outlives
+the records. A delete of a record older than the retention
+period leaves its day counts alone, so every process that hears of the
+expiry keeps the same history. With several server processes only the one
+that leads (the scheduler's lease holder) expires records and purges old
+rollups; each one downsamples its own buckets.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Sequence, Set, Tuple
+
+from backend.storage import Repository, as_text, put_and_delete
+
+HOURLY_DAYS = int(os.getenv("ANALYTICS_HOURLY_DAYS", "14"))
+DAILY_DAYS = int(os.getenv("ANALYTICS_DAILY_DAYS", "730"))
+MAINTENANCE_SECONDS = float(os.getenv("ANALYTICS_MAINTENANCE_SECONDS", "3600"))
+
+Bucket = Counter  # "total" and "field:value" -> records
+
+
+def _hour(value: Any) -> Optional[str]:
+    """The UTC hour of a ``created_date`` as ``YYYY-MM-DDTHH``."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%dT%H")
+
+
+def _grouped(bucket: Optional[Bucket], fields: Sequence[str]) -> Dict[str, Any]:
+    """``{"total": n, field: {value: n}}`` from a bucket."""
+    grouped: Dict[str, Any] = {"total": 0, **{field: {} for field in fields}}
+    for key, count in (bucket or {}).items():
+        if key == "total":
+            grouped["total"] = count
+        else:
+            field, _, value = key.partition(":")
+            grouped[field][value] = count
+    return grouped
+
+
+class Analytics:
+    def __init__(self, rollups: Repository, hourly_days: int = HOURLY_DAYS, daily_days: int = DAILY_DAYS):
+        self.rollups = rollups
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+        self._repos: Dict[str, Repository] = {}
+        self._fields: Dict[str, Tuple[str, ...]] = {}
+        self._series: Set[str] = set()
+        self._retention: Dict[str, int] = {}
+        self._counts: Dict[Tuple[str, str], Bucket] = {}  # (collection, tenant)
+        self._hours: Dict[Tuple[str, str], Dict[str, Bucket]] = {}  # (collection, tenant) -> hour -> bucket
+        self._days: Dict[Tuple[str, str], Dict[str, Bucket]] = {}
+        # (collection, record id) -> (tenant, bucket keys, hour or None)
+        self._seen: Dict[Tuple[str, str], Tuple[str, Tuple[str, ...], Optional[str]]] = {}
+        # Records share a handful of key combinations; keep one tuple of each.
+        self._interned: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._by_day: Dict[str, Dict[str, Set[str]]] = {}  # collection -> day -> record ids
+        self._cutoffs: Dict[str, str] = {}  # collection -> first day within retention
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._leader: Callable[[], bool] = lambda: True
+        self.expired = 0
+
+    def attach(
+        self,
+        repo: Repository,
+        fields: Sequence[str],
+        series: bool = False,
+        retention_days: int = 0,
+    ) -> "Analytics":
+        """Count the records of ``repo`` by ``fields`` from now on."""
+        name = repo.name
+        self._repos[name] = repo
+        self._fields[name] = tuple(fields)
+        if series or retention_days:
+            self._series.add(name)
+        if retention_days > 0:
+            self._retention[name] = retention_days
+            self._by_day[name] = {}
+            self._update_cutoffs(datetime.utcnow())
+        for rollup in self.rollups.find(collection=name):
+            self._add_rollup(name, rollup)
+        for record_id, obj in repo.items():
+            self.record(repo, record_id, obj)
+        repo.subscribe(lambda record_id, obj: self.record(repo, record_id, obj))
+        return self
+
+    def _add_rollup(self, name: str, rollup: Dict[str, Any]):
+        if rollup["day"] < self._oldest_day(datetime.utcnow()):
+            return
+        days = self._days.setdefault((name, as_text(rollup.get("user_id"))), {})
+        days.setdefault(rollup["day"], Counter()).update(rollup["counts"])
+
+    def _oldest_day(self, now: datetime) -> str:
+        return (now - timedelta(days=self.daily_days)).strftime("%Y-%m-%d")
+
+    def record(self, repo: Repository, record_id: str, obj: Optional[Dict[str, Any]]):
+        name = repo.name
+        key = (name, record_id)
+        with self._lock:
+            previous = self._seen.pop(key, None)
+            if previous is not None:
+                tenant, keys, hour = previous
+                # Expired records leave their counts in the day buckets (and the rollups).
+                expired = obj is None and hour is not None and hour[:10] < self._cutoffs.get(name, "")
+                self._apply(name, tenant, keys, None if expired else hour, -1)
+                if hour is not None and name in self._by_day:
+                    day = self._by_day[name].get(hour[:10])
+                    if day is not None:
+                        day.discard(record_id)
+                        if not day:
+                            del self._by_day[name][hour[:10]]
+            if obj is None:
+                return
+            tenant = as_text(obj.get(repo.tenant_field)) if repo.tenant_field else ""
+            keys = ("total", *(f"{field}:{as_text(obj.get(field))}" for field in self._fields[name]))
+            keys = self._interned.setdefault(keys, keys)
+            hour = _hour(obj.get("created_date")) if name in self._series else None
+            self._apply(name, tenant, keys, hour, 1)
+            self._seen[key] = (tenant, keys, hour)
+            if hour is not None and name in self._by_day:
+                self._by_day[name].setdefault(hour[:10], set()).add(record_id)
+
+    def _apply(self, name: str, tenant: str, keys: Tuple[str, ...], hour: Optional[str], sign: int):
+        targets = [self._counts.setdefault((name, tenant), Counter())]
+        if hour is not None:
+            for buckets, bucket_key in ((self._hours, hour), (self._days, hour[:10])):
+                series = buckets.setdefault((name, tenant), {})
+                # A bucket that was already dropped is not brought back by a delete.
+                if sign > 0 or bucket_key in series:
+                    targets.append(series.setdefault(bucket_key, Counter()))
+        for bucket in targets:
+            for key in keys:
+                bucket[key] += sign
+                if not bucket[key]:
+                    del bucket[key]
+
+    def summary(
+        self,
+        tenant: str,
+        days: int = 7,
+        hours: int = 24,
+        now: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        """Counts of every attached collection for ``tenant``.
+
+        Collections with a series also get ``daily`` (the last ``days``
+        days, oldest first) and ``hourly`` (the last ``hours`` hours).
+        Buckets without records are included with zero counts.
+        """
+        now = now or datetime.utcnow()
+        day_keys = [(now - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days - 1, -1, -1)]
+        hour_keys = [(now - timedelta(hours=offset)).strftime("%Y-%m-%dT%H") for offset in range(hours - 1, -1, -1)]
+        summary: Dict[str, Any] = {}
+        with self._lock:
+            for name, fields in self._fields.items():
+                scope = (name, tenant)
+                entry = _grouped(self._counts.get(scope), fields)
+                if name in self._series:
+                    series_days = self._days.get(scope, {})
+                    series_hours = self._hours.get(scope, {})
+                    entry["daily"] = [{"day": day, **_grouped(series_days.get(day), fields)} for day in day_keys]
+                    entry["hourly"] = [
+                        {"hour": f"{hour}:00", **_grouped(series_hours.get(hour), fields)} for hour in hour_keys
+                    ]
+                summary[name] = entry
+        return summary
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """Delete records past their collection's retention; returns how many.
+
+        Works a day at a time. The day's counts go to the rollups with the delete.
+        """
+        now = now or datetime.utcnow()
+        removed = 0
+        self._update_cutoffs(now)
+        for name, cutoff in self._cutoffs.items():
+            with self._lock:
+                expired_days = sorted(day for day in self._by_day[name] if day < cutoff)
+            for day in expired_days:
+                removed += self._expire_day(name, day, now)
+        self.expired += removed
+        return removed
+
+    def _update_cutoffs(self, now: datetime):
+        with self._lock:
+            for name, retention_days in self._retention.items():
+                self._cutoffs[name] = (now - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+
+    def _expire_day(self, name: str, day: str, now: datetime) -> int:
+        with self._lock:
+            record_ids = list(self._by_day[name].get(day, ()))
+            totals: Dict[str, Bucket] = {}
+            for record_id in record_ids:
+                tenant, keys, _ = self._seen[(name, record_id)]
+                totals.setdefault(tenant, Counter()).update(keys)
+        rollups = []
+        for tenant, counts in totals.items():
+            rollup_id = f"{name}:{tenant}:{day}"
+            stored = self.rollups.get(rollup_id)
+            if stored is not None:
+                counts.update(stored["counts"])
+            rollups.append((rollup_id, {
+                "id": rollup_id,
+                "collection": name,
+                "user_id": tenant,
+                "day": day,
+                "counts": dict(counts),
+                "updated_date": now,
+            }))
+        # One transaction where possible: a rollup stored without the records
+        # deleted would have the day counted into it again on the next expire().
+        return len(put_and_delete(self.rollups, rollups, self._repos[name], record_ids))
+
+    def downsample(self, now: Optional[datetime] = None, purge: bool = True):
+        """Drop hour buckets older than ``hourly_days`` and day buckets older than ``daily_days``.
+
+        ``purge`` also deletes rollups older than ``daily_days``.
+        """
+        now = now or datetime.utcnow()
+        oldest_hour = (now - timedelta(days=self.hourly_days)).strftime("%Y-%m-%dT%H")
+        oldest_day = self._oldest_day(now)
+        with self._lock:
+            for buckets, oldest in ((self._hours, oldest_hour), (self._days, oldest_day)):
+                for series in buckets.values():
+                    for key in [key for key in series if key < oldest]:
+                        del series[key]
+        if purge:
+            self.rollups.delete_many(
+                rollup["id"] for rollup in self.rollups.values() if rollup["day"] < oldest_day
+            )
+
+    def start(self, leader: Callable[[], bool] = lambda: True):
+        """Expire and downsample every ANALYTICS_MAINTENANCE_SECONDS in a background thread.
+
+        Storage is only cleaned up while ``leader()`` is true.
+        """
+        self._leader = leader
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="analytics", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                leading = self._leader()
+                if leading:
+                    self.expire()
+                else:
+                    # The leader's expiries arrive here as deletes.
+                    self._update_cutoffs(datetime.utcnow())
+                self.downsample(purge=leading)
+            except Exception as e:
+                print(f"Analytics maintenance failed: {e}")
+            time.sleep(MAINTENANCE_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "records": len(self._seen),
+            "hour_buckets": sum(len(series) for series in self._hours.values()),
+            "day_buckets": sum(len(series) for series in self._days.values()),
+            "expired": self.expired,
+        }
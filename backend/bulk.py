@@ -0,0 +1,316 @@
+"""Batch writes and streaming import/export for a collection.
+
+``apply_operations`` runs create/update/delete operations and reports a
+result for each one. Operations are validated one by one. Each group of
+BULK_BATCH_SIZE is then written with one ``put_many`` and one
+``delete_many``, so a batch costs one transaction rather than one per
+record. If a batch write fails, its records are written one at a time, so
+the error lands on the record that caused it.
+
+Imports go through the same path. The upload is spooled to a temporary
+file, which stays in memory up to 1 MiB and moves to disk beyond that. It
+is then read one CSV or NDJSON row at a time. At most one batch and
+BULK_MAX_ERRORS error reports are held in memory, so memory use does not
+depend on the file size. A row whose ``id`` belongs to an existing record
+updates it, and other rows create records.
+
+Exports page through the collection with the keyset cursor. Each page is
+streamed out before the next is read.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type
+from uuid import uuid4
+
+from pydantic import BaseModel, ValidationError
+
+from backend.storage import Repository
+
+BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "5000"))
+MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "100"))
+SPOOL_BYTES = 1 << 20
+EXPORT_PAGE_SIZE = 1000
+
+CSV = "csv"
+NDJSON = "ndjson"
+MEDIA_TYPES = {CSV: "text/csv; charset=utf-8", NDJSON: "application/x-ndjson"}
+OPERATIONS = ("create", "update", "delete", "upsert")
+SYSTEM_FIELDS = ("id", "created_date", "updated_date")
+# Operation of an import row that could not be read; its fields hold {"error": ...}
+UNREADABLE = "unreadable"
+
+# (position in the request or line in the file, operation, record id, fields)
+Operation = Tuple[int, str, Optional[str], Dict[str, Any]]
+
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" if item["loc"] else item["msg"]
+        for item in error.errors()
+    )
+
+
+def apply_operations(
+    repo: Repository, model: Type[BaseModel], operations: Iterable[Operation], dry_run: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """Validate and write ``operations``; yields one result per operation, in order.
+
+    ``update`` merges the given fields into the stored record. ``upsert``
+    updates when the id exists and creates a record with that id (or a new
+    one) otherwise. With ``dry_run`` nothing is written.
+    """
+    batch: List[Operation] = []
+    for operation in operations:
+        batch.append(operation)
+        if len(batch) >= BATCH_SIZE:
+            yield from _apply_batch(repo, model, batch, dry_run)
+            batch = []
+    if batch:
+        yield from _apply_batch(repo, model, batch, dry_run)
+
+
+def _apply_batch(
+    repo: Repository, model: Type[BaseModel], batch: List[Operation], dry_run: bool
+) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    stored = {obj["id"]: obj for obj in repo.get_many({record_id for _, _, record_id, _ in batch if record_id})}
+    results: List[Dict[str, Any]] = []
+    writes: Dict[str, Dict[str, Any]] = {}
+    deletes: Dict[str, Dict[str, Any]] = {}
+    for position, op, record_id, data in batch:
+        result: Dict[str, Any] = {"index": position, "op": op, "id": record_id, "success": False}
+        results.append(result)
+        if op == UNREADABLE:
+            result["error"] = data["error"]
+            continue
+        if op not in OPERATIONS:
+            result["error"] = f"Unknown operation: {op}"
+            continue
+        existing = stored.get(record_id) if record_id else None
+        if op == "upsert":
+            op = result["op"] = "update" if existing is not None else "create"
+        if op != "create" and existing is None:
+            result["error"] = "Record not found"
+            continue
+        if op == "delete":
+            del stored[record_id]
+            writes.pop(record_id, None)
+            deletes[record_id] = result
+            result["success"] = True
+            continue
+        fields = {key: value for key, value in data.items() if key not in SYSTEM_FIELDS}
+        try:
+            if op == "create":
+                valid = model(**fields)
+            else:
+                valid = model(**{**{k: v for k, v in existing.items() if k not in SYSTEM_FIELDS}, **fields})
+        except ValidationError as e:
+            result["error"] = validation_message(e)
+            continue
+        if op == "create":
+            record_id = result["id"] = record_id or str(uuid4())
+            obj = {**valid.dict(), "id": record_id, "created_date": now, "updated_date": now}
+        else:
+            obj = {**existing, **valid.dict(), "updated_date": now}
+        stored[record_id] = obj
+        deletes.pop(record_id, None)
+        writes[record_id] = result
+        result["record"] = obj
+        result["success"] = True
+
+    if not dry_run:
+        _write(repo, [result["record"] for result in writes.values()], writes, deletes)
+    for result in results:
+        result.pop("record", None)
+    return results
+
+
+def _write(
+    repo: Repository,
+    records: List[Dict[str, Any]],
+    writes: Dict[str, Dict[str, Any]],
+    deletes: Dict[str, Dict[str, Any]],
+):
+    try:
+        if records:
+            repo.put_many((obj["id"], obj) for obj in records)
+    except Exception:
+        # Find the records that cannot be written.
+        for obj in records:
+            try:
+                repo[obj["id"]] = obj
+            except KeyError:
+                # The id is taken by a record the caller cannot see.
+                writes[obj["id"]].update(success=False, error="id is already in use")
+            except Exception as e:
+                writes[obj["id"]].update(success=False, error=str(e) or type(e).__name__)
+    if deletes:
+        for record_id in set(deletes) - set(repo.delete_many(list(deletes))):
+            deletes[record_id].update(success=False, error="Record not found")
+
+
+def summarize(results: Iterable[Dict[str, Any]], dry_run: bool = False) -> Dict[str, Any]:
+    """Counts of an import's results, keeping the first MAX_ERRORS errors."""
+    summary: Dict[str, Any] = {"rows": 0, "created": 0, "updated": 0, "failed": 0, "errors": [], "dry_run": dry_run}
+    for result in results:
+        summary["rows"] += 1
+        if result["success"]:
+            summary["created" if result["op"] == "create" else "updated"] += 1
+            continue
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_ERRORS:
+            summary["errors"].append({"line": result["index"], "id": result["id"], "error": result["error"]})
+    summary["errors_truncated"] = summary["failed"] > len(summary["errors"])
+    return summary
+
+
+def request_format(format: Optional[str], content_type: Optional[str]) -> str:
+    """``csv`` or ``ndjson`` from an explicit ``format`` or the Content-Type."""
+    if format:
+        if format not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported format: {format}")
+        return format
+    content_type = (content_type or "").lower()
+    if "csv" in content_type:
+        return CSV
+    if "ndjson" in content_type or "jsonl" in content_type or "json-seq" in content_type:
+        return NDJSON
+    raise ValueError("Send text/csv or application/x-ndjson, or pass ?format=")
+
+
+async def spool(chunks: Any) -> IO[bytes]:
+    """Copy an upload (an async iterator of bytes) to a temporary file, rewound."""
+    upload = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        async for chunk in chunks:
+            upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+    upload.seek(0)
+    return upload
+
+
+def read_rows(
+    upload: IO[bytes],
+    format: str,
+    fields: Sequence[str],
+    aliases: Optional[Dict[str, str]] = None,
+    ignored: Optional[List[str]] = None,
+) -> Iterator[Operation]:
+    """An upsert for each record in the file, or an UNREADABLE operation for a bad row.
+
+    CSV headers may name a field or one of its ``aliases`` (e.g. display
+    labels). Headers that are neither a field nor an alias are added to
+    ``ignored``. Empty CSV cells are left out, so model defaults apply.
+    """
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    if format == NDJSON:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, UNREADABLE, None, {"error": f"Invalid JSON: {e}"}
+                continue
+            if not isinstance(row, dict):
+                yield line_number, UNREADABLE, None, {"error": "Each line must be a JSON object"}
+                continue
+            yield _upsert(line_number, row)
+        return
+
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [(aliases or {}).get(name.strip(), name.strip()) for name in header]
+    if ignored is not None:
+        known = {*fields, *SYSTEM_FIELDS}
+        ignored.extend(name for name in columns if name not in known)
+    for values in reader:
+        if not any(values):
+            continue
+        if len(values) > len(columns):
+            yield reader.line_num, UNREADABLE, None, {"error": f"Expected {len(columns)} columns, got {len(values)}"}
+            continue
+        yield _upsert(reader.line_num, {name: value for name, value in zip(columns, values) if value != ""})
+
+
+def _upsert(line_number: int, row: Dict[str, Any]) -> Operation:
+    record_id = row.get("id")
+    return line_number, "upsert", str(record_id) if record_id not in (None, "") else None, row
+
+
+def import_file(
+    repo: Repository,
+    model: Type[BaseModel],
+    upload: IO[bytes],
+    format: str,
+    aliases: Optional[Dict[str, str]] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Import every row of ``upload``; returns the summary() of the results."""
+    ignored: List[str] = []
+    operations = read_rows(upload, format, list(model.__fields__), aliases, ignored)
+    summary = summarize(apply_operations(repo, model, operations, dry_run), dry_run)
+    summary["ignored_columns"] = ignored
+    return summary
+
+
+def export_records(
+    repo: Repository,
+    where: Optional[Dict[str, Any]] = None,
+    sort: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Matching records, one page at a time."""
+    after = None
+    while True:
+        rows, after = repo.query(where, sort=sort, limit=EXPORT_PAGE_SIZE, after=after, fields=fields)
+        if rows:
+            yield rows
+        if not after:
+            return
+
+
+def export_ndjson(repo: Repository, where=None, sort=None, fields=None) -> Iterator[str]:
+    after = None
+    while True:
+        rows, after = repo.query_json(where, sort=sort, limit=EXPORT_PAGE_SIZE, after=after, fields=fields)
+        if rows:
+            yield "\n".join(rows) + "\n"
+        if not after:
+            return
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def export_csv(repo: Repository, columns: Sequence[str], where=None, sort=None, fields=None) -> Iterator[str]:
+    """CSV text with a header of ``columns``, one chunk per page.
+
+    Starts with a byte order mark so spreadsheet programs read the file as
+    UTF-8.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield "\ufeff" + buffer.getvalue()
+    for rows in export_records(repo, where, sort, fields):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_cell(obj.get(column)) for column in columns] for obj in rows)
+        yield buffer.getvalue()
@@ -0,0 +1,160 @@
+"""Change feed: an ordered log of record writes, for incremental sync.
+
+Every write to an attached collection gets the next sequence number and is
+kept as ``{"seq", "collection", "op", "id", "record"}``. ``op`` is
+``upsert`` (``record`` holds the record as the API renders it) or
+``delete`` (``record`` is null). A client keeps the highest ``seq`` it has
+applied and asks for what came after it. Records are not reloaded for
+that, and a client that is up to date gets an empty list.
+
+The log is kept in memory and holds the last CHANGE_FEED_MAX_ENTRIES
+changes. On SQLite the feed follows the database's change log
+(``Repository.follow()``), so it holds the writes of every server process,
+numbered by the log's ``seq``, and every process hands out the same
+numbers. On the memory backend sequence numbers start at the process start
+time in microseconds. Either way they keep growing across restarts. A client whose ``since`` is
+older than the oldest change kept gets ``reset``, and reloads its lists
+the usual way before following the feed again.
+
+Changes are tagged with the record's tenant. A tenant-wide collection
+(templates) is seen by everyone. Deletes carry only an id, so, like
+``TenantSearchIndex``, the feed keeps the tenant of every record it has
+seen.
+
+Listeners waiting for new changes (the SSE stream) register an
+``asyncio.Event`` with their loop. Writes come from worker threads as well
+as the loop, so the events are set with ``call_soon_threadsafe``.
+"""
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from backend.serialization import dumps, record_cache
+from backend.storage import Repository, as_text
+
+MAX_ENTRIES = int(os.getenv("CHANGE_FEED_MAX_ENTRIES", "10000"))
+DEFAULT_LIMIT = 500
+
+
+class ChangeFeed:
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        # In step: seq, (collection, tenant or "" for shared collections), rendered change.
+        self._seqs: List[int] = []
+        self._scopes: List[Tuple[str, str]] = []
+        self._changes: List[str] = []
+        self._next_seq = int(time.time() * 1_000_000)
+        # Changes after this seq are all kept; older ones are not.
+        self._floor = self._next_seq
+        self._owners: Dict[Tuple[str, str], str] = {}  # (collection, record id) -> tenant
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._lock = threading.Lock()
+
+    def attach(self, repo: Repository) -> "ChangeFeed":
+        """Record every write to ``repo`` from now on."""
+        if repo.tenant_field:
+            for record_id, obj in repo.items():
+                self._owners[(repo.name, record_id)] = as_text(obj.get(repo.tenant_field))
+        with self._lock:
+            repo.follow(lambda seq, record_id, obj: self.record(repo, record_id, obj, seq))
+            change_log = getattr(repo, "changes", None)
+            if change_log is not None and not self._seqs:
+                # Numbered by the shared log from here on.
+                self._next_seq = self._floor = change_log.last_seq
+        return self
+
+    @property
+    def last_seq(self) -> int:
+        return self._seqs[-1] if self._seqs else self._floor
+
+    def record(self, repo: Repository, record_id: str, obj: Optional[Dict[str, Any]], seq: Optional[int] = None):
+        """Add a write; ``seq`` is its number in the storage change log, if it has one."""
+        key = (repo.name, record_id)
+        # Rendered once here rather than for every client that reads the change.
+        record = record_cache.render(repo.name, obj) if obj is not None else "null"
+        with self._lock:
+            if not repo.tenant_field:
+                tenant = ""
+            elif obj is not None:
+                tenant = self._owners[key] = as_text(obj.get(repo.tenant_field))
+            else:
+                tenant = self._owners.pop(key, None)
+                if tenant is None:
+                    return
+            self._next_seq = seq if seq is not None else self._next_seq + 1
+            seq = self._next_seq
+            self._seqs.append(seq)
+            self._scopes.append((repo.name, tenant))
+            self._changes.append(
+                f'{{"seq":{seq},"collection":{dumps(repo.name).decode()},'
+                f'"op":"{"upsert" if obj is not None else "delete"}","id":{dumps(record_id).decode()},'
+                f'"record":{record}}}'
+            )
+            # Trim in chunks, so the lists are not shifted on every write.
+            excess = len(self._seqs) - self.max_entries
+            if excess > 0 and excess >= self.max_entries // 10:
+                self._floor = self._seqs[excess - 1]
+                del self._seqs[:excess], self._scopes[:excess], self._changes[:excess]
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def since(
+        self,
+        seq: int,
+        tenant: str,
+        limit: int = DEFAULT_LIMIT,
+        collections: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Tuple[int, str]], int, bool, bool]:
+        """``(seq, JSON text)`` of the changes after ``seq`` that ``tenant`` sees, oldest first.
+
+        Returns ``(changes, next, has_more, reset)``. ``next`` is the
+        ``since`` of the following call. It moves past changes the caller
+        does not see, so they are not scanned again. ``reset`` is true when
+        changes after ``seq`` are no longer kept (or ``seq`` comes from
+        another run of the server), and ``next`` is then the latest seq.
+        """
+        with self._lock:
+            last_seq = self.last_seq
+            if seq < self._floor or seq > last_seq:
+                return [], last_seq, False, True
+            position = start = bisect_right(self._seqs, seq)
+            end = len(self._seqs)
+            changes: List[Tuple[int, str]] = []
+            while position < end and len(changes) < limit:
+                collection, owner = self._scopes[position]
+                if owner in ("", tenant) and (not collections or collection in collections):
+                    changes.append((self._seqs[position], self._changes[position]))
+                position += 1
+            next_seq = self._seqs[position - 1] if position > start else seq
+            return changes, next_seq, position < end, False
+
+    async def wait(self, seq: int, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for a change after ``seq``; True if there is one."""
+        if self.last_seq > seq:
+            return True
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            # A write between the check above and registering would be missed.
+            if self.last_seq > seq:
+                return True
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._seqs),
+            "last_seq": self.last_seq,
+            "oldest_seq": self._floor,
+            "listeners": len(self._waiters),
+        }
@@ -0,0 +1,211 @@
+"""Server-side chat history with a bounded prompt context.
+
+A conversation is one record per agent and session in the ``conversations``
+collection. It holds the turns not yet summarized and a rolling summary of
+the older ones. The client sends only its new message. ``context()`` returns
+the summary and the latest turns that fit in CONVERSATION_CONTEXT_TOKENS, so
+a turn's prompt stays the same size however long the chat gets.
+
+When the stored turns exceed the budget, the oldest are folded into the
+summary by a background Gemini call at scheduled priority. Folding stops
+once the rest fit in half the budget, so it does not run on every turn. The
+last CONVERSATION_MIN_RECENT_TURNS turns are always kept verbatim. Without
+Gemini, or if the call fails, the summary is the opening of each folded
+turn. It is capped at CONVERSATION_SUMMARY_TOKENS. Until a summary is
+written, the window alone keeps the context within budget.
+
+Reads and writes of the collection can block (a SQLite write may wait for
+another process's lock), so the coroutines here run them on threads.
+"""
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from backend import llm, llm_queue, metrics
+from backend.storage import Repository
+
+CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "2000"))
+SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "300"))
+MIN_RECENT_TURNS = int(os.getenv("CONVERSATION_MIN_RECENT_TURNS", "4"))
+# Characters of each folded turn kept when the summary cannot come from Gemini
+EXCERPT_CHARS = 160
+
+context_tokens = metrics.Histogram(
+    "conversation_context_tokens", "Estimated history tokens sent with a chat turn.",
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+summaries = metrics.Counter("conversation_summaries_total", "Rolling summaries written, by source.", ("source",))
+
+
+def turn_tokens(turn: Dict[str, Any]) -> int:
+    # The sender label and line break cost a few tokens of their own.
+    return llm_queue.count_tokens(turn.get("text")) + 4
+
+
+def window(turns: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """The latest ``turns`` that fit in ``budget`` tokens, oldest first.
+
+    The latest turn is always included, cut to the budget if it is longer.
+    """
+    kept: List[Dict[str, Any]] = []
+    used = 0
+    for turn in reversed(turns):
+        cost = turn_tokens(turn)
+        if used + cost > budget:
+            if not kept:
+                kept.append({**turn, "text": turn["text"][:budget * llm_queue.CHARS_PER_TOKEN]})
+            break
+        kept.append(turn)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def fold_count(turns: List[Dict[str, Any]], budget: int) -> int:
+    """How many of the oldest ``turns`` to fold into the summary (0 if they fit in ``budget``)."""
+    total = sum(turn_tokens(turn) for turn in turns)
+    if total <= budget:
+        return 0
+    count = 0
+    while count < len(turns) - MIN_RECENT_TURNS and total > budget // 2:
+        total -= turn_tokens(turns[count])
+        count += 1
+    return count
+
+
+def summary_prompt(summary: str, turns: List[Dict[str, Any]]) -> str:
+    lines = "\n".join(f"{turn.get('sender', 'user')}: {turn.get('text', '')}" for turn in turns)
+    earlier = f"סיכום קודם:\n{summary}\n\n" if summary else ""
+    return f"""{earlier}המשך השיחה:
+{lines}
+
+כתוב סיכום מעודכן וקצר של כל השיחה (עד {SUMMARY_TOKENS * llm_queue.CHARS_PER_TOKEN} תווים), בעברית.
+שמור שמות, מזהים, תאריכים, החלטות ובקשות פתוחות. החזר את הסיכום בלבד."""
+
+
+def excerpt(summary: str, turns: List[Dict[str, Any]]) -> str:
+    lines = [f"{turn.get('sender', 'user')}: {turn.get('text', '')[:EXCERPT_CHARS]}" for turn in turns]
+    return "\n".join([summary, *lines] if summary else lines)
+
+
+class ConversationStore:
+    def __init__(self, repo: Repository, context_budget: int = CONTEXT_TOKENS):
+        self.repo = repo
+        self.context_budget = context_budget
+        self._summarizing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        # Serializes the read-modify-write of a record by append() and _summarize(), which run on threads.
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def key(agent_id: str, session_id: str) -> str:
+        return f"{agent_id}:{session_id}"
+
+    def get(self, user_id: str, agent_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        conversation = self.repo.get(self.key(agent_id, session_id))
+        return conversation if conversation is not None and conversation.get("user_id") == user_id else None
+
+    def load(self, user_id: str, agent_id: str, session_id: str) -> Dict[str, Any]:
+        """The stored conversation, or a new empty one (saved on the first append())."""
+        conversation = self.get(user_id, agent_id, session_id)
+        if conversation is None:
+            now = datetime.utcnow()
+            conversation = {
+                "id": self.key(agent_id, session_id),
+                "user_id": user_id,
+                "agent_id": agent_id,
+                "session_id": session_id,
+                "summary": "",
+                "turns": [],
+                "summarized_turns": 0,
+                "created_date": now,
+                "updated_date": now,
+            }
+        return conversation
+
+    def delete(self, user_id: str, agent_id: str, session_id: str) -> bool:
+        if self.get(user_id, agent_id, session_id) is None:
+            return False
+        del self.repo[self.key(agent_id, session_id)]
+        return True
+
+    def trim(self, turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The latest ``turns`` that fit in the context budget."""
+        return window(turns, self.context_budget)
+
+    def context(self, conversation: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        """The rolling summary and the recent turns to put in the next prompt."""
+        turns = self.trim(conversation["turns"])
+        context_tokens.observe(
+            llm_queue.count_tokens(conversation["summary"]) + sum(turn_tokens(turn) for turn in turns)
+        )
+        return conversation["summary"], turns
+
+    async def append(self, conversation: Dict[str, Any], *turns: Dict[str, Any]):
+        """Store new turns; starts folding old ones into the summary if over budget.
+
+        The stored record is re-read, so turns of the same session that ran
+        concurrently and a summary written since ``conversation`` was loaded
+        are kept.
+        """
+        conversation = await asyncio.to_thread(self._add_turns, conversation, turns)
+        conversation_id = conversation["id"]
+        if conversation_id not in self._summarizing and fold_count(conversation["turns"], self.context_budget):
+            self._summarizing.add(conversation_id)
+            task = asyncio.get_running_loop().create_task(self._summarize(conversation_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _add_turns(self, conversation: Dict[str, Any], turns: Tuple[Dict[str, Any], ...]) -> Dict[str, Any]:
+        conversation_id = conversation["id"]
+        with self._write_lock:
+            conversation = self.repo.get(conversation_id) or conversation
+            conversation["turns"].extend(turns)
+            conversation["updated_date"] = datetime.utcnow()
+            self.repo[conversation_id] = conversation
+        return conversation
+
+    async def _summarize(self, conversation_id: str):
+        try:
+            conversation = await asyncio.to_thread(self.repo.get, conversation_id)
+            if conversation is None:
+                return
+            count = fold_count(conversation["turns"], self.context_budget)
+            folded = conversation["turns"][:count]
+            summary = await self._write_summary(conversation["summary"], folded)
+            await asyncio.to_thread(self._fold, conversation_id, folded, summary)
+        except Exception as e:
+            print(f"Conversation summary failed for {conversation_id}: {e}")
+        finally:
+            self._summarizing.discard(conversation_id)
+
+    def _fold(self, conversation_id: str, folded: List[Dict[str, Any]], summary: str):
+        """Replace the ``folded`` turns with ``summary``, unless the chat changed under them."""
+        count = len(folded)
+        with self._write_lock:
+            # Turns may have been appended meanwhile, or the chat cleared.
+            conversation = self.repo.get(conversation_id)
+            if conversation is None or conversation["turns"][:count] != folded:
+                return
+            conversation["summary"] = summary
+            conversation["turns"] = conversation["turns"][count:]
+            conversation["summarized_turns"] += count
+            self.repo[conversation_id] = conversation
+
+    async def _write_summary(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        limit = SUMMARY_TOKENS * llm_queue.CHARS_PER_TOKEN
+        if os.getenv("GEMINI_API_KEY"):
+            try:
+                text = (await llm.generate(summary_prompt(summary, turns), priority=llm_queue.SCHEDULED)).strip()
+                summaries.inc("gemini")
+                return text[:limit]
+            except Exception as e:
+                print(f"Gemini summary failed, keeping excerpts: {e}")
+        summaries.inc("excerpt")
+        # Keep the end: the newest excerpts matter most.
+        return excerpt(summary, turns)[-limit:]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"summarizing": len(self._summarizing), "context_budget_tokens": self.context_budget}
@@ -0,0 +1,260 @@
+"""The /google/* actions against the real Google APIs.
+
+Each function takes the request body of its endpoint and returns the same
+response shape as the demo data the endpoint serves to users without a
+Google connection, so ``manage_*`` tools work the same either way. Calls
+that read several items (the messages of an email search) go out as one
+batch request.
+"""
+import base64
+import os
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from googleapiclient.http import MediaInMemoryUpload
+
+from backend.google_api import GoogleClients
+
+# Messages read by one email search
+SEARCH_LIMIT = 20
+FILE_SEARCH_LIMIT = 20
+EVENT_LIMIT = 20
+# Characters of a file or email body returned to the caller
+CONTENT_CHARS = 20000
+CALENDAR_TIMEZONE = os.getenv("GOOGLE_CALENDAR_TIMEZONE", "Asia/Jerusalem")
+GOOGLE_DOCUMENT = "application/vnd.google-apps."
+
+
+def _header(message: Dict[str, Any], name: str) -> str:
+    for header in message.get("payload", {}).get("headers", []):
+        if header.get("name", "").lower() == name.lower():
+            return header.get("value", "")
+    return ""
+
+
+def _plain_text(payload: Dict[str, Any]) -> Optional[str]:
+    """The first text/plain part of a message payload."""
+    data = payload.get("body", {}).get("data")
+    if payload.get("mimeType") == "text/plain" and data:
+        return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)).decode("utf-8", "replace")
+    for part in payload.get("parts") or []:
+        text = _plain_text(part)
+        if text is not None:
+            return text
+    return None
+
+
+def gmail(clients: GoogleClients, user_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    action = body.get("action")
+    service = clients.service(user_id, "gmail")
+    messages = service.users().messages()
+
+    if action == "send_email":
+        to_email = body.get("to")
+        message = MIMEText(body.get("body") or "", "plain", "utf-8")
+        message["to"] = to_email
+        message["subject"] = body.get("subject") or ""
+        raw = base64.urlsafe_b64encode(message.as_bytes()).decode("ascii")
+        sent = clients.execute(messages.send(userId="me", body={"raw": raw}))
+        return {"success": True, "message": f"מייל נשלח בהצלחה אל {to_email}", "email_id": sent.get("id")}
+
+    if action == "search_emails":
+        query = body.get("query", "")
+        found = clients.execute(messages.list(userId="me", q=query, maxResults=SEARCH_LIMIT)).get("messages") or []
+        # One batch request for all the messages instead of one request each.
+        results = clients.batch(user_id, "gmail", [
+            messages.get(userId="me", id=item["id"], format="metadata", metadataHeaders=["From", "Subject"])
+            for item in found
+        ])
+        emails = [
+            {"id": message["id"], "from": _header(message, "From"), "subject": _header(message, "Subject"),
+             "snippet": message.get("snippet", "")}
+            for message, error in results if error is None and message
+        ]
+        return {"success": True, "emails": emails, "message": f"נמצאו תוצאות עבור: {query}"}
+
+    if action == "read_email":
+        message = clients.execute(messages.get(userId="me", id=body.get("message_id"), format="full"))
+        text = _plain_text(message.get("payload", {}))
+        return {"success": True, "email": {
+            "from": _header(message, "From"),
+            "to": _header(message, "To"),
+            "subject": _header(message, "Subject"),
+            "body": (text if text is not None else message.get("snippet", ""))[:CONTENT_CHARS],
+        }}
+    return None
+
+
+def _event_time(value: str) -> Dict[str, str]:
+    # The agent sends local times without an offset.
+    return {"dateTime": value, "timeZone": CALENDAR_TIMEZONE}
+
+
+def _rfc3339(value: str) -> str:
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=ZoneInfo(CALENDAR_TIMEZONE))
+    return moment.isoformat()
+
+
+def calendar(clients: GoogleClients, user_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    action = body.get("action")
+    service = clients.service(user_id, "calendar")
+
+    if action == "create_event":
+        summary = body.get("summary")
+        event = {
+            "summary": summary,
+            "description": body.get("description") or "",
+            "start": _event_time(body.get("start_time")),
+            "end": _event_time(body.get("end_time")),
+        }
+        if body.get("attendee_emails"):
+            event["attendees"] = [{"email": email} for email in body["attendee_emails"]]
+        created = clients.execute(service.events().insert(calendarId="primary", body=event))
+        return {
+            "success": True,
+            "message": f"אירוע '{summary}' נוצר בהצלחה",
+            "event_id": created.get("id"),
+            "event_url": created.get("htmlLink"),
+        }
+
+    if action == "list_events":
+        now = datetime.utcnow()
+        listed = clients.execute(service.events().list(
+            calendarId="primary", timeMin=now.isoformat() + "Z", timeMax=(now + timedelta(days=7)).isoformat() + "Z",
+            singleEvents=True, orderBy="startTime", maxResults=EVENT_LIMIT,
+        ))
+        events = [
+            {
+                "id": event.get("id"),
+                "summary": event.get("summary"),
+                "start": event.get("start", {}).get("dateTime") or event.get("start", {}).get("date"),
+                "end": event.get("end", {}).get("dateTime") or event.get("end", {}).get("date"),
+            }
+            for event in listed.get("items") or []
+        ]
+        return {"success": True, "events": events, "message": "נמצאו אירועים בלוח השנה"}
+
+    if action == "check_availability":
+        start_time = body.get("start_time")
+        answer = clients.execute(service.freebusy().query(body={
+            "timeMin": _rfc3339(start_time),
+            "timeMax": _rfc3339(body.get("end_time") or start_time),
+            "items": [{"id": "primary"}],
+        }))
+        busy = answer.get("calendars", {}).get("primary", {}).get("busy") or []
+        return {"success": True, "available": not busy, "message": f"{'זמין' if not busy else 'תפוס'} ב-{start_time}"}
+    return None
+
+
+def _quote(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def drive(clients: GoogleClients, user_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    action = body.get("action")
+    files = clients.service(user_id, "drive").files()
+
+    if action == "search_files":
+        query = body.get("query", "")
+        listed = clients.execute(files.list(
+            q=f"name contains '{_quote(query)}' and trashed = false",
+            pageSize=FILE_SEARCH_LIMIT, fields="files(id,name,mimeType)",
+        ))
+        found = [
+            {"id": item["id"], "name": item.get("name"), "type": item.get("mimeType", "").rsplit(".", 1)[-1]}
+            for item in listed.get("files") or []
+        ]
+        return {"success": True, "files": found, "message": f"נמצאו קבצים עבור: {query}"}
+
+    if action == "read_file":
+        file_id = body.get("file_id")
+        meta = clients.execute(files.get(fileId=file_id, fields="id,name,mimeType"))
+        if meta.get("mimeType", "").startswith(GOOGLE_DOCUMENT):
+            content = clients.execute(files.export(fileId=file_id, mimeType="text/plain"))
+        else:
+            content = clients.execute(files.get_media(fileId=file_id))
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        return {"success": True, "content": content[:CONTENT_CHARS], "message": f"קובץ {file_id} נקרא בהצלחה"}
+
+    if action == "create_file":
+        file_name = body.get("file_name")
+        media = MediaInMemoryUpload((body.get("content") or "").encode("utf-8"), mimetype="text/plain")
+        created = clients.execute(files.create(body={"name": file_name}, media_body=media, fields="id"))
+        return {"success": True, "file_id": created.get("id"), "message": f"קובץ '{file_name}' נוצר בהצלחה"}
+    return None
+
+
+def sheets(clients: GoogleClients, user_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    action = body.get("action")
+    values = clients.service(user_id, "sheets").spreadsheets().values()
+    spreadsheet_id = body.get("spreadsheet_id")
+
+    if action == "read_range":
+        range_name = body.get("range")
+        found = clients.execute(values.get(spreadsheetId=spreadsheet_id, range=range_name))
+        return {"success": True, "values": found.get("values") or [], "message": f"נתונים נקראו מ-{range_name}"}
+
+    if action == "append_row":
+        row: List[Any] = body.get("values", [])
+        appended = clients.execute(values.append(
+            spreadsheetId=spreadsheet_id, range=body.get("range") or "A1",
+            valueInputOption="USER_ENTERED", body={"values": [row]},
+        ))
+        return {
+            "success": True,
+            "message": f"שורה חדשה נוספה עם {len(row)} עמודות",
+            "updated_range": appended.get("updates", {}).get("updatedRange"),
+        }
+    return None
+
+
+def _document_text(document: Dict[str, Any]) -> str:
+    return "".join(
+        element.get("textRun", {}).get("content", "")
+        for block in document.get("body", {}).get("content", [])
+        for element in block.get("paragraph", {}).get("elements", [])
+    )
+
+
+def _append(text: str) -> Dict[str, Any]:
+    return {"requests": [{"insertText": {"text": text, "endOfSegmentLocation": {}}}]}
+
+
+def docs(clients: GoogleClients, user_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    action = body.get("action")
+    documents = clients.service(user_id, "docs").documents()
+
+    if action == "create_document":
+        title = body.get("title")
+        created = clients.execute(documents.create(body={"title": title}))
+        doc_id = created["documentId"]
+        if body.get("content"):
+            clients.execute(documents.batchUpdate(documentId=doc_id, body=_append(body["content"])))
+        return {
+            "success": True,
+            "document": {"id": doc_id, "title": title, "url": f"https://docs.google.com/document/d/{doc_id}/edit"},
+            "message": f"מסמך '{title}' נוצר בהצלחה",
+        }
+
+    if action == "read_document":
+        document = clients.execute(documents.get(documentId=body.get("document_id")))
+        return {
+            "success": True,
+            "document": {
+                "id": document.get("documentId"),
+                "title": document.get("title"),
+                "content": _document_text(document)[:CONTENT_CHARS],
+            },
+            "message": "מסמך נקרא בהצלחה",
+        }
+
+    if action == "append_text":
+        document_id = body.get("document_id")
+        clients.execute(documents.batchUpdate(documentId=document_id, body=_append(body.get("insert_text") or "")))
+        return {"success": True, "message": f"טקסט נוסף למסמך {document_id}"}
+    return None
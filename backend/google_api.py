@@ -0,0 +1,301 @@
+"""Google API clients for the /google/* actions.
+
+``GoogleClients`` hands out googleapiclient service objects per user:
+
+- Discovery documents come from the copies bundled with
+  google-api-python-client. Each is parsed once per process. ``build()``
+  re-reads and parses 150 KB or more of JSON for every service, while
+  building from the parsed document takes microseconds.
+- Services are cached per user and API. They send their requests through
+  ``PooledHttp``, which has the httplib2 interface googleapiclient
+  expects. Underneath it is one ``requests`` session shared by all users
+  and threads, so connections and TLS sessions to Google are kept alive
+  and reused, up to GOOGLE_HTTP_POOL_SIZE per host. httplib2 (the default)
+  keeps a connection per Http object and is not thread-safe.
+- Access tokens are refreshed GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS before
+  they expire rather than after a request fails. Each user's token is
+  refreshed once even when several threads need it, and the new token is
+  stored. A 401 still forces a refresh and one retry.
+- ``batch()`` sends several calls to one API as a single request to
+  Google's batch endpoint, BATCH_SIZE calls at a time.
+
+Tokens are kept in the ``google_tokens`` collection, one record per user.
+Cached credentials follow that collection, so a token saved, refreshed or
+removed by another server process replaces this one's copy.
+GOOGLE_API_ROOT and GOOGLE_TOKEN_URI send every request to another server
+instead, such as benchmarks/fake_google.py.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import httplib2
+import requests
+from google.auth.transport.requests import Request as AuthRequest
+from google.oauth2.credentials import Credentials
+from googleapiclient import discovery, discovery_cache
+from googleapiclient.errors import HttpError
+
+from backend import metrics
+from backend.storage import Repository
+
+API_ROOT = os.getenv("GOOGLE_API_ROOT", "").rstrip("/")
+TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "20"))
+TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "30"))
+NUM_RETRIES = int(os.getenv("GOOGLE_NUM_RETRIES", "2"))
+REFRESH_MARGIN_SECONDS = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+MAX_CACHED_SERVICES = int(os.getenv("GOOGLE_MAX_CACHED_SERVICES", "1000"))
+# Google takes up to 100 calls per batch request; Gmail advises at most 50.
+BATCH_SIZE = 50
+
+# API name -> (discovery name, version)
+APIS = {
+    "gmail": ("gmail", "v1"),
+    "calendar": ("calendar", "v3"),
+    "drive": ("drive", "v3"),
+    "sheets": ("sheets", "v4"),
+    "docs": ("docs", "v1"),
+}
+SCOPES = [
+    "https://www.googleapis.com/auth/gmail.send",
+    "https://www.googleapis.com/auth/gmail.readonly",
+    "https://www.googleapis.com/auth/calendar",
+    "https://www.googleapis.com/auth/drive",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/documents",
+]
+
+api_requests = metrics.Counter(
+    "google_api_requests_total", "HTTP requests sent to Google, by kind (call, batch, token).", ("kind",)
+)
+batch_calls = metrics.Histogram(
+    "google_batch_calls", "API calls sent in one batch request.", buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+token_refreshes = metrics.Counter(
+    "google_token_refreshes_total", "OAuth access token refreshes, by reason (expiring, rejected).", ("reason",)
+)
+
+
+class NotConnected(Exception):
+    """The user has not connected a Google account."""
+
+
+def error_message(error: Exception) -> str:
+    """A short message for a failed Google call."""
+    if isinstance(error, HttpError):
+        return f"Google API {error.status_code}: {error.reason}"
+    return str(error) or type(error).__name__
+
+
+_documents: Dict[str, Dict[str, Any]] = {}
+
+
+def discovery_document(api: str) -> Dict[str, Any]:
+    """The parsed discovery document of ``api`` (a key of APIS)."""
+    document = _documents.get(api)
+    if document is None:
+        name, version = APIS[api]
+        document = _documents[api] = json.loads(discovery_cache.get_static_doc(name, version))
+    return document
+
+
+def _session() -> requests.Session:
+    session = requests.Session()
+    # One pool per host: gmail, sheets, docs, www.googleapis.com, oauth2, ...
+    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _rebase(uri: str) -> str:
+    parts = urlsplit(uri)
+    return f"{API_ROOT}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+
+class PooledHttp:
+    """The part of ``httplib2.Http`` googleapiclient uses, sent over a shared session.
+
+    ``authorize(rejected)`` returns the access token to send. It gets the
+    token a 401 came back for, which must then be refreshed.
+    """
+
+    def __init__(self, session: requests.Session, authorize: Callable[[Optional[str]], str]):
+        self.session = session
+        self.authorize = authorize
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if API_ROOT:
+            uri = _rebase(uri)
+        headers = dict(headers or {})
+        kind = "batch" if "multipart/mixed" in str(headers.get("content-type", "")) else "call"
+        token = self.authorize(None)
+        for attempt in range(2):
+            headers["Authorization"] = f"Bearer {token}"
+            api_requests.inc(kind)
+            response = self.session.request(method, uri, data=body, headers=headers, timeout=TIMEOUT_SECONDS)
+            if response.status_code != 401 or attempt:
+                break
+            token = self.authorize(token)
+        # requests has already decoded the body, so its encoding and length no longer apply.
+        info = {key.lower(): value for key, value in response.headers.items()}
+        info.pop("content-encoding", None)
+        info.pop("content-length", None)
+        info["status"] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+
+class GoogleClients:
+    def __init__(self, tokens: Repository):
+        self.tokens = tokens
+        self.session = _session()
+        self._credentials: Dict[str, Credentials] = {}
+        self._services: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._refresh_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        tokens.subscribe(self._token_changed)
+
+    def _token_changed(self, user_id: str, record: Optional[Dict[str, Any]]):
+        with self._lock:
+            credentials = self._credentials.get(user_id)
+            # Our own refresh stores the token we already hold.
+            if record is not None and credentials is not None and record.get("token") == credentials.token:
+                return
+            self._credentials.pop(user_id, None)
+            if record is None:
+                for key in [key for key in self._services if key[0] == user_id]:
+                    del self._services[key]
+
+    def connected(self, user_id: str) -> bool:
+        return user_id in self._credentials or user_id in self.tokens
+
+    def exchange_code(self, code: str, redirect_uri: str) -> Dict[str, Any]:
+        """Trade an OAuth authorization code for tokens (the token endpoint's JSON)."""
+        api_requests.inc("token")
+        response = self.session.post(TOKEN_URI, data={
+            "code": code,
+            "client_id": os.getenv("GOOGLE_CLIENT_ID", ""),
+            "client_secret": os.getenv("GOOGLE_CLIENT_SECRET", ""),
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code",
+        }, timeout=TIMEOUT_SECONDS)
+        if response.status_code != 200:
+            raise ValueError(f"Token exchange failed: {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def save(self, user_id: str, token: Dict[str, Any]):
+        """Store the token endpoint's answer for ``user_id``."""
+        now = datetime.utcnow()
+        stored = self.tokens.get(user_id) or {}
+        self.tokens[user_id] = {
+            "id": user_id,
+            "user_id": user_id,
+            "token": token["access_token"],
+            # Google sends a refresh token only on the first consent.
+            "refresh_token": token.get("refresh_token") or stored.get("refresh_token"),
+            "expiry_date": now + timedelta(seconds=int(token.get("expires_in", 3600))),
+            "scopes": (token.get("scope") or " ".join(SCOPES)).split(),
+            "created_date": stored.get("created_date", now),
+            "updated_date": now,
+        }
+        with self._lock:
+            self._credentials.pop(user_id, None)
+
+    def disconnect(self, user_id: str):
+        self.tokens.pop(user_id, None)
+
+    def _load(self, user_id: str) -> Credentials:
+        record = self.tokens.get(user_id)
+        if record is None:
+            raise NotConnected("חשבון Google לא מחובר")
+        credentials = Credentials(
+            record["token"],
+            refresh_token=record.get("refresh_token"),
+            token_uri=TOKEN_URI,
+            client_id=os.getenv("GOOGLE_CLIENT_ID"),
+            client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+            scopes=record.get("scopes"),
+            expiry=record.get("expiry_date"),
+        )
+        with self._lock:
+            # Keep credentials another thread stored meanwhile.
+            return self._credentials.setdefault(user_id, credentials)
+
+    def access_token(self, user_id: str, rejected: Optional[str] = None) -> str:
+        """A current access token for ``user_id``, refreshed if it expires soon or was ``rejected``."""
+        credentials = self._credentials.get(user_id) or self._load(user_id)
+        if rejected is None and not _expiring(credentials):
+            return credentials.token
+        with self._lock:
+            lock = self._refresh_locks.setdefault(user_id, threading.Lock())
+        with lock:
+            # Another thread may have refreshed it while this one waited.
+            credentials = self._credentials.get(user_id) or self._load(user_id)
+            if credentials.token == rejected or (rejected is None and _expiring(credentials)):
+                api_requests.inc("token")
+                credentials.refresh(AuthRequest(self.session))
+                token_refreshes.inc("rejected" if rejected else "expiring")
+                record = self.tokens.get(user_id)
+                if record is not None:
+                    record.update(token=credentials.token, expiry_date=credentials.expiry, updated_date=datetime.utcnow())
+                    self.tokens[user_id] = record
+            return credentials.token
+
+    def service(self, user_id: str, api: str) -> Any:
+        """The googleapiclient service for ``api`` (a key of APIS), acting as ``user_id``."""
+        key = (user_id, api)
+        service = self._services.get(key)
+        if service is not None:
+            return service
+        if not self.connected(user_id):
+            raise NotConnected("חשבון Google לא מחובר")
+        http = PooledHttp(self.session, lambda rejected: self.access_token(user_id, rejected))
+        service = discovery.build_from_document(discovery_document(api), http=http)
+        with self._lock:
+            self._services[key] = service
+            while len(self._services) > MAX_CACHED_SERVICES:
+                self._services.popitem(last=False)
+        return service
+
+    def execute(self, request: Any) -> Any:
+        """Run one API call, retrying 429 and 5xx answers with backoff."""
+        return request.execute(num_retries=NUM_RETRIES)
+
+    def batch(self, user_id: str, api: str, calls: Sequence[Any]) -> List[Tuple[Any, Optional[Exception]]]:
+        """Run API calls of one service in batch requests; ``(response, error)`` per call, in order."""
+        results: List[Tuple[Any, Optional[Exception]]] = [(None, None)] * len(calls)
+        if len(calls) == 1:
+            try:
+                results[0] = (self.execute(calls[0]), None)
+            except Exception as e:
+                results[0] = (None, e)
+            return results
+
+        def collect(request_id: str, response: Any, error: Optional[Exception]):
+            results[int(request_id)] = (response, error)
+
+        service = self.service(user_id, api)
+        for start in range(0, len(calls), BATCH_SIZE):
+            chunk = calls[start:start + BATCH_SIZE]
+            request = service.new_batch_http_request(callback=collect)
+            for offset, call in enumerate(chunk):
+                request.add(call, request_id=str(start + offset))
+            batch_calls.observe(len(chunk))
+            request.execute()
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {"users": len(self._credentials), "services": len(self._services)}
+
+
+def _expiring(credentials: Credentials) -> bool:
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False
+    return credentials.expiry - datetime.utcnow() < timedelta(seconds=REFRESH_MARGIN_SECONDS)
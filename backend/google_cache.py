@@ -0,0 +1,201 @@
+"""Read-through cache of /google/* results, per user.
+
+Read actions are cached for a TTL that depends on how fast their data
+changes (READS). Each cached result is filed under a scope: the user's
+calendar, a spreadsheet, a document, ... A write action drops the results
+of the scopes it changes (WRITES), whether or not it succeeded, so an
+agent that appends a row and reads the range again sees the new row. A
+read that was running while its scope was invalidated is not stored.
+
+Only successful results are cached, and at most GOOGLE_CACHE_MAX_ENTRIES
+of them; the least recently used goes first. Keys hold the user, the
+service and every argument of the call.
+
+Each server process has its own cache. ``share()`` makes invalidations
+reach all of them: every invalidation is also written to a collection (one
+record per user and scope), and writes to it from other processes
+invalidate here.
+"""
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from backend import metrics
+from backend.storage import Repository
+
+MAX_ENTRIES = int(os.getenv("GOOGLE_CACHE_MAX_ENTRIES", "2000"))
+
+Body = Dict[str, Any]
+
+# (service, action) -> (TTL in seconds, scope of the data it reads)
+READS: Dict[Tuple[str, str], Tuple[float, Callable[[Body], str]]] = {
+    ("gmail", "search_emails"): (60, lambda body: "gmail"),
+    ("gmail", "read_email"): (3600, lambda body: f"gmail:{body.get('message_id')}"),
+    ("calendar", "list_events"): (300, lambda body: "calendar"),
+    ("calendar", "check_availability"): (120, lambda body: "calendar"),
+    ("drive", "search_files"): (300, lambda body: "drive"),
+    ("drive", "read_file"): (600, lambda body: f"drive:{body.get('file_id')}"),
+    ("sheets", "read_range"): (300, lambda body: f"sheets:{body.get('spreadsheet_id')}"),
+    ("docs", "read_document"): (600, lambda body: f"docs:{body.get('document_id')}"),
+}
+# (service, action) -> scopes whose cached results it makes stale
+WRITES: Dict[Tuple[str, str], Callable[[Body], List[str]]] = {
+    ("gmail", "send_email"): lambda body: ["gmail"],
+    ("calendar", "create_event"): lambda body: ["calendar"],
+    ("drive", "create_file"): lambda body: ["drive"],
+    ("sheets", "append_row"): lambda body: [f"sheets:{body.get('spreadsheet_id')}"],
+    # New documents show up in Drive searches; Drive can read a document too.
+    ("docs", "create_document"): lambda body: ["drive"],
+    ("docs", "append_text"): lambda body: [f"docs:{body.get('document_id')}", f"drive:{body.get('document_id')}"],
+}
+
+lookups = metrics.Counter(
+    "google_cache_lookups_total", "Google tool result cache lookups.", ("service", "action", "result")
+)
+invalidations = metrics.Counter(
+    "google_cache_invalidations_total", "Cached Google results dropped by a write.", ("service", "action")
+)
+
+Key = Tuple[str, str, str]  # (user, service, arguments)
+Scope = Tuple[str, str]  # (user, scope)
+ALL_SCOPES = "*"
+
+
+class ToolResultCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Key, Tuple[float, Scope, Any]]" = OrderedDict()
+        self._scopes: Dict[Scope, Set[Key]] = {}
+        # Bumped by every invalidation of a scope, so reads that overlap one are not stored.
+        self._generations: Dict[Scope, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._shared: Optional[Repository] = None
+
+    def share(self, repo: Repository) -> "ToolResultCache":
+        """Publish invalidations to ``repo`` and apply the ones other processes publish."""
+        self._shared = repo
+        repo.subscribe(self._invalidated)
+        return self
+
+    def _invalidated(self, record_id: str, record: Optional[Dict[str, Any]]):
+        # Our own invalidations come back here too; dropping an empty scope again is harmless.
+        if record is None:
+            return
+        if record["scope"] == ALL_SCOPES:
+            self._drop_user(record["user_id"])
+        else:
+            self._drop(record["user_id"], record["scope"])
+
+    def _publish(self, user_id: str, scope: str):
+        if self._shared is not None:
+            record_id = f"{user_id}:{scope}"
+            self._shared[record_id] = {
+                "id": record_id, "user_id": user_id, "scope": scope, "updated_date": datetime.utcnow(),
+            }
+
+    def call(self, user_id: str, service: str, body: Body, run: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """The result of the action in ``body``: cached for reads, invalidating for writes."""
+        action = body.get("action")
+        read = READS.get((service, action))
+        if read is None:
+            try:
+                return run()
+            finally:
+                stale = WRITES.get((service, action))
+                if stale is not None:
+                    dropped = sum(self.invalidate(user_id, scope) for scope in stale(body))
+                    invalidations.inc(service, action, amount=dropped)
+
+        ttl, scope_of = read
+        key = (user_id, service, json.dumps(body, sort_keys=True, ensure_ascii=False, default=str))
+        scope = (user_id, scope_of(body))
+        cached = self.get(key)
+        lookups.inc(service, action, "miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+        generation = self._generations.get(scope, 0)
+        result = run()
+        if result.get("success"):
+            self.put(key, scope, ttl, result, generation)
+        return result
+
+    def get(self, key: Key) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(entry[2])
+
+    def put(self, key: Key, scope: Scope, ttl: float, value: Any, generation: int = 0):
+        if self.max_entries <= 0:
+            return
+        entry = (time.monotonic() + ttl, scope, copy.deepcopy(value))
+        with self._lock:
+            if self._generations.get(scope, 0) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, user_id: str, scope: str) -> int:
+        """Drop the cached results of ``scope``; returns how many there were here."""
+        dropped = self._drop(user_id, scope)
+        self._publish(user_id, scope)
+        return dropped
+
+    def invalidate_user(self, user_id: str):
+        """Drop everything cached for ``user_id`` (their Google account changed)."""
+        self._drop_user(user_id)
+        self._publish(user_id, ALL_SCOPES)
+
+    def _drop(self, user_id: str, scope: str) -> int:
+        with self._lock:
+            keys = list(self._scopes.get((user_id, scope), ()))
+            for key in keys:
+                self._remove(key)
+            self._generations[(user_id, scope)] = self._generations.get((user_id, scope), 0) + 1
+            return len(keys)
+
+    def _drop_user(self, user_id: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._remove(key)
+            for scope in [scope for scope in self._generations if scope[0] == user_id]:
+                self._generations[scope] += 1
+
+    def _remove(self, key: Key):
+        _, scope, _ = self._entries.pop(key)
+        keys = self._scopes[scope]
+        keys.discard(key)
+        if not keys:
+            del self._scopes[scope]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+tool_cache = ToolResultCache()
@@ -0,0 +1,463 @@
+"""Async Gemini client used by the backend.
+
+The google-generativeai SDK is synchronous (its async client only speaks gRPC
+asyncio), so blocking calls run on a dedicated, bounded thread pool instead of
+the uvicorn event loop. Calls are admitted by the shared queue in
+``llm_queue``, which applies rate limits and runs interactive calls before
+scheduled ones. Every call has a timeout, and cancelling the awaiting
+coroutine drops calls that have not started. A 429 from Gemini pauses the
+queue and the call is retried with exponential backoff. Identical
+generate() calls that are in flight at the same time share one request.
+Code inside ``track_usage()`` gets the latency and token counts of the
+calls it makes.
+
+Callers that expect JSON pass ``json_mode=True``: Gemini is then asked for a
+``application/json`` response (GEMINI_JSON_MODE=0 turns this off). Models
+that reject the option are remembered and called without it.
+
+Static instructions are passed as a system instruction. Where Gemini context
+caching is available for the model and the instruction is large enough, it
+is uploaded once as cached content and reused until it expires.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Set, Tuple
+
+import google.generativeai as genai
+from google.api_core.exceptions import ClientError, InvalidArgument, TooManyRequests
+from google.generativeai import caching
+
+from backend import llm_queue, metrics
+
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") != "0"
+CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_RETRY_SECONDS = float(os.getenv("GEMINI_CONTEXT_CACHE_RETRY_SECONDS", "300"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+JSON_MODE_ENABLED = os.getenv("GEMINI_JSON_MODE", "1") != "0"
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="llm")
+dispatcher = llm_queue.Dispatcher(MAX_CONCURRENCY)
+dispatcher.register_metrics()
+_END_OF_STREAM = object()
+
+
+def configure():
+    """Configure the SDK from the environment.
+
+    GEMINI_API_ENDPOINT (e.g. ``http://127.0.0.1:9000``) points the REST
+    transport at another server, such as benchmarks/fake_gemini.py for load
+    testing (see benchmarks/load_test.py).
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=api_key)
+
+
+# (model, system instruction) -> (model bound to cached content, expiry)
+_context_models: Dict[Tuple[str, str], Tuple[genai.GenerativeModel, float]] = {}
+_context_unavailable: Set[Tuple[str, str]] = set()
+# Keys whose cached content is being created, and when a failed create may be tried again.
+_context_creating: Set[Tuple[str, str]] = set()
+_context_retry_at: Dict[Tuple[str, str], float] = {}
+_context_lock = threading.Lock()
+context_cache_stats = {"hits": 0, "created": 0, "unavailable": 0, "failed": 0}
+
+
+@lru_cache(maxsize=256)
+def _plain_model(model_name: str, system_instruction: Optional[str]) -> genai.GenerativeModel:
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+def _is_rejection(error: Exception) -> bool:
+    """A 4xx other than 429: the prefix is too small or the model can't cache it."""
+    return isinstance(error, ClientError) and not isinstance(error, TooManyRequests)
+
+
+def _model(model_name: str, system_instruction: Optional[str] = None) -> genai.GenerativeModel:
+    """Model for a call; runs on the LLM pool since creating cached content is a request.
+
+    Only one thread creates a given cached content, and it does so outside the
+    lock; calls made meanwhile use the plain model. A rejected prefix is never
+    tried again; any other failure is retried after CONTEXT_CACHE_RETRY_SECONDS.
+    """
+    key = (model_name, system_instruction or "")
+    if not system_instruction or not CONTEXT_CACHE_ENABLED or key in _context_unavailable:
+        return _plain_model(model_name, system_instruction)
+
+    with _context_lock:
+        entry = _context_models.get(key)
+        if entry and entry[1] > time.time():
+            context_cache_stats["hits"] += 1
+            return entry[0]
+        if key in _context_creating or _context_retry_at.get(key, 0) > time.time():
+            return _plain_model(model_name, system_instruction)
+        _context_creating.add(key)
+
+    try:
+        cached = caching.CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction,
+            ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS),
+        )
+        model = genai.GenerativeModel.from_cached_content(cached)
+    except Exception as e:
+        print(f"Gemini context cache unavailable for {model_name}: {e}")
+        with _context_lock:
+            _context_creating.discard(key)
+            if _is_rejection(e):
+                _context_unavailable.add(key)
+                context_cache_stats["unavailable"] += 1
+            else:
+                _context_retry_at[key] = time.time() + CONTEXT_CACHE_RETRY_SECONDS
+                context_cache_stats["failed"] += 1
+        return _plain_model(model_name, system_instruction)
+
+    with _context_lock:
+        # Refresh a minute early so no call races the server-side expiry.
+        _context_models[key] = (model, time.time() + CONTEXT_CACHE_TTL_SECONDS - 60)
+        _context_creating.discard(key)
+        _context_retry_at.pop(key, None)
+        context_cache_stats["created"] += 1
+    return model
+
+
+_json_mode_unavailable: Set[str] = set()
+
+
+def _generation_config(model_name: str, temperature: Optional[float], json_mode: bool) -> Optional[Dict[str, Any]]:
+    config: Dict[str, Any] = {}
+    if temperature is not None:
+        config["temperature"] = temperature
+    if json_mode and JSON_MODE_ENABLED and model_name not in _json_mode_unavailable:
+        config["response_mime_type"] = "application/json"
+    return config or None
+
+
+def _generate_content(
+    prompt: str,
+    model_name: str,
+    temperature: Optional[float],
+    system_instruction: Optional[str],
+    json_mode: bool,
+    stream: bool = False,
+) -> Any:
+    """``generate_content``, retried without JSON mode if the model rejects it."""
+    model = _model(model_name, system_instruction)
+    config = _generation_config(model_name, temperature, json_mode)
+    try:
+        return model.generate_content(prompt, generation_config=config, stream=stream)
+    except InvalidArgument as e:
+        if not config or "response_mime_type" not in config:
+            raise
+        print(f"Gemini JSON mode unavailable for {model_name}: {e}")
+        _json_mode_unavailable.add(model_name)
+        return model.generate_content(
+            prompt, generation_config=_generation_config(model_name, temperature, False), stream=stream
+        )
+
+
+def _generate_sync(
+    prompt: str, model_name: str, temperature: Optional[float], system_instruction: Optional[str], json_mode: bool = False
+) -> Tuple[str, Tuple[int, int]]:
+    """Completion text and (prompt tokens, output tokens)."""
+    response = _generate_content(prompt, model_name, temperature, system_instruction, json_mode)
+    usage = getattr(response, "usage_metadata", None)
+    tokens = (getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0)
+    return response.text, tokens
+
+
+_usage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("llm_usage", default=None)
+token_stats = {"prompt_tokens": 0, "output_tokens": 0}
+
+llm_latency = metrics.Histogram(
+    "llm_request_duration_seconds", "Gemini call latency as seen by the caller, queueing included.", ("kind",)
+)
+llm_calls = metrics.Counter("llm_requests_total", "Gemini calls by outcome.", ("kind", "outcome"))
+metrics.Counter(
+    "llm_tokens_total", "Gemini tokens reported by the API.", ("type",),
+    function=lambda: {("prompt",): token_stats["prompt_tokens"], ("output",): token_stats["output_tokens"]},
+)
+
+
+@contextmanager
+def track_usage() -> Iterator[Dict[str, Any]]:
+    """Collect the number, latency and token counts of LLM calls made in the block."""
+    usage = {"calls": 0, "latency_ms": 0.0, "prompt_tokens": 0, "output_tokens": 0}
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def _outcome(error: BaseException) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, llm_queue.QueueFull):
+        return "rejected"
+    if isinstance(error, TooManyRequests):
+        return "rate_limited"
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    return "error"
+
+
+def _account(started: float, tokens: Tuple[int, int] = (0, 0), kind: str = "generate"):
+    llm_latency.observe(time.perf_counter() - started, kind)
+    llm_calls.inc(kind, "ok")
+    token_stats["prompt_tokens"] += tokens[0]
+    token_stats["output_tokens"] += tokens[1]
+    usage = _usage.get()
+    if usage is not None:
+        usage["calls"] += 1
+        usage["latency_ms"] += (time.perf_counter() - started) * 1000
+        usage["prompt_tokens"] += tokens[0]
+        usage["output_tokens"] += tokens[1]
+
+
+async def _submit(priority: str, cost: int, fn: Callable[..., Any], *args: Any) -> Future:
+    """Wait for the queue to admit the call and start ``fn`` on the LLM thread pool."""
+    await dispatcher.acquire(priority, cost)
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        dispatcher.release()
+        raise
+    # Release the slot when the worker thread is really done, not when the
+    # awaiting coroutine gives up, so a timed-out call keeps its slot until
+    # Gemini answers and the pool can never be oversubscribed.
+    future.add_done_callback(lambda _: dispatcher.release())
+    return future
+
+
+def _back_off(attempt: int) -> float:
+    """Pause the queue after a 429; returns how long this call should wait."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+    dispatcher.back_off(delay)
+    return delay
+
+
+async def _generate(
+    prompt: str,
+    model_name: str,
+    temperature: Optional[float],
+    system_instruction: Optional[str],
+    priority: str,
+    json_mode: bool,
+) -> Tuple[str, Tuple[int, int]]:
+    cost = llm_queue.estimate_tokens(prompt, system_instruction)
+    attempt = 0
+    while True:
+        future = await _submit(
+            priority, cost, _generate_sync, prompt, model_name, temperature, system_instruction, json_mode
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except TooManyRequests:
+            if attempt >= MAX_RETRIES:
+                raise
+        await asyncio.sleep(_back_off(attempt))
+        attempt += 1
+
+
+class _SharedCall:
+    """A generate() call in flight, awaited by every caller asking the same thing."""
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.waiters = 0
+        self.cancel: Callable[[], Any] = lambda: None
+
+
+_shared_calls: Dict[Tuple[Any, ...], _SharedCall] = {}
+_shared_lock = threading.Lock()
+dedup_stats = {"deduplicated": 0}
+
+
+def _start_shared(key: Tuple[Any, ...], shared: _SharedCall, coro: Any):
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(coro)
+    shared.cancel = lambda: loop.call_soon_threadsafe(task.cancel)
+
+    def finish(task: asyncio.Task):
+        with _shared_lock:
+            if _shared_calls.get(key) is shared:
+                del _shared_calls[key]
+        if task.cancelled():
+            shared.future.cancel()
+        elif task.exception() is not None:
+            shared.future.set_exception(task.exception())
+        else:
+            shared.future.set_result(task.result())
+
+    task.add_done_callback(finish)
+
+
+async def generate(
+    prompt: str,
+    model_name: Optional[str] = None,
+    temperature: Optional[float] = None,
+    timeout: Optional[float] = None,
+    system_instruction: Optional[str] = None,
+    priority: str = llm_queue.INTERACTIVE,
+    json_mode: bool = False,
+) -> str:
+    """Return the completion text for ``prompt``.
+
+    Raises ``asyncio.TimeoutError`` if queueing, retries and the call itself
+    take longer than ``timeout`` (LLM_TIMEOUT_SECONDS by default), and
+    ``llm_queue.QueueFull`` if the queue is full. The shared request is
+    cancelled only once every caller waiting for it has given up.
+    """
+    model_name = model_name or DEFAULT_MODEL
+    key = (model_name, system_instruction, prompt, temperature, json_mode)
+    with _shared_lock:
+        shared = _shared_calls.get(key)
+        if shared is None:
+            shared = _shared_calls[key] = _SharedCall()
+            _start_shared(
+                key, shared, _generate(prompt, model_name, temperature, system_instruction, priority, json_mode)
+            )
+        else:
+            dedup_stats["deduplicated"] += 1
+        shared.waiters += 1
+    started = time.perf_counter()
+    try:
+        text, tokens = await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(shared.future)), TIMEOUT_SECONDS if timeout is None else timeout
+        )
+        # Token counts are charged to every caller of a shared request.
+        _account(started, tokens)
+        return text
+    except BaseException as e:
+        llm_calls.inc("generate", _outcome(e))
+        raise
+    finally:
+        with _shared_lock:
+            shared.waiters -= 1
+            abandoned = shared.waiters == 0 and not shared.future.done()
+            if abandoned and _shared_calls.get(key) is shared:
+                del _shared_calls[key]
+        if abandoned:
+            shared.cancel()
+
+
+async def stream(
+    prompt: str,
+    model_name: Optional[str] = None,
+    temperature: Optional[float] = None,
+    timeout: Optional[float] = None,
+    system_instruction: Optional[str] = None,
+    priority: str = llm_queue.INTERACTIVE,
+    json_mode: bool = False,
+) -> AsyncIterator[str]:
+    """Yield completion text chunks for ``prompt`` as Gemini produces them.
+
+    Goes through the same queue as generate() and is retried on a 429 that
+    arrives before the first chunk; ``timeout`` is a deadline for the whole
+    stream. Closing the generator early stops reading from Gemini.
+    """
+    model_name = model_name or DEFAULT_MODEL
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (TIMEOUT_SECONDS if timeout is None else timeout)
+    cost = llm_queue.estimate_tokens(prompt, system_instruction)
+    started = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            chunks = _stream_attempt(
+                prompt, model_name, temperature, system_instruction, priority, json_mode, cost, deadline
+            )
+            try:
+                async for item in chunks:
+                    if isinstance(item, TooManyRequests):
+                        if attempt >= MAX_RETRIES:
+                            raise item
+                        break
+                    yield item
+                else:
+                    _account(started, kind="stream")
+                    return
+            finally:
+                await chunks.aclose()
+            await asyncio.wait_for(asyncio.sleep(_back_off(attempt)), deadline - loop.time())
+            attempt += 1
+    except GeneratorExit:
+        llm_calls.inc("stream", "closed")
+        raise
+    except BaseException as e:
+        llm_calls.inc("stream", _outcome(e))
+        raise
+
+
+async def _stream_attempt(
+    prompt: str,
+    model_name: str,
+    temperature: Optional[float],
+    system_instruction: Optional[str],
+    priority: str,
+    json_mode: bool,
+    cost: int,
+    deadline: float,
+) -> AsyncIterator[Any]:
+    """One streaming request; yields a 429 (instead of raising it) if it comes before any text."""
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            response = _generate_content(prompt, model_name, temperature, system_instruction, json_mode, stream=True)
+            for chunk in response:
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+        except Exception as e:
+            loop.call_soon_threadsafe(chunks.put_nowait, e)
+        loop.call_soon_threadsafe(chunks.put_nowait, _END_OF_STREAM)
+
+    await asyncio.wait_for(_submit(priority, cost, produce), deadline - loop.time())
+    started = False
+    try:
+        while True:
+            item = await asyncio.wait_for(chunks.get(), deadline - loop.time())
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, TooManyRequests) and not started:
+                yield item
+                return
+            if isinstance(item, Exception):
+                raise item
+            started = True
+            yield item
+    finally:
+        stopped.set()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "max_concurrency": MAX_CONCURRENCY,
+        "queue": dispatcher.stats(),
+        "deduplicated": dedup_stats["deduplicated"],
+        "tokens": dict(token_stats),
+        "context_cache": dict(context_cache_stats),
+        "json_mode": {"enabled": JSON_MODE_ENABLED, "unavailable": sorted(_json_mode_unavailable)},
+    }
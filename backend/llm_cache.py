@@ -0,0 +1,88 @@
+"""Exact-match cache for parsed LLM responses.
+
+Keys cover everything that shapes an answer: model, system instruction,
+prompt (whitespace-normalized), temperature and the enabled tools. Entries
+expire after a TTL and the least recently used one is evicted when full.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _normalize(text: Optional[str]) -> str:
+    return " ".join((text or "").split())
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Shared by the web loop and the scheduler's worker loop threads.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        model_name: str,
+        prompt: str,
+        temperature: Optional[float] = None,
+        tools: Optional[List[str]] = None,
+        system_instruction: Optional[str] = None,
+    ) -> str:
+        raw = json.dumps(
+            [model_name, _normalize(system_instruction), _normalize(prompt), temperature, sorted(tools or [])],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        entry = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# The default TTL outlives a day so daily scheduled prompts are served from cache.
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(26 * 3600))),
+)
@@ -0,0 +1,260 @@
+"""Central admission queue for Gemini calls.
+
+Every call, from chat or from a scheduled task on the scheduler's worker
+loop, waits here for permission to start. A call is admitted when all of
+these allow it:
+
+- a concurrency slot is free (LLM_MAX_CONCURRENCY),
+- the requests-per-minute bucket has a token (LLM_REQUESTS_PER_MINUTE),
+- the tokens-per-minute bucket covers the call's estimated tokens
+  (LLM_TOKENS_PER_MINUTE),
+- no 429 back-off is in progress.
+
+Waiting calls are admitted by priority class and then in arrival order, so
+interactive calls always go before scheduled ones. The head of the queue
+waits for the buckets to refill rather than letting smaller calls overtake
+it. A full queue (LLM_MAX_QUEUE) rejects new calls with ``QueueFull``.
+
+The queue is shared by several event loops, so its state is guarded by a
+lock and waiters are woken on their own loop.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from backend import metrics
+
+INTERACTIVE = "interactive"
+SCHEDULED = "scheduled"
+PRIORITIES = {INTERACTIVE: 0, SCHEDULED: 1}
+
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "1000"))
+# Tokens a call is expected to produce, added to the estimate of its input.
+OUTPUT_TOKENS_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKENS_ESTIMATE", "512"))
+
+
+class QueueFull(Exception):
+    """Raised when a call cannot even be queued."""
+
+
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Rough token count of ``text``: about 4 characters per token."""
+    return len(text or "") // CHARS_PER_TOKEN
+
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    """Rough token count of a call: its input plus the expected output."""
+    return sum(count_tokens(text) for text in texts) + OUTPUT_TOKENS_ESTIMATE
+
+
+class TokenBucket:
+    """``capacity`` tokens per minute, refilled continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` tokens are available (0 if they are now)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity > 0:
+            self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "priority", "cost", "enqueued", "admitted", "cancelled")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, priority: str, cost: int):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.priority = priority
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.admitted = False
+        self.cancelled = False
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        max_concurrency: int,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        max_queue: int = MAX_QUEUE,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._queued = {name: 0 for name in PRIORITIES}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._wake_at = 0.0
+        self._metrics = {
+            name: {"admitted": 0, "rejected": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+            for name in PRIORITIES
+        }
+        self.backoffs = 0
+
+    async def acquire(self, priority: str = INTERACTIVE, cost: int = 0):
+        """Wait until a call of ``cost`` estimated tokens may start; pair with release()."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        waiter = _Waiter(asyncio.get_running_loop(), priority, cost)
+        with self._lock:
+            if sum(self._queued.values()) >= self.max_queue:
+                self._metrics[priority]["rejected"] += 1
+                raise QueueFull(f"LLM queue is full ({self.max_queue} waiting)")
+            heapq.heappush(self._heap, (PRIORITIES[priority], next(self._seq), waiter))
+            self._queued[priority] += 1
+            self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                # Not admitted yet: drop it from the queue. Admitted but
+                # _admit still to run: it sees the cancelled future and gives
+                # the slot back. Admitted and _admit done, but cancelled
+                # before resuming: nobody will call release(), so do it here.
+                if not waiter.admitted:
+                    waiter.cancelled = True
+                    self._queued[priority] -= 1
+                elif waiter.future.done() and not waiter.future.cancelled():
+                    self._in_flight -= 1
+                    self._dispatch()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._dispatch()
+
+    def back_off(self, seconds: float):
+        """Admit nothing for ``seconds``, after Gemini answered 429."""
+        with self._lock:
+            self.backoffs += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _dispatch(self):
+        """Admit waiting calls while the limits allow; called with the lock held."""
+        while self._heap and self._in_flight < self.max_concurrency:
+            waiter = self._heap[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            now = time.monotonic()
+            wait = max(
+                self._paused_until - now,
+                self._requests.wait_time(1, now),
+                self._tokens.wait_time(waiter.cost, now),
+            )
+            if wait > 0:
+                self._wake_in(wait)
+                return
+            heapq.heappop(self._heap)
+            self._requests.take(1)
+            self._tokens.take(waiter.cost)
+            self._in_flight += 1
+            self._queued[waiter.priority] -= 1
+            waiter.admitted = True
+            metrics = self._metrics[waiter.priority]
+            waited = now - waiter.enqueued
+            metrics["admitted"] += 1
+            metrics["wait_seconds_total"] += waited
+            metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+            try:
+                waiter.loop.call_soon_threadsafe(self._admit, waiter)
+            except RuntimeError:
+                # The waiter's loop has been closed; nobody will use the slot.
+                self._in_flight -= 1
+
+    def _admit(self, waiter: _Waiter):
+        if waiter.future.cancelled():
+            self.release()
+        else:
+            waiter.future.set_result(None)
+
+    def _wake_in(self, seconds: float):
+        """Run _dispatch again once the limits have recovered."""
+        wake_at = time.monotonic() + seconds
+        if self._timer is not None and self._timer.is_alive() and self._wake_at <= wake_at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake_at = wake_at
+        self._timer = threading.Timer(seconds, self._wake)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _wake(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def register_metrics(self):
+        """Expose this queue on /metrics."""
+        def per_priority(key: str):
+            return lambda: {(name,): value for name, value in self._per_priority(key).items()}
+
+        metrics.Gauge("llm_queue_depth", "Gemini calls waiting for admission.", ("priority",), function=lambda: dict(
+            ((name,), count) for name, count in self._queued.items()
+        ))
+        metrics.Gauge("llm_in_flight", "Gemini calls running.", function=lambda: self._in_flight)
+        metrics.Counter("llm_queue_admitted_total", "Gemini calls admitted.", ("priority",), function=per_priority("admitted"))
+        metrics.Counter("llm_queue_rejected_total", "Gemini calls rejected by a full queue.", ("priority",), function=per_priority("rejected"))
+        metrics.Counter(
+            "llm_queue_wait_seconds_total", "Time admitted calls spent queued.", ("priority",),
+            function=per_priority("wait_seconds_total"),
+        )
+        metrics.Counter("llm_backoffs_total", "Pauses after a 429 from Gemini.", function=lambda: self.backoffs)
+
+    def _per_priority(self, key: str) -> Dict[str, float]:
+        return {name: values[key] for name, values in self._metrics.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            priorities = {}
+            for name, values in self._metrics.items():
+                admitted = values["admitted"]
+                priorities[name] = {
+                    "queued": self._queued[name],
+                    "admitted": admitted,
+                    "rejected": values["rejected"],
+                    "wait_seconds_avg": round(values["wait_seconds_total"] / admitted, 4) if admitted else 0.0,
+                    "wait_seconds_max": round(values["wait_seconds_max"], 4),
+                }
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": sum(self._queued.values()),
+                "max_queue": self.max_queue,
+                "requests_per_minute": self._requests.capacity,
+                "tokens_per_minute": self._tokens.capacity,
+                "backoffs": self.backoffs,
+                "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+                "priorities": priorities,
+            }
@@ -0,0 +1,477 @@
+"""Parsing of the JSON envelope the agent prompt asks Gemini to answer with:
+
+    {"response": "<text for the user>",
+     "tool_to_call": {"name": ..., "arguments": {...}} | null,
+     "tool_calls": [{"name": ..., "arguments": {...}}, ...]}
+
+``tool_calls`` lists independent calls that may run concurrently; parsed
+results always carry it, with ``tool_to_call`` kept as its first entry for
+callers that only handle one call.
+
+The envelope is found by scanning for balanced braces, so markdown fences,
+prose before it and text after it are ignored. An object that is not valid
+JSON as written gets trailing commas removed and, if the answer was cut off,
+its open strings and brackets closed. An answer with no envelope at all is
+used as plain text, with no tool calls.
+
+Given the enabled tools, every call is checked against the tool's argument
+schema (required keys, types and enums) before anything runs. Calls to
+other tools, calls with invalid arguments and calls from a cut-off answer
+are dropped, so a malformed answer never triggers a tool.
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend import metrics
+
+# result: "json" (a valid envelope), "repaired" (an envelope after trailing
+# commas were removed), "truncated" (a cut-off envelope, closed) or "text"
+# (no envelope; used as a plain answer)
+envelope_parses = metrics.Counter("llm_envelope_parse_total", "Parsed Gemini answers by outcome.", ("result",))
+rejected_tool_calls = metrics.Counter(
+    "llm_tool_calls_rejected_total", "Tool calls from Gemini dropped before running.", ("reason",)
+)
+
+ENVELOPE_KEYS = ("response", "tool_to_call", "tool_calls")
+
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_TYPES: Dict[str, Tuple[type, ...]] = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def parse_envelope(response_text: str, tools: Optional[Iterable[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Turn a complete Gemini answer into ``{"response", "tool_to_call", "tool_calls"}``.
+
+    ``tools`` are the enabled catalog entries; when given, only calls that
+    match one of their schemas are kept.
+    """
+    parsed, result = extract_envelope(response_text)
+    envelope_parses.inc(result)
+    if parsed is None:
+        return envelope(response_text.strip(), [])
+
+    calls = normalize_tool_calls(parsed.get("tool_calls"), parsed.get("tool_to_call"))
+    if result == "truncated":
+        # Arguments of a cut-off answer may themselves be cut off.
+        if calls:
+            rejected_tool_calls.inc("truncated", amount=len(calls))
+        calls = []
+    elif tools is not None:
+        calls, rejected = validate_tool_calls(calls, tools)
+        for call, reason in rejected:
+            print(f"Dropped tool call {call.get('name')}: {reason}")
+            rejected_tool_calls.inc("unknown_tool" if reason == "unknown tool" else "invalid_arguments")
+    response = parsed.get("response")
+    return envelope(response if isinstance(response, str) else "", calls)
+
+
+def extract_envelope(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """The first envelope object in ``text`` and how it was read.
+
+    The second value is ``"json"``, ``"repaired"``, ``"truncated"`` or, when
+    no envelope was found, ``"text"``.
+    """
+    start = text.find("{")
+    while start != -1:
+        end = _object_end(text, start)
+        candidate = text[start:] if end == -1 else text[start:end + 1]
+        value, how = _loads(candidate, truncated=end == -1)
+        if isinstance(value, dict) and any(key in value for key in ENVELOPE_KEYS):
+            return value, how
+        # Not an envelope: skip the whole object, or just this brace if it
+        # did not parse (it may be a stray brace in prose).
+        start = text.find("{", end + 1 if value is not None and end != -1 else start + 1)
+    return None, "text"
+
+
+def _object_end(text: str, start: int) -> int:
+    """Index of the brace closing the object opened at ``start``, or -1."""
+    depth = 0
+    in_string = False
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if ch == "\\":
+                i += 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+
+def _loads(candidate: str, truncated: bool) -> Tuple[Any, str]:
+    if not truncated:
+        try:
+            return json.loads(candidate), "json"
+        except json.JSONDecodeError:
+            pass
+    try:
+        return json.loads(_repair(candidate, truncated)), "truncated" if truncated else "repaired"
+    except json.JSONDecodeError:
+        return None, "text"
+
+
+def _repair(candidate: str, truncated: bool) -> str:
+    """Drop trailing commas and, for a cut-off object, close what is still open."""
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    string_start = 0
+    i = 0
+    while i < len(candidate):
+        ch = candidate[i]
+        if in_string:
+            if ch == "\\":
+                if i + 1 >= len(candidate):
+                    break
+                out.append(candidate[i:i + 2])
+                i += 2
+                continue
+            if ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            string_start = len(out)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+        i += 1
+    if truncated:
+        if in_string:
+            out.append('"')
+        text = "".join(out).rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+        elif text.endswith(":"):
+            text += " null"
+        elif stack and stack[-1] == "}" and text.endswith('"'):
+            # A key whose value never came.
+            if "".join(out[:string_start]).rstrip().endswith(("{", ",")):
+                text += ": null"
+        return text + "".join(reversed(stack))
+    return "".join(out)
+
+
+def tool_schemas(tools: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {tool["name"]: tool.get("arguments") or {} for tool in tools}
+
+
+def validate_tool_calls(
+    calls: List[Dict[str, Any]], tools: Iterable[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], str]]]:
+    """Split ``calls`` into those matching an enabled tool's schema and ``(call, reason)`` for the rest."""
+    schemas = tool_schemas(tools)
+    valid, rejected = [], []
+    for call in calls:
+        schema = schemas.get(call["name"])
+        reason = "unknown tool" if schema is None else argument_error(call["arguments"], schema)
+        if reason is None:
+            valid.append(call)
+        else:
+            rejected.append((call, reason))
+    return valid, rejected
+
+
+def argument_error(arguments: Any, schema: Dict[str, Any]) -> Optional[str]:
+    """Why ``arguments`` do not satisfy ``schema``, or None if they do.
+
+    Numbers sent as strings are accepted for integer and number arguments and
+    converted in place; keys the schema does not describe are left alone.
+    """
+    if not isinstance(arguments, dict):
+        return "arguments are not an object"
+    for key in schema.get("required", ()):
+        if arguments.get(key) in (None, ""):
+            return f"missing required argument '{key}'"
+    for key, spec in (schema.get("properties") or {}).items():
+        if key not in arguments or arguments[key] is None:
+            continue
+        value = arguments[key]
+        expected = spec.get("type")
+        if expected in ("integer", "number") and isinstance(value, str):
+            try:
+                value = arguments[key] = int(value) if expected == "integer" else float(value)
+            except ValueError:
+                return f"'{key}' should be {expected}"
+        if expected in _TYPES and (
+            not isinstance(value, _TYPES[expected]) or (isinstance(value, bool) and expected != "boolean")
+        ):
+            return f"'{key}' should be {expected}"
+        if "enum" in spec and value not in spec["enum"]:
+            return f"'{key}' must be one of {', '.join(map(str, spec['enum']))}"
+    return None
+
+
+def envelope(response: str, tool_calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "response": response,
+        "tool_to_call": tool_calls[0] if tool_calls else None,
+        "tool_calls": tool_calls,
+    }
+
+
+def normalize_tool_calls(tool_calls: Any, tool_to_call: Any = None) -> List[Dict[str, Any]]:
+    """Well-formed ``{"name", "arguments"}`` calls from either envelope field."""
+    if not isinstance(tool_calls, list) or not tool_calls:
+        tool_calls = [tool_to_call]
+    return [
+        {"name": call["name"], "arguments": call.get("arguments") or {}}
+        for call in tool_calls
+        if isinstance(call, dict) and call.get("name")
+    ]
+
+
+class EnvelopeStream:
+    """Incremental parser for the envelope while it is still being generated.
+
+    ``feed()`` takes raw completion chunks and returns a list of events:
+    ``("token", text)`` for each newly decoded piece of the ``response``
+    string and ``("tool_calls", calls)`` as soon as the ``tool_to_call`` or
+    ``tool_calls`` value is complete. Text before the opening brace (e.g. a ```json fence) is
+    skipped; an answer that is plain text rather than JSON is forwarded as
+    tokens unchanged. So is an answer that turns out not to be JSON partway
+    (an unquoted key, a bad escape): from its start if nothing was sent yet,
+    as parse_envelope() reads it, otherwise from where it broke. With
+    ``tools``, only calls that pass
+    ``validate_tool_calls`` are sent early; parse_envelope() on the full
+    buffer still decides the final result.
+    """
+
+    def __init__(self, tools: Optional[Iterable[Dict[str, Any]]] = None):
+        self.tools = list(tools) if tools is not None else None
+        self.buffer = ""
+        self.pos = 0
+        self.state = "start"
+        self.key: Optional[str] = None
+        self.value_start = 0
+        self.depth = 0
+        self.in_string = False
+        self.tool_call_sent = False
+        self.token_sent = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.buffer += chunk
+        events: List[Tuple[str, Any]] = []
+        while self.pos < len(self.buffer) and self.state != "done":
+            if not self._step(events):
+                break
+        return events
+
+    def _token(self, events: List[Tuple[str, Any]], text: str):
+        events.append(("token", text))
+        self.token_sent = True
+
+    def _to_plain(self) -> bool:
+        """The answer is not JSON after all: forward it as text from here on."""
+        if not self.token_sent:
+            self.pos = len(self.buffer) - len(self.buffer.lstrip())
+        self.state = "plain"
+        return True
+
+    def _step(self, events: List[Tuple[str, Any]]) -> bool:
+        """Advance the state machine; return False when more input is needed."""
+        buf, ch = self.buffer, self.buffer[self.pos]
+
+        if self.state == "start":
+            if ch.isspace():
+                self.pos += 1
+            elif ch == "{" or ch == "`":
+                self.state = "object"
+            else:
+                self.state = "plain"
+            return True
+
+        if self.state == "plain":
+            self._token(events, buf[self.pos:])
+            self.pos = len(buf)
+            return True
+
+        if self.state == "object":
+            brace = buf.find("{", self.pos)
+            if brace == -1:
+                self.pos = len(buf)
+                return False
+            self.pos = brace + 1
+            self.state = "key"
+            return True
+
+        if self.state in ("key", "colon", "value") and (ch.isspace() or (ch == "," and self.state == "key")):
+            self.pos += 1
+            return True
+
+        if self.state == "key":
+            if ch == "}":
+                self.state = "done"
+                return True
+            if ch != '"':
+                return self._to_plain()
+            end = _string_end(buf, self.pos)
+            if end == -1:
+                return False
+            try:
+                self.key = json.loads(buf[self.pos:end + 1])
+            except ValueError:
+                return self._to_plain()
+            self.pos = end + 1
+            self.state = "colon"
+            return True
+
+        if self.state == "colon":
+            if ch != ":":
+                return self._to_plain()
+            self.pos += 1
+            self.state = "value"
+            return True
+
+        if self.state == "value":
+            self.value_start = self.pos
+            if self.key == "response" and ch == '"':
+                self.pos += 1
+                self.state = "response"
+            else:
+                self.depth = 0
+                self.in_string = False
+                self.state = "skip"
+            return True
+
+        if self.state == "response":
+            return self._read_response(events)
+
+        if self.state == "skip":
+            return self._skip_value(events)
+
+        return False
+
+    def _read_response(self, events: List[Tuple[str, Any]]) -> bool:
+        buf = self.buffer
+        out = []
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                i += 1
+                self.state = "key"
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc in _SIMPLE_ESCAPES:
+                out.append(_SIMPLE_ESCAPES[esc])
+                i += 2
+                continue
+            # \uXXXX, possibly a surrogate pair; wait until all of it arrived
+            if esc == "u" and i + 6 > len(buf):
+                break
+            code = _hex4(buf, i + 2) if esc == "u" else None
+            if code is None:
+                # Not JSON (e.g. \uZZZZ or \x): send what was decoded, then the rest as it is.
+                if out:
+                    self._token(events, "".join(out))
+                self.pos = i
+                return self._to_plain()
+            pair = buf[i + 6:i + 8]
+            if 0xD800 <= code < 0xDC00 and "\\u".startswith(pair):
+                if i + 12 > len(buf):
+                    break
+                low = _hex4(buf, i + 8)
+                if low is not None and 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            # A lone surrogate is kept, as json.loads keeps it.
+            out.append(chr(code))
+            i += 6
+        if out:
+            self._token(events, "".join(out))
+        progressed = i > self.pos
+        self.pos = i
+        return progressed
+
+    def _skip_value(self, events: List[Tuple[str, Any]]) -> bool:
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if self.in_string:
+                if ch == "\\":
+                    if i + 1 >= len(buf):
+                        break
+                    i += 2
+                    continue
+                if ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]" and self.depth > 0:
+                self.depth -= 1
+            elif self.depth == 0 and ch in ",}":
+                self._finish_value(buf[self.value_start:i], events)
+                self.state = "key" if ch == "," else "done"
+                self.pos = i + 1
+                return True
+            i += 1
+        self.pos = i
+        return False
+
+    def _finish_value(self, raw: str, events: List[Tuple[str, Any]]):
+        if self.key not in ("tool_to_call", "tool_calls") or self.tool_call_sent:
+            return
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        calls = normalize_tool_calls(value) if self.key == "tool_calls" else normalize_tool_calls(None, value)
+        if self.tools is not None:
+            calls, _ = validate_tool_calls(calls, self.tools)
+        if calls:
+            self.tool_call_sent = True
+            events.append(("tool_calls", calls))
+
+
+def _hex4(buf: str, start: int) -> Optional[int]:
+    """The four hex digits at ``start`` as a number, or None if they are not hex digits."""
+    digits = buf[start:start + 4]
+    if len(digits) != 4 or any(d not in "0123456789abcdefABCDEF" for d in digits):
+        return None
+    return int(digits, 16)
+
+
+def _string_end(buf: str, start: int) -> int:
+    """Index of the closing quote of the JSON string opening at ``start``, or -1."""
+    i = start + 1
+    while i < len(buf):
+        if buf[i] == "\\":
+            i += 2
+            continue
+        if buf[i] == '"':
+            return i
+        i += 1
+    return -1
@@ -1,28 +1,37 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Request as HttpRequest
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from uuid import uuid4
 from datetime import datetime, timedelta
 import os
+import json
+import time
 import asyncio
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-import google.generativeai as genai
+import functools
+import contextvars
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import Flow
+from backend import agent_tools, analytics, bulk, changes, google_actions, google_api, google_cache, llm, llm_queue, metrics, storage, webhooks, workflows
+from backend.conversations import ConversationStore
+from backend.llm_cache import response_cache
+from backend.llm_response import EnvelopeStream, envelope, parse_envelope
+from backend.run_log import RunLog
+from backend.scheduling import task_scheduler, trigger_for
+from backend.search_index import TenantSearchIndex
+from backend.serialization import FastJSONResponse, dumps, json_array, json_response, record_cache, record_response
 
-app = FastAPI(title="Local Agent Backend", version="0.1.0")
-
-# Initialize scheduler
-scheduler = AsyncIOScheduler()
+app = FastAPI(title="Local Agent Backend", version="0.1.0", default_response_class=FastJSONResponse)
 
 # Configure Google Gemini if API key is available
 try:
-    if os.getenv("GEMINI_API_KEY"):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    llm.configure()
 except Exception as e:
     print(f"Failed to configure Gemini: {e}")
 
@@ -32,16 +41,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
-# In-memory stores (replace with DB later) - POPULATED WITH REAL DATA
-from datetime import datetime, timedelta
+# Stores (see backend/storage.py) - seeded with sample data when empty
 
 # Sample agents with real configurations
-agents: Dict[str, Dict[str, Any]] = {
+agents = storage.collection("agents", ("status", "created_date"), tenant_field="user_id", seed={
     "agent-1": {
         "id": "agent-1",
+        "user_id": "user-1",
         "name": "סוכן מכירות מתקדם",
         "personality": "ידידותי, מקצועי ובעל ידע עמוק במכירות",
         "system_prompt": "אתה סוכן מכירות מתקדם. השתמש בכלי CRM לניהול לקוחות, Gmail לתקשורת, ו-Calendar לתיאום פגישות. דבר בעברית ותמיד עזור ללקוח להשיג את המטרות שלו.",
@@ -53,6 +64,7 @@ agents: Dict[str, Dict[str, Any]] = {
     },
     "agent-2": {
         "id": "agent-2", 
+        "user_id": "user-1",
         "name": "מנהל תוכן ומסמכים",
         "personality": "יצירתי, מאורגן ובעל יכולת כתיבה מצוינת",
         "system_prompt": "אתה מנהל תוכן מתקדם. השתמש ב-Google Docs ליצירת מסמכים, ב-Drive לניהול קבצים, וב-Sheets לניתוח נתונים. צור תוכן איכותי בעברית.",
@@ -64,6 +76,7 @@ agents: Dict[str, Dict[str, Any]] = {
     },
     "agent-3": {
         "id": "agent-3",
+        "user_id": "user-1",
         "name": "עוזר אישי חכם", 
         "personality": "עוזר, יעיל ובעל יכולת ריבוי משימות",
         "system_prompt": "אתה עוזר אישי חכם. השתמש בכל הכלים הזמינים - CRM, Gmail, Calendar, Drive, Sheets, Docs - לעזור למשתמש בכל משימה. תמיד שאל שאלות מפרטות ותן פתרונות מעשיים.",
@@ -73,12 +86,13 @@ agents: Dict[str, Dict[str, Any]] = {
         "created_date": datetime.utcnow(),
         "updated_date": datetime.utcnow()
     }
-}
+})
 
 # Sample customers
-customers: Dict[str, Dict[str, Any]] = {
+customers = storage.collection("customers", ("status", "segment", "created_date"), tenant_field="user_id", seed={
     "customer-1": {
         "id": "customer-1",
+        "user_id": "user-1",
         "name": "דוד כהן",
         "email": "david.cohen@example.com",
         "company": "טכנולוגיות דוד בע״מ",
@@ -95,6 +109,7 @@ customers: Dict[str, Dict[str, Any]] = {
     },
     "customer-2": {
         "id": "customer-2", 
+        "user_id": "user-1",
         "name": "שרה לוי",
         "email": "sarah.levi@startup.com",
         "company": "סטארטאפ חדשני",
@@ -109,12 +124,18 @@ customers: Dict[str, Dict[str, Any]] = {
         "created_date": datetime.utcnow(),
         "updated_date": datetime.utcnow()
     }
-}
+})
+customer_index = TenantSearchIndex(
+    "user_id",
+    exact_fields=("status", "segment"),
+    text_fields=("name", "company", "notes", "email"),
+).attach(customers)
 
 # Sample scheduled tasks
-tasks: Dict[str, Dict[str, Any]] = {
+tasks = storage.collection("tasks", ("agent_id", "created_date"), tenant_field="user_id", seed={
     "task-1": {
         "id": "task-1",
+        "user_id": "user-1",
         "agent_id": "agent-1",
         "task_name": "מעקב יומי אחר לידים חדשים",
         "description": "בדיקה יומית של לידים חדשים במערכת CRM ושליחת עדכון",
@@ -128,11 +149,12 @@ tasks: Dict[str, Dict[str, Any]] = {
         "created_date": datetime.utcnow(),
         "updated_date": datetime.utcnow()
     }
-}
+})
 
-activities: Dict[str, Dict[str, Any]] = {
+activities = storage.collection("activities", ("agent_id", "type", "status", "created_date"), tenant_field="user_id", seed={
     "activity-1": {
         "id": "activity-1",
+        "user_id": "user-1",
         "action": "צ'אט עם לקוח",
         "description": "שיחה עם שירה כהן על הצעת מחיר",
         "type": "chat",
@@ -144,6 +166,7 @@ activities: Dict[str, Dict[str, Any]] = {
     },
     "activity-2": {
         "id": "activity-2", 
+        "user_id": "user-1",
         "action": "שליחת אימייל",
         "description": "שליחת הצעת מחיר ללקוח פוטנציאלי",
         "type": "email",
@@ -155,6 +178,7 @@ activities: Dict[str, Dict[str, Any]] = {
     },
     "activity-3": {
         "id": "activity-3",
+        "user_id": "user-1",
         "action": "יצירת מסמך",
         "description": "יצירת דוח סיכום עבור פגישה",
         "type": "document",
@@ -165,6 +189,7 @@ activities: Dict[str, Dict[str, Any]] = {
     },
     "activity-4": {
         "id": "activity-4",
+        "user_id": "user-1",
         "action": "עדכון CRM",
         "description": "עדכון פרטי לקוח חדש במערכת",
         "type": "crm",
@@ -174,10 +199,28 @@ activities: Dict[str, Dict[str, Any]] = {
         "created_date": datetime.utcnow() - timedelta(minutes=30),
         "updated_date": datetime.utcnow() - timedelta(minutes=30)
     }
-}
+})
+
+# Run history of scheduled tasks; created_date is when the run started
+task_runs = storage.collection("task_runs", ("task_id", "created_date"), tenant_field="user_id")
+run_log = RunLog(task_runs)
+
+# Compiled task workflows, and the step outputs of runs that did not finish
+workflow_cache = workflows.WorkflowCache([tool["name"] for tool in agent_tools.TOOL_CATALOG])
+workflow_checkpoints = workflows.Checkpoints(storage.collection("workflow_checkpoints", tenant_field="user_id"))
+
+# Server-side agent chat history, one record per agent and chat session
+conversations = storage.collection("conversations", ("agent_id", "updated_date"), tenant_field="user_id")
+conversation_store = ConversationStore(conversations)
+
+# Google OAuth tokens, one record per user
+google_tokens = storage.collection("google_tokens")
+google_clients = google_api.GoogleClients(google_tokens)
+# Scopes of the Google tool cache invalidated by a write, so every process drops them
+google_cache.tool_cache.share(storage.collection("google_cache_invalidations"))
 
 # Agent templates with real configurations
-agent_templates: Dict[str, Dict[str, Any]] = {
+agent_templates = storage.collection("agent_templates", ("category", "created_date"), seed={
     "template-1": {
         "id": "template-1",
         "name": "סוכן מכירות מקצועי",
@@ -223,7 +266,21 @@ agent_templates: Dict[str, Dict[str, Any]] = {
         "created_date": datetime.utcnow(),
         "updated_date": datetime.utcnow()
     }
-}
+})
+
+# Ordered log of writes to the collections the pages show, for /changes
+change_feed = changes.ChangeFeed()
+for synced in (agents, customers, tasks, activities, agent_templates):
+    change_feed.attach(synced)
+
+# Dashboard counts, kept current on every write; activities older than
+# ACTIVITY_RETENTION_DAYS are deleted and only their daily counts kept
+activity_rollups = storage.collection("activity_rollups", ("collection", "day"), tenant_field="user_id")
+dashboard_stats = analytics.Analytics(activity_rollups)
+dashboard_stats.attach(agents, ("status",))
+dashboard_stats.attach(customers, ("status", "segment"), series=True)
+dashboard_stats.attach(activities, ("type", "status", "agent_id"), series=True,
+                       retention_days=int(os.getenv("ACTIVITY_RETENTION_DAYS", "90")))
 
 
 class AgentIn(BaseModel):
@@ -268,10 +325,14 @@ class ScheduledTaskIn(BaseModel):
     schedule_type: str = Field(default="daily")
     schedule_time: str = Field(default="09:00")
     schedule_day: Optional[int] = 1
+    interval_minutes: Optional[int] = None
     workflow_definition: str
     workflow_type: str = Field(default="prompt")
     tools_to_use: List[str] = Field(default_factory=list)
     webhook_trigger: bool = False
+    # Required as X-Webhook-Secret on /webhooks/{task_id}. Generated when a
+    # webhook-triggered task is saved without one; an update that leaves it out keeps the stored one.
+    webhook_secret: Optional[str] = None
     next_run_at: Optional[str] = None
     last_run_status: Optional[str] = "pending"
     is_active: bool = True
@@ -283,14 +344,52 @@ class ScheduledTaskOut(ScheduledTaskIn):
     updated_date: datetime
 
 
+class TaskRunOut(BaseModel):
+    id: str
+    task_id: str
+    trigger: str
+    status: str
+    created_date: datetime
+    finished_date: datetime
+    duration_ms: float
+    llm_calls: int = 0
+    llm_latency_ms: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    tool_calls: List[Dict[str, Any]] = Field(default_factory=list)
+    steps: List[Dict[str, Any]] = Field(default_factory=list)
+    resumed_steps: int = 0
+    output: Optional[str] = None
+    output_truncated: bool = False
+    error: Optional[str] = None
+
+
 # Multi-tenant support
-users_db: Dict[str, Dict[str, Any]] = {
+users_db = storage.collection("users", ("email",), seed={
     "user-1": {"id": "user-1", "email": "user1@example.com", "name": "משתמש 1"},
     "user-2": {"id": "user-2", "email": "user2@example.com", "name": "משתמש 2"}
-}
+})
 
 current_user = "user-1"  # Simulated current user
 
+
+def current_user_id() -> str:
+    """The signed-in user, as a dependency of the handlers the agent tools share.
+
+    Tools run for the user who owns the agent or task, so those handlers
+    take the user as an argument instead of reading ``current_user``.
+    """
+    return current_user
+
+# Display names of the customer custom fields
+CUSTOM_FIELD_LABELS = {
+    "custom_field_1": "תעשייה",
+    "custom_field_2": "גודל חברה",
+    "custom_field_3": "מקור הליד",
+    "custom_field_4": "עדיפות",
+    "custom_field_5": "הערות נוספות",
+}
+
 @app.get("/auth/me")
 def auth_me():
     user = users_db.get(current_user)
@@ -300,105 +399,261 @@ def auth_me():
         "id": user["id"], 
         "email": user["email"],
         "name": user.get("name", ""),
-        "custom_field_1_label": "תעשייה",
-        "custom_field_2_label": "גודל חברה", 
-        "custom_field_3_label": "מקור הליד",
-        "custom_field_4_label": "עדיפות",
-        "custom_field_5_label": "הערות נוספות"
+        **{f"{field}_label": label for field, label in CUSTOM_FIELD_LABELS.items()},
     }
 
 
-# Multi-tenant agent filtering
-def get_user_agents(user_id: str):
-    return {k: v for k, v in agents.items() if v.get("user_id", "user-1") == user_id}
+# Multi-tenant access: each user only sees their own partition of a collection
+def get_user_agents(user_id: str) -> storage.Repository:
+    return agents.tenant(user_id)
+
+def get_user_customers(user_id: str) -> storage.Repository:
+    return customers.tenant(user_id)
+
+def get_user_tasks(user_id: str) -> storage.Repository:
+    return tasks.tenant(user_id)
 
-def get_user_customers(user_id: str):
-    return {k: v for k, v in customers.items() if v.get("user_id", "user-1") == user_id}
+def get_user_activities(user_id: str) -> storage.Repository:
+    return activities.tenant(user_id)
+
+def get_user_task_runs(user_id: str) -> storage.Repository:
+    return task_runs.tenant(user_id)
+
+TENANT_COLLECTIONS = {
+    "agents": agents, "customers": customers, "scheduled_tasks": tasks, "activities": activities, "task_runs": task_runs,
+    "conversations": conversations,
+}
+
+
+@app.get("/usage")
+def get_usage():
+    """Rows and stored bytes the current user has in each collection."""
+    return {name: repo.usage(current_user)[current_user] for name, repo in TENANT_COLLECTIONS.items()}
+
+# List endpoints: cursor pagination, projection, sorting, filtering and counts
+MAX_PAGE_SIZE = 1000
+LIST_PARAMS = {"limit", "after", "fields", "sort", "count"}
+
+
+class ListParams:
+    """``?limit=&after=&fields=a,b&sort=-field&count=true``; any other query
+    parameter filters on field equality (``status=lead``)."""
+
+    def __init__(
+        self,
+        request: HttpRequest,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[str] = None,
+        fields: Optional[str] = None,
+        sort: Optional[str] = None,
+        count: bool = False,
+    ):
+        self.limit = limit
+        self.after = after
+        self.fields = [f for f in (fields or "").split(",") if f]
+        self.sort = sort
+        self.count = count
+        self.where: Dict[str, Any] = {}
+        for key, value in request.query_params.items():
+            if key not in LIST_PARAMS:
+                self.where[key] = {"true": True, "false": False}.get(value, value)
+
+
+def list_page(repo: storage.Repository, params: ListParams):
+    """A page of ``repo`` as a JSON array; the next page's cursor is in X-Next-Cursor.
+
+    ``count=true`` answers ``{"count": n}`` without loading any records.
+    Records are sent as stored (or from the record cache), not re-validated.
+    """
+    try:
+        if params.count:
+            return FastJSONResponse({"count": repo.count(params.where)})
+        rows, next_cursor = repo.query_json(
+            params.where, sort=params.sort, limit=params.limit, after=params.after, fields=params.fields,
+            render=lambda obj: record_cache.render(repo.name, obj),
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return json_response(json_array(rows), headers=headers)
+
+
+def create_record(repo: storage.Repository, payload: BaseModel) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    record_id = str(uuid4())
+    repo[record_id] = {**payload.dict(), "id": record_id, "created_date": now, "updated_date": now}
+    # A tenant view stamps the owner on the stored copy only; answer (and
+    # fill the render cache) with what was stored.
+    return repo[record_id]
+
+
+def update_record(repo: storage.Repository, record_id: str, payload: BaseModel) -> Optional[Dict[str, Any]]:
+    """Apply ``payload`` to a stored record; None if there is no such record."""
+    obj = repo.get(record_id)
+    if obj is None:
+        return None
+    # The repository handed out a fresh copy, so it can be updated in place.
+    obj.update(payload.dict(), updated_date=datetime.utcnow())
+    repo[record_id] = obj
+    return obj
 
-def get_user_tasks(user_id: str):
-    return {k: v for k, v in tasks.items() if v.get("user_id", "user-1") == user_id}
 
 # Agents CRUD
 @app.get("/agents", response_model=List[AgentOut])
-def list_agents():
+def list_agents(params: ListParams = Depends()):
     user_agents = get_user_agents(current_user)
-    return list(user_agents.values())
+    return list_page(user_agents, params)
 
 
 @app.get("/agents/{agent_id}", response_model=AgentOut)
 def get_agent(agent_id: str):
-    if agent_id not in agents:
+    user_agents = get_user_agents(current_user)
+    if agent_id not in user_agents:
         raise HTTPException(404, "Agent not found")
-    return agents[agent_id]
+    return record_response(agents.name, user_agents[agent_id])
 
 
 @app.post("/agents", response_model=AgentOut)
 def create_agent(payload: AgentIn):
-    now = datetime.utcnow()
-    agent_id = str(uuid4())
-    obj = {**payload.dict(), "id": agent_id, "created_date": now, "updated_date": now}
-    agents[agent_id] = obj
-    return obj
+    return record_response(agents.name, create_record(get_user_agents(current_user), payload))
 
 
 @app.put("/agents/{agent_id}", response_model=AgentOut)
 def update_agent(agent_id: str, payload: AgentIn):
-    if agent_id not in agents:
+    obj = update_record(get_user_agents(current_user), agent_id, payload)
+    if obj is None:
         raise HTTPException(404, "Agent not found")
-    now = datetime.utcnow()
-    obj = {**agents[agent_id], **payload.dict(), "updated_date": now}
-    agents[agent_id] = obj
-    return obj
+    return record_response(agents.name, obj)
 
 
 @app.delete("/agents/{agent_id}")
 def delete_agent(agent_id: str):
-    agents.pop(agent_id, None)
+    user_agents = get_user_agents(current_user)
+    user_agents.pop(agent_id, None)
     return {"success": True}
 
 
 # Customers
 @app.get("/customers", response_model=List[CustomerOut])
-def list_customers():
-    return list(customers.values())
+def list_customers(params: ListParams = Depends()):
+    user_customers = get_user_customers(current_user)
+    return list_page(user_customers, params)
+
+
+@app.get("/customers/export")
+def export_customers(params: ListParams = Depends(), format: str = "csv"):
+    """Stream every matching customer as CSV or NDJSON, a page at a time.
+
+    Takes the filters, ``sort`` and ``fields`` of GET /customers.
+    """
+    if format not in bulk.MEDIA_TYPES:
+        raise HTTPException(400, f"Unsupported format: {format}")
+    params.where.pop("format", None)
+    repo = get_user_customers(current_user)
+    try:
+        # Validate field names before the response starts.
+        repo.query(params.where, sort=params.sort, limit=1, fields=params.fields)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if format == bulk.CSV:
+        columns = ["id", *(params.fields or [*CustomerIn.__fields__, "created_date", "updated_date"])]
+        chunks = bulk.export_csv(repo, columns, params.where, params.sort, params.fields)
+    else:
+        chunks = bulk.export_ndjson(repo, params.where, params.sort, params.fields)
+    headers = {"Content-Disposition": f'attachment; filename="customers.{format}"'}
+    return StreamingResponse(chunks, media_type=bulk.MEDIA_TYPES[format], headers=headers)
 
 
 @app.get("/customers/{customer_id}", response_model=CustomerOut)
 def get_customer(customer_id: str):
-    if customer_id not in customers:
+    user_customers = get_user_customers(current_user)
+    if customer_id not in user_customers:
         raise HTTPException(404, "Customer not found")
-    return customers[customer_id]
+    return record_response(customers.name, user_customers[customer_id])
 
 
 @app.post("/customers", response_model=CustomerOut)
 def create_customer(payload: CustomerIn):
-    now = datetime.utcnow()
-    customer_id = str(uuid4())
-    obj = {**payload.dict(), "id": customer_id, "created_date": now, "updated_date": now}
-    customers[customer_id] = obj
-    return obj
+    return record_response(customers.name, create_record(get_user_customers(current_user), payload))
 
 
 @app.put("/customers/{customer_id}", response_model=CustomerOut)
 def update_customer(customer_id: str, payload: CustomerIn):
-    if customer_id not in customers:
+    obj = update_record(get_user_customers(current_user), customer_id, payload)
+    if obj is None:
         raise HTTPException(404, "Customer not found")
-    now = datetime.utcnow()
-    obj = {**customers[customer_id], **payload.dict(), "updated_date": now}
-    customers[customer_id] = obj
-    return obj
+    return record_response(customers.name, obj)
 
 
 @app.delete("/customers/{customer_id}")
 def delete_customer(customer_id: str):
-    customers.pop(customer_id, None)
+    user_customers = get_user_customers(current_user)
+    user_customers.pop(customer_id, None)
     return {"success": True}
 
 
+@app.post("/customers/bulk")
+def bulk_customers(body: Dict[str, Any]):
+    """Create, update and delete customers in batches.
+
+    ``{"operations": [{"op": "create", "data": {...}}, {"op": "update", "id":
+    ..., "data": {...}}, {"op": "delete", "id": ...}], "dry_run": false}``.
+    Updates merge ``data`` into the stored customer. Each operation gets a
+    result, in order, and one failing does not stop the others.
+    """
+    operations = body.get("operations")
+    if not isinstance(operations, list):
+        raise HTTPException(400, "operations must be a list")
+    if len(operations) > bulk.MAX_OPERATIONS:
+        raise HTTPException(413, f"At most {bulk.MAX_OPERATIONS} operations per request")
+    parsed = [
+        (i, item.get("op"), None if item.get("op") == "create" else item.get("id"), item.get("data") or {})
+        if isinstance(item, dict) else (i, bulk.UNREADABLE, None, {"error": "Each operation must be an object"})
+        for i, item in enumerate(operations)
+    ]
+    results = list(bulk.apply_operations(get_user_customers(current_user), CustomerIn, parsed, bool(body.get("dry_run"))))
+    counts = {op: sum(1 for r in results if r["success"] and r["op"] == op) for op in ("create", "update", "delete")}
+    return {
+        "created": counts["create"],
+        "updated": counts["update"],
+        "deleted": counts["delete"],
+        "failed": sum(1 for r in results if not r["success"]),
+        "results": results,
+    }
+
+
+@app.post("/customers/import")
+async def import_customers(request: HttpRequest, format: Optional[str] = None, dry_run: bool = False):
+    """Load customers from a CSV or NDJSON upload of any size.
+
+    The format comes from ``?format=csv|ndjson`` or the Content-Type. CSV
+    columns are customer fields; the custom fields may also be headed by
+    their labels. Rows with the ``id`` of an existing customer update it.
+    ``dry_run=true`` only validates. Answers with counts and the first
+    errors, each with its line number.
+    """
+    try:
+        file_format = bulk.request_format(format, request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(415, str(e))
+    aliases = {label: field for field, label in CUSTOM_FIELD_LABELS.items()}
+    with await bulk.spool(request.stream()) as upload:
+        return await asyncio.to_thread(
+            bulk.import_file, get_user_customers(current_user), CustomerIn, upload, file_format, aliases, dry_run
+        )
+
+
 @app.post("/customers/search", response_model=List[CustomerOut])
-def search_customers(filter: Dict[str, Any]):
-    results: List[Dict[str, Any]] = list(customers.values())
-    for key, value in filter.items():
+def search_customers_endpoint(filter: Dict[str, Any]):
+    found = search_customers(current_user, filter)
+    return json_response(json_array(record_cache.render(customers.name, c) for c in found))
+
+
+def search_customers(user_id: str, filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+    user_customers = get_user_customers(user_id)
+    ids, rest = customer_index.lookup(user_id, filter)
+    results: List[Dict[str, Any]] = list(user_customers.values()) if ids is None else user_customers.get_many(ids)
+    for key, value in rest.items():
         if value is None:
             continue
         v = str(value).lower()
@@ -408,162 +663,383 @@ def search_customers(filter: Dict[str, Any]):
 
 # Activities CRUD
 @app.get("/activities", response_model=List[Dict[str, Any]])
-def list_activities():
-    return list(activities.values())
+def list_activities(params: ListParams = Depends()):
+    user_activities = get_user_activities(current_user)
+    return list_page(user_activities, params)
 
 
 # Scheduled Tasks
 @app.get("/scheduled-tasks", response_model=List[ScheduledTaskOut])
-def list_tasks():
-    return list(tasks.values())
+def list_tasks(params: ListParams = Depends()):
+    user_tasks = get_user_tasks(current_user)
+    return list_page(user_tasks, params)
 
 
 @app.get("/scheduled-tasks/{task_id}", response_model=ScheduledTaskOut)
 def get_task(task_id: str):
-    if task_id not in tasks:
+    user_tasks = get_user_tasks(current_user)
+    if task_id not in user_tasks:
         raise HTTPException(404, "Task not found")
-    return tasks[task_id]
+    return record_response(tasks.name, user_tasks[task_id])
+
+
+def check_schedule(payload: ScheduledTaskIn):
+    try:
+        trigger_for(payload.dict())
+        workflows.compile_workflow(payload.dict(), workflow_cache.known_tools)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def set_webhook_secret(payload: ScheduledTaskIn, stored: Optional[Dict[str, Any]] = None):
+    """Webhook runs can call tools as the task's owner, so a webhook-triggered task always has a secret."""
+    if not payload.webhook_secret:
+        payload.webhook_secret = (stored or {}).get("webhook_secret") or None
+    if payload.webhook_trigger and not payload.webhook_secret:
+        payload.webhook_secret = webhooks.new_secret()
 
 
 @app.post("/scheduled-tasks", response_model=ScheduledTaskOut)
 def create_task(payload: ScheduledTaskIn):
-    now = datetime.utcnow()
-    task_id = str(uuid4())
-    obj = {**payload.dict(), "id": task_id, "created_date": now, "updated_date": now}
-    tasks[task_id] = obj
-    return obj
+    check_schedule(payload)
+    set_webhook_secret(payload)
+    obj = create_record(get_user_tasks(current_user), payload)
+    return record_response(tasks.name, obj)
 
 
 @app.put("/scheduled-tasks/{task_id}", response_model=ScheduledTaskOut)
 def update_task(task_id: str, payload: ScheduledTaskIn):
-    if task_id not in tasks:
+    check_schedule(payload)
+    user_tasks = get_user_tasks(current_user)
+    set_webhook_secret(payload, user_tasks.get(task_id))
+    obj = update_record(user_tasks, task_id, payload)
+    if obj is None:
         raise HTTPException(404, "Task not found")
-    now = datetime.utcnow()
-    obj = {**tasks[task_id], **payload.dict(), "updated_date": now}
-    tasks[task_id] = obj
-    return obj
+    workflow_cache.discard(task_id)
+    return record_response(tasks.name, obj)
 
 
 @app.delete("/scheduled-tasks/{task_id}")
 def delete_task(task_id: str):
-    tasks.pop(task_id, None)
+    user_tasks = get_user_tasks(current_user)
+    # Cached workflows and checkpoints are keyed by task id alone: check the owner first.
+    if task_id not in user_tasks:
+        raise HTTPException(404, "Task not found")
+    user_tasks.pop(task_id, None)
+    workflow_cache.discard(task_id)
+    workflow_checkpoints.clear(task_id)
     return {"success": True}
 
 
-async def execute_scheduled_task(task_id: str):
-    """Execute a scheduled task"""
-    if task_id not in tasks:
+def set_task_run_status(task_id: str, status: str):
+    """Record a run status; stores hand out copies, so write the task back."""
+    task = tasks.get(task_id)
+    if task is not None:
+        tasks[task_id] = {**task, "last_run_status": status, "updated_date": datetime.utcnow()}
+
+
+async def execute_scheduled_task(task_id: str, trigger: str = "schedule", events: Optional[List[Dict[str, Any]]] = None):
+    """Execute a scheduled task and append the run to its history
+
+    ``events`` are the webhook events a webhook-triggered run handles.
+    """
+    task = tasks.get(task_id)
+    if task is None:
         return
-    
-    task = tasks[task_id]
+    inputs = {"webhook": dumps(events).decode("utf-8")} if events else None
+
+    started_date = datetime.utcnow()
+    started = time.perf_counter()
+    output, tool_calls, error = None, [], None
+    steps, resumed_steps = [], 0
+    with llm.track_usage() as usage:
+        try:
+            print(f"Executing task: {task['task_name']}")
+
+            # Update task status
+            set_task_run_status(task_id, "running")
+
+            # Run the task's workflow, picking up after the steps a failed run finished
+            result = await workflows.run_workflow(
+                task, workflow_cache.get(task), workflow_checkpoints, generate_envelope, execute_tools,
+                llm_queue.SCHEDULED, inputs,
+            )
+            output, error = result["output"], result["error"]
+            tool_calls, steps, resumed_steps = result["tool_calls"], result["steps"], result["resumed_steps"]
+            status = "failed" if error else "success"
+        except Exception as e:
+            print(f"Task {task_id} failed: {e}")
+            status, error = "failed", str(e)
+
+    set_task_run_status(task_id, status)
+    run_log.append({
+        "id": str(uuid4()),
+        "task_id": task_id,
+        "user_id": task.get("user_id"),
+        "trigger": trigger,
+        "status": status,
+        "created_date": started_date,
+        "finished_date": datetime.utcnow(),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "llm_calls": usage["calls"],
+        "llm_latency_ms": round(usage["latency_ms"], 1),
+        "prompt_tokens": usage["prompt_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "tool_calls": tool_calls,
+        "steps": steps,
+        "resumed_steps": resumed_steps,
+        "webhook_events": len(events or ()),
+        "output": output,
+        "error": error,
+    })
+
+@app.get("/scheduled-tasks/{task_id}/runs", response_model=List[TaskRunOut])
+def list_task_runs(task_id: str, params: ListParams = Depends()):
+    """Run history of a task, newest first unless ``sort`` says otherwise."""
+    if task_id not in get_user_tasks(current_user):
+        raise HTTPException(404, "Task not found")
+    run_log.flush()
+    params.where["task_id"] = task_id
+    params.sort = params.sort or "-created_date"
+    return list_page(get_user_task_runs(current_user), params)
+
+
+# Webhook triggers: events are queued and answered with 202; bursts for a task share a run
+async def run_webhook_task(task_id: str, events: List[Dict[str, Any]]):
+    await asyncio.wrap_future(task_scheduler.run_now(task_id, "webhook", events))
+
+
+# Idempotency keys of accepted events; only read back, so not synced to other processes
+webhook_keys = storage.collection("webhook_keys", ("created_date",), synced=False)
+webhook_queue = webhooks.WebhookQueue(run_webhook_task, keys=webhook_keys).attach(tasks)
+
+
+@app.post("/webhooks/{task_id}", status_code=202)
+async def receive_webhook(task_id: str, request: HttpRequest):
+    """Accept an external event for a webhook-enabled task; the task runs shortly after.
+
+    The task's secret goes in the ``X-Webhook-Secret`` header (never the
+    query string, which ends up in access logs). An ``Idempotency-Key``
+    header makes retries of the same event safe.
+    """
+    body = await request.body()
+    if len(body) > webhooks.MAX_BODY_BYTES:
+        raise HTTPException(413, "Webhook payload too large")
     try:
-        print(f"Executing task: {task['task_name']}")
-        
-        # Update task status
-        tasks[task_id]["last_run_status"] = "running"
-        tasks[task_id]["updated_date"] = datetime.utcnow()
-        
-        # Execute the task based on workflow_type
-        if task.get("workflow_type") == "prompt":
-            # Execute LLM prompt
-            response = await invoke_llm({"prompt": task.get("workflow_definition", "")})
-            print(f"Task {task_id} LLM response: {response.get('response', '')[:100]}...")
-        
-        # Mark as completed
-        tasks[task_id]["last_run_status"] = "success"
-        tasks[task_id]["updated_date"] = datetime.utcnow()
-        
-    except Exception as e:
-        print(f"Task {task_id} failed: {e}")
-        tasks[task_id]["last_run_status"] = "failed"
-        tasks[task_id]["updated_date"] = datetime.utcnow()
+        payload = orjson.loads(body) if body else None
+    except orjson.JSONDecodeError:
+        payload = body.decode("utf-8", "replace")
+    try:
+        event_id, outcome = await webhook_queue.offer(
+            task_id,
+            payload,
+            secret=request.headers.get("x-webhook-secret"),
+            idempotency_key=request.headers.get("idempotency-key"),
+        )
+    except webhooks.UnknownHook:
+        raise HTTPException(404, "Webhook not found")
+    except webhooks.BadSecret:
+        raise HTTPException(401, "Invalid webhook secret")
+    except webhooks.QueueFull:
+        raise HTTPException(429, "Too many queued events", headers={"Retry-After": str(webhooks.RETRY_AFTER_SECONDS)})
+    return json_response(
+        b'{"accepted":true,"event_id":"' + event_id.encode() + b'","status":"' + outcome.encode() + b'"}',
+        status_code=202,
+    )
+
 
 @app.post("/scheduled-tasks/run")
 async def run_task_now(body: Dict[str, Any]):
     task_id = body.get("task_id")
-    if task_id and task_id in tasks:
-        await execute_scheduled_task(task_id)
+    if task_id and await asyncio.to_thread(get_user_tasks(current_user).__contains__, task_id):
+        # Runs on the scheduler's worker loop, not on the server's event loop.
+        await asyncio.wrap_future(task_scheduler.run_now(task_id, "manual"))
         return {"success": True, "message": "Task executed"}
     return {"success": False, "message": "Task not found"}
 
 
 # Real LLM with tool calling
-@app.post("/invoke-llm")
-async def invoke_llm(payload: Dict[str, Any]):
-    prompt = payload.get("prompt", "")
-    agent_tools = payload.get("tools", [])
-    
-    # Enhanced system prompt for tool usage
-    enhanced_prompt = f"""{prompt}
-
-אתה חייב להחזיר תגובה בפורמט JSON בדיוק כמו הדוגמה הבאה:
-{{
+# Tool-usage instructions are static, so they are built once and sent as the
+# system instruction, where Gemini context caching can reuse them.
+TOOL_INSTRUCTIONS = """אתה חייב להחזיר תגובה בפורמט JSON בדיוק כמו הדוגמה הבאה:
+{
   "response": "הודעה למשתמש בעברית",
-  "tool_to_call": {{ "name": "שם_כלי", "arguments": {{ "פרמטר": "ערך" }} }} או null
-}}
+  "tool_to_call": { "name": "שם_כלי", "arguments": { "פרמטר": "ערך" } } או null
+}
+
+כשהבקשה דורשת כמה כלים שאינם תלויים זה בזה, החזר את כולם ברשימה "tool_calls" במקום "tool_to_call" - הם יבוצעו במקביל.
+כלי שזקוק לתוצאה של כלי אחר יש לבקש רק אחרי שהתוצאה הראשונה התקבלה.
 
 כשמשתמש מבקש משהו שקשור ללקוחות או CRM, השתמש בכלי manage_crm.
 דוגמאות:
-- "חפש לקוח בשם יוסי" -> {{"response": "מחפש לקוח בשם יוסי...", "tool_to_call": {{"name": "manage_crm", "arguments": {{"action": "search_customers", "name": "יוסי"}}}}}}
-- "צור לקוח חדש שירה כהן" -> {{"response": "יוצר לקוח חדש...", "tool_to_call": {{"name": "manage_crm", "arguments": {{"action": "create_customer", "name": "שירה כהן"}}}}}}
-- "מה שלום?" -> {{"response": "שלום! מה שלומך? איך אוכל לעזור?", "tool_to_call": null}}
+- "חפש לקוח בשם יוסי" -> {"response": "מחפש לקוח בשם יוסי...", "tool_to_call": {"name": "manage_crm", "arguments": {"action": "search_customers", "name": "יוסי"}}}
+- "צור לקוח חדש שירה כהן" -> {"response": "יוצר לקוח חדש...", "tool_to_call": {"name": "manage_crm", "arguments": {"action": "create_customer", "name": "שירה כהן"}}}
+- "בדוק את היומן שלי ומצא את הלקוח יוסי" -> {"response": "בודק את היומן ומחפש את יוסי...", "tool_calls": [{"name": "manage_calendar", "arguments": {"action": "list_events"}}, {"name": "manage_crm", "arguments": {"action": "search_customers", "name": "יוסי"}}]}
+- "מה שלום?" -> {"response": "שלום! מה שלומך? איך אוכל לעזור?", "tool_to_call": null}
 
 תשובה חייבת להיות JSON תקין!"""
 
+
+def llm_system_instruction(system: Optional[str] = None) -> str:
+    return f"{TOOL_INSTRUCTIONS}\n\n{system}" if system else TOOL_INSTRUCTIONS
+
+
+def llm_tools(tool_names: List[str]) -> List[Dict[str, Any]]:
+    """Catalog entries tool calls are checked against: the requested tools, or all of them."""
+    return agent_tools.select_tools(tool_names or None)
+
+
+llm_fallbacks = metrics.Counter("llm_fallback_responses_total", "Canned answers sent because Gemini was unavailable.")
+
+
+def fallback_llm_response(tool_names: List[str]) -> Dict[str, Any]:
+    llm_fallbacks.inc()
+    return envelope(
+        f"מערכת AI זמינה! יש לי גישה לכלים: {', '.join(tool_names) if tool_names else 'אין כלים'}. איך אוכל לעזור לך?",
+        []
+    )
+
+
+def llm_cache_key(payload: Dict[str, Any], system_instruction: str) -> Optional[str]:
+    """Response-cache key for an /invoke-llm payload, or None if it opted out."""
+    if not payload.get("cache", True):
+        return None
+    return response_cache.key(
+        llm.DEFAULT_MODEL,
+        payload.get("prompt", ""),
+        payload.get("temperature"),
+        payload.get("tools", []),
+        system_instruction,
+    )
+
+
+class LLMUnavailable(Exception):
+    """Gemini is not configured or did not answer."""
+
+
+async def generate_envelope(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """The answer of /invoke-llm, raising ``LLMUnavailable`` instead of falling back.
+
+    Scheduled workflows call this: a step whose LLM call failed must fail
+    (and run again on the next run), not checkpoint the canned answer.
+    """
+    if not os.getenv("GEMINI_API_KEY"):
+        raise LLMUnavailable("GEMINI_API_KEY is not set")
+    system_instruction = llm_system_instruction(payload.get("system"))
     try:
-        if os.getenv("GEMINI_API_KEY"):
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content(enhanced_prompt)
-            response_text = response.text.strip()
-            
-            # Try to parse JSON response
-            try:
-                import json
-                # Clean up response (remove markdown if present)
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_text:
-                    response_text = response_text.split("```")[1].split("```")[0].strip()
-                
-                parsed_response = json.loads(response_text)
-                
-                # Validate the response structure
-                if "response" in parsed_response:
-                    return {
-                        "response": parsed_response.get("response", "תשובה מהסוכן"),
-                        "tool_to_call": parsed_response.get("tool_to_call")
-                    }
-            except json.JSONDecodeError:
-                print(f"Failed to parse JSON: {response_text}")
-                pass
-            
-            # Fallback: try to detect tool usage from regular response
-            if any(keyword in response_text.lower() for keyword in ["חפש", "מצא", "לקוח", "crm", "צור", "עדכן"]):
-                # This is a basic heuristic - in production you'd want more sophisticated parsing
-                return {
-                    "response": response_text,
-                    "tool_to_call": {
-                        "name": "manage_crm", 
-                        "arguments": {"action": "list_recent_customers"}
-                    }
-                }
-            
-            return {
-                "response": response_text,
-                "tool_to_call": None
-            }
-            
+        cache_key = llm_cache_key(payload, system_instruction)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return cached
+        response_text = (await llm.generate(
+            payload.get("prompt", ""),
+            temperature=payload.get("temperature"),
+            system_instruction=system_instruction,
+            priority=payload.get("priority", llm_queue.INTERACTIVE),
+            json_mode=True,
+        )).strip()
+        result = parse_envelope(response_text, llm_tools(payload.get("tools", [])))
+    except asyncio.TimeoutError as e:
+        raise LLMUnavailable(f"Gemini call timed out after {llm.TIMEOUT_SECONDS}s") from e
     except Exception as e:
-        print(f"Gemini error: {e}")
-    
-    # Fallback response
-    return {
-        "response": f"מערכת AI זמינה! יש לי גישה לכלים: {', '.join(agent_tools) if agent_tools else 'אין כלים'}. איך אוכל לעזור לך?",
-        "tool_to_call": None
-    }
+        raise LLMUnavailable(f"Gemini error: {e}") from e
+    if cache_key:
+        response_cache.put(cache_key, result)
+    return result
+
+
+@app.post("/invoke-llm")
+async def invoke_llm(payload: Dict[str, Any]):
+    """Ask Gemini for a {response, tool_calls} envelope.
+
+    Optional payload keys: ``system`` (instructions added after the static
+    tool-usage block), ``temperature``, ``tools``, ``cache`` (False to
+    skip the response cache) and ``priority`` ("interactive" by default or
+    "scheduled", the LLM queue's priority class). Tool calls are only
+    returned if they match the schema of one of ``tools`` (any catalog tool
+    when none are given). Answers with a canned response if Gemini is not
+    configured or fails.
+    """
+    try:
+        return await generate_envelope(payload)
+    except LLMUnavailable as e:
+        if e.__cause__ is not None:
+            print(e)
+    return fallback_llm_response(payload.get("tools", []))
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/invoke-llm/stream")
+async def invoke_llm_stream(payload: Dict[str, Any]):
+    """Same contract as /invoke-llm, streamed as Server-Sent Events.
+
+    Events: ``token`` ({"text"}) for each piece of the user-facing response,
+    ``tool_calls`` (list of {"name", "arguments"}) as soon as they are complete, and a
+    final ``done`` carrying the full parsed result. ``error`` precedes a
+    ``done`` with the fallback response if Gemini fails mid-stream.
+    """
+    prompt = payload.get("prompt", "")
+    tool_names = payload.get("tools", [])
+    system_instruction = llm_system_instruction(payload.get("system"))
+
+    async def events():
+        try:
+            if os.getenv("GEMINI_API_KEY"):
+                cache_key = llm_cache_key(payload, system_instruction)
+                cached = response_cache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    yield sse_event("token", {"text": cached["response"]})
+                    if cached["tool_calls"]:
+                        yield sse_event("tool_calls", cached["tool_calls"])
+                    yield sse_event("done", cached)
+                    return
+
+                tools = llm_tools(tool_names)
+                parser = EnvelopeStream(tools)
+                async for chunk in llm.stream(
+                    prompt,
+                    temperature=payload.get("temperature"),
+                    system_instruction=system_instruction,
+                    priority=payload.get("priority", llm_queue.INTERACTIVE),
+                    json_mode=True,
+                ):
+                    for event, data in parser.feed(chunk):
+                        if event == "token":
+                            yield sse_event("token", {"text": data})
+                        else:
+                            yield sse_event("tool_calls", data)
+                result = parse_envelope(parser.buffer, tools)
+                if result["tool_calls"] and not parser.tool_call_sent:
+                    yield sse_event("tool_calls", result["tool_calls"])
+                if cache_key:
+                    response_cache.put(cache_key, result)
+                yield sse_event("done", result)
+                return
+        except asyncio.TimeoutError:
+            print(f"Gemini stream timed out after {llm.TIMEOUT_SECONDS}s")
+            yield sse_event("error", {"error": "timeout"})
+        except Exception as e:
+            print(f"Gemini error: {e}")
+            yield sse_event("error", {"error": str(e)})
+
+        result = fallback_llm_response(tool_names)
+        yield sse_event("token", {"text": result["response"]})
+        yield sse_event("done", result)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 # Google OAuth 
+def oauth_redirect_uri() -> str:
+    return f"https://{os.getenv('REPLIT_DEV_DOMAIN', 'localhost:5000')}/oauth2callback"
+
+
 @app.post("/google/oauth")
 def google_oauth(body: Dict[str, Any]):
     action = body.get("action")
@@ -579,7 +1055,7 @@ def google_oauth(body: Dict[str, Any]):
         global user_oauth_tokens
         if 'user_oauth_tokens' not in globals():
             user_oauth_tokens = {}
-        user_has_token = user_oauth_tokens.get(user_id, False)
+        user_has_token = user_oauth_tokens.get(user_id, False) or google_clients.connected(current_user)
         
         return {
             "success": True,
@@ -594,17 +1070,10 @@ def google_oauth(body: Dict[str, Any]):
         
         # Build real OAuth URL
         client_id = os.getenv("GOOGLE_CLIENT_ID")
-        redirect_uri = f"https://{os.getenv('REPLIT_DEV_DOMAIN', 'localhost:5000')}/oauth2callback"
+        redirect_uri = oauth_redirect_uri()
         
-        # Define required scopes for all Google services
-        scopes = [
-            "https://www.googleapis.com/auth/gmail.send",
-            "https://www.googleapis.com/auth/calendar",
-            "https://www.googleapis.com/auth/drive",
-            "https://www.googleapis.com/auth/spreadsheets", 
-            "https://www.googleapis.com/auth/documents"
-        ]
-        scope_string = " ".join(scopes)
+        # Scopes for all Google services (see backend/google_api.py)
+        scope_string = " ".join(google_api.SCOPES)
         
         auth_url = f"https://accounts.google.com/o/oauth2/v2/auth?client_id={client_id}&redirect_uri={redirect_uri}&scope={scope_string}&response_type=code&access_type=offline"
         
@@ -615,6 +1084,8 @@ def google_oauth(body: Dict[str, Any]):
     
     elif action == "disconnect":
         # Disconnect Google services
+        google_clients.disconnect(current_user)
+        google_cache.tool_cache.invalidate_user(current_user)
         return {
             "success": True,
             "message": "החיבור לשירותי Google נותק בהצלחה"
@@ -627,12 +1098,57 @@ def google_oauth(body: Dict[str, Any]):
     return {"success": False, "error": "פעולה לא מזוהה"}
 
 
+google_action_latency = metrics.Histogram(
+    "google_action_duration_seconds", "Latency of /google/* actions, whether called over HTTP or as a tool.",
+    ("service", "action"),
+)
+
+
+def timed_google_action(service: str, actions: List[str]):
+    """Record the latency of a /google/<service> handler per ``action``; others count as "unknown"."""
+    known = frozenset(actions)
+
+    def decorate(handler):
+        @functools.wraps(handler)
+        def timed(body: Dict[str, Any], user_id: str):
+            started = time.perf_counter()
+            try:
+                return handler(body, user_id)
+            finally:
+                action = body.get("action")
+                google_action_latency.observe(
+                    time.perf_counter() - started, service, action if action in known else "unknown"
+                )
+        return timed
+    return decorate
+
+
+def cached_google_action(service: str):
+    """Serve repeated reads from ``google_cache`` and let writes invalidate them.
+
+    Only for users with a Google connection; the demo data needs no cache.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        def cached(body: Dict[str, Any], user_id: str):
+            if not google_clients.connected(user_id):
+                return handler(body, user_id)
+            return google_cache.tool_cache.call(user_id, service, body, lambda: handler(body, user_id))
+        return cached
+    return decorate
+
+
 # Gmail Tool Implementation  
 @app.post("/google/gmail")
-def gmail_action(body: Dict[str, Any]):
+@timed_google_action("gmail", ["send_email", "search_emails", "read_email"])
+@cached_google_action("gmail")
+def gmail_action(body: Dict[str, Any], user_id: str = Depends(current_user_id)):
     action = body.get("action")
     
     try:
+        if google_clients.connected(user_id):
+            return google_actions.gmail(google_clients, user_id, body) or {"success": False, "error": "פעולה לא מזוהה"}
+
         if action == "send_email":
             to_email = body.get("to")
             subject = body.get("subject") 
@@ -670,17 +1186,22 @@ def gmail_action(body: Dict[str, Any]):
             }
             
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": google_api.error_message(e)}
     
     return {"success": False, "error": "פעולה לא מזוהה"}
 
 
 # Calendar Tool Implementation
 @app.post("/google/calendar")
-def calendar_action(body: Dict[str, Any]):
+@timed_google_action("calendar", ["create_event", "list_events", "check_availability"])
+@cached_google_action("calendar")
+def calendar_action(body: Dict[str, Any], user_id: str = Depends(current_user_id)):
     action = body.get("action")
     
     try:
+        if google_clients.connected(user_id):
+            return google_actions.calendar(google_clients, user_id, body) or {"success": False, "error": "פעולה לא מזוהה"}
+
         if action == "create_event":
             summary = body.get("summary")
             start_time = body.get("start_time")
@@ -717,17 +1238,22 @@ def calendar_action(body: Dict[str, Any]):
             }
             
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": google_api.error_message(e)}
     
     return {"success": False, "error": "פעולה לא מזוהה"}
 
 
 # Drive Tool Implementation
 @app.post("/google/drive")
-def drive_action(body: Dict[str, Any]):
+@timed_google_action("drive", ["search_files", "read_file", "create_file"])
+@cached_google_action("drive")
+def drive_action(body: Dict[str, Any], user_id: str = Depends(current_user_id)):
     action = body.get("action")
     
     try:
+        if google_clients.connected(user_id):
+            return google_actions.drive(google_clients, user_id, body) or {"success": False, "error": "פעולה לא מזוהה"}
+
         if action == "search_files":
             query = body.get("query", "")
             return {
@@ -757,17 +1283,22 @@ def drive_action(body: Dict[str, Any]):
             }
             
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": google_api.error_message(e)}
     
     return {"success": False, "error": "פעולה לא מזוהה"}
 
 
 # Sheets Tool Implementation
 @app.post("/google/sheets")
-def sheets_action(body: Dict[str, Any]):
+@timed_google_action("sheets", ["read_range", "append_row"])
+@cached_google_action("sheets")
+def sheets_action(body: Dict[str, Any], user_id: str = Depends(current_user_id)):
     action = body.get("action")
     
     try:
+        if google_clients.connected(user_id):
+            return google_actions.sheets(google_clients, user_id, body) or {"success": False, "error": "פעולה לא מזוהה"}
+
         if action == "read_range":
             spreadsheet_id = body.get("spreadsheet_id")
             range_name = body.get("range")
@@ -796,17 +1327,22 @@ def sheets_action(body: Dict[str, Any]):
             }
             
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": google_api.error_message(e)}
     
     return {"success": False, "error": "פעולה לא מזוהה"}
 
 
 # Docs Tool Implementation
 @app.post("/google/docs")
-def docs_action(body: Dict[str, Any]):
+@timed_google_action("docs", ["create_document", "read_document", "append_text"])
+@cached_google_action("docs")
+def docs_action(body: Dict[str, Any], user_id: str = Depends(current_user_id)):
     action = body.get("action")
     
     try:
+        if google_clients.connected(user_id):
+            return google_actions.docs(google_clients, user_id, body) or {"success": False, "error": "פעולה לא מזוהה"}
+
         if action == "create_document":
             title = body.get("title")
             content = body.get("content", "")
@@ -844,11 +1380,458 @@ def docs_action(body: Dict[str, Any]):
             }
             
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": google_api.error_message(e)}
     
     return {"success": False, "error": "פעולה לא מזוהה"}
 
 
+# Server-side agent tools
+# Each handler takes the arguments chosen by the LLM and the user the call
+# runs for (the owner of the agent or task, not ``current_user``) and returns
+# {"success": True, "result": <text for the follow-up prompt>} or
+# {"success": False, "error": <message shown to the user>}.
+def tool_result(text: str) -> Dict[str, Any]:
+    return {"success": True, "result": text}
+
+
+def tool_error(message: str) -> Dict[str, Any]:
+    return {"success": False, "error": message}
+
+
+def _customer_details(c: Dict[str, Any]) -> str:
+    return (
+        f"שם: {c.get('name')}\nאימייל: {c.get('email')}\nטלפון: {c.get('phone') or 'לא הוזן'}\n"
+        f"חברה: {c.get('company') or 'לא הוזנה'}\nסטטוס: {c.get('status') or 'לא הוגדר'}\nמזהה (ID): {c.get('id')}"
+    )
+
+
+def _customer_line(c: Dict[str, Any]) -> str:
+    return f"• שם: {c.get('name')}, חברה: {c.get('company') or 'N/A'}, טלפון: {c.get('phone') or 'לא הוזן'}, מזהה (ID): {c.get('id')}"
+
+
+def manage_crm(args: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    action = args.get("action")
+    customer_id = args.get("customer_id")
+    user_customers = get_user_customers(user_id)
+
+    if action == "search_customers":
+        filter = {k: args[k] for k in ("name", "email", "company", "phone", "status") if args.get(k)}
+        if not filter:
+            return tool_error("לחיפוש לקוחות, אנא ספק לפחות קריטריון אחד (כמו שם, אימייל או חברה).")
+        found = search_customers(user_id, filter)
+        if not found:
+            return tool_result("לא נמצאו לקוחות התואמים לחיפוש.")
+        if len(found) == 1:
+            return tool_result(f"נמצא לקוח אחד:\n\n{_customer_details(found[0])}")
+        limit = min(int(args.get("limit") or 5), 20)
+        found = sorted(found, key=lambda c: c.get("name") or "")
+        return tool_result(f"נמצאו {len(found)} לקוחות:\n\n" + "\n".join(_customer_line(c) for c in found[:limit]))
+
+    if action == "get_customer_by_id":
+        if not customer_id:
+            return tool_error("שגיאה: חובה לספק customer_id.")
+        customer = user_customers.get(customer_id)
+        if not customer:
+            return tool_result(f"לא נמצא לקוח עם מזהה {customer_id}.")
+        return tool_result(f"פרטי הלקוח:\n\n{_customer_details(customer)}")
+
+    if action == "list_recent_customers":
+        if not user_customers:
+            return tool_result("לא נמצאו לקוחות במערכת.")
+        recent = sorted(
+            user_customers.values(), key=lambda c: c.get("updated_date") or c.get("created_date"), reverse=True
+        )[:10]
+        return tool_result("10 הלקוחות האחרונים שעודכנו:\n\n" + "\n".join(_customer_line(c) for c in recent))
+
+    if action == "create_customer":
+        name, email, company = args.get("name"), args.get("email"), args.get("company")
+        if not name or not email or not company:
+            return tool_error("שגיאה: ליצירת לקוח חדש, אני צריך שם מלא, כתובת אימייל ושם חברה. תוכל לספק לי אותם?")
+        created = create_record(user_customers, CustomerIn(
+            name=name,
+            email=email,
+            company=company,
+            phone=args.get("phone") or "",
+            status=args.get("status") or "lead",
+        ))
+        return tool_result(f"✅ לקוח חדש נוצר בהצלחה:\nשם: {created['name']}\nמזהה: {created['id']}")
+
+    if action == "update_customer":
+        data_to_update = args.get("data_to_update")
+        if not (customer_id or args.get("name") or args.get("email")) or not data_to_update:
+            return tool_error("שגיאה: לעדכון לקוח, ספק customer_id או name או email + נתונים לעדכון.")
+        if customer_id:
+            target = user_customers.get(customer_id)
+        else:
+            found = search_customers(user_id, {k: args[k] for k in ("name", "email") if args.get(k)})
+            if not found:
+                return tool_error("לא נמצא לקוח עם הפרטים שסופקו.")
+            if len(found) > 1:
+                options = "\n".join(f"• {c.get('name')} (ID: {c.get('id')})" for c in found[:3])
+                return tool_error(f"נמצאו {len(found)} לקוחות. אנא ספק פרטים יותר ספציפיים:\n{options}")
+            target = found[0]
+        if not target:
+            return tool_error("לא נמצא לקוח לעדכון.")
+        updated = update_record(user_customers, target["id"], CustomerIn(**{**target, **data_to_update}))
+        return tool_result(f"✅ לקוח {updated['name']} עודכן בהצלחה.")
+
+    if action == "delete_customer":
+        if not customer_id:
+            return tool_error("שגיאה: מזהה לקוח נדרש למחיקה.")
+        user_customers.pop(customer_id, None)
+        return tool_result(f"✅ לקוח עם מזהה {customer_id} נמחק בהצלחה.")
+
+    return tool_error(f"פעולת CRM לא ידועה: {action}")
+
+
+def manage_gmail(args: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    action = args.get("action")
+    response = gmail_action(args, user_id)
+    if not response.get("success"):
+        return tool_error(response.get("error") or f"Failed to perform Gmail action: {action}.")
+
+    if action == "send_email":
+        return tool_result(f"✅ המייל נשלח בהצלחה לנמען: {args.get('to')}")
+    if action == "search_emails":
+        emails = response.get("emails") or []
+        if not emails:
+            return tool_result(f"לא נמצאו מיילים התואמים לחיפוש שלך: \"{args.get('query')}\"")
+        listing = "\n\n".join(f"• נושא: {e.get('subject')}\n  מאת: {e.get('from')}\n  ID: {e.get('id')}" for e in emails)
+        return tool_result(f"מצאתי {len(emails)} מיילים רלוונטיים:\n\n{listing}")
+    email = response.get("email")
+    if not email:
+        return tool_result(f"לא נמצא מייל עם מזהה {args.get('message_id')}.")
+    return tool_result(
+        f"תוכן המייל (ID: {args.get('message_id')}):\n\nמאת: {email.get('from')}\nלכבוד: {email.get('to')}\n"
+        f"נושא: {email.get('subject')}\n\nתוכן: {email.get('body')}"
+    )
+
+
+def manage_calendar(args: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    action = args.get("action")
+    if not action:
+        return tool_error("שגיאה: חסר סוג פעולה ליומן (create_event, list_events, או check_availability).")
+    response = calendar_action(args, user_id)
+    if not response.get("success"):
+        return tool_error(response.get("error") or "Failed to perform calendar operation.")
+
+    if action == "create_event":
+        attendees = args.get("attendee_emails") or []
+        text = (
+            f"✅ האירוע נוצר בהצלחה ביומן!\n\n📅 פרטי האירוע:\n• כותרת: {args.get('summary')}\n"
+            f"• זמן התחלה: {args.get('start_time')}\n• זמן סיום: {args.get('end_time')}"
+        )
+        if attendees:
+            text += f"\n• משתתפים: {', '.join(attendees)}"
+        return tool_result(text)
+    if action == "list_events":
+        events = response.get("events") or []
+        if not events:
+            return tool_result("📅 אין אירועים מתוכננים לשבוע הקרוב.")
+        return tool_result("📅 אירועים לשבוע הקרוב:\n\n" + "\n".join(f"• {e.get('summary')} - {e.get('start')}" for e in events))
+    availability = "✅ הזמן פנוי לקביעת פגישה" if response.get("available") else "❌ הזמן תפוס"
+    return tool_result(f"🔍 בדיקת זמינות:\n{availability}\n\nזמן נבדק: {args.get('start_time')} - {args.get('end_time')}")
+
+
+def manage_drive(args: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    action = args.get("action")
+    response = drive_action(args, user_id)
+    if not response.get("success"):
+        return tool_error(response.get("error") or "Failed to perform Drive operation.")
+
+    if action == "search_files":
+        files = response.get("files") or []
+        if not files:
+            return tool_result("לא נמצאו קבצים שתואמים לחיפוש.")
+        return tool_result(f"מצאתי {len(files)} קבצים:\n" + "\n".join(f"• {f.get('name')} (ID: {f.get('id')})" for f in files))
+    if action == "read_file":
+        return tool_result(f"תוכן הקובץ:\n\n{response.get('content')}")
+    return tool_result(f"{response.get('message')}\nמזהה הקובץ: {response.get('file_id')}")
+
+
+def manage_sheets(args: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    action = args.get("action")
+    response = sheets_action(args, user_id)
+    if not response.get("success"):
+        return tool_error(response.get("error") or "Failed to perform Sheets operation.")
+
+    if action == "read_range":
+        values = response.get("values") or []
+        if not values:
+            return tool_result("לא נמצאו נתונים בטווח המבוקש.")
+        return tool_result("הנתונים מהגיליון:\n" + "\n".join(", ".join(str(v) for v in row) for row in values))
+    return tool_result("השורה נוספה בהצלחה לגיליון.")
+
+
+def manage_docs(args: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    action = args.get("action")
+    response = docs_action(args, user_id)
+    if not response.get("success"):
+        return tool_error(response.get("error") or "Failed to perform Docs operation.")
+
+    document = response.get("document") or {}
+    if action == "create_document":
+        return tool_result(
+            f"המסמך \"{document.get('title')}\" נוצר בהצלחה!\nמזהה המסמך: {document.get('id')}\nקישור: {document.get('url')}"
+        )
+    if action == "read_document":
+        return tool_result(f"תוכן המסמך \"{document.get('title')}\":\n\n{document.get('content')}")
+    return tool_result("הטקסט נוסף בהצלחה למסמך.")
+
+
+TOOL_HANDLERS = {
+    "manage_crm": manage_crm,
+    "manage_gmail": manage_gmail,
+    "manage_calendar": manage_calendar,
+    "manage_drive": manage_drive,
+    "manage_sheets": manage_sheets,
+    "manage_docs": manage_docs,
+}
+
+
+tool_latency = metrics.Histogram("tool_call_duration_seconds", "Agent tool call latency.", ("tool", "success"))
+
+
+def execute_tool(name: str, arguments: Dict[str, Any], user_id: str, allowed: Optional[List[str]] = None) -> Dict[str, Any]:
+    handler = TOOL_HANDLERS.get(name)
+    if not handler or (allowed is not None and name not in allowed):
+        return tool_error(f"כלי לא מוכר: {name}")
+    started = time.perf_counter()
+    result = tool_error(f"שגיאה בביצוע הכלי {name}")
+    try:
+        result = handler(arguments, user_id)
+    except HTTPException as e:
+        result = tool_error(f"שגיאה בביצוע הכלי {name}: {e.detail}")
+    except Exception as e:
+        print(f"Tool {name} failed: {e}")
+        result = tool_error(f"שגיאה בביצוע הכלי {name}: {e}")
+    finally:
+        tool_latency.observe(time.perf_counter() - started, name, "true" if result.get("success") else "false")
+    return result
+
+
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+# Tool calls wait on Google and storage, not the CPU; asyncio's default pool
+# has only cpu_count + 4 threads, which would queue the calls of a busy turn.
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "32"))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+async def execute_tools(
+    calls: List[Dict[str, Any]], user_id: str, allowed: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Run independent tool calls for ``user_id`` concurrently, each bounded by TOOL_TIMEOUT_SECONDS.
+
+    Handlers are synchronous, so each runs on a thread of ``tool_executor``;
+    a turn with N calls (up to TOOL_WORKERS) takes as long as the slowest one.
+    Outcomes are in ``calls`` order.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def run(call: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return await asyncio.wait_for(
+                # Like asyncio.to_thread, the handler sees the caller's context variables.
+                loop.run_in_executor(tool_executor, functools.partial(
+                    contextvars.copy_context().run, execute_tool, call["name"], call["arguments"], user_id, allowed,
+                )),
+                TOOL_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            return tool_error(f"הכלי {call['name']} לא הגיב בזמן")
+
+    return list(await asyncio.gather(*(run(call) for call in calls)))
+
+
+# Agent chat: the plan -> tool -> summarize loop, run in-process
+AGENT_MAX_TOOL_STEPS = int(os.getenv("AGENT_MAX_TOOL_STEPS", "5"))
+
+
+class AgentChatIn(BaseModel):
+    message: str
+    # With a session_id the server keeps the history and ``history`` is ignored.
+    session_id: Optional[str] = None
+    history: List[Dict[str, Any]] = Field(default_factory=list)
+    integrations: Optional[List[str]] = None
+
+
+async def run_agent_turn(
+    user_id: str,
+    agent: Dict[str, Any],
+    message: str,
+    history: List[Dict[str, Any]],
+    integrations: Optional[List[str]] = None,
+    summary: Optional[str] = None,
+):
+    """Run one chat turn and yield ``(event, data)`` progress pairs.
+
+    ``message`` is each text for the user, ``tool_start``/``tool_result``
+    surround every tool call and ``done`` carries the final response and the
+    tool runs. All calls the model asks for in one step are independent and run
+    concurrently; their results go straight back into the next LLM call, so a
+    turn costs one LLM call plus one per step.
+    """
+    tools = agent_tools.select_tools(agent.get("tools"), integrations)
+    tool_names = [t["name"] for t in tools]
+    llm_payload = {
+        "tools": tool_names,
+        "temperature": agent.get("temperature"),
+        "system": agent_tools.build_agent_system_prompt(agent, tools),
+    }
+
+    decision = await invoke_llm(
+        {**llm_payload, "prompt": agent_tools.build_agent_prompt(agent, history, message, summary)}
+    )
+    response = decision.get("response") or "אני עובד על זה..."
+    yield "message", {"text": response}
+
+    tool_runs: List[Dict[str, Any]] = []
+    for _ in range(AGENT_MAX_TOOL_STEPS):
+        calls = [
+            call for call in decision.get("tool_calls") or []
+            if not any(run["name"] == call["name"] and run["arguments"] == call["arguments"] for run in tool_runs)
+        ]
+        if not calls:
+            break
+
+        for call in calls:
+            yield "tool_start", call
+        outcomes = await execute_tools(calls, user_id, tool_names)
+        for call, outcome in zip(calls, outcomes):
+            yield "tool_result", {"name": call["name"], **outcome}
+        if not any(outcome["success"] for outcome in outcomes):
+            response = "\n".join(outcome["error"] for outcome in outcomes)
+            break
+        tool_runs.extend(
+            {**call, "result": outcome["result"] if outcome["success"] else f"שגיאה: {outcome['error']}"}
+            for call, outcome in zip(calls, outcomes)
+        )
+
+        decision = await invoke_llm({**llm_payload, "prompt": agent_tools.build_followup_prompt(agent, message, tool_runs)})
+        response = decision.get("response") or "תגובה מהסוכן"
+        yield "message", {"text": response}
+
+    yield "done", {"response": response, "tool_runs": tool_runs}
+
+
+@app.post("/agents/{agent_id}/chat")
+async def agent_chat(agent_id: str, payload: AgentChatIn):
+    """Run a chat turn server-side, streaming progress as Server-Sent Events."""
+    # Storage calls block (on SQLite a write can wait for another process's lock), so they run on threads.
+    agent = await asyncio.to_thread(get_user_agents(current_user).get, agent_id)
+    if agent is None:
+        raise HTTPException(404, "Agent not found")
+
+    if payload.session_id:
+        conversation = await asyncio.to_thread(conversation_store.load, current_user, agent_id, payload.session_id)
+        summary, history = conversation_store.context(conversation)
+    else:
+        conversation, summary = None, None
+        history = conversation_store.trim(payload.history)
+
+    async def events():
+        async for event, data in run_agent_turn(current_user, agent, payload.message, history, payload.integrations, summary):
+            if event == "done" and conversation is not None:
+                now = datetime.utcnow()
+                await conversation_store.append(
+                    conversation,
+                    {"sender": "user", "text": payload.message, "timestamp": now},
+                    {"sender": "agent", "text": data["response"], "timestamp": now},
+                )
+            yield sse_event(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.get("/agents/{agent_id}/conversations/{session_id}")
+def get_conversation(agent_id: str, session_id: str):
+    """The stored history of a chat session: rolling summary and recent turns."""
+    conversation = conversation_store.get(current_user, agent_id, session_id)
+    if conversation is None:
+        raise HTTPException(404, "Conversation not found")
+    return conversation
+
+
+@app.delete("/agents/{agent_id}/conversations/{session_id}")
+def delete_conversation(agent_id: str, session_id: str):
+    if not conversation_store.delete(current_user, agent_id, session_id):
+        raise HTTPException(404, "Conversation not found")
+    return {"success": True}
+
+
+# Incremental sync: clients apply the writes since the last seq they saw
+CHANGES_HEARTBEAT_SECONDS = 15
+
+
+def collection_names(collections: Optional[str]) -> Optional[List[str]]:
+    return [name for name in (collections or "").split(",") if name] or None
+
+
+@app.get("/stats")
+def get_stats(days: int = Query(7, ge=1, le=analytics.DAILY_DAYS), hours: int = Query(24, ge=1, le=analytics.HOURLY_DAYS * 24)):
+    """Dashboard counts: agents, customers and activities, with daily and hourly series"""
+    return dashboard_stats.summary(current_user, days=days, hours=hours)
+
+
+@app.get("/changes")
+def list_changes(
+    since: Optional[int] = None,
+    limit: int = Query(changes.DEFAULT_LIMIT, ge=1, le=MAX_PAGE_SIZE),
+    collections: Optional[str] = None,
+):
+    """Writes after ``since`` as ``{"changes", "next", "has_more", "reset"}``.
+
+    Without ``since`` there are no changes, only the ``next`` to start from;
+    take it before loading the lists. ``reset`` means the changes after
+    ``since`` are gone: reload the lists and continue from ``next``.
+    ``collections=customers,tasks`` limits the changes to those collections.
+    """
+    if since is None:
+        rows, next_seq, has_more, reset = [], change_feed.last_seq, False, False
+    else:
+        rows, next_seq, has_more, reset = change_feed.since(since, current_user, limit, collection_names(collections))
+    tail = dumps({"next": next_seq, "has_more": has_more, "reset": reset})
+    return json_response(b'{"changes":' + json_array(row for _, row in rows) + b"," + tail[1:])
+
+
+@app.get("/changes/stream")
+async def stream_changes(
+    request: HttpRequest,
+    since: Optional[int] = None,
+    collections: Optional[str] = None,
+):
+    """The change feed as Server-Sent Events, for use with EventSource.
+
+    Each ``change`` event carries one change, and its ``id`` is the seq, so
+    a reconnecting EventSource resumes after the last change it got
+    (Last-Event-ID). ``reset`` tells the client to reload its lists; the
+    stream then continues from the latest seq. A comment is sent every
+    CHANGES_HEARTBEAT_SECONDS so proxies keep the connection open.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    seq = int(last_event_id) if last_event_id and last_event_id.isdigit() else since
+    names = collection_names(collections)
+
+    async def events():
+        nonlocal seq
+        if seq is None:
+            seq = change_feed.last_seq
+            yield f"id: {seq}\nevent: ready\ndata: {{}}\n\n"
+        while True:
+            rows, next_seq, has_more, reset = change_feed.since(seq, current_user, changes.DEFAULT_LIMIT, names)
+            if reset:
+                yield f"id: {next_seq}\nevent: reset\ndata: {{}}\n\n"
+            for change_seq, row in rows:
+                yield f"id: {change_seq}\nevent: change\ndata: {row}\n\n"
+            seq = next_seq
+            if has_more:
+                continue
+            if not await change_feed.wait(seq, CHANGES_HEARTBEAT_SECONDS):
+                yield ": heartbeat\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 # Agent Templates CRUD
 @app.get("/agent-templates", response_model=List[Dict[str, Any]])
 def list_agent_templates():
@@ -884,34 +1867,18 @@ def delete_agent_template(template_id: str):
 
 @app.on_event("startup")
 async def startup_event():
-    """Start the scheduler and load existing tasks"""
-    scheduler.start()
+    """Start the scheduler; the process holding its lease keeps the jobs in line with the stored tasks"""
+    task_scheduler.start(execute_scheduled_task, tasks)
+    dashboard_stats.start(leader=lambda: task_scheduler.running)
+    webhook_queue.start()
     print("Scheduler started")
-    
-    # Add existing tasks to scheduler
-    for task_id, task in tasks.items():
-        if task.get("is_active", True):
-            try:
-                schedule_type = task.get("schedule_type", "daily")
-                schedule_time = task.get("schedule_time", "09:00")
-                
-                if schedule_type == "daily":
-                    hour, minute = map(int, schedule_time.split(":"))
-                    scheduler.add_job(
-                        execute_scheduled_task,
-                        CronTrigger(hour=hour, minute=minute),
-                        args=[task_id],
-                        id=f"task_{task_id}",
-                        replace_existing=True
-                    )
-                    print(f"Scheduled daily task {task_id} at {schedule_time}")
-            except Exception as e:
-                print(f"Failed to schedule task {task_id}: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Stop the scheduler"""
-    scheduler.shutdown()
+    await webhook_queue.stop()
+    task_scheduler.shutdown()
+    run_log.flush()
     print("Scheduler stopped")
 
 
@@ -933,14 +1900,16 @@ def oauth_callback(code: str = None, error: str = None):
         return "שגיאה: קוד OAuth חסר"
     
     try:
-        # TODO: Exchange code for tokens and save to user
         print(f"OAuth code received: {code[:20]}...")
         
-        # For demo: mark user as having tokens (simulate successful token exchange)
-        # In real implementation: call Google token endpoint and save tokens
-        # This simulates that the user now has valid Google OAuth tokens
-        global user_oauth_tokens
-        user_oauth_tokens = {"default_user": True}  # Simulate user tokens saved
+        if os.getenv("GOOGLE_CLIENT_SECRET"):
+            google_clients.save(current_user, google_clients.exchange_code(code, oauth_redirect_uri()))
+            google_cache.tool_cache.invalidate_user(current_user)
+        else:
+            # Without app credentials there is nothing to exchange the code with:
+            # mark the user as connected so the demo data is served
+            global user_oauth_tokens
+            user_oauth_tokens = {"default_user": True}  # Simulate user tokens saved
         
         return f"""
         <html>
@@ -961,8 +1930,47 @@ def oauth_callback(code: str = None, error: str = None):
         </html>
         """
 
+metrics.Gauge("record_cache_entries", "Rendered records in the record cache.", function=lambda: record_cache.stats()["size"])
+metrics.Counter(
+    "record_cache_lookups_total", "Record cache lookups.", ("result",),
+    function=lambda: {("hit",): record_cache.hits, ("miss",): record_cache.misses},
+)
+metrics.Counter(
+    "llm_response_cache_lookups_total", "LLM response cache lookups.", ("result",),
+    function=lambda: {("hit",): response_cache.hits, ("miss",): response_cache.misses},
+)
+metrics.Gauge("change_feed_entries", "Changes kept for /changes.", function=lambda: change_feed.stats()["entries"])
+metrics.Gauge("change_feed_listeners", "Open /changes/stream connections waiting for a change.",
+              function=lambda: change_feed.stats()["listeners"])
+metrics.Gauge("google_cache_entries", "Cached Google tool results.", function=lambda: google_cache.tool_cache.stats()["size"])
+metrics.Counter("activities_expired_total", "Activities deleted after the retention period.",
+                function=lambda: dashboard_stats.stats()["expired"])
+metrics.Gauge("webhook_queued_events", "Webhook events waiting for a run.",
+              function=lambda: webhook_queue.stats()["queued_events"])
+metrics.Gauge("run_log_pending", "Task runs waiting to be written.", function=lambda: run_log.stats()["pending"])
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/health")
 def health():
-    return {"ok": True, "scheduler_running": scheduler.running}
+    return {
+        "ok": True,
+        "scheduler_running": task_scheduler.running,
+        "scheduler": task_scheduler.stats(),
+        "llm": {**llm.stats(), "response_cache": response_cache.stats()},
+        "record_cache": record_cache.stats(),
+        "customer_index": customer_index.stats(),
+        "run_log": run_log.stats(),
+        "conversations": conversation_store.stats(),
+        "changes": change_feed.stats(),
+        "workflows": workflow_cache.stats(),
+        "webhooks": webhook_queue.stats(),
+        "analytics": dashboard_stats.stats(),
+        "google": {**google_clients.stats(), "cache": google_cache.tool_cache.stats()},
+    }
 
 
@@ -0,0 +1,200 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters, gauges and histograms are registered here at import time and
+rendered by ``GET /metrics``. Recording is an unlocked dict lookup and an
+addition (a bisect for histograms), so it costs well under a microsecond.
+Under concurrent threads the GIL can at worst lose an increment, which is
+acceptable for monitoring. Values owned by other modules (queue depths,
+cache sizes) are read through callbacks when the endpoint is scraped.
+
+``MetricsMiddleware`` is a plain ASGI middleware, since Starlette's
+BaseHTTPMiddleware costs far more than the measurement itself. It labels
+requests with the route's path template (``/customers/{customer_id}``), so
+label sets stay bounded. Requests that match no route share the label
+``unmatched``.
+"""
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0, 3600.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _Value(_Metric):
+    """A number per label set, kept here or read from ``function`` at scrape time.
+
+    ``function`` returns a number for an unlabelled metric, or a mapping of
+    label-value tuples to numbers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], Any]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self.function = function
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        values: Dict[Labels, float] = dict(self._values)
+        if self.function is not None:
+            result = self.function()
+            values.update(result if isinstance(result, dict) else {(): result})
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+
+class Counter(_Value):
+    kind = "counter"
+
+
+class Gauge(_Value):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (last is +Inf), sum]
+        self._series: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), list(counts)):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+registry: List[_Metric] = []
+
+
+def render(metrics: Optional[Iterable[_Metric]] = None) -> str:
+    lines: List[str] = []
+    for metric in registry if metrics is None else metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_in_flight = [0]
+# (method, route) -> [status -> count, histogram counts per bucket, latency sum];
+# one lookup per request feeds both HTTP metrics.
+_http_series: Dict[Labels, List[Any]] = {}
+
+
+def _http_requests() -> Dict[Labels, int]:
+    return {
+        (method, route, str(status)): count
+        for (method, route), series in list(_http_series.items())
+        for status, count in list(series[0].items())
+    }
+
+
+Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"), function=_http_requests)
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+Gauge("http_requests_in_flight", "HTTP requests being served.", function=lambda: _in_flight[0])
+
+
+class MetricsMiddleware:
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message: Dict[str, Any]):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _in_flight[0] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _in_flight[0] -= 1
+            # The router stores the matched route in the (shared) scope.
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else "unmatched")
+            series = _http_series.get(key)
+            if series is None:
+                latency = http_latency._series.setdefault(key, [[0] * (len(http_latency.buckets) + 1), 0.0])
+                series = _http_series.setdefault(key, [{}, latency])
+            statuses, latency = series
+            statuses[status] = statuses.get(status, 0) + 1
+            latency[0][bisect_left(http_latency.buckets, elapsed)] += 1
+            latency[1] += elapsed
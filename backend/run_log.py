@@ -0,0 +1,103 @@
+"""Append-only history of scheduled-task runs.
+
+A task run appends one record when it finishes. The record holds timing,
+status, LLM usage, the tool calls the model asked for and the output, which
+is truncated to RUN_LOG_MAX_OUTPUT_CHARS. ``append()`` only puts the record
+on an in-memory buffer. A background thread writes the buffer to the
+``task_runs`` collection every RUN_LOG_FLUSH_SECONDS, in one transaction
+per batch, so a run never waits for storage. Readers call ``flush()``
+first to see every finished run.
+
+Runs older than RUN_LOG_RETENTION_DAYS are deleted by the same thread,
+oldest first, about once an hour.
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Optional
+
+from backend.storage import Repository
+
+FLUSH_SECONDS = float(os.getenv("RUN_LOG_FLUSH_SECONDS", "1"))
+MAX_BATCH = int(os.getenv("RUN_LOG_MAX_BATCH", "500"))
+MAX_OUTPUT_CHARS = int(os.getenv("RUN_LOG_MAX_OUTPUT_CHARS", "4000"))
+RETENTION_DAYS = float(os.getenv("RUN_LOG_RETENTION_DAYS", "90"))
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+class RunLog:
+    def __init__(self, repo: Repository, flush_seconds: float = FLUSH_SECONDS, retention_days: float = RETENTION_DAYS):
+        self.repo = repo
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._next_prune = 0.0
+        self.written = 0
+        self.pruned = 0
+
+    def append(self, run: Dict[str, Any]):
+        """Queue a finished run for writing; never blocks on storage."""
+        if run.get("output") and len(run["output"]) > MAX_OUTPUT_CHARS:
+            run["output"] = run["output"][:MAX_OUTPUT_CHARS]
+            run["output_truncated"] = True
+        self._pending.append(run)
+        if self._thread is None:
+            self._start()
+        if len(self._pending) >= MAX_BATCH:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write every queued run now."""
+        with self._flush_lock:
+            batch = []
+            while self._pending:
+                batch.append(self._pending.popleft())
+            if not batch:
+                return
+            try:
+                self.repo.put_many((run["id"], run) for run in batch)
+            except Exception:
+                # Keep the runs for the next attempt, in order.
+                self._pending.extendleft(reversed(batch))
+                raise
+            self.written += len(batch)
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """Delete runs older than the retention period; returns how many."""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        removed = 0
+        while True:
+            runs, _ = self.repo.query(sort="created_date", limit=500, fields=("created_date",))
+            expired = [run["id"] for run in runs if run["created_date"] < cutoff]
+            removed += len(self.repo.delete_many(expired))
+            if len(expired) < len(runs) or not runs:
+                break
+        self.pruned += removed
+        return removed
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="run-log", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.retention_days > 0 and time.monotonic() >= self._next_prune:
+                    self._next_prune = time.monotonic() + PRUNE_INTERVAL_SECONDS
+                    self.prune()
+            except Exception as e:
+                print(f"Run log write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._pending), "written": self.written, "pruned": self.pruned}
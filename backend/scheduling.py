@@ -0,0 +1,461 @@
+"""Scheduler for scheduled tasks.
+
+Every active task has one APScheduler job (id ``task_<task id>``), added,
+replaced or removed by the task handlers as tasks change. Jobs are kept in
+the app database (table ``scheduler_jobs``, the layout of APScheduler's
+SQLAlchemy store), so next run times survive restarts and runs missed while
+the server was down are caught up under the misfire policy.
+
+Due jobs go to a bounded thread pool (SCHEDULER_WORKERS threads). Each job
+runs the task coroutine on a dedicated worker event loop rather than on the
+web server's loop, and a semaphore on that loop bounds manual runs as well.
+
+Policies, all configurable from the environment:
+
+- coalesce: a job that missed several runs runs once.
+- misfire grace (SCHEDULER_MISFIRE_GRACE_SECONDS): a run that is later
+  than this is skipped.
+- jitter (SCHEDULER_JITTER_SECONDS): every run starts up to this many
+  seconds after its nominal time, so thousands of "09:00" tasks reach
+  Gemini spread out rather than in the same second.
+
+Several server processes (``uvicorn --workers N``) share the database, so
+only one of them may fire jobs. Each process tries to take the
+``scheduler`` lease (``storage.lease()``) every SCHEDULER_LEASE_SECONDS / 3.
+The holder runs APScheduler; the others only run manual and webhook runs
+on their own worker loop. When the leader stops renewing (it exited or
+hangs) another process takes the lease after SCHEDULER_LEASE_SECONDS and
+starts firing. A leader whose renewal fails stops firing at once. One
+that stalled past its lease fires nothing more: the jobstore hands out due
+jobs only while the lease is held, so their run times stay due for the new
+leader. A job already handed out checks the lease again before it runs;
+if it is gone, the run is recorded (``scheduler_skipped_runs``) and the
+new leader runs it, once. Jobs follow the tasks collection, whose writes
+reach the leader from every process.
+"""
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED, JobEvent, JobSubmissionEvent
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.combining import OrTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from backend import metrics, storage
+
+WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+JITTER_SECONDS = int(os.getenv("SCHEDULER_JITTER_SECONDS", "120"))
+MISFIRE_GRACE_SECONDS = int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "3600"))
+TIMEZONE = os.getenv("SCHEDULER_TIMEZONE") or None
+LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "15"))
+
+# schedule_day for weekly tasks counts from Sunday = 0, as in the UI
+WEEKDAYS = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+MONTH_LENGTHS = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
+
+
+job_lag = metrics.Histogram(
+    "scheduler_job_lag_seconds", "Delay between a job's scheduled time (jitter included) and its start.",
+    buckets=metrics.LAG_BUCKETS,
+)
+job_events = metrics.Counter(
+    "scheduler_job_events_total", "Scheduler job submissions, misses, errors and runs skipped by a non-leader.", ("event",)
+)
+
+
+def _record_event(event: JobEvent):
+    if isinstance(event, JobSubmissionEvent):
+        job_events.inc("submitted")
+        now = datetime.now(timezone.utc)
+        for scheduled in event.scheduled_run_times:
+            job_lag.observe(max(0.0, (now - scheduled).total_seconds()))
+    elif event.code == EVENT_JOB_MISSED:
+        job_events.inc("missed")
+    else:
+        job_events.inc("error")
+
+
+def job_id(task_id: str) -> str:
+    return f"task_{task_id}"
+
+
+def trigger_for(task: Dict[str, Any]) -> BaseTrigger:
+    """The trigger for a task's schedule; ValueError if the schedule is invalid."""
+    schedule_type = task.get("schedule_type") or "daily"
+    jitter = JITTER_SECONDS or None
+    if schedule_type == "interval":
+        minutes = int(task.get("interval_minutes") or 0)
+        if minutes <= 0:
+            raise ValueError("interval tasks need interval_minutes > 0")
+        # Never let the jitter exceed half the interval.
+        return IntervalTrigger(minutes=minutes, jitter=min(JITTER_SECONDS, minutes * 30) or None, timezone=TIMEZONE)
+
+    try:
+        hour, minute = (int(part) for part in (task.get("schedule_time") or "09:00").split(":"))
+    except ValueError:
+        raise ValueError(f"Invalid schedule_time: {task.get('schedule_time')!r}")
+    cron = {"hour": hour, "minute": minute, "jitter": jitter, "timezone": TIMEZONE}
+    day = task.get("schedule_day")
+
+    if schedule_type == "daily":
+        return CronTrigger(**cron)
+    if schedule_type == "weekly":
+        return CronTrigger(day_of_week=WEEKDAYS[int(day or 0) % 7], **cron)
+    if schedule_type == "monthly":
+        day = max(1, min(31, int(day or 1)))
+        if day <= 28:
+            return CronTrigger(day=day, **cron)
+        # Day 29-31: months that are too short run on their last day instead.
+        short_months = ",".join(str(month) for month, length in MONTH_LENGTHS.items() if length < day)
+        return OrTrigger([CronTrigger(day=day, **cron), CronTrigger(day="last", month=short_months, **cron)])
+    raise ValueError(f"Unknown schedule_type: {schedule_type}")
+
+
+class SQLiteJobStore(BaseJobStore):
+    """APScheduler jobstore on the app's SQLite database.
+
+    With a ``lease``, due jobs are only handed out while it is held.
+    APScheduler moves a job's next run time on as soon as it hands it out,
+    so a leader that lost the lease would otherwise take the run from the
+    one that took over.
+    """
+
+    def __init__(
+        self,
+        db: storage.Database,
+        tablename: str = "scheduler_jobs",
+        pickle_protocol: int = pickle.HIGHEST_PROTOCOL,
+        lease: Optional[storage.Lease] = None,
+    ):
+        super().__init__()
+        self.db = db
+        self.tablename = tablename
+        self.pickle_protocol = pickle_protocol
+        self.lease = lease
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.tablename} "
+            "(id TEXT PRIMARY KEY, next_run_time REAL, job_state BLOB NOT NULL)"
+        )
+        self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.tablename}_next_run_time ON {self.tablename} (next_run_time)"
+        )
+
+    def lookup_job(self, job_id: str) -> Optional[Job]:
+        rows = self.db.execute(f"SELECT job_state FROM {self.tablename} WHERE id = ?", (job_id,))
+        return self._reconstitute_job(rows[0][0]) if rows else None
+
+    def get_due_jobs(self, now: datetime) -> List[Job]:
+        if self.lease is not None and not self.lease.held():
+            return []
+        return self._get_jobs("WHERE next_run_time <= ?", (datetime_to_utc_timestamp(now),))
+
+    def get_next_run_time(self) -> Optional[datetime]:
+        rows = self.db.execute(
+            f"SELECT next_run_time FROM {self.tablename} WHERE next_run_time IS NOT NULL "
+            "ORDER BY next_run_time LIMIT 1"
+        )
+        return utc_timestamp_to_datetime(rows[0][0]) if rows else None
+
+    def get_all_jobs(self) -> List[Job]:
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job: Job):
+        try:
+            self.db.execute(
+                f"INSERT INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)",
+                (job.id, datetime_to_utc_timestamp(job.next_run_time), self._state(job)),
+            )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job: Job):
+        with self.db.connection() as conn:
+            cursor = conn.execute(
+                f"UPDATE {self.tablename} SET next_run_time = ?, job_state = ? WHERE id = ?",
+                (datetime_to_utc_timestamp(job.next_run_time), self._state(job), job.id),
+            )
+            if cursor.rowcount == 0:
+                raise JobLookupError(job.id)
+
+    def remove_job(self, job_id: str):
+        with self.db.connection() as conn:
+            if conn.execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,)).rowcount == 0:
+                raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        self.db.execute(f"DELETE FROM {self.tablename}")
+
+    def _state(self, job: Job) -> bytes:
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_job(self, job_state: bytes) -> Job:
+        state = pickle.loads(job_state)
+        state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where: str = "", params: tuple = ()) -> List[Job]:
+        jobs, failed = [], []
+        rows = self.db.execute(f"SELECT id, job_state FROM {self.tablename} {where} ORDER BY next_run_time", params)
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                self._logger.exception('Unable to restore job "%s" -- removing it', job_id)
+                failed.append(job_id)
+        for job_id in failed:
+            self.db.execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (table={self.tablename})>"
+
+
+class _WorkerLoop:
+    """An event loop on its own thread that runs at most ``size`` tasks at once."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.active = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self._slots = asyncio.Semaphore(self.size)
+        self._thread = threading.Thread(target=self.loop.run_forever, name="scheduler-loop", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[..., Awaitable[Any]], *args: Any) -> Future:
+        if self.loop is None:
+            raise RuntimeError("The task scheduler is not running")
+
+        async def run():
+            async with self._slots:
+                self.active += 1
+                try:
+                    return await fn(*args)
+                finally:
+                    self.active -= 1
+
+        return asyncio.run_coroutine_threadsafe(run(), self.loop)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+            self.loop = None
+
+
+class TaskScheduler:
+    def __init__(self, workers: int = WORKERS, lease_seconds: float = LEASE_SECONDS):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.lease: Optional[storage.Lease] = None
+        self._scheduler: Optional[BackgroundScheduler] = None
+        self._worker_loop = _WorkerLoop(workers)
+        self._run_task: Optional[Callable[..., Awaitable[Any]]] = None
+        self._tasks: Optional[storage.Repository] = None
+        self._skipped: Optional[storage.Repository] = None
+        self._jobstore: Optional[Callable[[], BaseJobStore]] = None
+        self._leading = threading.Lock()  # held while APScheduler is started or stopped
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.terms = 0
+
+    @property
+    def running(self) -> bool:
+        """Whether this process is the leader and fires jobs."""
+        return self._scheduler is not None and self._scheduler.running
+
+    def start(
+        self,
+        run_task: Callable[..., Awaitable[Any]],
+        tasks: storage.Repository,
+        jobstore: Optional[Callable[[], BaseJobStore]] = None,
+    ):
+        """Start the worker loop and compete for the lease.
+
+        ``run_task(task_id, trigger)`` is the coroutine a run executes.
+        While this process leads, every task of ``tasks`` has its job.
+        """
+        self._run_task = run_task
+        self._tasks = tasks
+        self._jobstore = jobstore
+        self._worker_loop.start()
+        self.lease = storage.lease("scheduler", self.lease_seconds)
+        self._skipped = storage.collection("scheduler_skipped_runs", synced=False)
+        tasks.subscribe(self._task_changed)
+        self._stopped.clear()
+        self._renew()
+        self._thread = threading.Thread(target=self._run, name="scheduler-lease", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self._renew()
+            except Exception as e:
+                print(f"Scheduler lease renewal failed: {e}")
+                # The lease may lapse before the next renewal; stop firing now.
+                self._step_down()
+
+    def _renew(self):
+        """Take or keep the lease, and start or stop firing jobs to match."""
+        if not self.lease.acquire():
+            self._step_down()
+            return
+        with self._leading:
+            if not self.running:
+                self._lead()
+        self._run_skipped()
+
+    def _step_down(self):
+        with self._leading:
+            if self.running:
+                print("Scheduler lease lost; no longer firing jobs")
+                self._scheduler.shutdown(wait=False)
+
+    def skip(self, task_id: str):
+        """Leave a due run of ``task_id`` to whichever process leads next."""
+        record_id = uuid.uuid4().hex
+        self._skipped[record_id] = {"id": record_id, "task_id": task_id, "created_date": datetime.utcnow()}
+
+    def _run_skipped(self):
+        """Run each run a former leader skipped, once."""
+        for record in self._skipped.values():
+            # Deleting the record claims the run.
+            if self._skipped.delete_many([record["id"]]):
+                self.run_now(record["task_id"], "schedule")
+
+    def _lead(self):
+        if self._jobstore is not None:
+            jobstore = self._jobstore()
+        else:
+            jobstore = MemoryJobStore() if storage.BACKEND == "memory" else SQLiteJobStore(storage.database(), lease=self.lease)
+        config: Dict[str, Any] = {
+            "jobstores": {"default": jobstore},
+            "executors": {"default": ThreadPoolExecutor(self.workers)},
+            "job_defaults": {"coalesce": True, "misfire_grace_time": MISFIRE_GRACE_SECONDS, "max_instances": 1},
+        }
+        if TIMEZONE:
+            config["timezone"] = TIMEZONE
+        self._scheduler = BackgroundScheduler(**config)
+        self._scheduler.add_listener(_record_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_ERROR)
+        # Paused until the jobs match the tasks, so none fires for a deleted task.
+        self._scheduler.start(paused=True)
+        self.sync(self._tasks.values())
+        self._scheduler.resume()
+        self.terms += 1
+        print("Scheduler lease taken; firing jobs")
+
+    def _task_changed(self, task_id: str, task: Optional[Dict[str, Any]]):
+        # Writes of other processes arrive here too, so the leader follows them all.
+        if not self.running:
+            return
+        try:
+            if task is None:
+                self.unschedule(task_id)
+            else:
+                self.schedule(task)
+        except Exception as e:
+            print(f"Failed to schedule task {task_id}: {e}")
+
+    def shutdown(self):
+        self._stopped.set()
+        with self._leading:
+            if self.running:
+                self._scheduler.shutdown(wait=False)
+        if self.lease is not None:
+            # Let another process take over now rather than after the lease runs out.
+            self.lease.release()
+        self._worker_loop.stop()
+
+    def schedule(self, task: Dict[str, Any]) -> Optional[datetime]:
+        """Make the task's job match its current settings; returns the next run time."""
+        if not task.get("is_active", True):
+            self.unschedule(task["id"])
+            return None
+        trigger = trigger_for(task)
+        existing = self._scheduler.get_job(job_id(task["id"]))
+        # Keep an unchanged job as it is, so its pending run (and any run it
+        # missed while the server was down) is not reset.
+        if existing is not None and str(existing.trigger) == str(trigger):
+            return existing.next_run_time
+        job = self._scheduler.add_job(
+            run_job, trigger, args=[task["id"]], id=job_id(task["id"]), name=task.get("task_name"), replace_existing=True
+        )
+        return job.next_run_time
+
+    def unschedule(self, task_id: str):
+        try:
+            self._scheduler.remove_job(job_id(task_id))
+        except JobLookupError:
+            pass
+
+    def sync(self, tasks: Iterable[Dict[str, Any]]):
+        """Schedule every task and drop jobs whose task no longer exists."""
+        wanted = set()
+        for task in tasks:
+            try:
+                if self.schedule(task) is not None:
+                    wanted.add(job_id(task["id"]))
+            except ValueError as e:
+                print(f"Failed to schedule task {task.get('id')}: {e}")
+        for job in self._scheduler.get_jobs():
+            if job.id.startswith("task_") and job.id not in wanted:
+                job.remove()
+
+    def run_now(self, task_id: str, trigger: str = "manual", *args: Any) -> Future:
+        """Run a task on the worker pool now; the future resolves when it is done.
+
+        ``args`` are passed to ``run_task`` after the trigger.
+        """
+        return self._worker_loop.submit(self._run_task, task_id, trigger, *args)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "terms": self.terms,
+            "workers": self.workers,
+            "active_runs": self._worker_loop.active,
+        }
+
+
+task_scheduler = TaskScheduler()
+metrics.Gauge("scheduler_active_runs", "Task runs executing on the worker loop.", function=lambda: task_scheduler.stats()["active_runs"])
+
+
+def run_job(task_id: str):
+    """Job entry point, referenced by name from stored jobs."""
+    # A leader that stalled past its lease may still have jobs in flight.
+    # Their next run times have already moved on, so the process that took
+    # over is told to run them.
+    if not task_scheduler.lease.held():
+        task_scheduler.skip(task_id)
+        job_events.inc("skipped")
+        return
+    task_scheduler.run_now(task_id, "schedule").result()
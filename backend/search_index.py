@@ -0,0 +1,247 @@
+"""In-process search index over a repository's records.
+
+Two kinds of per-field index, both case-insensitive and both matching
+substrings, as a scan of the records would:
+
+- exact: value -> record ids, for enum-like fields (status, segment). A
+  query matches the ids of every value containing it; there are few
+  distinct values, so checking each of them is cheap.
+- text: trigram -> record ids, for substring search on free text (name,
+  company, notes). A query's trigrams are intersected, smallest posting set
+  first, and the few surviving candidates are checked against the stored
+  text, so only matching records are ever loaded. A value shorter than a
+  trigram is a key of its own. For queries shorter than a trigram, every
+  1- and 2-character substring of a key points to the keys containing it;
+  the union of their postings is the answer. There are far fewer keys than
+  postings, so this costs little next to indexing the short substrings of
+  every record.
+
+Records get small integer doc ids in insertion order, which keeps postings
+compact and lets results come back in the order the repository lists them.
+A deleted record leaves its slot empty; once more than half the slots (and
+at least COMPACT_MIN_SLOTS) are empty, the ids are renumbered. The index
+subscribes to the repository and is updated on every write.
+
+``TenantSearchIndex`` keeps one such index per tenant, so a search only
+ever walks the postings of the tenant it runs for.
+"""
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from backend.storage import Repository, as_text
+
+GRAM = 3
+COMPACT_MIN_SLOTS = 1024
+
+
+def _grams(text: str) -> Set[str]:
+    """The trigrams of ``text``, or ``text`` itself if it is shorter than one."""
+    if len(text) < GRAM:
+        return {text} if text else set()
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def _short_substrings(key: str) -> Set[str]:
+    return {key[i:i + n] for n in range(1, GRAM) for i in range(len(key) - n + 1)}
+
+
+def _fold(value: Any) -> str:
+    return "" if value is None else str(value).lower()
+
+
+class SearchIndex:
+    def __init__(self, exact_fields: Sequence[str] = (), text_fields: Sequence[str] = ()):
+        self.exact_fields = tuple(exact_fields)
+        self.text_fields = tuple(text_fields)
+        self._fields = tuple(dict.fromkeys(self.exact_fields + self.text_fields))
+        self._doc_ids: Dict[str, int] = {}
+        self._record_ids: List[Optional[str]] = []
+        self._values: Dict[int, Tuple[str, ...]] = {}
+        # A field in both lists is searched through its trigrams alone.
+        self._exact: Dict[str, Dict[str, Set[int]]] = {f: {} for f in self.exact_fields if f not in self.text_fields}
+        self._grams: Dict[str, Dict[str, Set[int]]] = {f: {} for f in self.text_fields}
+        # field -> 1- or 2-character string -> the keys of _grams[field] containing it
+        self._short: Dict[str, Dict[str, Set[str]]] = {f: {} for f in self.text_fields}
+        self._empty_slots = 0
+        self._lock = threading.Lock()
+
+    def attach(self, repo: Repository) -> "SearchIndex":
+        """Index everything in ``repo`` and follow its writes from now on."""
+        repo.subscribe(self.update)
+        for record_id, obj in repo.items():
+            self.update(record_id, obj)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def update(self, record_id: str, obj: Optional[Dict[str, Any]]):
+        """Index ``obj`` under ``record_id``; ``None`` removes the record."""
+        with self._lock:
+            doc = self._doc_ids.get(record_id)
+            if doc is not None:
+                self._unindex(doc)
+            if obj is None:
+                if doc is not None:
+                    del self._doc_ids[record_id]
+                    self._record_ids[doc] = None
+                    self._empty_slots += 1
+                    if self._empty_slots >= max(COMPACT_MIN_SLOTS, len(self._doc_ids)):
+                        self._compact()
+                return
+            if doc is None:
+                doc = len(self._record_ids)
+                self._doc_ids[record_id] = doc
+                self._record_ids.append(record_id)
+            values = tuple(_fold(obj.get(field)) for field in self._fields)
+            self._values[doc] = values
+            for field, value in zip(self._fields, values):
+                if field in self._exact:
+                    self._exact[field].setdefault(value, set()).add(doc)
+                if field in self._grams:
+                    postings = self._grams[field]
+                    for gram in _grams(value):
+                        docs = postings.get(gram)
+                        if docs is None:
+                            docs = postings[gram] = set()
+                            for short in _short_substrings(gram):
+                                self._short[field].setdefault(short, set()).add(gram)
+                        docs.add(doc)
+
+    def _unindex(self, doc: int):
+        values = self._values.pop(doc)
+        for field, value in zip(self._fields, values):
+            if field in self._exact:
+                _discard(self._exact[field], value, doc)
+            if field in self._grams:
+                postings = self._grams[field]
+                for gram in _grams(value):
+                    if _discard(postings, gram, doc):
+                        for short in _short_substrings(gram):
+                            _discard(self._short[field], short, gram)
+
+    def _compact(self):
+        """Renumber the live records 0..n-1 in their order; called with the lock held."""
+        live = [(doc, record_id) for doc, record_id in enumerate(self._record_ids) if record_id is not None]
+        renumbered = {old: new for new, (old, _) in enumerate(live)}
+        self._record_ids = [record_id for _, record_id in live]
+        self._doc_ids = {record_id: new for new, record_id in enumerate(self._record_ids)}
+        self._values = {renumbered[doc]: values for doc, values in self._values.items()}
+        for postings in (*self._exact.values(), *self._grams.values()):
+            for key, docs in postings.items():
+                postings[key] = {renumbered[doc] for doc in docs}
+        self._empty_slots = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"records": len(self._doc_ids), "slots": len(self._record_ids)}
+
+    def lookup(self, filters: Dict[str, Any]) -> Tuple[Optional[List[str]], Dict[str, Any]]:
+        """Record ids matching the indexed filters, in insertion order.
+
+        Returns ``(ids, rest)`` where ``rest`` holds the filters on fields
+        this index does not cover (for the caller to apply to the loaded
+        records). ``ids`` is None when no filter could use the index.
+        """
+        rest: Dict[str, Any] = {}
+        sets: List[Set[int]] = []
+        with self._lock:
+            for field, value in filters.items():
+                if value is None:
+                    continue
+                if field not in self._fields:
+                    rest[field] = value
+                    continue
+                sets.append(self._match(field, _fold(value)))
+            if not sets:
+                return None, rest
+            docs = _intersect(sets)
+            return [self._record_ids[doc] for doc in sorted(docs)], rest
+
+    def _match(self, field: str, query: str) -> Set[int]:
+        if field not in self._grams:
+            return set().union(*(docs for value, docs in self._exact[field].items() if query in value))
+        if not query:
+            return set(self._values)
+        postings = self._grams[field]
+        if len(query) < GRAM:
+            keys = self._short[field].get(query, ())
+            return set().union(*(postings[key] for key in keys))
+        position = self._fields.index(field)
+        candidates = _intersect([postings.get(gram, set()) for gram in _grams(query)])
+        return {doc for doc in candidates if query in self._values[doc][position]}
+
+
+class TenantSearchIndex:
+    """A ``SearchIndex`` per value of ``tenant_field``."""
+
+    def __init__(self, tenant_field: str, exact_fields: Sequence[str] = (), text_fields: Sequence[str] = ()):
+        self.tenant_field = tenant_field
+        self.exact_fields = tuple(exact_fields)
+        self.text_fields = tuple(text_fields)
+        self._partitions: Dict[str, SearchIndex] = {}
+        self._tenants: Dict[str, str] = {}  # record id -> tenant
+        self._lock = threading.Lock()
+
+    def attach(self, repo: Repository) -> "TenantSearchIndex":
+        repo.subscribe(self.update)
+        for record_id, obj in repo.items():
+            self.update(record_id, obj)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+    def update(self, record_id: str, obj: Optional[Dict[str, Any]]):
+        tenant = None if obj is None else as_text(obj.get(self.tenant_field))
+        with self._lock:
+            previous = self._tenants.pop(record_id, None)
+            if previous is not None and previous != tenant:
+                partition = self._partitions[previous]
+                partition.update(record_id, None)
+                if not len(partition):
+                    del self._partitions[previous]
+            if tenant is None:
+                return
+            self._tenants[record_id] = tenant
+            partition = self._partitions.get(tenant)
+            if partition is None:
+                partition = self._partitions[tenant] = SearchIndex(self.exact_fields, self.text_fields)
+            partition.update(record_id, obj)
+
+    def stats(self) -> Dict[str, int]:
+        partitions = list(self._partitions.values())
+        return {
+            "tenants": len(partitions),
+            "records": len(self._tenants),
+            "slots": sum(len(partition._record_ids) for partition in partitions),
+        }
+
+    def lookup(self, tenant_id: str, filters: Dict[str, Any]) -> Tuple[Optional[List[str]], Dict[str, Any]]:
+        """``SearchIndex.lookup`` within one tenant; an unknown tenant matches nothing."""
+        partition = self._partitions.get(as_text(tenant_id))
+        if partition is None:
+            return [], {}
+        return partition.lookup(filters)
+
+
+def _discard(postings: Dict[str, Set[Any]], key: str, item: Any) -> bool:
+    """Remove ``item`` from ``postings[key]``; True if that emptied (and removed) the key."""
+    items = postings.get(key)
+    if items is not None:
+        items.discard(item)
+        if not items:
+            del postings[key]
+            return True
+    return False
+
+
+def _intersect(sets: Iterable[Set[int]]) -> Set[int]:
+    ordered = sorted(sets, key=len)
+    if not ordered or not ordered[0]:
+        return set()
+    result = set(ordered[0])
+    for other in ordered[1:]:
+        result &= other
+        if not result:
+            break
+    return result
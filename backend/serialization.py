@@ -0,0 +1,80 @@
+"""Fast JSON rendering for API responses.
+
+Records are rendered with orjson (datetimes as ISO 8601, like FastAPI's
+encoder) and the rendered text of each record is cached under its id,
+tagged with its ``updated_date``: a record that has not been written
+since is served from the cache, a newer version replaces the entry.
+Responses built here are returned directly, so FastAPI does not validate
+them against the route's ``response_model`` again; the data comes from our
+own store, which only accepts validated input.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+
+MAX_CACHED_RECORDS = int(os.getenv("RECORD_CACHE_MAX_ENTRIES", "50000"))
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: orjson instead of the stdlib encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RecordCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, namespace: str, obj: Dict[str, Any]) -> str:
+        """JSON text of ``obj``, reused while its ``updated_date`` is unchanged."""
+        record_id, version = obj.get("id"), obj.get("updated_date")
+        if record_id is None or version is None or self.max_entries <= 0:
+            return dumps(obj).decode("utf-8")
+        key = (namespace, record_id)
+        # Hits take no lock: a dict read is atomic, and a racing writer can
+        # at worst make us render a record twice.
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+        text = dumps(obj).decode("utf-8")
+        with self._lock:
+            self.misses += 1
+            # Re-rendered records move to the end; the oldest renders go first.
+            self._entries[key] = (version, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+record_cache = RecordCache(MAX_CACHED_RECORDS)
+
+
+def json_array(items: Iterable[str]) -> bytes:
+    """A JSON array from already rendered elements."""
+    return ("[" + ",".join(items) + "]").encode("utf-8")
+
+
+def json_response(body: bytes, headers: Optional[Dict[str, str]] = None, status_code: int = 200) -> Response:
+    return Response(body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def record_response(namespace: str, obj: Dict[str, Any]) -> Response:
+    return json_response(record_cache.render(namespace, obj).encode("utf-8"))
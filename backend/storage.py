@@ -0,0 +1,1088 @@
+"""Pluggable record storage for the backend's collections.
+
+Every collection (agents, customers, tasks, ...) is a ``Repository``: a
+mapping of record id -> record dict, so handlers keep using ``repo[id]``,
+``repo.get(id)``, ``repo.values()`` and ``repo.pop(id, None)``. Records
+returned by a repository are copies; write changes back with ``repo[id] = obj``.
+Listeners registered with ``subscribe()`` see every write, which is how
+in-process indexes (see backend/search_index.py) stay current.
+
+Collections opened with a ``tenant_field`` are partitioned by it:
+``repo.tenant(user_id)`` is a repository of that user's records only, whose
+lookups touch nothing but that partition (a dedicated id set in memory, a
+tenant-prefixed index range in SQLite), and ``repo.usage()`` reports rows
+and stored bytes per tenant.
+
+STORAGE_BACKEND selects the implementation:
+
+- ``sqlite`` (default): one table per collection in an embedded SQLite
+  database (DATABASE_PATH) in WAL mode, so data survives restarts and is
+  shared by several uvicorn workers. Each record is stored as JSON next to
+  indexed columns for the fields it is usually filtered or sorted by.
+- ``memory``: plain dicts, as before; nothing survives a restart. One
+  process only.
+
+Several processes on one SQLite database: every write also appends
+``(seq, collection, record id)`` to the ``_changes`` table in the same
+transaction (see ``ChangeLog``). Each process reads the rows other
+processes added every STORAGE_SYNC_INTERVAL_MS and hands the current
+records to its listeners, so in-process indexes and caches follow writes
+made by other workers too. ``follow()`` sees all writes, local and remote,
+in the order they were committed. ``lease()`` is a lock one process holds
+at a time, for work that must not run in every worker.
+"""
+import base64
+import bisect
+import heapq
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import orjson
+
+BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+DATABASE_PATH = os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(__file__), "data", "app.db"))
+POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "8"))
+SYNC_INTERVAL_SECONDS = float(os.getenv("STORAGE_SYNC_INTERVAL_MS", "100")) / 1000
+# Rows kept in _changes; a process further behind than this misses changes.
+CHANGE_LOG_KEEP = int(os.getenv("STORAGE_CHANGE_LOG_KEEP", "100000"))
+
+
+def encode_record(obj: Dict[str, Any]) -> str:
+    # orjson writes datetimes as ISO 8601, the same text the API responds with,
+    # so stored records can be sent to clients as they are.
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+def as_text(value: Any) -> str:
+    """Text form used for indexed columns and equality filters (None -> "")."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_text(field: str) -> str:
+    """SQL for ``as_text`` of a field of the stored JSON, so filters on it compare like the memory backend's."""
+    path = f"'$.{check_field(field)}'"
+    # json_extract turns true/false into 1/0 and null (or a missing field) into NULL.
+    return (
+        f"CASE json_type(data, {path}) WHEN 'true' THEN 'true' WHEN 'false' THEN 'false' "
+        f"ELSE COALESCE(CAST(json_extract(data, {path}) AS TEXT), '') END"
+    )
+
+
+_FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def check_field(field: str) -> str:
+    """Field names end up in SQL, so only plain identifiers are accepted."""
+    if not _FIELD_NAME.match(field):
+        raise ValueError(f"Invalid field name: {field!r}")
+    return field
+
+
+def parse_sort(sort: Optional[str]) -> Tuple[Optional[str], bool]:
+    """``"-created_date"`` -> ``("created_date", True)``; None keeps insertion order."""
+    if not sort:
+        return None, False
+    descending = sort.startswith("-")
+    return check_field(sort.lstrip("-+")), descending
+
+
+def encode_cursor(position: Any) -> str:
+    raw = json.dumps(position, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def project(obj: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    if not fields:
+        return obj
+    return {"id": obj.get("id"), **{field: obj.get(field) for field in fields}}
+
+
+# (records, cursor for the next page or None)
+Page = Tuple[List[Dict[str, Any]], Optional[str]]
+# The same with each record as JSON text
+JsonPage = Tuple[List[str], Optional[str]]
+
+
+def decode_record(data: str) -> Dict[str, Any]:
+    obj = orjson.loads(data)
+    for key, value in obj.items():
+        if key.endswith("_date") and isinstance(value, str):
+            try:
+                obj[key] = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    return obj
+
+
+# Called with (record_id, record) after a write and (record_id, None) after a delete.
+Listener = Callable[[str, Optional[Dict[str, Any]]], None]
+# The same with the write's sequence number first (None where writes are not logged).
+Follower = Callable[[Optional[int], str, Optional[Dict[str, Any]]], None]
+
+
+class Repository(MutableMapping):
+    """Mapping of id -> record with an equality query on top."""
+
+    def __init__(self, name: str, indexed_fields: Sequence[str] = (), tenant_field: Optional[str] = None):
+        self.name = name
+        self.indexed_fields = tuple(indexed_fields)
+        if tenant_field and tenant_field not in self.indexed_fields:
+            self.indexed_fields = (tenant_field, *self.indexed_fields)
+        self.tenant_field = tenant_field
+        self._listeners: List[Listener] = []
+
+    def tenant(self, tenant_id: str) -> "TenantView":
+        """The records of one tenant, as a repository of their own."""
+        if not self.tenant_field:
+            raise ValueError(f"Collection {self.name} is not partitioned by tenant")
+        return TenantView(self, tenant_id)
+
+    def usage(self, tenant_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """``{tenant: {"rows": n, "bytes": b}}`` for every tenant, or just ``tenant_id``.
+
+        Bytes are the size of the stored JSON records.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, listener: Listener):
+        """Call ``listener`` after each write, from this process or (SQLite) another one."""
+        self._listeners.append(listener)
+
+    def follow(self, follower: Follower):
+        """Call ``follower`` for every write in commit order, with its sequence number.
+
+        Backends without a change log call it right after each write with
+        None for the sequence number.
+        """
+        self.subscribe(lambda record_id, obj: follower(None, record_id, obj))
+
+    def add(self, record_id: str, obj: Dict[str, Any]) -> bool:
+        """Write ``obj`` unless ``record_id`` exists; True if it was written."""
+        if record_id in self:
+            return False
+        self[record_id] = obj
+        return True
+
+    def _notify(self, record_id: str, obj: Optional[Dict[str, Any]]):
+        for listener in self._listeners:
+            listener(record_id, obj)
+
+    def get_many(self, record_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """Records for ``record_ids`` in the given order, skipping missing ones."""
+        found = []
+        for record_id in record_ids:
+            obj = self.get(record_id)
+            if obj is not None:
+                found.append(obj)
+        return found
+
+    def find(self, **criteria: Any) -> List[Dict[str, Any]]:
+        """Records whose fields equal every value in ``criteria``, compared by ``as_text``."""
+        wanted = {check_field(k): as_text(v) for k, v in criteria.items()}
+        return [obj for obj in self.values() if all(as_text(obj.get(k)) == v for k, v in wanted.items())]
+
+    def put_many(self, records: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Write several ``(id, record)`` pairs; backends do it in one transaction."""
+        for record_id, obj in records:
+            self[record_id] = obj
+
+    def delete_many(self, record_ids: Iterable[str]) -> List[str]:
+        """Delete the given records; returns the ids that existed."""
+        deleted = []
+        for record_id in record_ids:
+            if self.pop(record_id, None) is not None:
+                deleted.append(record_id)
+        return deleted
+
+    def query(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        sort: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Page:
+        """One page of records matching ``where`` (equality on text form).
+
+        ``sort`` is a field name, prefixed with ``-`` for descending; ties
+        and the default order follow insertion. ``after`` is the cursor
+        returned with the previous page, so paging stays stable while
+        records are added. ``fields`` limits each record to those keys
+        (plus ``id``).
+        """
+        raise NotImplementedError
+
+    def query_json(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        sort: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+        render: Callable[[Dict[str, Any]], str] = encode_record,
+    ) -> JsonPage:
+        """query(), with every record already rendered as JSON by ``render``.
+
+        Backends that store JSON return it as stored and skip ``render``.
+        """
+        records, next_cursor = self.query(where, sort=sort, limit=limit, after=after, fields=fields)
+        return [render(obj) for obj in records], next_cursor
+
+    def count(self, where: Optional[Dict[str, Any]] = None) -> int:
+        raise NotImplementedError
+
+    def seed(self, records: Dict[str, Dict[str, Any]]):
+        """Insert ``records`` if the collection is still empty."""
+        if len(self) == 0:
+            for record_id, obj in records.items():
+                self[record_id] = obj
+
+
+def _position(entry: Tuple[List[Any], str]) -> List[Any]:
+    return entry[0]
+
+
+def _memory_sort_key(value: Any) -> List[Any]:
+    # Numbers before text, like SQLite; None sorts as "".
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [0, value]
+    return [1, as_text(value)]
+
+
+class MemoryRepository(Repository):
+    def __init__(self, name: str, indexed_fields: Sequence[str] = (), tenant_field: Optional[str] = None):
+        super().__init__(name, indexed_fields, tenant_field)
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._seq: Dict[str, int] = {}
+        self._next_seq = 0
+        # record id -> sort key of each indexed field, computed once per write
+        self._sort_keys: Dict[str, Dict[str, List[Any]]] = {}
+        # tenant (None: all records) -> field -> ([sort key, seq], id) in order.
+        # Built on the first sorted query and kept up to date by every write.
+        self._orders: Dict[Optional[str], Dict[str, List[Tuple[List[Any], str]]]] = {}
+        # tenant -> its record ids (a dict as an insertion-ordered set)
+        self._partitions: Dict[str, Dict[str, None]] = {}
+        self._usage: Dict[str, Dict[str, int]] = {}
+        self._placement: Dict[str, Tuple[str, int]] = {}  # record id -> (tenant, bytes)
+        # Records are written from worker threads too (asyncio.to_thread).
+        self._write_lock = threading.RLock()
+
+    def _place(self, record_id: str, obj: Optional[Dict[str, Any]]):
+        if not self.tenant_field:
+            return
+        new_tenant = None if obj is None else as_text(obj.get(self.tenant_field))
+        old = self._placement.pop(record_id, None)
+        if old is not None:
+            tenant, size = old
+            usage = self._usage[tenant]
+            usage["rows"] -= 1
+            usage["bytes"] -= size
+            # An update within the tenant keeps the record's place in the
+            # partition, which is what keeps partitions in insertion order.
+            if tenant != new_tenant:
+                self._partitions[tenant].pop(record_id, None)
+                if not usage["rows"]:
+                    del self._partitions[tenant], self._usage[tenant]
+        if obj is not None:
+            tenant, size = new_tenant, len(encode_record(obj).encode("utf-8"))
+            self._placement[record_id] = (tenant, size)
+            self._partitions.setdefault(tenant, {})[record_id] = None
+            usage = self._usage.setdefault(tenant, {"rows": 0, "bytes": 0})
+            usage["rows"] += 1
+            usage["bytes"] += size
+
+    def _tenant_orders(self, record_id: str) -> List[Dict[str, List[Tuple[List[Any], str]]]]:
+        tenants = [None]
+        if record_id in self._placement:
+            tenants.append(self._placement[record_id][0])
+        return [self._orders[tenant] for tenant in tenants if tenant in self._orders]
+
+    def _unorder(self, record_id: str):
+        if record_id not in self._records:
+            return
+        keys, seq = self._sort_keys[record_id], self._seq[record_id]
+        for orders in self._tenant_orders(record_id):
+            for field, order in orders.items():
+                position = [keys[field], seq]
+                del order[bisect.bisect_left(order, position, key=_position)]
+
+    def _reorder(self, record_id: str):
+        keys, seq = self._sort_keys[record_id], self._seq[record_id]
+        for orders in self._tenant_orders(record_id):
+            for field, order in orders.items():
+                bisect.insort(order, ([keys[field], seq], record_id), key=_position)
+
+    def _order(self, tenant: Optional[str], field: str) -> List[Tuple[List[Any], str]]:
+        orders = self._orders.setdefault(tenant, {})
+        if field not in orders:
+            record_ids = self._records if tenant is None else self._partitions.get(tenant, {})
+            orders[field] = sorted(
+                (([self._sort_keys[record_id][field], self._seq[record_id]], record_id) for record_id in record_ids),
+                key=_position,
+            )
+        return orders[field]
+
+    def _walk(self, order, wanted, descending, limit, after) -> Page:
+        """Like ``_page``, reading ``order`` from the cursor until the page is full."""
+        if descending:
+            end = bisect.bisect_left(order, decode_cursor(after), key=_position) if after else len(order)
+            entries = (order[i] for i in range(end - 1, -1, -1))
+        else:
+            begin = bisect.bisect_right(order, decode_cursor(after), key=_position) if after else 0
+            entries = (order[i] for i in range(begin, len(order)))
+        rows = []
+        for position, record_id in entries:
+            obj = self._records[record_id]
+            if all(as_text(obj.get(k)) == v for k, v in wanted.items()):
+                rows.append((position, obj))
+                if limit is not None and len(rows) > limit:
+                    break
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][0])
+        return [obj for _, obj in rows], next_cursor
+
+    def __getitem__(self, record_id: str) -> Dict[str, Any]:
+        return dict(self._records[record_id])
+
+    def add(self, record_id: str, obj: Dict[str, Any]) -> bool:
+        # Check and write under one lock, so of two concurrent adds only one wins.
+        with self._write_lock:
+            return super().add(record_id, obj)
+
+    def __setitem__(self, record_id: str, obj: Dict[str, Any]):
+        with self._write_lock:
+            if record_id not in self._records:
+                self._next_seq += 1
+                self._seq[record_id] = self._next_seq
+            self._unorder(record_id)
+            self._records[record_id] = dict(obj)
+            self._sort_keys[record_id] = {field: _memory_sort_key(obj.get(field)) for field in self.indexed_fields}
+            self._place(record_id, obj)
+            self._reorder(record_id)
+            self._notify(record_id, obj)
+
+    def __delitem__(self, record_id: str):
+        with self._write_lock:
+            if record_id not in self._records:
+                raise KeyError(record_id)
+            self._unorder(record_id)
+            del self._records[record_id]
+            del self._seq[record_id]
+            del self._sort_keys[record_id]
+            self._place(record_id, None)
+            self._notify(record_id, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._records))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, record_id: object) -> bool:
+        return record_id in self._records
+
+    def values(self) -> List[Dict[str, Any]]:
+        return [dict(obj) for obj in self._records.values()]
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(k, dict(obj)) for k, obj in self._records.items()]
+
+    def find(self, **criteria: Any) -> List[Dict[str, Any]]:
+        return [dict(obj) for _, obj in self._matching(criteria)]
+
+    def _matching(self, where: Optional[Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+        wanted = {check_field(k): as_text(v) for k, v in (where or {}).items()}
+        if self.tenant_field in wanted:
+            partition = self._partitions.get(wanted.pop(self.tenant_field), {})
+            candidates = [(record_id, self._records[record_id]) for record_id in partition]
+        else:
+            candidates = list(self._records.items())
+        if not wanted:
+            return candidates
+        return [(record_id, obj) for record_id, obj in candidates if all(as_text(obj.get(k)) == v for k, v in wanted.items())]
+
+    def _page(self, where, sort, limit, after) -> Page:
+        """The stored records (not copies) on one page, and the next cursor."""
+        field, descending = parse_sort(sort)
+        if field is None:
+            # Matches already come out in insertion order.
+            rows = [([0, self._seq[record_id]], obj) for record_id, obj in self._matching(where)]
+            if descending:
+                rows.reverse()
+        elif field in self.indexed_fields:
+            wanted = {check_field(k): as_text(v) for k, v in (where or {}).items()}
+            tenant = wanted.pop(self.tenant_field, None) if self.tenant_field else None
+            return self._walk(self._order(tenant, field), wanted, descending, limit, after)
+        else:
+            rows = [([_memory_sort_key(obj.get(field)), self._seq[record_id]], obj)
+                    for record_id, obj in self._matching(where)]
+        if after:
+            start = decode_cursor(after)
+            rows = [row for row in rows if (row[0] < start if descending else row[0] > start)]
+        if field is not None:
+            if limit is not None and len(rows) > limit:
+                # Only the page (and one more, to know there is a next one) is ordered.
+                select = heapq.nlargest if descending else heapq.nsmallest
+                rows = select(limit + 1, rows, key=lambda row: row[0])
+            else:
+                rows.sort(key=lambda row: row[0], reverse=descending)
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][0])
+        return [obj for _, obj in rows], next_cursor
+
+    def query(self, where=None, sort=None, limit=None, after=None, fields=None) -> Page:
+        records, next_cursor = self._page(where, sort, limit, after)
+        return [project(dict(obj), fields) for obj in records], next_cursor
+
+    def query_json(self, where=None, sort=None, limit=None, after=None, fields=None, render=encode_record) -> JsonPage:
+        records, next_cursor = self._page(where, sort, limit, after)
+        if fields:
+            return [encode_record(project(obj, fields)) for obj in records], next_cursor
+        return [render(obj) for obj in records], next_cursor
+
+    def count(self, where: Optional[Dict[str, Any]] = None) -> int:
+        return len(self._matching(where)) if where else len(self._records)
+
+    def usage(self, tenant_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        if tenant_id is None:
+            return {tenant: dict(usage) for tenant, usage in self._usage.items()}
+        tenant_id = as_text(tenant_id)
+        return {tenant_id: dict(self._usage.get(tenant_id, {"rows": 0, "bytes": 0}))}
+
+
+class Database:
+    """A small pool of SQLite connections to one database file.
+
+    Connections are opened lazily up to ``pool_size`` and shared across
+    threads (one at a time). Statements use fixed SQL with parameters, so
+    each connection's statement cache keeps them prepared.
+    """
+
+    def __init__(self, path: str, pool_size: int = POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.pool_size
+                if can_open:
+                    self._opened += 1
+            conn = self._open() if can_open else self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        with self.connection() as conn:
+            return conn.execute(sql, tuple(params)).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """A connection whose statements commit together (connections autocommit otherwise)."""
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+
+class ChangeLog:
+    """Writes to the collections of one database, shared by every process using it.
+
+    Writers call ``append()`` inside their transaction, so a row is there
+    exactly when the write is. A daemon thread reads new rows in ``seq``
+    order: writes of other processes go to the repository's listeners, and
+    every write goes to its followers. Local writes wake the thread at once;
+    other processes' writes are noticed within SYNC_INTERVAL_SECONDS.
+    """
+
+    BATCH = 1000
+
+    def __init__(self, db: Database, interval: float = SYNC_INTERVAL_SECONDS):
+        self.db = db
+        self.interval = interval
+        self.origin = uuid.uuid4().hex
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS _changes "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, record_id TEXT NOT NULL, origin TEXT NOT NULL)"
+        )
+        self.last_seq = db.execute("SELECT COALESCE(MAX(seq), 0) FROM _changes")[0][0]
+        self._repos: Dict[str, "SQLiteRepository"] = {}
+        self._followers: Dict[str, List[Follower]] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_trim = 0.0
+        self.applied = 0
+
+    def register(self, repo: "SQLiteRepository"):
+        self._repos[repo.name] = repo
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-sync", daemon=True)
+            self._thread.start()
+
+    def follow(self, repo: "SQLiteRepository", follower: Follower):
+        self._followers.setdefault(repo.name, []).append(follower)
+
+    def append(self, conn: sqlite3.Connection, collection: str, record_ids: Iterable[str]):
+        conn.executemany(
+            "INSERT INTO _changes (collection, record_id, origin) VALUES (?, ?, ?)",
+            [(collection, record_id, self.origin) for record_id in record_ids],
+        )
+
+    def written(self, collection: str):
+        """Called after a local commit; followers hear of it without waiting for the next poll."""
+        if collection in self._followers:
+            self._wakeup.set()
+
+    def poll(self) -> int:
+        """Deliver the changes committed since the last poll; returns how many."""
+        rows = self.db.execute(
+            "SELECT seq, collection, record_id, origin FROM _changes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (self.last_seq, self.BATCH),
+        )
+        if not rows:
+            return 0
+        # Current records, read once per collection. Followers need local writes too.
+        wanted: Dict[str, List[str]] = {}
+        for _, collection, record_id, origin in rows:
+            if collection in self._repos and (origin != self.origin or collection in self._followers):
+                wanted.setdefault(collection, []).append(record_id)
+        current: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for collection, record_ids in wanted.items():
+            for obj in self._repos[collection].get_many(dict.fromkeys(record_ids)):
+                current[(collection, obj["id"])] = obj
+        for seq, collection, record_id, origin in rows:
+            self.last_seq = seq
+            if collection not in wanted:
+                continue
+            obj = current.get((collection, record_id))
+            if origin != self.origin:
+                self.applied += 1
+                self._repos[collection]._notify(record_id, obj)
+            for follower in self._followers.get(collection, ()):
+                follower(seq, record_id, obj)
+        return len(rows)
+
+    def _trim(self):
+        self.db.execute("DELETE FROM _changes WHERE seq <= ?", (self.last_seq - CHANGE_LOG_KEEP,))
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                while self.poll() == self.BATCH:
+                    pass
+                if time.monotonic() >= self._next_trim:
+                    self._next_trim = time.monotonic() + 60
+                    self._trim()
+            except Exception as e:
+                print(f"Storage sync failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"last_seq": self.last_seq, "applied": self.applied}
+
+
+class Lease:
+    """A named lock that one process holds at a time.
+
+    The holder keeps it by calling ``acquire()`` again within ``ttl``
+    seconds; after that any process may take it over. Without a database
+    (the memory backend, one process) it is always held.
+    """
+
+    def __init__(self, db: Optional[Database], name: str, ttl: float):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.holder = uuid.uuid4().hex
+        if db is not None:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS _leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def acquire(self) -> bool:
+        """Take or renew the lease; True if this process holds it now."""
+        if self.db is None:
+            return True
+        now = time.time()
+        with self.db.connection() as conn:
+            taken = conn.execute(
+                "INSERT INTO _leases (name, holder, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires "
+                "WHERE _leases.holder = excluded.holder OR _leases.expires < ?",
+                (self.name, self.holder, now + self.ttl, now),
+            ).rowcount
+        return taken == 1
+
+    def held(self) -> bool:
+        """Whether this process holds the lease right now (checked in the database)."""
+        if self.db is None:
+            return True
+        rows = self.db.execute("SELECT holder, expires FROM _leases WHERE name = ?", (self.name,))
+        return bool(rows) and rows[0][0] == self.holder and rows[0][1] > time.time()
+
+    def release(self):
+        if self.db is not None:
+            self.db.execute("DELETE FROM _leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+
+
+class SQLiteRepository(Repository):
+    def __init__(
+        self,
+        db: Database,
+        name: str,
+        indexed_fields: Sequence[str] = (),
+        tenant_field: Optional[str] = None,
+        changes: Optional[ChangeLog] = None,
+    ):
+        super().__init__(name, indexed_fields, tenant_field)
+        self.db = db
+        self.changes = changes
+        if changes is not None:
+            changes.register(self)
+        indexed = self.indexed_fields
+        columns = "".join(f", {field} TEXT" for field in indexed)
+        db.execute(f"CREATE TABLE IF NOT EXISTS {name} (id TEXT PRIMARY KEY{columns}, data TEXT NOT NULL)")
+        for field in indexed:
+            self._create_index((field,))
+            # Lists are filtered by the tenant and usually one more field and
+            # sorted by creation date; leading with the tenant keeps each
+            # tenant's rows one contiguous index range, and the trailing date
+            # lets SQLite page through them without sorting.
+            prefix = (tenant_field,) if tenant_field and field != tenant_field else ()
+            if field != "created_date" and "created_date" in indexed:
+                self._create_index((*prefix, field, "created_date"))
+            elif prefix:
+                self._create_index((*prefix, field))
+
+        placeholders = ", ".join("?" for _ in self.indexed_fields)
+        assignments = "".join(f", {field} = excluded.{field}" for field in self.indexed_fields)
+        insert = (
+            f"INSERT INTO {name} (id{''.join(', ' + f for f in self.indexed_fields)}, data) "
+            f"VALUES (?{', ' if placeholders else ''}{placeholders}, ?) "
+        )
+        self._upsert_sql = f"{insert}ON CONFLICT(id) DO UPDATE SET data = excluded.data{assignments}"
+        self._insert_sql = f"{insert}ON CONFLICT(id) DO NOTHING"
+        self._get_sql = f"SELECT data FROM {name} WHERE id = ?"
+        self._exists_sql = f"SELECT 1 FROM {name} WHERE id = ?"
+        self._delete_sql = f"DELETE FROM {name} WHERE id = ?"
+        self._values_sql = f"SELECT data FROM {name} ORDER BY rowid"
+        self._items_sql = f"SELECT id, data FROM {name} ORDER BY rowid"
+        self._ids_sql = f"SELECT id FROM {name} ORDER BY rowid"
+        self._count_sql = f"SELECT COUNT(*) FROM {name}"
+
+    def _create_index(self, columns: Tuple[str, ...]):
+        self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.name}_{'_'.join(columns)} ON {self.name} ({', '.join(columns)})"
+        )
+
+    def _column_value(self, value: Any) -> str:
+        # Never NULL, so (column, rowid) keyset comparisons always hold.
+        return as_text(value)
+
+    def _where(self, criteria: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        clauses, params = [], []
+        for field, value in criteria.items():
+            check_field(field)
+            if field in self.indexed_fields:
+                clauses.append(f"{field} = ?")
+                params.append(self._column_value(value))
+            else:
+                clauses.append(f"{_json_text(field)} = ?")
+                params.append(as_text(value))
+        return clauses, params
+
+    def __getitem__(self, record_id: str) -> Dict[str, Any]:
+        rows = self.db.execute(self._get_sql, (record_id,))
+        if not rows:
+            raise KeyError(record_id)
+        return decode_record(rows[0][0])
+
+    def _row(self, record_id: str, obj: Dict[str, Any]) -> tuple:
+        return (record_id, *(self._column_value(obj.get(field)) for field in self.indexed_fields), encode_record(obj))
+
+    @contextmanager
+    def _writing(self) -> Iterator[sqlite3.Connection]:
+        # Logged writes need a transaction to commit the log row with the write.
+        if self.changes is None:
+            with self.db.connection() as conn:
+                yield conn
+        else:
+            with self.db.transaction() as conn:
+                yield conn
+
+    def _logged(self, conn: sqlite3.Connection, record_ids: List[str]):
+        if self.changes is not None and record_ids:
+            self.changes.append(conn, self.name, record_ids)
+
+    def _written(self, record_ids: List[str], objs: Iterable[Optional[Dict[str, Any]]]):
+        for record_id, obj in zip(record_ids, objs):
+            self._notify(record_id, obj)
+        if self.changes is not None and record_ids:
+            self.changes.written(self.name)
+
+    def follow(self, follower: Follower):
+        if self.changes is None:
+            super().follow(follower)
+        else:
+            self.changes.follow(self, follower)
+
+    def __setitem__(self, record_id: str, obj: Dict[str, Any]):
+        with self._writing() as conn:
+            conn.execute(self._upsert_sql, self._row(record_id, obj))
+            self._logged(conn, [record_id])
+        self._written([record_id], [obj])
+
+    def add(self, record_id: str, obj: Dict[str, Any]) -> bool:
+        with self._writing() as conn:
+            if not conn.execute(self._insert_sql, self._row(record_id, obj)).rowcount:
+                return False
+            self._logged(conn, [record_id])
+        self._written([record_id], [obj])
+        return True
+
+    def put_many(self, records: Iterable[Tuple[str, Dict[str, Any]]]):
+        records = list(records)
+        with self.db.transaction() as conn:
+            self._put_rows(conn, records)
+        self._written([record_id for record_id, _ in records], [obj for _, obj in records])
+
+    def _put_rows(self, conn: sqlite3.Connection, records: List[Tuple[str, Dict[str, Any]]]):
+        conn.executemany(self._upsert_sql, [self._row(record_id, obj) for record_id, obj in records])
+        self._logged(conn, [record_id for record_id, _ in records])
+
+    def __delitem__(self, record_id: str):
+        with self._writing() as conn:
+            if conn.execute(self._delete_sql, (record_id,)).rowcount == 0:
+                raise KeyError(record_id)
+            self._logged(conn, [record_id])
+        self._written([record_id], [None])
+
+    def delete_many(self, record_ids: Iterable[str]) -> List[str]:
+        with self.db.transaction() as conn:
+            deleted = self._delete_rows(conn, record_ids)
+        self._written(deleted, [None] * len(deleted))
+        return deleted
+
+    def _delete_rows(self, conn: sqlite3.Connection, record_ids: Iterable[str]) -> List[str]:
+        deleted = [record_id for record_id in record_ids if conn.execute(self._delete_sql, (record_id,)).rowcount]
+        self._logged(conn, deleted)
+        return deleted
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([row[0] for row in self.db.execute(self._ids_sql)])
+
+    def __len__(self) -> int:
+        return self.db.execute(self._count_sql)[0][0]
+
+    def __contains__(self, record_id: object) -> bool:
+        return bool(self.db.execute(self._exists_sql, (record_id,)))
+
+    def get(self, record_id: str, default: Any = None) -> Any:
+        try:
+            return self[record_id]
+        except KeyError:
+            return default
+
+    def get_many(self, record_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        record_ids = list(record_ids)
+        by_id: Dict[str, Dict[str, Any]] = {}
+        # Stay well below SQLite's bound-parameter limit.
+        for start in range(0, len(record_ids), 500):
+            chunk = record_ids[start:start + 500]
+            sql = f"SELECT id, data FROM {self.name} WHERE id IN ({', '.join('?' for _ in chunk)})"
+            by_id.update((row[0], decode_record(row[1])) for row in self.db.execute(sql, chunk))
+        return [by_id[record_id] for record_id in record_ids if record_id in by_id]
+
+    def values(self) -> List[Dict[str, Any]]:
+        return [decode_record(row[0]) for row in self.db.execute(self._values_sql)]
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(row[0], decode_record(row[1])) for row in self.db.execute(self._items_sql)]
+
+    def find(self, **criteria: Any) -> List[Dict[str, Any]]:
+        clauses, params = self._where(criteria)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.db.execute(f"SELECT data FROM {self.name}{where} ORDER BY rowid", params)
+        return [decode_record(row[0]) for row in rows]
+
+    def query(self, where=None, sort=None, limit=None, after=None, fields=None) -> Page:
+        rows, next_cursor = self._select(where, sort, limit, after, fields)
+        return [decode_record(data) for data in rows], next_cursor
+
+    def query_json(self, where=None, sort=None, limit=None, after=None, fields=None, render=encode_record) -> JsonPage:
+        return self._select(where, sort, limit, after, fields)
+
+    def _select(self, where, sort, limit, after, fields) -> JsonPage:
+        field, descending = parse_sort(sort)
+        clauses, params = self._where(where or {})
+        if field is None:
+            key = None
+        elif field in self.indexed_fields:
+            # Indexed columns are never NULL, so ORDER BY can walk the index.
+            key = field
+        else:
+            key = f"COALESCE(json_extract(data, '$.{field}'), '')"
+        op = "<" if descending else ">"
+        if after:
+            position = decode_cursor(after)
+            if key is None:
+                clauses.append(f"rowid {op} ?")
+                params.append(position[-1])
+            else:
+                clauses.append(f"({key}, rowid) {op} (?, ?)")
+                params.extend(position)
+        direction = " DESC" if descending else ""
+        order = f"{key}{direction}, rowid{direction}" if key else f"rowid{direction}"
+        if fields:
+            # ``->`` keeps each value's JSON type; json_extract would turn true/false into 1/0.
+            pairs = ", ".join(f"'{check_field(f)}', data -> '$.{f}'" for f in fields)
+            payload = f"json_object('id', id, {pairs})"
+        else:
+            payload = "data"
+        sql = (
+            f"SELECT rowid, {key or 'NULL'}, {payload} FROM {self.name}"
+            f"{' WHERE ' + ' AND '.join(clauses) if clauses else ''} ORDER BY {order}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        rows = self.db.execute(sql, params)
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            rowid, sort_value, _ = rows[-1]
+            next_cursor = encode_cursor([sort_value, rowid] if key else [rowid])
+        return [row[2] for row in rows], next_cursor
+
+    def count(self, where: Optional[Dict[str, Any]] = None) -> int:
+        clauses, params = self._where(where or {})
+        sql = self._count_sql + (f" WHERE {' AND '.join(clauses)}" if clauses else "")
+        return self.db.execute(sql, params)[0][0]
+
+    def usage(self, tenant_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        if not self.tenant_field:
+            raise ValueError(f"Collection {self.name} is not partitioned by tenant")
+        field = self.tenant_field
+        sql = f"SELECT {field}, COUNT(*), COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0) FROM {self.name}"
+        if tenant_id is None:
+            rows = self.db.execute(f"{sql} GROUP BY {field}")
+        else:
+            rows = self.db.execute(f"{sql} WHERE {field} = ?", (as_text(tenant_id),))
+            rows = [(as_text(tenant_id), *rows[0][1:])]
+        return {tenant: {"rows": n, "bytes": size} for tenant, n, size in rows}
+
+
+def put_and_delete(
+    put_repo: Repository,
+    records: Iterable[Tuple[str, Dict[str, Any]]],
+    delete_repo: Repository,
+    record_ids: Iterable[str],
+) -> List[str]:
+    """``put_repo.put_many(records)`` and ``delete_repo.delete_many(record_ids)``; returns the ids deleted.
+
+    When both are SQLite collections of one database the two commit in one
+    transaction; otherwise the put comes first.
+    """
+    records = list(records)
+    if (
+        isinstance(put_repo, SQLiteRepository)
+        and isinstance(delete_repo, SQLiteRepository)
+        and put_repo.db is delete_repo.db
+    ):
+        with put_repo.db.transaction() as conn:
+            put_repo._put_rows(conn, records)
+            deleted = delete_repo._delete_rows(conn, record_ids)
+        put_repo._written([record_id for record_id, _ in records], [obj for _, obj in records])
+        delete_repo._written(deleted, [None] * len(deleted))
+        return deleted
+    put_repo.put_many(records)
+    return delete_repo.delete_many(record_ids)
+
+
+class TenantView(Repository):
+    """One tenant's records in a tenant-partitioned repository.
+
+    Reads only see records whose tenant field matches; writes stamp it, so a
+    record cannot be moved to another tenant through the view.
+    """
+
+    def __init__(self, repo: Repository, tenant_id: str):
+        super().__init__(repo.name, repo.indexed_fields, repo.tenant_field)
+        self.repo = repo
+        self.tenant_id = tenant_id
+
+    def _scope(self, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {**(where or {}), self.tenant_field: self.tenant_id}
+
+    def _owns(self, obj: Dict[str, Any]) -> bool:
+        return as_text(obj.get(self.tenant_field)) == as_text(self.tenant_id)
+
+    def subscribe(self, listener: Listener):
+        self.repo.subscribe(listener)
+
+    def __getitem__(self, record_id: str) -> Dict[str, Any]:
+        obj = self.repo[record_id]
+        if not self._owns(obj):
+            raise KeyError(record_id)
+        return obj
+
+    def __setitem__(self, record_id: str, obj: Dict[str, Any]):
+        existing = self.repo.get(record_id)
+        if existing is not None and not self._owns(existing):
+            raise KeyError(record_id)
+        self.repo[record_id] = {**obj, self.tenant_field: self.tenant_id}
+
+    def __delitem__(self, record_id: str):
+        self[record_id]
+        del self.repo[record_id]
+
+    def put_many(self, records: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Write all of ``records`` in one batch, or none if any id belongs to another tenant."""
+        records = list(records)
+        for obj in self.repo.get_many(record_id for record_id, _ in records):
+            if not self._owns(obj):
+                raise KeyError(obj["id"])
+        self.repo.put_many((record_id, {**obj, self.tenant_field: self.tenant_id}) for record_id, obj in records)
+
+    def delete_many(self, record_ids: Iterable[str]) -> List[str]:
+        return self.repo.delete_many([obj["id"] for obj in self.get_many(record_ids)])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([obj["id"] for obj in self.query(fields=(self.tenant_field,))[0]])
+
+    def __len__(self) -> int:
+        return self.repo.count(self._scope())
+
+    def __contains__(self, record_id: object) -> bool:
+        return self.get(record_id) is not None
+
+    def get(self, record_id: str, default: Any = None) -> Any:
+        try:
+            return self[record_id]
+        except KeyError:
+            return default
+
+    def get_many(self, record_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        return [obj for obj in self.repo.get_many(record_ids) if self._owns(obj)]
+
+    def values(self) -> List[Dict[str, Any]]:
+        return self.query()[0]
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(obj["id"], obj) for obj in self.values()]
+
+    def find(self, **criteria: Any) -> List[Dict[str, Any]]:
+        return self.repo.find(**self._scope(criteria))
+
+    def query(self, where=None, sort=None, limit=None, after=None, fields=None) -> Page:
+        return self.repo.query(self._scope(where), sort=sort, limit=limit, after=after, fields=fields)
+
+    def query_json(self, where=None, sort=None, limit=None, after=None, fields=None, render=encode_record) -> JsonPage:
+        return self.repo.query_json(self._scope(where), sort=sort, limit=limit, after=after, fields=fields, render=render)
+
+    def count(self, where: Optional[Dict[str, Any]] = None) -> int:
+        return self.repo.count(self._scope(where))
+
+    def usage(self, tenant_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        return self.repo.usage(self.tenant_id)
+
+
+_database: Optional[Database] = None
+_change_log: Optional[ChangeLog] = None
+
+
+def database() -> Database:
+    global _database
+    if _database is None:
+        _database = Database(DATABASE_PATH)
+    return _database
+
+
+def change_log() -> Optional[ChangeLog]:
+    """The change log of the SQLite database (None on the memory backend)."""
+    global _change_log
+    if _change_log is None and BACKEND == "sqlite":
+        _change_log = ChangeLog(database())
+    return _change_log
+
+
+def lease(name: str, ttl: float) -> Lease:
+    return Lease(database() if BACKEND == "sqlite" else None, name, ttl)
+
+
+def collection(
+    name: str,
+    indexed_fields: Sequence[str] = (),
+    seed: Optional[Dict[str, Dict[str, Any]]] = None,
+    tenant_field: Optional[str] = None,
+    synced: bool = True,
+) -> Repository:
+    """Open the named collection on the configured backend, seeding it if empty.
+
+    Writes to a collection opened with ``synced=False`` are not logged, so
+    other processes' listeners do not see them. For data that is only
+    read back from storage.
+    """
+    if BACKEND == "memory":
+        repo: Repository = MemoryRepository(name, indexed_fields, tenant_field)
+    elif BACKEND == "sqlite":
+        repo = SQLiteRepository(database(), name, indexed_fields, tenant_field, change_log() if synced else None)
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {BACKEND}")
+    if seed:
+        repo.seed(seed)
+    return repo
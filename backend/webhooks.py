@@ -0,0 +1,268 @@
+"""Webhook triggers: external events that run a scheduled task.
+
+``POST /webhooks/{task_id}`` only checks the task and its secret, then
+queues the event and answers 202. The secret comes in the
+``X-Webhook-Secret`` header. Every webhook-enabled task has one, because
+its runs can call tools as the owner. Runs happen later, on
+WEBHOOK_WORKERS consumer coroutines:
+
+- Coalescing: a task has at most one queued run, which starts
+  WEBHOOK_COALESCE_MS after the event that queued it. Events that arrive
+  meanwhile are added to that run, and events that arrive while it runs
+  make one more run. A burst of N events costs one or two runs, not N. A
+  run takes at most WEBHOOK_MAX_EVENTS_PER_RUN events; the rest go to the
+  next one.
+- Idempotency: an event with an ``Idempotency-Key`` header that was
+  already accepted in the last WEBHOOK_IDEMPOTENCY_SECONDS is not queued
+  again, and the answer names the first event. Keys are claimed in the
+  keys collection, so a retry that reaches another server process is
+  caught as well. The claim runs on a thread, because the write can wait
+  for another process's lock. Recent keys are also remembered in memory.
+- Backpressure: at most WEBHOOK_MAX_QUEUED_EVENTS events wait in total.
+  Beyond that ``offer()`` raises ``QueueFull``, and the endpoint answers
+  429 with Retry-After.
+
+The webhook-enabled tasks and their secrets are kept in memory, in step
+with the tasks collection, so the event loop never reads or writes
+storage to accept an event. The queue itself is touched only from the
+server's event loop, and belongs to its process: events that reach
+different processes are coalesced separately.
+"""
+import asyncio
+import hmac
+import os
+import secrets
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from backend import metrics
+from backend.storage import Repository
+
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+MAX_QUEUED_EVENTS = int(os.getenv("WEBHOOK_MAX_QUEUED_EVENTS", "10000"))
+MAX_EVENTS_PER_RUN = int(os.getenv("WEBHOOK_MAX_EVENTS_PER_RUN", "100"))
+COALESCE_SECONDS = float(os.getenv("WEBHOOK_COALESCE_MS", "200")) / 1000
+IDEMPOTENCY_SECONDS = float(os.getenv("WEBHOOK_IDEMPOTENCY_SECONDS", "86400"))
+MAX_IDEMPOTENCY_KEYS = int(os.getenv("WEBHOOK_MAX_IDEMPOTENCY_KEYS", "100000"))
+MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", "65536"))
+RETRY_AFTER_SECONDS = 1
+PRUNE_INTERVAL_SECONDS = 3600
+
+events_total = metrics.Counter(
+    "webhook_events_total", "Webhook events by outcome (queued, coalesced, duplicate, rejected).", ("result",)
+)
+runs_total = metrics.Counter("webhook_runs_total", "Task runs started by webhook events.")
+
+
+class QueueFull(Exception):
+    """Too many events are waiting; the sender should retry later."""
+
+
+class UnknownHook(Exception):
+    """No active, webhook-enabled task has this id."""
+
+
+class BadSecret(Exception):
+    """The request does not carry the task's webhook secret."""
+
+
+def new_secret() -> str:
+    return secrets.token_urlsafe(32)
+
+
+# run_task(task_id, events) runs the task once for the events
+RunTask = Callable[[str, List[Dict[str, Any]]], Awaitable[Any]]
+
+
+class WebhookQueue:
+    def __init__(
+        self,
+        run_task: RunTask,
+        workers: int = WORKERS,
+        max_queued: int = MAX_QUEUED_EVENTS,
+        max_events_per_run: int = MAX_EVENTS_PER_RUN,
+        coalesce_seconds: float = COALESCE_SECONDS,
+        keys: Optional[Repository] = None,
+    ):
+        self.run_task = run_task
+        self.keys = keys
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_events_per_run = max_events_per_run
+        self.coalesce_seconds = coalesce_seconds
+        self._hooks: Dict[str, str] = {}  # task id -> secret ("" if the task was stored without one)
+        # Events waiting per task; a task is in here from its first event until its run leaves nothing behind.
+        self._pending: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._running: Set[str] = set()
+        self._queued = 0
+        self._keys: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._workers: List[asyncio.Task] = []
+        self._pruner: Optional[asyncio.Task] = None
+        self.counts = {"queued": 0, "coalesced": 0, "duplicate": 0, "rejected": 0, "runs": 0}
+
+    def attach(self, tasks: Repository) -> "WebhookQueue":
+        """Follow the webhook settings of ``tasks``."""
+        for task_id, task in tasks.items():
+            self._track(task_id, task)
+        tasks.subscribe(self._track)
+        return self
+
+    def _track(self, task_id: str, task: Optional[Dict[str, Any]]):
+        if task is not None and task.get("webhook_trigger") and task.get("is_active", True):
+            self._hooks[task_id] = task.get("webhook_secret") or ""
+        else:
+            self._hooks.pop(task_id, None)
+
+    def start(self):
+        """Start the consumers on the running event loop."""
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        if self.keys is not None:
+            self._pruner = asyncio.ensure_future(self._prune_periodically())
+
+    async def stop(self):
+        tasks = self._workers + ([self._pruner] if self._pruner is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._pruner = [], None
+
+    async def offer(
+        self,
+        task_id: str,
+        payload: Any,
+        secret: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Tuple[str, str]:
+        """Queue an event for ``task_id``; returns ``(event id, outcome)``.
+
+        The outcome is ``queued`` (a run is now waiting), ``coalesced``
+        (added to a waiting or running run) or ``duplicate``.
+        """
+        expected = self._hooks.get(task_id)
+        if expected is None:
+            raise UnknownHook(task_id)
+        # A task stored without a secret accepts nothing until it is saved again and gets one.
+        if not expected or not hmac.compare_digest(expected.encode(), (secret or "").encode()):
+            raise BadSecret(task_id)
+
+        now = time.monotonic()
+        if idempotency_key:
+            self._forget_keys(now)
+            seen = self._keys.get((task_id, idempotency_key))
+            if seen is not None:
+                return self._count(seen[1], "duplicate")
+        if self._queued >= self.max_queued or self._ready is None:
+            self._count("", "rejected")
+            raise QueueFull()
+
+        event_id = uuid.uuid4().hex
+        if idempotency_key:
+            # The claim is a write that can wait for another process's lock,
+            # so it runs on a thread. Events that arrive meanwhile may
+            # overshoot max_queued by the number of claims in flight.
+            first = await asyncio.to_thread(self._claim, task_id, idempotency_key, event_id)
+            self._keys[(task_id, idempotency_key)] = (now + IDEMPOTENCY_SECONDS, first)
+            if len(self._keys) > MAX_IDEMPOTENCY_KEYS:
+                self._keys.popitem(last=False)
+            if first != event_id:
+                return self._count(first, "duplicate")
+        event = {"id": event_id, "received_date": datetime.utcnow().isoformat(), "payload": payload}
+        self._queued += 1
+        pending = self._pending.get(task_id)
+        if pending is not None:
+            pending.append(event)
+            return self._count(event_id, "coalesced")
+        self._pending[task_id] = deque((event,))
+        self._schedule(task_id)
+        return self._count(event_id, "queued")
+
+    def _schedule(self, task_id: str):
+        if self.coalesce_seconds > 0:
+            asyncio.get_running_loop().call_later(self.coalesce_seconds, self._ready.put_nowait, task_id)
+        else:
+            self._ready.put_nowait(task_id)
+
+    def _count(self, event_id: str, outcome: str) -> Tuple[str, str]:
+        self.counts[outcome] += 1
+        events_total.inc(outcome)
+        return event_id, outcome
+
+    def _forget_keys(self, now: float):
+        # Keys expire in the order they were added.
+        while self._keys:
+            key, (expires, _) = next(iter(self._keys.items()))
+            if expires > now:
+                break
+            del self._keys[key]
+
+    def _claim(self, task_id: str, idempotency_key: str, event_id: str) -> str:
+        """Store the key for ``event_id``; returns the event that holds it (``event_id`` if it is new)."""
+        if self.keys is None:
+            return event_id
+        key_id = f"{task_id}:{idempotency_key}"
+        now = datetime.utcnow()
+        record = {"id": key_id, "task_id": task_id, "event_id": event_id, "created_date": now}
+        if self.keys.add(key_id, record):
+            return event_id
+        stored = self.keys.get(key_id)
+        if stored is not None and stored["created_date"] >= now - timedelta(seconds=IDEMPOTENCY_SECONDS):
+            return stored["event_id"]
+        # The stored key has expired (or was just pruned).
+        self.keys[key_id] = record
+        return event_id
+
+    def prune_keys(self, now: Optional[datetime] = None) -> int:
+        """Delete stored keys older than WEBHOOK_IDEMPOTENCY_SECONDS; returns how many."""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=IDEMPOTENCY_SECONDS)
+        removed = 0
+        while True:
+            keys, _ = self.keys.query(sort="created_date", limit=500, fields=("created_date",))
+            expired = [key["id"] for key in keys if key["created_date"] < cutoff]
+            removed += len(self.keys.delete_many(expired))
+            if len(expired) < len(keys) or not keys:
+                return removed
+
+    async def _prune_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.prune_keys)
+            except Exception as e:
+                print(f"Webhook key pruning failed: {e}")
+            await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+
+    async def _work(self):
+        while True:
+            task_id = await self._ready.get()
+            pending = self._pending[task_id]
+            events = [pending.popleft() for _ in range(min(len(pending), self.max_events_per_run))]
+            self._queued -= len(events)
+            self._running.add(task_id)
+            self.counts["runs"] += 1
+            runs_total.inc()
+            try:
+                await self.run_task(task_id, events)
+            except Exception as e:
+                print(f"Webhook run of task {task_id} failed: {e}")
+            finally:
+                self._running.discard(task_id)
+                if pending:
+                    # A backlog needs no time to gather.
+                    self._ready.put_nowait(task_id)
+                else:
+                    del self._pending[task_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hooks": len(self._hooks),
+            "remembered_keys": len(self._keys),
+            "queued_events": self._queued,
+            "waiting_tasks": len(self._pending) - len(self._running),
+            "running_tasks": len(self._running),
+            **self.counts,
+        }
@@ -0,0 +1,392 @@
+"""Scheduled-task workflows: DAGs of LLM and tool steps.
+
+A task's ``workflow_type`` says how ``workflow_definition`` is read:
+
+- ``prompt``: the definition is one prompt. It runs as a single LLM step,
+  and the tool calls the model returns (limited to ``tools_to_use``) are
+  executed.
+- ``dag``: the definition is JSON::
+
+      {"steps": [
+          {"id": "leads", "type": "tool", "tool": "manage_crm",
+           "arguments": {"action": "search_customers", "status": "lead"}},
+          {"id": "events", "type": "tool", "tool": "manage_calendar",
+           "arguments": {"action": "list_events"}},
+          {"id": "report", "type": "llm", "depends_on": ["leads", "events"],
+           "prompt": "Write a daily summary.\\nLeads: {{leads}}\\nMeetings: {{events}}"}
+       ],
+       "output": "report"}
+
+  ``{{step_id}}`` in a prompt or a string argument is replaced by that
+  step's output and makes the step depend on it. ``{{webhook}}`` is
+  replaced by the events of a webhook-triggered run (empty otherwise); a
+  ``prompt`` workflow of a webhook-enabled task gets them appended, and
+  any other ``{{...}}`` in its prompt is left as written. An ``llm`` step with
+  ``tools`` executes the tool calls the model returns. Without
+  ``output``, the run's output is that of the steps nothing depends on.
+
+``compile_workflow`` validates a definition (known tools, no cycles) and
+orders it. ``WorkflowCache`` keeps the compiled form of each task until
+its definition changes.
+
+``run_workflow`` starts each step once its dependencies are done, so
+independent branches run concurrently, at most WORKFLOW_MAX_PARALLEL_STEPS
+at a time. After each step its output is saved as a checkpoint. When a
+step fails, running branches finish, nothing new starts and the run fails.
+The next run of the task within WORKFLOW_RESUME_HOURS skips the steps the
+checkpoint holds, so LLM calls that already succeeded are not paid for
+again. A successful run drops the checkpoint.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend import metrics
+from backend.storage import Repository
+
+MAX_PARALLEL_STEPS = int(os.getenv("WORKFLOW_MAX_PARALLEL_STEPS", "4"))
+RESUME_HOURS = float(os.getenv("WORKFLOW_RESUME_HOURS", "24"))
+MAX_STEPS = 50
+STEP_TYPES = ("llm", "tool")
+
+# Values a run is started with, referenced like step outputs
+INPUTS = ("webhook",)
+
+_STEP_ID = re.compile(r"[A-Za-z0-9_-]+")
+_REFERENCE = re.compile(r"\{\{\s*([A-Za-z0-9_-]+)\s*\}\}")
+
+step_duration = metrics.Histogram("workflow_step_duration_seconds", "Workflow step latency.", ("type", "status"))
+steps_resumed = metrics.Counter("workflow_steps_resumed_total", "Workflow steps taken from a checkpoint.")
+
+
+@dataclass
+class Step:
+    id: str
+    type: str
+    depends_on: Tuple[str, ...]
+    prompt: str = ""
+    system: Optional[str] = None
+    tool: Optional[str] = None
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    tools: Tuple[str, ...] = ()
+
+
+@dataclass
+class Workflow:
+    source: str  # hash of what the workflow was compiled from
+    steps: Dict[str, Step]  # in dependency order
+    outputs: Tuple[str, ...]
+
+
+def _references(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return _REFERENCE.findall(value)
+    if isinstance(value, dict):
+        return [ref for item in value.values() for ref in _references(item)]
+    if isinstance(value, list):
+        return [ref for item in value for ref in _references(item)]
+    return []
+
+
+def _fill(value: Any, outputs: Dict[str, str]) -> Any:
+    """``value`` with every ``{{step_id}}`` replaced by the step's output.
+
+    Names that are neither steps nor inputs stay as written: a ``prompt``
+    workflow is the user's own text, which may contain ``{{...}}``.
+    """
+    if isinstance(value, str):
+        return _REFERENCE.sub(lambda match: outputs.get(match.group(1), match.group(0)), value)
+    if isinstance(value, dict):
+        return {key: _fill(item, outputs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, outputs) for item in value]
+    return value
+
+
+def source_of(task: Dict[str, Any]) -> str:
+    """Hash of the task fields a workflow is compiled from."""
+    text = json.dumps(
+        [
+            task.get("workflow_type") or "prompt",
+            task.get("workflow_definition") or "",
+            sorted(task.get("tools_to_use") or []),
+            bool(task.get("webhook_trigger")),
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compile_workflow(task: Dict[str, Any], known_tools: List[str]) -> Workflow:
+    """The workflow of a task; ValueError if its definition is not valid."""
+    workflow_type = task.get("workflow_type") or "prompt"
+    allowed = list(task.get("tools_to_use") or [])
+    unknown = [name for name in allowed if name not in known_tools]
+    if unknown:
+        raise ValueError(f"Unknown tools: {', '.join(unknown)}")
+
+    if workflow_type == "prompt":
+        prompt = task.get("workflow_definition") or ""
+        if task.get("webhook_trigger"):
+            prompt += "\n\n{{webhook}}"
+        step = Step(id="prompt", type="llm", depends_on=(), prompt=prompt, tools=tuple(allowed))
+        return Workflow(source_of(task), {step.id: step}, (step.id,))
+    if workflow_type != "dag":
+        raise ValueError(f"Unknown workflow_type: {workflow_type}")
+
+    try:
+        definition = json.loads(task.get("workflow_definition") or "")
+    except ValueError as e:
+        raise ValueError(f"workflow_definition is not valid JSON: {e}")
+    raw_steps = definition.get("steps") if isinstance(definition, dict) else None
+    if not isinstance(raw_steps, list) or not raw_steps:
+        raise ValueError("A dag workflow needs a non-empty 'steps' list")
+    if len(raw_steps) > MAX_STEPS:
+        raise ValueError(f"A workflow has at most {MAX_STEPS} steps")
+
+    steps: Dict[str, Step] = {}
+    for raw in raw_steps:
+        step_id = str(raw.get("id") or "") if isinstance(raw, dict) else ""
+        if not _STEP_ID.fullmatch(step_id) or step_id in INPUTS:
+            raise ValueError(f"Invalid step id: {step_id!r}")
+        if step_id in steps:
+            raise ValueError(f"Duplicate step id: {step_id}")
+        step_type = raw.get("type", "llm")
+        if step_type not in STEP_TYPES:
+            raise ValueError(f"Step {step_id}: unknown type {step_type!r}")
+        tools = tuple(raw.get("tools") or ())
+        if step_type == "tool":
+            tools = (raw.get("tool"),)
+        for name in tools:
+            if name not in known_tools or (allowed and name not in allowed):
+                raise ValueError(f"Step {step_id}: tool {name!r} is not available to this task")
+        prompt = raw.get("prompt") or ""
+        if step_type == "llm" and not prompt:
+            raise ValueError(f"Step {step_id}: an llm step needs a prompt")
+        arguments = raw.get("arguments") or {}
+        depends_on = list(raw.get("depends_on") or [])
+        depends_on += [ref for ref in _references([prompt, arguments]) if ref not in depends_on and ref not in INPUTS]
+        steps[step_id] = Step(
+            id=step_id,
+            type=step_type,
+            depends_on=tuple(depends_on),
+            prompt=prompt,
+            system=raw.get("system"),
+            tool=raw.get("tool"),
+            arguments=arguments,
+            tools=tools,
+        )
+
+    ordered: Dict[str, Step] = {}
+    visiting: List[str] = []
+
+    def visit(step_id: str):
+        if step_id in ordered:
+            return
+        if step_id in visiting:
+            raise ValueError(f"Steps depend on each other: {' -> '.join(visiting + [step_id])}")
+        visiting.append(step_id)
+        for dependency in steps[step_id].depends_on:
+            if dependency not in steps:
+                raise ValueError(f"Step {step_id} depends on unknown step {dependency!r}")
+            visit(dependency)
+        visiting.pop()
+        ordered[step_id] = steps[step_id]
+
+    for step_id in steps:
+        visit(step_id)
+
+    output = definition.get("output")
+    if output is not None:
+        outputs = tuple(output) if isinstance(output, list) else (output,)
+        for step_id in outputs:
+            if step_id not in steps:
+                raise ValueError(f"Unknown output step: {step_id!r}")
+    else:
+        needed = {dependency for step in steps.values() for dependency in step.depends_on}
+        outputs = tuple(step_id for step_id in ordered if step_id not in needed)
+    return Workflow(source_of(task), ordered, outputs)
+
+
+class WorkflowCache:
+    """Compiled workflows by task id, recompiled when the definition changes."""
+
+    def __init__(self, known_tools: List[str]):
+        self.known_tools = known_tools
+        self._workflows: Dict[str, Workflow] = {}
+        self._lock = threading.Lock()
+        self.compiles = 0
+
+    def get(self, task: Dict[str, Any]) -> Workflow:
+        workflow = self._workflows.get(task["id"])
+        if workflow is not None and workflow.source == source_of(task):
+            return workflow
+        workflow = compile_workflow(task, self.known_tools)
+        with self._lock:
+            self._workflows[task["id"]] = workflow
+            self.compiles += 1
+        return workflow
+
+    def discard(self, task_id: str):
+        with self._lock:
+            self._workflows.pop(task_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cached": len(self._workflows), "compiles": self.compiles}
+
+
+class Checkpoints:
+    """Step outputs of a task's unfinished run, one record per task."""
+
+    def __init__(self, repo: Repository, resume_hours: float = RESUME_HOURS):
+        self.repo = repo
+        self.resume_hours = resume_hours
+
+    def load(self, task: Dict[str, Any], workflow: Workflow, source: str) -> Dict[str, str]:
+        """Outputs of the steps finished by an earlier run of the same workflow and inputs."""
+        record = self.repo.get(task["id"])
+        if record is None:
+            return {}
+        fresh = record["updated_date"] > datetime.utcnow() - timedelta(hours=self.resume_hours)
+        if record.get("source") != source or not fresh:
+            self.repo.pop(task["id"], None)
+            return {}
+        return {step_id: output for step_id, output in record["outputs"].items() if step_id in workflow.steps}
+
+    def save(self, task: Dict[str, Any], source: str, outputs: Dict[str, str]):
+        now = datetime.utcnow()
+        self.repo[task["id"]] = {
+            "id": task["id"],
+            "task_id": task["id"],
+            "user_id": task.get("user_id"),
+            "source": source,
+            "outputs": {step_id: output for step_id, output in outputs.items() if step_id not in INPUTS},
+            "created_date": now,
+            "updated_date": now,
+        }
+
+    def clear(self, task_id: str):
+        self.repo.pop(task_id, None)
+
+
+# invoke_llm(payload) -> {"response", "tool_calls"}; raises if the model gave no answer,
+# which fails the step (a canned fallback answer would be checkpointed as its output)
+InvokeLLM = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+# execute_tools(calls, user_id, allowed) -> [{"success", "result" | "error"}] in call order
+ExecuteTools = Callable[[List[Dict[str, Any]], str, Optional[List[str]]], Awaitable[List[Dict[str, Any]]]]
+
+
+class StepFailed(Exception):
+    pass
+
+
+async def _run_step(step: Step, outputs: Dict[str, str], user_id: str, invoke_llm: InvokeLLM,
+                    execute_tools: ExecuteTools, priority: str, tool_calls: List[Dict[str, Any]]) -> str:
+    if step.type == "tool":
+        call = {"name": step.tool, "arguments": _fill(step.arguments, outputs)}
+        tool_calls.append(call)
+        outcome = (await execute_tools([call], user_id, list(step.tools)))[0]
+        if not outcome["success"]:
+            raise StepFailed(outcome["error"])
+        return outcome["result"]
+
+    payload: Dict[str, Any] = {"prompt": _fill(step.prompt, outputs), "tools": list(step.tools), "priority": priority}
+    if step.system:
+        payload["system"] = step.system
+    decision = await invoke_llm(payload)
+    output = decision.get("response") or ""
+    calls = (decision.get("tool_calls") or []) if step.tools else []
+    if calls:
+        tool_calls.extend(calls)
+        outcomes = await execute_tools(calls, user_id, list(step.tools))
+        output += "".join(
+            f"\n\n{call['name']}: {outcome['result'] if outcome['success'] else 'שגיאה: ' + outcome['error']}"
+            for call, outcome in zip(calls, outcomes)
+        )
+    return output
+
+
+async def run_workflow(
+    task: Dict[str, Any],
+    workflow: Workflow,
+    checkpoints: Checkpoints,
+    invoke_llm: InvokeLLM,
+    execute_tools: ExecuteTools,
+    priority: str,
+    inputs: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Run ``workflow`` for ``task`` with ``inputs``, resuming from its checkpoint.
+
+    Tool calls run for the task's owner, ``task["user_id"]``.
+
+    Returns ``{"output", "error", "tool_calls", "steps", "resumed_steps"}``;
+    ``error`` is None unless a step failed. ``steps`` has the status and
+    duration of each step.
+    """
+    source = workflow.source
+    if inputs:
+        source = hashlib.sha256(json.dumps([source, inputs], sort_keys=True).encode("utf-8")).hexdigest()
+    outputs = checkpoints.load(task, workflow, source)
+    resumed = len(outputs)
+    steps_resumed.inc(amount=resumed)
+    report: Dict[str, Dict[str, Any]] = {step_id: {"status": "resumed"} for step_id in outputs}
+    # Step ids never clash with input names, so both share the template values.
+    outputs.update({name: "" for name in INPUTS}, **(inputs or {}))
+    tool_calls: List[Dict[str, Any]] = []
+    slots = asyncio.Semaphore(MAX_PARALLEL_STEPS)
+    running: Dict[asyncio.Task, Step] = {}
+    failure: Optional[BaseException] = None
+
+    def ready() -> List[Step]:
+        started = {step.id for step in running.values()}
+        return [
+            step for step in workflow.steps.values()
+            if step.id not in outputs and step.id not in started and all(d in outputs for d in step.depends_on)
+        ]
+
+    async def run(step: Step) -> str:
+        async with slots:
+            return await _run_step(step, outputs, task["user_id"], invoke_llm, execute_tools, priority, tool_calls)
+
+    started_at: Dict[str, float] = {}
+    while True:
+        if failure is None:
+            for step in ready():
+                started_at[step.id] = time.perf_counter()
+                running[asyncio.ensure_future(run(step))] = step
+        if not running:
+            break
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            step = running.pop(future)
+            seconds = time.perf_counter() - started_at[step.id]
+            error = future.exception()
+            status = "failed" if error else "success"
+            step_duration.observe(seconds, step.type, status)
+            report[step.id] = {"status": status, "duration_ms": round(seconds * 1000, 1)}
+            if error is not None:
+                report[step.id]["error"] = str(error)
+                failure = failure or error
+                continue
+            outputs[step.id] = future.result()
+            # The last step needs no checkpoint: the run is over.
+            if any(step_id not in outputs for step_id in workflow.steps):
+                checkpoints.save(task, source, outputs)
+
+    finished = failure is None
+    if finished:
+        checkpoints.clear(task["id"])
+    return {
+        "output": "\n\n".join(outputs[step_id] for step_id in workflow.outputs) if finished else None,
+        "error": None if finished else str(failure) or type(failure).__name__,
+        "tool_calls": tool_calls,
+        "steps": [{"id": step_id, **report.get(step_id, {"status": "skipped"})} for step_id in workflow.steps],
+        "resumed_steps": resumed,
+    }
@@ -0,0 +1,169 @@
+"""List, get and search over N customers: the repository layer vs the old dict scans.
+
+Before the repository layer, customers were one module-level dict and every
+request scanned it: ``get_user_customers`` copied the caller's records out
+of all of them, ``GET /customers`` returned that whole copy, and
+``search_customers`` lower-cased and substring-matched every field of every
+record. The baseline below reproduces those functions as they were.
+
+The new path is what the handlers call now: a tenant view's ``query`` for a
+page of --page records, ``get`` for one id, and the tenant search index
+(plus ``get_many``) for a search. Both backends are measured, each filled
+with the same --records customers spread over --tenants tenants.
+
+    python -m benchmarks.customers_scale --records 100000 --tenants 10
+    python -m benchmarks.customers_scale --backends memory --repeat 50
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from backend.search_index import TenantSearchIndex
+from backend.storage import Database, MemoryRepository, Repository, SQLiteRepository
+
+INDEXED_FIELDS = ("status", "segment", "email", "created_date")
+STATUSES = ("lead", "prospect", "customer", "inactive")
+SEGMENTS = ("small_business", "enterprise", "individual")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per operation")
+    parser.add_argument("--backends", default="memory,sqlite")
+    return parser.parse_args()
+
+
+def make_customers(records: int, tenants: int) -> Dict[str, Dict[str, Any]]:
+    start = datetime(2024, 1, 1)
+    customers = {}
+    for i in range(records):
+        customer_id = f"customer-{i}"
+        customers[customer_id] = {
+            "id": customer_id,
+            "user_id": f"user-{i % tenants + 1}",
+            "name": f"לקוח {i} Name{i}",
+            "email": f"customer{i}@example.com",
+            "company": f"Company {i % 500}",
+            "phone": f"050-{i:07d}",
+            "status": STATUSES[i % len(STATUSES)],
+            "segment": SEGMENTS[i % len(SEGMENTS)],
+            "notes": "נוצר לצורך מדידת ביצועים",
+            "created_date": start + timedelta(seconds=i),
+            "updated_date": start + timedelta(seconds=i),
+        }
+    return customers
+
+
+# The handlers as they were before the repository layer.
+
+def old_get_user_customers(customers: Dict[str, Dict[str, Any]], user_id: str) -> Dict[str, Dict[str, Any]]:
+    return {k: v for k, v in customers.items() if v.get("user_id", "user-1") == user_id}
+
+
+def old_search(customers: Dict[str, Dict[str, Any]], user_id: str, filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+    results = list(old_get_user_customers(customers, user_id).values())
+    for key, value in filter.items():
+        if value is None:
+            continue
+        v = str(value).lower()
+        results = [c for c in results if str(c.get(key, "")).lower().find(v) != -1]
+    return results
+
+
+def new_search(repo: Repository, index: TenantSearchIndex, user_id: str, filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+    ids, rest = index.lookup(user_id, filter)
+    view = repo.tenant(user_id)
+    results = list(view.values()) if ids is None else view.get_many(ids)
+    for key, value in rest.items():
+        v = str(value).lower()
+        results = [c for c in results if str(c.get(key, "")).lower().find(v) != -1]
+    return results
+
+
+def timed(call: Callable[[int], Any], repeat: int) -> Dict[str, float]:
+    call(0)  # warm up
+    latencies = []
+    for i in range(repeat):
+        began = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - began)
+    latencies.sort()
+    return {"p50_ms": statistics.median(latencies) * 1000, "max_ms": latencies[-1] * 1000}
+
+
+def open_repo(backend: str, workdir: str) -> Repository:
+    if backend == "memory":
+        return MemoryRepository("customers", INDEXED_FIELDS, "user_id")
+    return SQLiteRepository(Database(os.path.join(workdir, "customers.db")), "customers", INDEXED_FIELDS, "user_id")
+
+
+def searches(records: int, tenants: int) -> Dict[str, Dict[str, Any]]:
+    # customer-0's tenant owns every tenants-th record; pick one of its names.
+    name = f"Name{records // 2 - records // 2 % tenants}"
+    return {
+        "search status": {"status": "prospect"},
+        "search name": {"name": name},
+        "search name+segment": {"name": "name1", "segment": "enterprise"},
+    }
+
+
+def report(label: str, rows: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]] = None):
+    print(label)
+    for name, timing in rows.items():
+        speedup = ""
+        if baseline and name in baseline:
+            speedup = f"  ({baseline[name]['p50_ms'] / timing['p50_ms']:.0f}x)"
+        print(f"  {name:<22} p50 {timing['p50_ms']:9.3f} ms   max {timing['max_ms']:9.3f} ms{speedup}")
+
+
+def main():
+    args = parse_args()
+    customers = make_customers(args.records, args.tenants)
+    owner = customers["customer-0"]["user_id"]
+    own_ids = list(customers)[:args.tenants * 1000:args.tenants]
+    filters = searches(args.records, args.tenants)
+    print(f"{args.records} customers over {args.tenants} tenants; one tenant's requests, {args.repeat} calls each\n")
+
+    baseline = {
+        "list": timed(lambda i: list(old_get_user_customers(customers, owner).values()), args.repeat),
+        "get": timed(lambda i: old_get_user_customers(customers, owner).get(own_ids[i % len(own_ids)]), args.repeat),
+        **{name: timed(lambda i, f=filter: old_search(customers, owner, f), args.repeat) for name, filter in filters.items()},
+    }
+    report("dict scans (before)", baseline)
+
+    workdir = tempfile.mkdtemp(prefix="customers-scale-")
+    for backend in args.backends.split(","):
+        repo = open_repo(backend, workdir)
+        began = time.perf_counter()
+        repo.put_many(customers.items())
+        index = TenantSearchIndex(
+            "user_id",
+            exact_fields=("status", "segment"),
+            text_fields=("name", "company", "notes", "email"),
+        ).attach(repo)
+        loaded = time.perf_counter() - began
+        view = repo.tenant(owner)
+        rows = {
+            "list": timed(lambda i: view.query(sort="-created_date", limit=args.page), args.repeat),
+            "get": timed(lambda i: view.get(own_ids[i % len(own_ids)]), args.repeat),
+            **{name: timed(lambda i, f=filter: new_search(repo, index, owner, f), args.repeat)
+               for name, filter in filters.items()},
+        }
+        print()
+        report(f"{backend} repository (load and index: {loaded:.1f} s)", rows, baseline)
+        for name, filter in filters.items():
+            expected = sorted(c["id"] for c in old_search(customers, owner, filter))
+            found = sorted(c["id"] for c in new_search(repo, index, owner, filter))
+            if found != expected:
+                print(f"  {name}: {len(found)} results, the dict scan found {len(expected)}")
+
+
+if __name__ == "__main__":
+    main()
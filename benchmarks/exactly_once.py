@@ -0,0 +1,157 @@
+"""Checks that scheduled tasks fire exactly once with several server processes.
+
+Starts --workers uvicorn processes on one SQLite database, each on its own
+port (the same as ``uvicorn --workers N``, but every process can be asked
+for its /health). Creates --tasks interval tasks through one process,
+waits --minutes, then reads every task's run history and counts the
+scheduled runs:
+
+- duplicate: two runs of a task less than half an interval apart;
+- missed: fewer runs than interval boundaries passed since the task was
+  created.
+
+With --kill-leader the process holding the scheduler lease is stopped
+after the first round of runs; another one must take over within
+SCHEDULER_LEASE_SECONDS and fire the remaining rounds. Exits with status 1
+if any run was duplicated or missed.
+
+    python -m benchmarks.exactly_once --workers 4 --tasks 20 --minutes 3 --kill-leader
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+INTERVAL_MINUTES = 1
+LEASE_SECONDS = 6
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--minutes", type=float, default=3)
+    parser.add_argument("--port", type=int, default=8850, help="first port; worker i listens on port + i")
+    parser.add_argument("--kill-leader", action="store_true", help="stop the leader after the first round")
+    return parser.parse_args()
+
+
+def start_workers(count: int, first_port: int, database: str) -> List[subprocess.Popen]:
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "DATABASE_PATH": database,
+        "SCHEDULER_JITTER_SECONDS": "0",
+        "SCHEDULER_LEASE_SECONDS": str(LEASE_SECONDS),
+        "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    }
+    return [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(first_port + i), "--log-level", "warning"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for i in range(count)
+    ]
+
+
+def wait_until_up(clients: List[httpx.Client], timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    for client in clients:
+        while True:
+            try:
+                client.get("/health").raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"{client.base_url} did not start")
+                time.sleep(0.5)
+
+
+def leader(clients: List[httpx.Client], alive: List[bool]) -> Optional[int]:
+    leaders = [
+        i for i, client in enumerate(clients)
+        if alive[i] and client.get("/health").json()["scheduler"]["running"]
+    ]
+    if len(leaders) > 1:
+        print(f"More than one leader: workers {leaders}")
+    return leaders[0] if leaders else None
+
+
+def create_tasks(client: httpx.Client, count: int) -> Dict[str, datetime]:
+    created = {}
+    for i in range(count):
+        response = client.post("/scheduled-tasks", json={
+            "agent_id": "agent-1",
+            "task_name": f"exactly-once {i}",
+            "workflow_definition": "בדיקת הפעלה",
+            "schedule_type": "interval",
+            "interval_minutes": INTERVAL_MINUTES,
+        })
+        response.raise_for_status()
+        created[response.json()["id"]] = datetime.utcnow()
+    return created
+
+
+def check(runs: List[Dict[str, Any]], created: datetime, finished: datetime) -> Dict[str, int]:
+    interval = timedelta(minutes=INTERVAL_MINUTES)
+    started = sorted(datetime.fromisoformat(run["created_date"]) for run in runs if run["trigger"] == "schedule")
+    duplicates = sum(1 for a, b in zip(started, started[1:]) if b - a < interval / 2)
+    # A boundary in the last seconds may or may not have fired yet.
+    expected = int((finished - created - timedelta(seconds=5)) / interval)
+    return {"runs": len(started), "duplicates": duplicates, "missed": max(0, expected - (len(started) - duplicates))}
+
+
+def main():
+    args = parse_args()
+    database = os.path.join(tempfile.mkdtemp(prefix="exactly-once-"), "app.db")
+    processes = start_workers(args.workers, args.port, database)
+    alive = [True] * args.workers
+    clients = [httpx.Client(base_url=f"http://127.0.0.1:{args.port + i}", timeout=30) for i in range(args.workers)]
+    try:
+        wait_until_up(clients)
+        print(f"{args.workers} workers up; leader is worker {leader(clients, alive)}")
+        created = create_tasks(clients[0], args.tasks)
+        began = time.monotonic()
+        if args.kill_leader:
+            time.sleep(INTERVAL_MINUTES * 60 + 10)
+            current = leader(clients, alive)
+            if current is not None:
+                processes[current].terminate()
+                processes[current].wait()
+                alive[current] = False
+                print(f"Stopped the leader, worker {current}")
+            time.sleep(LEASE_SECONDS * 2)
+            print(f"New leader: worker {leader(clients, alive)}")
+        time.sleep(max(0.0, args.minutes * 60 - (time.monotonic() - began)))
+        finished = datetime.utcnow()
+        time.sleep(3)  # run logs are written every second
+
+        reader = clients[alive.index(True)]
+        totals = {"runs": 0, "duplicates": 0, "missed": 0}
+        for task_id, task_created in created.items():
+            result = check(reader.get(f"/scheduled-tasks/{task_id}/runs", params={"limit": 1000}).json(),
+                           task_created, finished)
+            for key in totals:
+                totals[key] += result[key]
+        print(f"{args.tasks} tasks, {totals['runs']} scheduled runs, "
+              f"{totals['duplicates']} duplicates, {totals['missed']} missed")
+        if totals["duplicates"] or totals["missed"]:
+            sys.exit(1)
+    finally:
+        for i, process in enumerate(processes):
+            if alive[i]:
+                process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
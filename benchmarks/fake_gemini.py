@@ -0,0 +1,156 @@
+"""A local stand-in for the Gemini REST API.
+
+Serves ``generateContent`` and ``streamGenerateContent`` for any model
+with answers of the shapes Gemini gives to the backend's prompts: the JSON
+envelope with and without tool calls, fenced or bare. ``--malformed-rate``
+of the answers are broken the ways real ones are (trailing commas, cut-off
+output, prose around the JSON, plain text), so the parsing and fallback
+paths get load too. ``--latency-ms`` (plus up to ``--jitter-ms``) delays
+every answer; a streamed answer spreads the delay over its chunks. Other
+endpoints (context caching) answer 404, which the backend takes as "not
+available". ``GET /_stats`` counts requests by kind.
+
+    python -m benchmarks.fake_gemini --port 8901 --latency-ms 400 --malformed-rate 0.1
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=http://127.0.0.1:8901 uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Any, Dict, List, Tuple
+
+from fastapi import FastAPI
+from fastapi import Request as HttpRequest
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CRM_SEARCH = {"name": "manage_crm", "arguments": {"action": "search_customers", "name": "יוסי"}}
+CALENDAR_LIST = {"name": "manage_calendar", "arguments": {"action": "list_events"}}
+GMAIL_SEARCH = {"name": "manage_gmail", "arguments": {"action": "search_emails", "query": "הצעת מחיר"}}
+
+
+def _envelope(response: str, *calls: Dict[str, Any]) -> str:
+    body: Dict[str, Any] = {"response": response, "tool_to_call": None}
+    if len(calls) == 1:
+        body["tool_to_call"] = calls[0]
+    elif calls:
+        body["tool_calls"] = list(calls)
+    return json.dumps(body, ensure_ascii=False)
+
+
+WELL_FORMED: List[str] = [
+    _envelope("שלום! איך אוכל לעזור היום?"),
+    _envelope("מחפש לקוח בשם יוסי...", CRM_SEARCH),
+    "```json\n" + _envelope("בודק את היומן...", CALENDAR_LIST) + "\n```",
+    _envelope("מחפש מיילים על הצעות מחיר...", GMAIL_SEARCH),
+    _envelope("סיכום: שלושה לידים חדשים השבוע, שניים ממתינים להצעת מחיר."),
+]
+MALFORMED: List[str] = [
+    '{"response": "מחפש לקוח בשם יוסי...", "tool_to_call": {"name": "manage_crm", '
+    '"arguments": {"action": "search_customers", "name": "יוסי",},},}',
+    '{"response": "הנה סיכום הלקוחות שמצאתי: יוסי כהן, דנה לוי, ומשה',
+    "בטח, הנה התשובה:\n" + _envelope("בודק את היומן...", CALENDAR_LIST) + "\n\nאם תרצה, אוכל גם לקבוע פגישה.",
+    "לא מצאתי לקוח בשם הזה. תרצה שאצור לקוח חדש?",
+]
+
+
+class FakeGemini:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, malformed_rate: float = 0, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.stats: Dict[str, int] = {}
+
+    def count(self, kind: str):
+        self.stats[kind] = self.stats.get(kind, 0) + 1
+
+    def delay(self) -> float:
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def answer(self, request: Dict[str, Any]) -> str:
+        if self.random.random() < self.malformed_rate:
+            self.count("malformed")
+            return self.random.choice(MALFORMED)
+        return self.random.choice(WELL_FORMED)
+
+    def usage(self, request: Dict[str, Any], text: str) -> Dict[str, int]:
+        # About four characters per token, like Gemini's count for mixed text.
+        prompt = sum(len(part.get("text", "")) for content in request.get("contents", []) for part in content.get("parts", []))
+        prompt += sum(len(part.get("text", "")) for part in (request.get("systemInstruction") or {}).get("parts", []))
+        prompt_tokens, output_tokens = prompt // 4 + 1, len(text) // 4 + 1
+        return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens}
+
+    def chunks(self, text: str, size: int = 16) -> List[Tuple[str, bool]]:
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        return [(piece, i == len(pieces) - 1) for i, piece in enumerate(pieces)]
+
+
+def _candidate(text: str, finished: bool) -> Dict[str, Any]:
+    candidate: Dict[str, Any] = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return candidate
+
+
+def build_app(fake: FakeGemini) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/_stats")
+    def stats():
+        return fake.stats
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate(model: str, request: HttpRequest):
+        fake.count("generate")
+        body = await request.json()
+        await asyncio.sleep(fake.delay())
+        text = fake.answer(body)
+        return {"candidates": [_candidate(text, True)], "usageMetadata": fake.usage(body, text)}
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream(model: str, request: HttpRequest):
+        fake.count("stream")
+        body = await request.json()
+        text = fake.answer(body)
+        chunks = fake.chunks(text)
+        pause = fake.delay() / len(chunks)
+
+        async def produce():
+            yield "["
+            for i, (piece, last) in enumerate(chunks):
+                await asyncio.sleep(pause)
+                chunk: Dict[str, Any] = {"candidates": [_candidate(piece, last)]}
+                if last:
+                    chunk["usageMetadata"] = fake.usage(body, text)
+                yield ("," if i else "") + json.dumps(chunk, ensure_ascii=False)
+            yield "]"
+
+        return StreamingResponse(produce(), media_type="application/json")
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PATCH", "DELETE"])
+    async def unsupported(path: str):
+        fake.count("unsupported")
+        return JSONResponse({"error": {"code": 404, "message": f"{path} is not served by the fake"}}, status_code=404)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    fake = FakeGemini(args.latency_ms, args.jitter_ms, args.malformed_rate, args.seed)
+    uvicorn.run(build_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""A local stand-in for the Google APIs the /google/* actions use.
+
+Serves the OAuth token endpoint, the Gmail, Calendar, Drive, Sheets and
+Docs calls in backend/google_actions.py and the batch endpoint, from
+in-memory data. Access tokens expire after --token-ttl seconds, and
+requests with an unknown or expired token get 401, as Google's do.
+``--latency-ms`` delays every HTTP request (not each call in a batch) to
+stand in for the round trip to Google. ``GET /_stats`` counts requests by
+kind.
+
+    python -m benchmarks.fake_google --port 8900 --latency-ms 40
+    GOOGLE_API_ROOT=http://127.0.0.1:8900 GOOGLE_TOKEN_URI=http://127.0.0.1:8900/token \\
+        uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import base64
+import email
+import email.policy
+import json
+import re
+import time
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+from uuid import uuid4
+
+from fastapi import FastAPI
+from fastapi import Request as HttpRequest
+from fastapi.responses import JSONResponse, Response
+
+Answer = Tuple[int, Any]
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+class FakeGoogle:
+    def __init__(self, messages: int = 200, token_ttl: float = 3600, latency_ms: float = 0):
+        self.token_ttl = token_ttl
+        self.latency = latency_ms / 1000
+        self.tokens: Dict[str, float] = {}  # access token -> expiry (monotonic)
+        self.stats: Dict[str, int] = {}
+        self._ids = count(1)
+        self.messages = {
+            str(i): {
+                "id": str(i),
+                "threadId": str(i),
+                "snippet": f"הודעה מספר {i}",
+                "payload": {
+                    "mimeType": "text/plain",
+                    "headers": [
+                        {"name": "From", "value": f"client{i}@example.com"},
+                        {"name": "To", "value": "me@company.com"},
+                        {"name": "Subject", "value": f"בקשה להצעת מחיר {i}"},
+                    ],
+                    "body": {"data": _b64(f"שלום,\nזו הודעה מספר {i}.\nתודה!")},
+                },
+            }
+            for i in range(1, messages + 1)
+        }
+        self.events: List[Dict[str, Any]] = []
+        self.files = {"file1": {"id": "file1", "name": "דוח מכירות", "mimeType": "text/plain", "content": "תוכן הקובץ"}}
+        self.sheets: Dict[str, List[List[Any]]] = {"sheet1": [["שם", "מייל", "סטטוס"], ["דוד כהן", "david@example.com", "לקוח"]]}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.routes: List[Tuple[str, "re.Pattern[str]", Callable[..., Answer]]] = [
+            ("GET", re.compile(r"/gmail/v1/users/me/messages"), self.list_messages),
+            ("GET", re.compile(r"/gmail/v1/users/me/messages/(?P<message_id>[^/]+)"), self.get_message),
+            ("POST", re.compile(r"/gmail/v1/users/me/messages/send"), self.send_message),
+            ("GET", re.compile(r"/calendar/v3/calendars/primary/events"), self.list_events),
+            ("POST", re.compile(r"/calendar/v3/calendars/primary/events"), self.insert_event),
+            ("POST", re.compile(r"/calendar/v3/freeBusy"), self.freebusy),
+            ("GET", re.compile(r"/drive/v3/files"), self.list_files),
+            ("GET", re.compile(r"/drive/v3/files/(?P<file_id>[^/]+)"), self.get_file),
+            ("GET", re.compile(r"/drive/v3/files/(?P<file_id>[^/]+)/export"), self.export_file),
+            ("POST", re.compile(r"/upload/drive/v3/files"), self.create_file),
+            ("GET", re.compile(r"/v4/spreadsheets/(?P<sheet_id>[^/]+)/values/(?P<range>[^/]+)"), self.get_values),
+            ("POST", re.compile(r"/v4/spreadsheets/(?P<sheet_id>[^/]+)/values/(?P<range>[^/]+):append"), self.append_values),
+            ("POST", re.compile(r"/v1/documents"), self.create_document),
+            ("GET", re.compile(r"/v1/documents/(?P<document_id>[^/:]+)"), self.get_document),
+            ("POST", re.compile(r"/v1/documents/(?P<document_id>[^/:]+):batchUpdate"), self.update_document),
+        ]
+
+    def count(self, kind: str):
+        self.stats[kind] = self.stats.get(kind, 0) + 1
+
+    # OAuth
+    def issue_token(self, form: Dict[str, str]) -> Answer:
+        if form.get("grant_type") not in ("authorization_code", "refresh_token"):
+            return 400, {"error": "unsupported_grant_type"}
+        self.count("token")
+        token = f"fake-{uuid4().hex}"
+        self.tokens[token] = time.monotonic() + self.token_ttl
+        answer = {"access_token": token, "expires_in": int(self.token_ttl), "token_type": "Bearer", "scope": ""}
+        if form.get("grant_type") == "authorization_code":
+            answer["refresh_token"] = f"refresh-{uuid4().hex}"
+        return 200, answer
+
+    def authorized(self, headers: Dict[str, str]) -> bool:
+        token = (headers.get("authorization") or "").removeprefix("Bearer ").strip()
+        return self.tokens.get(token, 0) > time.monotonic()
+
+    def dispatch(self, method: str, target: str, body: bytes) -> Answer:
+        parts = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        path = unquote(parts.path)
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                payload = json.loads(body) if body and body[:1] in (b"{", b"[") else body
+                return handler(query=query, body=payload, **match.groupdict())
+        return 404, {"error": {"code": 404, "message": f"No fake for {method} {path}"}}
+
+    def batch(self, content_type: str, body: bytes) -> Tuple[str, bytes]:
+        """Answer each call of a multipart/mixed batch request, as Google's batch endpoint does."""
+        message = email.message_from_bytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body, policy=email.policy.HTTP
+        )
+        boundary = f"batch_{uuid4().hex}"
+        out: List[str] = []
+        for part in message.iter_parts():
+            raw = part.get_payload(decode=True) or b""
+            head, _, inner_body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+            request_line = head.split(b"\n", 1)[0].decode()
+            method, target, _ = request_line.split(" ", 2)
+            self.count("batched_call")
+            status, answer = self.dispatch(method, target, inner_body.strip())
+            content_id = (part["Content-ID"] or "").strip("<>")
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(answer, ensure_ascii=False)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(out).encode("utf-8")
+
+    # Gmail
+    def list_messages(self, query, body) -> Answer:
+        limit = int(query.get("maxResults", 100))
+        return 200, {"messages": [{"id": m["id"], "threadId": m["threadId"]} for m in list(self.messages.values())[:limit]]}
+
+    def get_message(self, query, body, message_id) -> Answer:
+        message = self.messages.get(message_id)
+        if message is None:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        if query.get("format") == "metadata":
+            return 200, {**message, "payload": {"headers": message["payload"]["headers"]}}
+        return 200, message
+
+    def send_message(self, query, body) -> Answer:
+        return 200, {"id": f"sent-{next(self._ids)}", "labelIds": ["SENT"]}
+
+    # Calendar
+    def list_events(self, query, body) -> Answer:
+        return 200, {"items": self.events[: int(query.get("maxResults", 250))]}
+
+    def insert_event(self, query, body) -> Answer:
+        event = {**body, "id": f"event-{next(self._ids)}", "htmlLink": "https://calendar.google.com/calendar/event?eid=fake"}
+        self.events.append(event)
+        return 200, event
+
+    def freebusy(self, query, body) -> Answer:
+        return 200, {"calendars": {"primary": {"busy": []}}}
+
+    # Drive
+    def list_files(self, query, body) -> Answer:
+        return 200, {"files": [{k: f[k] for k in ("id", "name", "mimeType")} for f in self.files.values()]}
+
+    def get_file(self, query, body, file_id) -> Answer:
+        found = self.files.get(file_id)
+        if found is None:
+            return 404, {"error": {"code": 404, "message": "File not found"}}
+        if query.get("alt") == "media":
+            return 200, found["content"]
+        return 200, {k: found[k] for k in ("id", "name", "mimeType")}
+
+    def export_file(self, query, body, file_id) -> Answer:
+        return self.get_file({"alt": "media"}, body, file_id)
+
+    def create_file(self, query, body) -> Answer:
+        file_id = f"file-{next(self._ids)}"
+        self.files[file_id] = {"id": file_id, "name": "upload", "mimeType": "text/plain", "content": ""}
+        return 200, {"id": file_id}
+
+    # Sheets
+    def get_values(self, query, body, sheet_id, range) -> Answer:
+        return 200, {"range": range, "majorDimension": "ROWS", "values": self.sheets.get(sheet_id, [])}
+
+    def append_values(self, query, body, sheet_id, range) -> Answer:
+        rows = self.sheets.setdefault(sheet_id, [])
+        rows.extend(body.get("values") or [])
+        return 200, {"spreadsheetId": sheet_id, "updates": {"updatedRange": f"{range}!A{len(rows)}"}}
+
+    # Docs
+    def create_document(self, query, body) -> Answer:
+        document_id = f"doc-{next(self._ids)}"
+        self.documents[document_id] = {"documentId": document_id, "title": body.get("title"), "text": ""}
+        return 200, {"documentId": document_id, "title": body.get("title")}
+
+    def get_document(self, query, body, document_id) -> Answer:
+        document = self.documents.get(document_id)
+        if document is None:
+            return 404, {"error": {"code": 404, "message": "Document not found"}}
+        return 200, {
+            "documentId": document_id, "title": document["title"],
+            "body": {"content": [{"paragraph": {"elements": [{"textRun": {"content": document["text"]}}]}}]},
+        }
+
+    def update_document(self, query, body, document_id) -> Answer:
+        document = self.documents.get(document_id)
+        if document is None:
+            return 404, {"error": {"code": 404, "message": "Document not found"}}
+        for request in body.get("requests") or []:
+            document["text"] += request.get("insertText", {}).get("text", "")
+        return 200, {"documentId": document_id, "replies": [{}]}
+
+
+def build_app(fake: FakeGoogle) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/_stats")
+    def stats():
+        return fake.stats
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    async def serve(path: str, request: HttpRequest):
+        if fake.latency:
+            await asyncio.sleep(fake.latency)
+        body = await request.body()
+        if path == "token":
+            form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+            status, answer = fake.issue_token(form)
+            return JSONResponse(answer, status_code=status)
+        if not fake.authorized(dict(request.headers)):
+            fake.count("unauthorized")
+            return JSONResponse({"error": {"code": 401, "message": "Invalid Credentials"}}, status_code=401)
+        if path == "batch" or path.startswith("batch/"):
+            fake.count("batch")
+            content_type, content = fake.batch(request.headers.get("content-type", ""), body)
+            return Response(content, media_type=content_type)
+        fake.count("call")
+        target = f"/{path}" + (f"?{request.url.query}" if request.url.query else "")
+        status, answer = fake.dispatch(request.method, target, body)
+        if isinstance(answer, str):
+            return Response(answer.encode("utf-8"), status_code=status, media_type="text/plain")
+        return JSONResponse(answer, status_code=status)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--token-ttl", type=float, default=3600)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    fake = FakeGoogle(args.messages, args.token_ttl, args.latency_ms)
+    uvicorn.run(build_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
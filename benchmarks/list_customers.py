@@ -0,0 +1,94 @@
+"""Requests/sec for ``GET /customers`` against a database of N customers.
+
+Requests go straight to the ASGI app (no sockets), so the numbers measure
+the handler, storage and serialization path rather than the network:
+
+    python -m benchmarks.list_customers --records 10000 --requests 200
+    python -m benchmarks.list_customers --query "limit=100&sort=-created_date"
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--query", default="", help="query string for GET /customers")
+    return parser.parse_args()
+
+
+def seed(main, records: int):
+    customers = main.get_user_customers(main.current_user)
+    start = datetime(2024, 1, 1)
+    for i in range(records):
+        customer_id = f"bench-{i}"
+        customers[customer_id] = {
+            "id": customer_id,
+            "name": f"לקוח {i}",
+            "email": f"customer{i}@example.com",
+            "company": f"Company {i % 500}",
+            "phone": f"050-{i:07d}",
+            "status": ("lead", "prospect", "customer")[i % 3],
+            "segment": "small_business",
+            "notes": "נוצר לצורך מדידת ביצועים",
+            "created_date": start + timedelta(seconds=i),
+            "updated_date": start + timedelta(seconds=i),
+        }
+
+
+async def run(app, path: str, total: int, concurrency: int):
+    import httpx
+
+    latencies = []
+    size = 0
+    remaining = total
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await client.get(path)  # warm caches and connections
+
+        async def worker():
+            nonlocal remaining, size
+            while remaining > 0:
+                remaining -= 1
+                began = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - began)
+                response.raise_for_status()
+                size = len(response.content)
+
+        began = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    return {
+        "requests_per_second": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "response_bytes": size,
+    }
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_PATH", os.path.join(workdir, "bench.db"))
+    from backend import main as backend_main
+
+    seed(backend_main, args.records)
+    path = "/customers" + (f"?{args.query}" if args.query else "")
+    result = asyncio.run(run(backend_main.app, path, args.requests, args.concurrency))
+    print(f"GET {path} with {args.records} customers ({os.getenv('STORAGE_BACKEND', 'sqlite')}):")
+    for key, value in result.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
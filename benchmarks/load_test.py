@@ -0,0 +1,568 @@
+"""End-to-end load test of the backend against local fake services.
+
+Starts benchmarks/fake_gemini.py, benchmarks/fake_google.py and the
+backend (uvicorn backend.main:app, --workers processes) on a fresh
+database. It seeds --customers customers, connects the user to the fake
+Google and creates --burst prompt tasks. Then it runs each scenario for
+--duration seconds with --concurrency clients:
+
+- crud: list, read, create, update and delete customers;
+- search: ``POST /customers/search`` by status, segment, name and company;
+- chat: chat turns through ``POST /invoke-llm`` (mostly new prompts, some
+  repeated ones that the response cache can answer);
+- google: Gmail, Calendar, Drive and Sheets reads through /google/*, with
+  an occasional write that invalidates cached reads;
+- tasks: bursts of --burst scheduled tasks started at once with
+  ``POST /scheduled-tasks/run``; each request lasts the whole run. The
+  task prompts change between bursts (untimed), so runs are not answered
+  by the LLM response cache;
+- mixed: all of the above in one stream, weighted like a busy day;
+- health: one client polls ``GET /health`` while --llm-calls clients keep
+  that many uncached ``/invoke-llm`` calls in flight. Its latencies are
+  those of /health, which must stay low while Gemini calls wait; the LLM
+  calls are reported under ``llm_calls``.
+
+For every scenario it reports throughput and latency percentiles, overall
+and per operation, and writes them with the fakes' counters and the
+settings to --output as JSON. With --baseline (an earlier --output) every
+scenario is compared with it. A throughput drop, a p50 or p99 latency rise
+beyond --tolerance, or more errors counts as a regression, and the exit
+status is 1. A baseline file that does not exist yet is written from this
+run, and --update-baseline overwrites it.
+
+The client shares the machine with the servers, so compare runs from the
+same machine and settings only.
+
+    python -m benchmarks.load_test --duration 15 --gemini-latency-ms 300 --malformed-rate 0.1
+    python -m benchmarks.load_test --scenarios crud,search --baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("crud", "search", "chat", "google", "tasks", "mixed", "health")
+STATUSES = ("lead", "prospect", "customer")
+SEGMENTS = ("small_business", "enterprise", "startup")
+QUESTIONS = (
+    "מה הלקוחות החדשים השבוע?",
+    "תקבע לי פגישה עם דנה מחר בעשר",
+    "שלח מייל תודה ליוסי כהן",
+    "מה יש לי ביומן היום?",
+    "חפש את הלקוח משה לוי",
+)
+
+# A scenario operation: (client, state, random) -> operation name; raises on failure
+Operation = Callable[[httpx.AsyncClient, "State", random.Random], Awaitable[str]]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=15, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds per scenario before measuring")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=20, help="tasks started at once in the tasks scenario")
+    parser.add_argument("--llm-calls", type=int, default=50, help="LLM calls in flight in the health scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (sqlite only)")
+    parser.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=100)
+    parser.add_argument("--malformed-rate", type=float, default=0.1)
+    parser.add_argument("--google-latency-ms", type=float, default=40)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8870, help="backend port; the fakes use the next two")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "load_test.json"))
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="write this run to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before it is a regression")
+    parser.add_argument("--min-latency-delta-ms", type=float, default=2,
+                        help="latency changes smaller than this are never regressions")
+    args = parser.parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.workers > 1 and args.storage == "memory":
+        parser.error("several workers need --storage sqlite")
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline needs --baseline")
+    return args
+
+
+# Servers
+
+def start_servers(args: argparse.Namespace, directory: str) -> List[subprocess.Popen]:
+    gemini_port, google_port = args.port + 1, args.port + 2
+    google_root = f"http://127.0.0.1:{google_port}"
+    logs = open(os.path.join(directory, "servers.log"), "wb")
+    env = {
+        # The limits the backend has for the real Gemini would measure the limiter.
+        "LLM_REQUESTS_PER_MINUTE": "100000",
+        "LLM_TOKENS_PER_MINUTE": "100000000",
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "STORAGE_BACKEND": args.storage,
+        "DATABASE_PATH": os.path.join(directory, "app.db"),
+        "GEMINI_API_KEY": "fake",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{gemini_port}",
+        "GOOGLE_API_ROOT": google_root,
+        "GOOGLE_TOKEN_URI": f"{google_root}/token",
+        "GOOGLE_CLIENT_ID": "load-test",
+        "GOOGLE_CLIENT_SECRET": "load-test",
+        "SCHEDULER_JITTER_SECONDS": "0",
+    }
+    commands = [
+        ["-m", "benchmarks.fake_gemini", "--port", str(gemini_port), "--latency-ms", str(args.gemini_latency_ms),
+         "--jitter-ms", str(args.gemini_jitter_ms), "--malformed-rate", str(args.malformed_rate), "--seed", str(args.seed)],
+        ["-m", "benchmarks.fake_google", "--port", str(google_port), "--latency-ms", str(args.google_latency_ms)],
+        ["-m", "uvicorn", "backend.main:app", "--port", str(args.port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+    ]
+    return [
+        subprocess.Popen([sys.executable, *command], cwd=ROOT, env=env, stdout=logs, stderr=subprocess.STDOUT)
+        for command in commands
+    ]
+
+
+async def wait_until_up(urls: List[str], timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            while True:
+                try:
+                    if (await client.get(url)).status_code < 500:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"{url} did not come up; see the servers.log")
+                await asyncio.sleep(0.3)
+
+
+# Workload
+
+class State:
+    """What the scenarios work on: the ids of records the run created."""
+
+    def __init__(self):
+        self.customers: List[str] = []
+        self.tasks: List[Tuple[str, Dict[str, Any]]] = []  # (id, settings)
+        self.turns = 0
+        self.bursts = 0
+
+
+def customer(rng: random.Random, i: int) -> Dict[str, Any]:
+    return {
+        "name": f"לקוח {i}",
+        "email": f"customer{i}@example.com",
+        "company": f"Company {i % 200}",
+        "phone": f"050-{i:07d}",
+        "status": rng.choice(STATUSES),
+        "segment": rng.choice(SEGMENTS),
+        "notes": "נוצר במבחן עומס",
+    }
+
+
+async def seed(client: httpx.AsyncClient, state: State, args: argparse.Namespace, rng: random.Random):
+    for start in range(0, args.customers, 1000):
+        operations = [{"op": "create", "data": customer(rng, i)} for i in range(start, min(args.customers, start + 1000))]
+        response = await client.post("/customers/bulk", json={"operations": operations})
+        response.raise_for_status()
+        state.customers += [result["id"] for result in response.json()["results"] if result["success"]]
+    # Exchanges the code with the fake token endpoint and stores the tokens.
+    (await client.get("/oauth2callback", params={"code": "load-test"})).raise_for_status()
+    for i in range(args.burst):
+        task = {
+            "agent_id": "agent-1",
+            "task_name": f"load test {i}",
+            "workflow_definition": f"סכם את הלידים החדשים ושלח עדכון ({i})",
+            "schedule_type": "daily",
+            "schedule_time": "03:00",
+            "tools_to_use": ["manage_crm"],
+        }
+        response = await client.post("/scheduled-tasks", json=task)
+        response.raise_for_status()
+        state.tasks.append((response.json()["id"], task))
+
+
+def check(response: httpx.Response, name: str) -> str:
+    response.raise_for_status()
+    body = response.json()
+    if isinstance(body, dict) and body.get("success") is False:
+        raise RuntimeError(f"{name}: {body.get('error') or body.get('message')}")
+    return name
+
+
+async def crud(client: httpx.AsyncClient, state: State, rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < 0.4:
+        sort = rng.choice(("-created_date", "name", "-updated_date"))
+        return check(await client.get("/customers", params={"limit": 50, "sort": sort}), "list")
+    if roll < 0.65:
+        return check(await client.get(f"/customers/{rng.choice(state.customers)}"), "read")
+    if roll < 0.8:
+        response = await client.post("/customers", json=customer(rng, rng.randrange(10**6)))
+        check(response, "create")
+        state.customers.append(response.json()["id"])
+        return "create"
+    if roll < 0.95:
+        customer_id = rng.choice(state.customers)
+        return check(await client.put(f"/customers/{customer_id}", json=customer(rng, rng.randrange(10**6))), "update")
+    if len(state.customers) > 100:
+        customer_id = state.customers.pop(rng.randrange(len(state.customers)))
+        return check(await client.delete(f"/customers/{customer_id}"), "delete")
+    return check(await client.get("/customers", params={"limit": 50}), "list")
+
+
+async def search(client: httpx.AsyncClient, state: State, rng: random.Random) -> str:
+    kind, query = rng.choice((
+        ("status", lambda: {"status": rng.choice(STATUSES)}),
+        ("status_segment", lambda: {"status": rng.choice(STATUSES), "segment": rng.choice(SEGMENTS)}),
+        ("name", lambda: {"name": f"לקוח {rng.randrange(1000)}"}),
+        ("company", lambda: {"company": f"Company {rng.randrange(200)}"}),
+    ))
+    return check(await client.post("/customers/search", json=query()), kind)
+
+
+async def chat(client: httpx.AsyncClient, state: State, rng: random.Random) -> str:
+    state.turns += 1
+    repeated = rng.random() < 0.2
+    prompt = rng.choice(QUESTIONS) if repeated else f"{rng.choice(QUESTIONS)} (שיחה {state.turns})"
+    response = await client.post("/invoke-llm", json={
+        "prompt": prompt,
+        "system": "אתה סוכן מכירות. ענה בעברית.",
+        "tools": ["manage_crm", "manage_calendar", "manage_gmail"],
+    })
+    response.raise_for_status()
+    if "response" not in response.json():
+        raise RuntimeError("invoke-llm: no response in the envelope")
+    return "repeated" if repeated else "new"
+
+
+GOOGLE_READS = (
+    ("gmail", {"action": "search_emails", "query": "הצעת מחיר"}),
+    ("calendar", {"action": "list_events"}),
+    ("drive", {"action": "search_files", "query": "דוח"}),
+    ("sheets", {"action": "read_range", "spreadsheet_id": "sheet1", "range": "A1:C50"}),
+)
+
+
+async def google(client: httpx.AsyncClient, state: State, rng: random.Random) -> str:
+    if rng.random() < 0.05:
+        body = {"action": "append_row", "spreadsheet_id": "sheet1", "range": "A1", "values": ["לקוח", "a@example.com", "ליד"]}
+        return check(await client.post("/google/sheets", json=body), "sheets.append_row")
+    service, body = rng.choice(GOOGLE_READS)
+    return check(await client.post(f"/google/{service}", json=body), f"{service}.{body['action']}")
+
+
+async def run_task(client: httpx.AsyncClient, state: State, rng: random.Random) -> str:
+    task_id, _ = rng.choice(state.tasks)
+    return check(await client.post("/scheduled-tasks/run", json={"task_id": task_id}), "run")
+
+
+MIXED: List[Tuple[Operation, float]] = [(crud, 0.45), (search, 0.2), (chat, 0.15), (google, 0.15), (run_task, 0.05)]
+
+
+async def mixed(client: httpx.AsyncClient, state: State, rng: random.Random) -> str:
+    operation = rng.choices([op for op, _ in MIXED], weights=[weight for _, weight in MIXED])[0]
+    return f"{operation.__name__}.{await operation(client, state, rng)}"
+
+
+# Measurement
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies: List[float], errors: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered) + errors,
+        "errors": errors,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+            "p50": round(percentile(ordered, 0.5), 2),
+            "p90": round(percentile(ordered, 0.9), 2),
+            "p99": round(percentile(ordered, 0.99), 2),
+            "max": round(ordered[-1], 2) if ordered else 0.0,
+        },
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.first_errors: List[str] = []
+
+    def ok(self, operation: str, milliseconds: float):
+        self.latencies.setdefault(operation, []).append(milliseconds)
+
+    def failed(self, operation: str, error: Exception):
+        self.errors[operation] = self.errors.get(operation, 0) + 1
+        if len(self.first_errors) < 5:
+            self.first_errors.append(f"{operation}: {error!r}"[:300])
+
+    def result(self, seconds: float) -> Dict[str, Any]:
+        every = [latency for latencies in self.latencies.values() for latency in latencies]
+        total = summarize(every, sum(self.errors.values()))
+        total["duration_s"] = round(seconds, 2)
+        total["throughput_rps"] = round(len(every) / seconds, 2) if seconds else 0.0
+        total["operations"] = {
+            name: summarize(self.latencies.get(name, []), self.errors.get(name, 0))
+            for name in sorted(set(self.latencies) | set(self.errors))
+        }
+        if self.first_errors:
+            total["first_errors"] = self.first_errors
+        return total
+
+
+async def drive(
+    client: httpx.AsyncClient, operation: Operation, state: State, args: argparse.Namespace, seconds: float,
+    rng: random.Random, recorder: Optional[Recorder],
+):
+    """Call ``operation`` from --concurrency clients for ``seconds``."""
+    deadline = time.perf_counter() + seconds
+
+    async def user(user_rng: random.Random):
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            name = operation.__name__
+            try:
+                name = await operation(client, state, user_rng)
+            except Exception as e:
+                if recorder is not None:
+                    recorder.failed(name, e)
+                continue
+            if recorder is not None:
+                recorder.ok(name, (time.perf_counter() - began) * 1000)
+
+    await asyncio.gather(*(user(random.Random(rng.random())) for _ in range(args.concurrency)))
+
+
+async def bursts(
+    client: httpx.AsyncClient, state: State, args: argparse.Namespace, seconds: float,
+    rng: random.Random, recorder: Optional[Recorder],
+) -> float:
+    """Start every task at once, wait for all of them, repeat for ``seconds``; returns the time spent in bursts."""
+    deadline = time.perf_counter() + seconds
+    busy = 0.0
+
+    async def one(task_id: str):
+        began = time.perf_counter()
+        try:
+            check(await client.post("/scheduled-tasks/run", json={"task_id": task_id}), "run")
+        except Exception as e:
+            if recorder is not None:
+                recorder.failed("run", e)
+            return
+        if recorder is not None:
+            recorder.ok("run", (time.perf_counter() - began) * 1000)
+
+    while time.perf_counter() < deadline:
+        state.bursts += 1
+        for task_id, task in state.tasks:
+            prompt = f"{task['workflow_definition']} [{state.bursts}]"
+            (await client.put(f"/scheduled-tasks/{task_id}", json={**task, "workflow_definition": prompt})).raise_for_status()
+        began = time.perf_counter()
+        await asyncio.gather(*(one(task_id) for task_id, _ in state.tasks))
+        busy += time.perf_counter() - began
+    return busy
+
+
+async def health_during_llm(
+    client: httpx.AsyncClient, state: State, args: argparse.Namespace, seconds: float,
+    rng: random.Random, recorder: Optional[Recorder],
+) -> Recorder:
+    """Poll /health into ``recorder`` while --llm-calls clients call /invoke-llm; returns the LLM calls' recorder."""
+    deadline = time.perf_counter() + seconds
+    llm_calls = Recorder()
+
+    async def caller():
+        while time.perf_counter() < deadline:
+            state.turns += 1
+            began = time.perf_counter()
+            try:
+                response = await client.post("/invoke-llm", json={
+                    "prompt": f"{rng.choice(QUESTIONS)} (שיחה {state.turns})",
+                    "tools": ["manage_crm"],
+                    "cache": False,
+                })
+                response.raise_for_status()
+            except Exception as e:
+                llm_calls.failed("invoke_llm", e)
+                continue
+            llm_calls.ok("invoke_llm", (time.perf_counter() - began) * 1000)
+
+    async def prober():
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            try:
+                check(await client.get("/health"), "health")
+            except Exception as e:
+                if recorder is not None:
+                    recorder.failed("health", e)
+                continue
+            if recorder is not None:
+                recorder.ok("health", (time.perf_counter() - began) * 1000)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(prober(), *(caller() for _ in range(args.llm_calls)))
+    return llm_calls
+
+
+OPERATIONS: Dict[str, Operation] = {"crud": crud, "search": search, "chat": chat, "google": google, "mixed": mixed}
+
+
+async def run_scenarios(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    state = State()
+    connections = max(args.concurrency, args.burst, args.llm_calls + 1)
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await seed(client, state, args, rng)
+        for name in args.scenarios.split(","):
+            print(f"{name}: {args.duration:.0f}s ...", flush=True)
+            for seconds, recorder in ((args.warmup, None), (args.duration, Recorder())):
+                began = time.perf_counter()
+                llm_calls = None
+                if name == "tasks":
+                    measured = await bursts(client, state, args, seconds, rng, recorder)
+                elif name == "health":
+                    llm_calls = await health_during_llm(client, state, args, seconds, rng, recorder)
+                    measured = time.perf_counter() - began
+                else:
+                    await drive(client, OPERATIONS[name], state, args, seconds, rng, recorder)
+                    measured = time.perf_counter() - began
+            results[name] = recorder.result(measured)
+            if llm_calls is not None:
+                results[name]["llm_calls"] = llm_calls.result(measured)
+        health = (await client.get("/health")).json()
+    async with httpx.AsyncClient() as client:
+        fakes = {
+            "gemini": (await client.get(f"http://127.0.0.1:{args.port + 1}/_stats")).json(),
+            "google": (await client.get(f"http://127.0.0.1:{args.port + 2}/_stats")).json(),
+        }
+    return {"scenarios": results, "fakes": fakes, "health": health}
+
+
+# Reporting
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(), "commit": commit}
+
+
+def print_results(results: Dict[str, Any]):
+    print(f"\n{'scenario':<10} {'ops':>7} {'err':>5} {'ops/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, result in results["scenarios"].items():
+        latency = result["latency_ms"]
+        print(f"{name:<10} {result['requests']:>7} {result['errors']:>5} {result['throughput_rps']:>9.1f} "
+              f"{latency['p50']:>9.1f} {latency['p90']:>9.1f} {latency['p99']:>9.1f} {latency['max']:>9.1f}")
+        for error in result.get("first_errors", ()):
+            print(f"    {error}")
+        if "llm_calls" in result:
+            calls = result["llm_calls"]
+            print(f"    with {calls['requests']} /invoke-llm calls ({calls['errors']} failed) in flight, "
+                  f"p50 {calls['latency_ms']['p50']:.0f} ms")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_latency_delta: float) -> List[str]:
+    """Print each scenario against the baseline; returns the regressions."""
+    regressions = []
+    print(f"\n{'scenario':<10} {'metric':<16} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            print(f"{name:<10} (not in the baseline)")
+            continue
+        checks = [
+            ("throughput_rps", before["throughput_rps"], now["throughput_rps"],
+             now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance)),
+            ("error_rate", _error_rate(before), _error_rate(now), _error_rate(now) > _error_rate(before) + 0.01),
+        ]
+        for key in ("p50", "p99"):
+            old, new = before["latency_ms"][key], now["latency_ms"][key]
+            worse = new > old * (1 + tolerance) and new - old > min_latency_delta
+            checks.append((f"latency_{key}_ms", old, new, worse))
+        for metric, old, new, worse in checks:
+            change = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+            print(f"{name:<10} {metric:<16} {old:>10.2f} {new:>10.2f} {change:>8}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f"{name} {metric}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def _error_rate(result: Dict[str, Any]) -> float:
+    return result["errors"] / result["requests"] if result["requests"] else 0.0
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp(prefix="load-test-")
+    processes = start_servers(args, directory)
+    try:
+        asyncio.run(wait_until_up([
+            f"http://127.0.0.1:{args.port + 1}/_stats",
+            f"http://127.0.0.1:{args.port + 2}/_stats",
+            f"http://127.0.0.1:{args.port}/health",
+        ]))
+        measured = asyncio.run(run_scenarios(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    results = {
+        "date": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "baseline", "update_baseline", "tolerance", "min_latency_delta_ms")},
+        "environment": environment(),
+        **measured,
+    }
+    print_results(results)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != results["settings"]:
+            print("Warning: the baseline was run with other settings")
+        regressions = compare(results, baseline, args.tolerance, args.min_latency_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Per-request cost of ``MetricsMiddleware`` and of single metric updates.
+
+Apps are called directly over ASGI, with and without the middleware, in
+alternating rounds; the difference between the best rounds is the
+instrumentation overhead per request. A stub app that only sends a response
+gives the precise figure; a minimal FastAPI app shows it next to a real
+request, where run-to-run noise is of the same order:
+
+    python -m benchmarks.metrics_overhead --requests 20000 --rounds 5
+"""
+import argparse
+import asyncio
+import time
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    return parser.parse_args()
+
+
+def build_app():
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+
+    app = FastAPI()
+
+    @app.get("/items/{item_id}", response_class=PlainTextResponse)
+    async def item(item_id: str):
+        return item_id
+
+    return app
+
+
+class StubRoute:
+    path = "/items/{item_id}"
+
+
+async def stub_app(scope, receive, send):
+    scope["route"] = StubRoute
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"1"})
+
+
+async def call(app, requests: int) -> float:
+    """Seconds per request for ``requests`` sequential GETs."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/items/1", "raw_path": b"/items/1", "root_path": "", "query_string": b"", "headers": [],
+        "client": ("bench", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    began = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - began) / requests
+
+
+def micro(label: str, fn, iterations: int = 200_000) -> str:
+    began = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return f"  {label}: {(time.perf_counter() - began) / iterations * 1e6:.3f} us"
+
+
+def main():
+    args = parse_args()
+    from backend import metrics
+
+    async def measure(plain, instrumented):
+        await call(plain, 1000)
+        await call(instrumented, 1000)
+        bare, timed = [], []
+        for _ in range(args.rounds):
+            bare.append(await call(plain, args.requests))
+            timed.append(await call(instrumented, args.requests))
+        return min(bare), min(timed)
+
+    fastapi_app = build_app()
+    for label, plain, instrumented in (
+        ("stub ASGI app", stub_app, metrics.MetricsMiddleware(stub_app)),
+        ("FastAPI app", fastapi_app, metrics.MetricsMiddleware(fastapi_app)),
+    ):
+        bare, timed = asyncio.run(measure(plain, instrumented))
+        print(f"GET /items/{{item_id}} on a {label}, best of {args.rounds} x {args.requests} requests:")
+        print(f"  without middleware: {bare * 1e6:.2f} us/request")
+        print(f"  with middleware:    {timed * 1e6:.2f} us/request")
+        print(f"  overhead:           {(timed - bare) * 1e6:.2f} us/request")
+
+    counter = metrics.Counter("bench_counter_total", "benchmark", ("route",))
+    histogram = metrics.Histogram("bench_latency_seconds", "benchmark", ("route",))
+    print("Single updates:")
+    print(micro("Counter.inc", lambda: counter.inc("/items/{item_id}")))
+    print(micro("Histogram.observe", lambda: histogram.observe(0.0042, "/items/{item_id}")))
+
+
+if __name__ == "__main__":
+    main()
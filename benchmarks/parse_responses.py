@@ -0,0 +1,192 @@
+"""Parse success and wasted tool calls for a corpus of Gemini answers.
+
+Each answer in the corpus is a shape seen from Gemini in practice (fenced
+JSON, prose around the envelope, trailing commas, cut-off output, plain
+text, not-quite-JSON, calls with bad arguments) with the response and tool
+calls a correct reading gives. The pre-existing parser (split on the fence,
+``json.loads``, then the CRM keyword heuristic) is compared with
+``parse_envelope`` and with what /invoke-llm/stream sends: the tokens of
+``EnvelopeStream`` fed in --chunk-size pieces, and its early tool calls or
+else those of the final parse:
+
+- parsed: the user-facing response came out as intended,
+- wasted: tool calls that would run although the answer did not ask for
+  them or could not succeed (each costs a tool round trip and an LLM call),
+- missed: intended tool calls that were not run,
+- raised: answers the parser failed on with an exception.
+
+    python -m benchmarks.parse_responses --repeat 2000
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+CRM_SEARCH = {"name": "manage_crm", "arguments": {"action": "search_customers", "name": "יוסי"}}
+CALENDAR_LIST = {"name": "manage_calendar", "arguments": {"action": "list_events"}}
+SEND_EMAIL = {
+    "name": "manage_gmail",
+    "arguments": {"action": "send_email", "to": "dana@example.com", "subject": "סיכום", "body": "תודה על הפגישה"},
+}
+
+
+def answer(response: str, *calls: Dict[str, Any], indent: Any = None) -> str:
+    body: Dict[str, Any] = {"response": response}
+    if len(calls) == 1:
+        body["tool_to_call"] = calls[0]
+    elif calls:
+        body["tool_calls"] = list(calls)
+    else:
+        body["tool_to_call"] = None
+    return json.dumps(body, ensure_ascii=False, indent=indent)
+
+
+# (label, answer text, intended response, intended calls)
+CORPUS: List[Tuple[str, str, str, List[Dict[str, Any]]]] = [
+    ("bare json", answer("מחפש לקוח בשם יוסי...", CRM_SEARCH), "מחפש לקוח בשם יוסי...", [CRM_SEARCH]),
+    ("bare json, no tool", answer("שלום! איך אוכל לעזור?"), "שלום! איך אוכל לעזור?", []),
+    ("json fence", "```json\n" + answer("בודק את היומן...", CALENDAR_LIST, indent=2) + "\n```",
+     "בודק את היומן...", [CALENDAR_LIST]),
+    ("plain fence", "```\n" + answer("שולח את המייל...", SEND_EMAIL) + "\n```", "שולח את המייל...", [SEND_EMAIL]),
+    ("prose before", "בטח, הנה התשובה:\n" + answer("מחפש לקוח בשם יוסי...", CRM_SEARCH),
+     "מחפש לקוח בשם יוסי...", [CRM_SEARCH]),
+    ("prose after", answer("בודק את היומן ומחפש את יוסי...", CALENDAR_LIST, CRM_SEARCH)
+     + "\n\nאם תרצה, אוכל גם לקבוע פגישה.", "בודק את היומן ומחפש את יוסי...", [CALENDAR_LIST, CRM_SEARCH]),
+    ("fence and prose after", "```json\n" + answer("שלום! מה שלומך?") + "\n```\nהערה: לא נדרש כלי.",
+     "שלום! מה שלומך?", []),
+    ("braces in strings", answer("התבנית היא {שם} {תאריך} - ממלא אותה", SEND_EMAIL),
+     "התבנית היא {שם} {תאריך} - ממלא אותה", [SEND_EMAIL]),
+    ("trailing comma", '{"response": "מחפש לקוח בשם יוסי...", "tool_to_call": {"name": "manage_crm", '
+     '"arguments": {"action": "search_customers", "name": "יוסי",},},}', "מחפש לקוח בשם יוסי...", [CRM_SEARCH]),
+    ("cut off in response", '{"response": "הנה סיכום הלקוחות שמצאתי: יוסי כהן, דנה לוי, ומשה',
+     "הנה סיכום הלקוחות שמצאתי: יוסי כהן, דנה לוי, ומשה", []),
+    ("cut off in arguments", '{"response": "מחפש לקוח...", "tool_to_call": {"name": "manage_crm", '
+     '"arguments": {"action": "search_customers", "name": "יו', "מחפש לקוח...", []),
+    ("plain text with keywords", "לא מצאתי לקוח בשם הזה. תרצה שאצור לקוח חדש?",
+     "לא מצאתי לקוח בשם הזה. תרצה שאצור לקוח חדש?", []),
+    ("plain text", "בוקר טוב! במה אפשר לעזור היום?", "בוקר טוב! במה אפשר לעזור היום?", []),
+    ("unknown action", answer("מוחק את כל הלקוחות...", {"name": "manage_crm", "arguments": {"action": "drop_all"}}),
+     "מוחק את כל הלקוחות...", []),
+    ("unknown tool", answer("פותח את Slack...", {"name": "manage_slack", "arguments": {"action": "post"}}),
+     "פותח את Slack...", []),
+    ("missing action", answer("מחפש...", {"name": "manage_crm", "arguments": {"name": "יוסי"}}), "מחפש...", []),
+    ("numeric string", answer("מחפש...", {"name": "manage_crm", "arguments": {
+        "action": "search_customers", "name": "יוסי", "limit": "3"}}),
+     "מחפש...", [{"name": "manage_crm", "arguments": {"action": "search_customers", "name": "יוסי", "limit": 3}}]),
+    # Not JSON, so used as plain text, calls and all.
+    ("unquoted keys", '{response: "מחפש לקוח...", tool_to_call: null}',
+     '{response: "מחפש לקוח...", tool_to_call: null}', []),
+    ("bad unicode escape", '{"response": "\\uZZZZ"}', '{"response": "\\uZZZZ"}', []),
+    ("unknown escape", '{"response": "\\x41 בדיקה", "tool_to_call": null}',
+     '{"response": "\\x41 בדיקה", "tool_to_call": null}', []),
+]
+
+
+def legacy_parse(response_text: str) -> Dict[str, Any]:
+    """The parser this repo used before: fence split, json.loads, keyword heuristic."""
+    from backend.llm_response import envelope, normalize_tool_calls
+
+    try:
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+        parsed_response = json.loads(response_text)
+        if "response" in parsed_response:
+            return envelope(
+                parsed_response.get("response", "תשובה מהסוכן"),
+                normalize_tool_calls(parsed_response.get("tool_calls"), parsed_response.get("tool_to_call")),
+            )
+    except json.JSONDecodeError:
+        pass
+    if any(keyword in response_text.lower() for keyword in ["חפש", "מצא", "לקוח", "crm", "צור", "עדכן"]):
+        return envelope(response_text, [{"name": "manage_crm", "arguments": {"action": "list_recent_customers"}}])
+    return envelope(response_text, [])
+
+
+def streamed(text: str, tools: List[Dict[str, Any]], chunk_size: int) -> Dict[str, Any]:
+    """What /invoke-llm/stream shows: the tokens, and the early tool calls or else the final parse's."""
+    from backend.llm_response import EnvelopeStream, envelope, parse_envelope
+
+    parser = EnvelopeStream(tools)
+    tokens, calls = [], []
+    for start in range(0, len(text), chunk_size):
+        for event, data in parser.feed(text[start:start + chunk_size]):
+            if event == "token":
+                tokens.append(data)
+            else:
+                calls = data
+    return envelope("".join(tokens), calls or parse_envelope(parser.buffer, tools)["tool_calls"])
+
+
+def score(parse: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+    parsed = wasted = missed = raised = 0
+    failures = []
+    for label, text, response, calls in CORPUS:
+        try:
+            result = parse(text)
+        except Exception:
+            raised += 1
+            failures.append(f"{label} (raised)")
+            continue
+        ok = result["response"] == response
+        parsed += ok
+        extra = [call for call in result["tool_calls"] if call not in calls]
+        lost = [call for call in calls if call not in result["tool_calls"]]
+        wasted += len(extra)
+        missed += len(lost)
+        if not ok or extra or lost:
+            failures.append(label)
+    return {"parsed": parsed, "wasted": wasted, "missed": missed, "raised": raised, "failures": failures}
+
+
+def timing(parse: Callable[[str], Dict[str, Any]], repeat: int) -> float:
+    """Microseconds per answer over the corpus."""
+    began = time.perf_counter()
+    for _ in range(repeat):
+        for _, text, _, _ in CORPUS:
+            try:
+                parse(text)
+            except Exception:
+                pass
+    return (time.perf_counter() - began) / (repeat * len(CORPUS)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=7, help="characters per streamed chunk")
+    args = parser.parse_args()
+
+    from backend import agent_tools
+    from backend.llm_response import parse_envelope
+
+    tools = agent_tools.select_tools()
+    total_calls = sum(len(calls) for *_, calls in CORPUS)
+    print(f"{len(CORPUS)} answers, {total_calls} intended tool calls")
+    results = {}
+    parsers = (
+        ("legacy", legacy_parse),
+        ("parse_envelope", lambda text: parse_envelope(text, tools)),
+        ("EnvelopeStream", lambda text: streamed(text, tools, args.chunk_size)),
+    )
+    for name, parse in parsers:
+        # parse_envelope logs each call it drops; keep the report readable.
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = results[name] = score(parse)
+            micros = timing(parse, args.repeat)
+        print(f"{name}:")
+        print(f"  parsed:            {result['parsed']}/{len(CORPUS)} ({result['parsed'] / len(CORPUS):.0%})")
+        print(f"  wasted tool calls: {result['wasted']}")
+        print(f"  missed tool calls: {result['missed']}")
+        print(f"  raised:            {result['raised']}")
+        print(f"  time:              {micros:.1f} us/answer")
+        if result["failures"]:
+            print(f"  wrong:             {', '.join(result['failures'])}")
+    print(f"wasted tool calls avoided: {results['legacy']['wasted'] - results['parse_envelope']['wasted']}")
+
+
+if __name__ == "__main__":
+    main()
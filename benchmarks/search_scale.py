@@ -0,0 +1,126 @@
+"""Customer search over N records: the search index vs a scan of every record.
+
+Builds one ``SearchIndex`` with the fields of the customer index (all
+records in one tenant, the worst case for ``TenantSearchIndex``) and times
+lookups: status, substring queries of 1, 2, 3 and more characters,
+and combinations. The scan is what ``search_customers`` did before the
+index: lower-case every field value and look for the query in it.
+
+Then deletes --churn of the records and adds as many new ones, twice, to
+show the slots of deleted records being reclaimed. Reports build time,
+the process's peak memory and every lookup's result count, which is
+checked against the scan.
+
+    python -m benchmarks.search_scale --records 1000000
+    python -m benchmarks.search_scale --records 200000 --scan-repeat 5
+"""
+import argparse
+import resource
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from backend.search_index import SearchIndex
+
+EXACT_FIELDS = ("status", "segment")
+TEXT_FIELDS = ("name", "company", "notes", "email")
+FIRST_NAMES = ["דוד", "שרה", "יוסי", "דנה", "משה", "נועה", "אבי", "מיכל", "Yosi", "Dana", "Noa", "Avi"]
+LAST_NAMES = ["כהן", "לוי", "מזרחי", "פרץ", "ביטון", "Cohen", "Levi", "Mizrahi", "Peretz", "Biton"]
+STATUSES = ("lead", "prospect", "customer", "inactive")
+SEGMENTS = ("small_business", "enterprise", "individual")
+QUERIES: Dict[str, Dict[str, Any]] = {
+    "status": {"status": "prospect"},
+    "name, 1 char": {"name": "q"},
+    "name, 2 chars": {"name": "zq"},
+    "name, 3 chars": {"name": "ביט"},
+    "name, 7 chars": {"name": "noa per"},
+    "name id, 8 chars": {"name": "#0123456"},
+    "company, 2 chars": {"company": "77"},
+    "name + status": {"name": "dana levi", "status": "prospect"},
+    "email + segment": {"email": "customer4242", "segment": "enterprise"},
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20, help="timed lookups per query")
+    parser.add_argument("--scan-repeat", type=int, default=2, help="timed scans per query")
+    parser.add_argument("--churn", type=float, default=0.6, help="share of records replaced per churn round")
+    return parser.parse_args()
+
+
+def customer(i: int) -> Dict[str, Any]:
+    first, last = FIRST_NAMES[i % len(FIRST_NAMES)], LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]
+    # A few names carry rarer letters, so short queries have small answers too.
+    suffix = " zq" if i % 1000 == 0 else (" q" if i % 100 == 0 else "")
+    return {
+        "name": f"{first} {last} #{i:07d}{suffix}",
+        "email": f"customer{i}@example.com",
+        "company": f"חברה {i % 5000}",
+        "status": STATUSES[i % len(STATUSES)],
+        "segment": SEGMENTS[i % len(SEGMENTS)],
+        "notes": "נוצר לצורך מדידת ביצועים",
+    }
+
+
+def scan(records: Dict[str, Dict[str, Any]], filters: Dict[str, Any]) -> List[str]:
+    results = list(records.items())
+    for key, value in filters.items():
+        v = str(value).lower()
+        results = [(record_id, c) for record_id, c in results if str(c.get(key, "")).lower().find(v) != -1]
+    return [record_id for record_id, _ in results]
+
+
+def timed(call: Callable[[], Any], repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - began)
+    return statistics.median(latencies) * 1000
+
+
+def peak_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    args = parse_args()
+    records = {f"customer-{i}": customer(i) for i in range(args.records)}
+    before = peak_mb()
+    began = time.perf_counter()
+    index = SearchIndex(EXACT_FIELDS, TEXT_FIELDS)
+    for record_id, obj in records.items():
+        index.update(record_id, obj)
+    print(f"{args.records} records indexed in {time.perf_counter() - began:.1f} s, "
+          f"peak memory {before:.0f} -> {peak_mb():.0f} MB\n")
+
+    print(f"  {'query':<20} {'matches':>8} {'index p50':>12} {'scan p50':>12}")
+    for name, filters in QUERIES.items():
+        ids, _ = index.lookup(filters)
+        expected = scan(records, filters)
+        check = "" if ids == expected else f"   MISMATCH: the scan found {len(expected)}"
+        indexed = timed(lambda: index.lookup(filters), args.repeat)
+        scanned = timed(lambda: scan(records, filters), args.scan_repeat)
+        print(f"  {name:<20} {len(ids):>8} {indexed:>9.3f} ms {scanned:>9.1f} ms{check}")
+
+    print()
+    next_id = args.records
+    for churn_round in range(2):
+        replaced = list(records)[:int(len(records) * args.churn)]
+        began = time.perf_counter()
+        for record_id in replaced:
+            index.update(record_id, None)
+            del records[record_id]
+        for _ in replaced:
+            record_id = f"customer-{next_id}"
+            records[record_id] = customer(next_id)
+            index.update(record_id, records[record_id])
+            next_id += 1
+        print(f"churn round {churn_round + 1}: replaced {len(replaced)} records in {time.perf_counter() - began:.1f} s; "
+              f"index {index.stats()}, peak memory {peak_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""One tenant's page, count and usage among N tenants, on both backends.
+
+Fills each backend with --tenants tenants of --rows customers each (the
+default 10k x 30 is 300k rows) and times, for randomly picked tenants:
+
+- page: the first --page records, newest first, through the tenant view;
+- count: ``len`` of the tenant view;
+- usage: ``usage(tenant)``, the tenant's rows and bytes.
+
+It also checks isolation for every timed tenant. The page and count must
+hold only that tenant's records. Reading, overwriting or deleting a record
+of another tenant through the view must fail. Every tenant's usage must
+add up to the whole collection. Exits with status 1 on any leak.
+
+    python -m benchmarks.tenants_scale --tenants 10000 --rows 30
+    python -m benchmarks.tenants_scale --backends sqlite --samples 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from backend.storage import Database, MemoryRepository, Repository, SQLiteRepository, encode_record
+
+INDEXED_FIELDS = ("status", "created_date")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=10_000)
+    parser.add_argument("--rows", type=int, default=30, help="customers per tenant")
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=200, help="tenants timed and checked")
+    parser.add_argument("--backends", default="memory,sqlite")
+    return parser.parse_args()
+
+
+def customers(tenants: int, rows: int) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    start = datetime(2024, 1, 1)
+    # Interleaved, so no tenant's records are stored next to each other.
+    for i in range(tenants * rows):
+        customer_id = f"customer-{i}"
+        yield customer_id, {
+            "id": customer_id,
+            "user_id": f"user-{i % tenants}",
+            "name": f"לקוח {i}",
+            "email": f"customer{i}@example.com",
+            "status": ("lead", "prospect", "customer")[i % 3],
+            "created_date": start + timedelta(seconds=i),
+        }
+
+
+def open_repo(backend: str, workdir: str) -> Repository:
+    if backend == "memory":
+        return MemoryRepository("customers", INDEXED_FIELDS, "user_id")
+    return SQLiteRepository(Database(os.path.join(workdir, "tenants.db")), "customers", INDEXED_FIELDS, "user_id")
+
+
+def timed(call: Callable[[], Any], latencies: List[float]) -> Any:
+    began = time.perf_counter()
+    result = call()
+    latencies.append(time.perf_counter() - began)
+    return result
+
+
+def leaks(repo: Repository, tenant: str, other_id: str, rows: int, page: List[Dict[str, Any]], count: int) -> List[str]:
+    found = []
+    if any(obj["user_id"] != tenant for obj in page):
+        found.append("page holds another tenant's records")
+    if count != rows:
+        found.append(f"count is {count}, not {rows}")
+    view = repo.tenant(tenant)
+    if view.get(other_id) is not None or other_id in view:
+        found.append(f"reads {other_id}")
+    try:
+        view[other_id] = {"id": other_id, "name": "taken over"}
+        found.append(f"overwrites {other_id}")
+    except KeyError:
+        pass
+    try:
+        del view[other_id]
+        found.append(f"deletes {other_id}")
+    except KeyError:
+        pass
+    if view.get_many([other_id]):
+        found.append(f"batch-reads {other_id}")
+    return found
+
+
+def summary(latencies: List[float]) -> str:
+    latencies = sorted(latencies)
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    return f"p50 {statistics.median(latencies) * 1000:7.3f} ms   p99 {p99 * 1000:7.3f} ms"
+
+
+def main():
+    args = parse_args()
+    total = args.tenants * args.rows
+    rng = random.Random(0)
+    sampled = [f"user-{t}" for t in rng.sample(range(args.tenants), min(args.samples, args.tenants))]
+    workdir = tempfile.mkdtemp(prefix="tenants-scale-")
+    print(f"{args.tenants} tenants x {args.rows} customers = {total} rows; {len(sampled)} tenants timed\n")
+    failed = False
+    for backend in args.backends.split(","):
+        repo = open_repo(backend, workdir)
+        began = time.perf_counter()
+        batch: List[Tuple[str, Dict[str, Any]]] = []
+        for record in customers(args.tenants, args.rows):
+            batch.append(record)
+            if len(batch) == 10_000:
+                repo.put_many(batch)
+                batch = []
+        repo.put_many(batch)
+        loaded = time.perf_counter() - began
+
+        timings: Dict[str, List[float]] = {"page": [], "count": [], "usage": []}
+        problems = []
+        for tenant in sampled:
+            view = repo.tenant(tenant)
+            page, _ = timed(lambda: view.query(sort="-created_date", limit=args.page), timings["page"])
+            count = timed(lambda: len(view), timings["count"])
+            usage = timed(lambda: repo.usage(tenant), timings["usage"])
+            if usage[tenant]["rows"] != args.rows:
+                problems.append(f"{tenant}: usage counts {usage[tenant]['rows']} rows")
+            # The record just before the tenant's first one belongs to a neighbour.
+            neighbour = f"customer-{(int(tenant.split('-')[1]) - 1) % args.tenants}"
+            problems += [f"{tenant}: {leak}" for leak in leaks(repo, tenant, neighbour, args.rows, page, count)]
+
+        began = time.perf_counter()
+        everyone = repo.usage()
+        all_usage = time.perf_counter() - began
+        rows = sum(usage["rows"] for usage in everyone.values())
+        size = sum(usage["bytes"] for usage in everyone.values())
+        stored = sum(len(encode_record(obj).encode("utf-8")) for obj in repo.values())
+        if len(everyone) != args.tenants or rows != total or size != stored:
+            problems.append(f"usage of all tenants: {len(everyone)} tenants, {rows} rows, {size} of {stored} bytes")
+
+        print(f"{backend} (load: {loaded:.1f} s)")
+        for name, latencies in timings.items():
+            print(f"  {name:<6} {summary(latencies)}")
+        print(f"  usage of all {len(everyone)} tenants: {all_usage * 1000:.1f} ms")
+        print(f"  isolation: {'ok' if not problems else f'{len(problems)} problems'}")
+        for problem in problems[:10]:
+            print(f"    {problem}")
+        failed = failed or bool(problems)
+        print()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
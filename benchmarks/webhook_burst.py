@@ -0,0 +1,202 @@
+"""A burst of webhook events for one task, sent to several server processes.
+
+Starts --workers uvicorn processes on one SQLite database, creates one
+webhook-enabled task and sends it --events events, each with its own
+Idempotency-Key, spread over the processes with --concurrency requests in
+flight. Meanwhile every process's /health is polled, to show whether
+accepting events (and claiming their keys in SQLite) holds up the event
+loop. Then --duplicates of the keys are sent again, each to a different
+process than the first time; every answer must name the first event.
+
+With --hold-lock-ms, a connection in this process takes the database's
+write lock for that long every second of the burst, as a busy worker
+would. Key claims then wait for it; /health must not.
+
+Reports accepted events/s, webhook latency, /health latency during the
+burst, the outcomes and how many runs the burst cost. Exits with status 1
+if a resent key was queued again or named another event.
+
+    python -m benchmarks.webhook_burst --workers 2 --events 20000
+    python -m benchmarks.webhook_burst --workers 2 --events 5000 --hold-lock-ms 500
+    python -m benchmarks.webhook_burst --workers 1 --events 5000 --no-keys
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64, help="webhook requests in flight")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of keys sent again")
+    parser.add_argument("--no-keys", action="store_true", help="send no Idempotency-Key (and resend nothing)")
+    parser.add_argument("--hold-lock-ms", type=float, default=0, help="write lock held per second of the burst")
+    parser.add_argument("--port", type=int, default=8870, help="first port; worker i listens on port + i")
+    return parser.parse_args()
+
+
+def start_workers(count: int, first_port: int, database: str) -> List[subprocess.Popen]:
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "DATABASE_PATH": database,
+        "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    }
+    env.pop("GEMINI_API_KEY", None)  # runs answer at once; the burst is what is measured
+    return [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(first_port + i), "--log-level", "warning"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for i in range(count)
+    ]
+
+
+async def wait_until(clients: List[httpx.AsyncClient], ready, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    for client in clients:
+        while True:
+            try:
+                if ready((await client.get("/health")).json()):
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"{client.base_url} did not get ready")
+            await asyncio.sleep(0.2)
+
+
+async def send(client: httpx.AsyncClient, task: Dict[str, str], key: Optional[str]) -> Tuple[int, Dict[str, str], float]:
+    headers = {"X-Webhook-Secret": task["webhook_secret"]}
+    if key:
+        headers["Idempotency-Key"] = key
+    began = time.perf_counter()
+    response = await client.post(
+        f"/webhooks/{task['id']}",
+        json={"key": key, "lead": {"name": "ליד חדש", "source": "benchmark"}},
+        headers=headers,
+    )
+    elapsed = time.perf_counter() - began
+    return response.status_code, response.json() if response.status_code == 202 else {}, elapsed
+
+
+async def poll_health(clients: List[httpx.AsyncClient], latencies: List[float], done: asyncio.Event):
+    while not done.is_set():
+        for client in clients:
+            began = time.perf_counter()
+            await client.get("/health")
+            latencies.append(time.perf_counter() - began)
+        await asyncio.sleep(0.02)
+
+
+def hold_lock(database: str, hold_seconds: float, done: threading.Event):
+    connection = sqlite3.connect(database, isolation_level=None, timeout=30)
+    while not done.is_set():
+        connection.execute("BEGIN IMMEDIATE")
+        time.sleep(hold_seconds)
+        connection.execute("COMMIT")
+        done.wait(max(0.0, 1 - hold_seconds))
+    connection.close()
+
+
+def summary(latencies: List[float]) -> str:
+    latencies = sorted(latencies)
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    return f"p50 {statistics.median(latencies) * 1000:7.1f} ms   p99 {p99 * 1000:7.1f} ms   max {latencies[-1] * 1000:7.1f} ms"
+
+
+async def burst(args: argparse.Namespace, database: str):
+    clients = [httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port + i}", timeout=60) for i in range(args.workers)]
+    await wait_until(clients, lambda health: health["ok"])
+    response = await clients[0].post("/scheduled-tasks", json={
+        "agent_id": "agent-1",
+        "task_name": "webhook burst",
+        "workflow_definition": "סכם את הלידים החדשים",
+        "webhook_trigger": True,
+    })
+    response.raise_for_status()
+    task = response.json()
+    # The other processes learn about the task through the change log.
+    await wait_until(clients, lambda health: health["webhooks"]["hooks"] >= 1)
+
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def limited(i: int, key: Optional[str]):
+        async with slots:
+            return await send(clients[i % args.workers], task, key)
+
+    health_latencies: List[float] = []
+    done = asyncio.Event()
+    poller = asyncio.ensure_future(poll_health(clients, health_latencies, done))
+    released = threading.Event()
+    holder = threading.Thread(target=hold_lock, args=(database, args.hold_lock_ms / 1000, released))
+    if args.hold_lock_ms:
+        holder.start()
+    began = time.perf_counter()
+    first = await asyncio.gather(*(limited(i, None if args.no_keys else f"event-{i}") for i in range(args.events)))
+    elapsed = time.perf_counter() - began
+    done.set()
+    released.set()
+    await poller
+    if args.hold_lock_ms:
+        holder.join()
+
+    outcomes = Counter(body.get("status", str(status)) for status, body, _ in first)
+    accepted = sum(1 for status, _, _ in first if status == 202)
+    print(f"{args.events} events to {args.workers} workers, {args.concurrency} in flight: "
+          f"{accepted / elapsed:,.0f} accepted events/s")
+    print(f"  webhook  {summary([latency for _, _, latency in first])}")
+    print(f"  /health  {summary(health_latencies)}   ({len(health_latencies)} polls during the burst)")
+    print(f"  outcomes {dict(outcomes)}")
+
+    resent = [] if args.no_keys else random.Random(0).sample(range(args.events), int(args.events * args.duplicates))
+    again = await asyncio.gather(*(limited(i + 1, f"event-{i}") for i in resent))
+    wrong = [
+        i for i, (status, body, _) in zip(resent, again)
+        if first[i][0] == 202 and (status != 202 or body["status"] != "duplicate" or body["event_id"] != first[i][1]["event_id"])
+    ]
+    if resent:
+        print(f"  {len(resent)} keys resent to another worker: {len(resent) - len(wrong)} named the first event")
+
+    await wait_until(clients, lambda health: health["webhooks"]["queued_events"] == 0, timeout=300)
+    runs = [(await client.get("/health")).json()["webhooks"]["runs"] for client in clients]
+    print(f"  runs: {sum(runs)} ({' + '.join(map(str, runs))} per worker)")
+    for client in clients:
+        await client.aclose()
+    return wrong
+
+
+def main():
+    args = parse_args()
+    database = os.path.join(tempfile.mkdtemp(prefix="webhook-burst-"), "app.db")
+    processes = start_workers(args.workers, args.port, database)
+    try:
+        wrong = asyncio.run(burst(args, database))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    if wrong:
+        print(f"  resent keys not answered as duplicates: {wrong[:10]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,14 +32,60 @@ async function request(path, options = {}) {
     error.data = data;
     throw error;
   }
+  if (options.page) {
+    // List endpoints put the cursor for the following page in a header.
+    return { items: data, next: res.headers.get('X-Next-Cursor') };
+  }
   return data;
 }
 
+async function stream(path, body, onEvent) {
+  const res = await fetch(`${API_BASE_URL}${path}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify(body),
+    credentials: 'include'
+  });
+  if (!res.ok || !res.body) {
+    const error = new Error('Request failed');
+    error.status = res.status;
+    throw error;
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      const parsed = data ? JSON.parse(data) : null;
+      if (event === 'done') result = parsed;
+      onEvent?.(event, parsed);
+    }
+  }
+  return result;
+}
+
 export const api = {
   get: (path) => request(path),
+  page: (path) => request(path, { page: true }),
   post: (path, body) => request(path, { method: 'POST', body }),
   put: (path, body) => request(path, { method: 'PUT', body }),
-  delete: (path) => request(path, { method: 'DELETE' })
+  delete: (path) => request(path, { method: 'DELETE' }),
+  url: (path) => `${API_BASE_URL}${path}`,
+  stream
 };
 
 export default api;
@@ -1,15 +1,36 @@
 import { api } from './client';
 
+// `sort` is a field name ('-' prefix for descending); `options` may hold `after`
+// (the X-Next-Cursor of the previous page), `fields` and equality filters.
+const listPath = (path, sort, limit, options = {}) => {
+  const params = new URLSearchParams();
+  if (sort) params.set('sort', sort);
+  if (limit) params.set('limit', limit);
+  for (const [key, value] of Object.entries(options)) {
+    if (value !== undefined && value !== null) {
+      params.set(key, Array.isArray(value) ? value.join(',') : value);
+    }
+  }
+  const query = params.toString();
+  return query ? `${path}?${query}` : path;
+};
+
+const countPath = (path, filter = {}) => listPath(path, null, null, { ...filter, count: true });
+
 export const Agent = {
-  list: async () => api.get('/agents'),
+  list: async (sort, limit, options) => api.get(listPath('/agents', sort, limit, options)),
   get: async (id) => api.get(`/agents/${id}`),
   create: async (payload) => api.post('/agents', payload),
   update: async (id, payload) => api.put(`/agents/${id}`, payload),
-  delete: async (id) => api.delete(`/agents/${id}`)
+  delete: async (id) => api.delete(`/agents/${id}`),
+  // Runs a whole chat turn (LLM + tools) on the server; `onEvent(event, data)` receives progress.
+  chat: async (id, body, onEvent) => api.stream(`/agents/${id}/chat`, body, onEvent)
 };
 
 export const Customer = {
-  list: async () => api.get('/customers'),
+  list: async (sort, limit, options) => api.get(listPath('/customers', sort, limit, options)),
+  page: async (sort, limit, options) => api.page(listPath('/customers', sort, limit, options)),
+  count: async (filter) => (await api.get(countPath('/customers', filter))).count,
   filter: async (filter) => api.post('/customers/search', filter),
   get: async (id) => api.get(`/customers/${id}`),
   create: async (payload) => api.post('/customers', payload),
@@ -18,7 +39,7 @@ export const Customer = {
 };
 
 export const ScheduledTask = {
-  list: async () => api.get('/scheduled-tasks'),
+  list: async (sort, limit, options) => api.get(listPath('/scheduled-tasks', sort, limit, options)),
   get: async (id) => api.get(`/scheduled-tasks/${id}`),
   create: async (payload) => api.post('/scheduled-tasks', payload),
   update: async (id, payload) => api.put(`/scheduled-tasks/${id}`, payload),
@@ -26,7 +47,13 @@ export const ScheduledTask = {
 };
 
 export const Activity = {
-  list: async () => api.get('/activities')
+  list: async (sort, limit, options) => api.get(listPath('/activities', sort, limit, options)),
+  count: async (filter) => (await api.get(countPath('/activities', filter))).count
+};
+
+// Counts for the dashboard, by status, type, ... with `daily` and `hourly` series.
+export const Stats = {
+  get: async (options) => api.get(listPath('/stats', null, null, options))
 };
 
 export const User = {
@@ -39,4 +66,17 @@ export const AgentTemplate = {
   create: async (payload) => api.post('/agent-templates', payload),
   update: async (id, payload) => api.put(`/agent-templates/${id}`, payload),
   delete: async (id) => api.delete(`/agent-templates/${id}`)
-};
\ No newline at end of file
+};
+// Writes to agents, customers, tasks, activities and templates, in order.
+export const Changes = {
+  // `{ changes, next, has_more, reset }`; without `since`, only the `next` to start from.
+  since: async (since, options) => api.get(listPath('/changes', null, null, { since, ...options })),
+  // Pushes each change to `onChange`; `onReset` means the lists must be reloaded.
+  // Returns a function that closes the stream.
+  subscribe: (collections, onChange, onReset) => {
+    const source = new EventSource(api.url(listPath('/changes/stream', null, null, { collections })), { withCredentials: true });
+    source.addEventListener('change', (event) => onChange(JSON.parse(event.data)));
+    source.addEventListener('reset', () => onReset?.());
+    return () => source.close();
+  }
+};
@@ -4,6 +4,12 @@ export const InvokeLLM = async ({ prompt, response_json_schema, temperature }) =
   return api.post('/invoke-llm', { prompt, response_json_schema, temperature });
 };
 
+// Streams /invoke-llm over Server-Sent Events. `onEvent(event, data)` is called for
+// every `token`, `tool_calls`, `error` and `done` event; resolves with the `done` payload.
+export const InvokeLLMStream = async ({ prompt, temperature }, onEvent) => {
+  return api.stream('/invoke-llm/stream', { prompt, temperature }, onEvent);
+};
+
 export const SendEmail = async (body) => api.post('/core/send-email', body);
 
 export const UploadFile = async (body) => api.post('/core/upload-file', body);
@@ -38,6 +38,7 @@ export default function ScheduledTasksPanel({ currentAgentId }) {
         schedule_type: 'daily',
         schedule_time: '09:00',
         schedule_day: 1,
+        interval_minutes: 60,
         workflow_definition: '',
         workflow_type: 'prompt',
         tools_to_use: [],
@@ -74,7 +75,7 @@ export default function ScheduledTasksPanel({ currentAgentId }) {
         }
 
         try {
-            const nextRunAt = calculateNextRunTime(newTask.schedule_type, newTask.schedule_time, newTask.schedule_day);
+            const nextRunAt = calculateNextRunTime(newTask.schedule_type, newTask.schedule_time, newTask.schedule_day, newTask.interval_minutes);
             
             const taskData = {
                 ...newTask,
@@ -92,6 +93,7 @@ export default function ScheduledTasksPanel({ currentAgentId }) {
                 schedule_type: 'daily',
                 schedule_time: '09:00',
                 schedule_day: 1,
+                interval_minutes: 60,
                 workflow_definition: '',
                 workflow_type: 'prompt',
                 tools_to_use: [],
@@ -172,8 +174,11 @@ export default function ScheduledTasksPanel({ currentAgentId }) {
         }
     };
 
-    const calculateNextRunTime = (scheduleType, scheduleTime, scheduleDay) => {
+    const calculateNextRunTime = (scheduleType, scheduleTime, scheduleDay, intervalMinutes) => {
         const now = new Date();
+        if (scheduleType === 'interval') {
+            return new Date(now.getTime() + intervalMinutes * 60000).toISOString();
+        }
         const [hours, minutes] = scheduleTime.split(':').map(Number);
         
         let nextRun = new Date();
@@ -297,6 +302,7 @@ export default function ScheduledTasksPanel({ currentAgentId }) {
                                             <SelectItem value="daily" className="text-white text-xs">יומי</SelectItem>
                                             <SelectItem value="weekly" className="text-white text-xs">שבועי</SelectItem>
                                             <SelectItem value="monthly" className="text-white text-xs">חודשי</SelectItem>
+                                            <SelectItem value="interval" className="text-white text-xs">כל X דקות</SelectItem>
                                         </SelectContent>
                                     </Select>
                                 </div>
@@ -332,6 +338,19 @@ export default function ScheduledTasksPanel({ currentAgentId }) {
                                 </div>
                             )}
 
+                            {newTask.schedule_type === 'interval' && (
+                                <div>
+                                    <Label className="text-white/80 text-xs">מרווח (דקות)</Label>
+                                    <Input
+                                        type="number"
+                                        min="1"
+                                        value={newTask.interval_minutes}
+                                        onChange={(e) => setNewTask({...newTask, interval_minutes: Math.max(1, parseInt(e.target.value, 10) || 1)})}
+                                        className="glass border-white/20 text-white text-xs h-8"
+                                    />
+                                </div>
+                            )}
+
                             {newTask.schedule_type === 'monthly' && (
                                 <div>
                                     <Label className="text-white/80 text-xs">יום בחודש</Label>
@@ -1,5 +1,5 @@
-import React, { useState, useEffect } from 'react';
-import { Customer } from '@/api/entities';
+import React, { useState, useEffect, useRef } from 'react';
+import { Changes, Customer } from '@/api/entities';
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Card, CardContent } from "@/components/ui/card";
@@ -16,8 +16,15 @@ import CreateCustomerModal from '@/components/customers/CreateCustomerModal';
 import EditCustomerModal from '@/components/customers/EditCustomerModal';
 import CustomersTable from '@/components/customers/CustomersTable';
 
+const PAGE_SIZE = 100;
+const STATUSES = ['lead', 'prospect', 'customer', 'churned'];
+// Counts are re-read at most once per this interval while changes stream in.
+const COUNTS_REFRESH_MS = 1000;
+
 export default function Customers() {
     const [customers, setCustomers] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [statusCounts, setStatusCounts] = useState({ all: 0, lead: 0, prospect: 0, customer: 0, churned: 0 });
     const [searchTerm, setSearchTerm] = useState('');
     const [filterStatus, setFilterStatus] = useState('all');
     const [showCreateModal, setShowCreateModal] = useState(false);
@@ -25,15 +32,44 @@ export default function Customers() {
     const [editingCustomer, setEditingCustomer] = useState(null);
     const [loading, setLoading] = useState(true);
     const [viewMode, setViewMode] = useState('grid'); // 'grid' or 'table'
+    const filterRef = useRef(filterStatus);
 
     useEffect(() => {
+        filterRef.current = filterStatus;
         loadCustomers();
+    }, [filterStatus]);
+
+    useEffect(() => {
+        loadStatusCounts();
+    }, []);
+
+    // Writes from anywhere (other tabs, agents, imports) arrive as changes,
+    // so the list is patched instead of re-fetched.
+    useEffect(() => {
+        let countsTimer = null;
+        const close = Changes.subscribe('customers', (change) => {
+            applyChange(change);
+            if (!countsTimer) {
+                countsTimer = setTimeout(() => {
+                    countsTimer = null;
+                    loadStatusCounts();
+                }, COUNTS_REFRESH_MS);
+            }
+        }, reloadCustomers);
+        return () => {
+            close();
+            clearTimeout(countsTimer);
+        };
     }, []);
 
-    const loadCustomers = async () => {
+    // Loads the first page, or the next one when `after` is given.
+    const loadCustomers = async (after) => {
         try {
-            const customersData = await Customer.list('-last_interaction');
-            setCustomers(Array.isArray(customersData) ? customersData : []);
+            const status = filterStatus === 'all' ? undefined : filterStatus;
+            const { items, next } = await Customer.page('-created_date', PAGE_SIZE, { after, status });
+            const page = Array.isArray(items) ? items : [];
+            setCustomers(prev => after ? [...prev, ...page] : page);
+            setNextCursor(next);
         } catch (error) {
             console.error('Error loading customers:', error);
         } finally {
@@ -41,11 +77,44 @@ export default function Customers() {
         }
     };
 
+    const loadStatusCounts = async () => {
+        try {
+            const [all, ...byStatus] = await Promise.all([
+                Customer.count(),
+                ...STATUSES.map(status => Customer.count({ status }))
+            ]);
+            setStatusCounts({ all, ...Object.fromEntries(STATUSES.map((status, i) => [status, byStatus[i]])) });
+        } catch (error) {
+            console.error('Error loading customer counts:', error);
+        }
+    };
+
+    const reloadCustomers = () => {
+        loadCustomers();
+        loadStatusCounts();
+    };
+
+    // Applies an upsert or delete to the loaded list; new customers go first (newest first).
+    const applyChange = ({ op, id, record }) => {
+        setCustomers(prev => {
+            const index = prev.findIndex(customer => customer.id === id);
+            const visible = op !== 'delete' && (filterRef.current === 'all' || record.status === filterRef.current);
+            if (!visible) {
+                return index === -1 ? prev : prev.filter(customer => customer.id !== id);
+            }
+            if (index === -1) return [record, ...prev];
+            const next = [...prev];
+            next[index] = record;
+            return next;
+        });
+    };
+
     const handleCreateCustomer = async (customerData) => {
         try {
-            await Customer.create(customerData);
+            const created = await Customer.create(customerData);
             setShowCreateModal(false);
-            loadCustomers();
+            applyChange({ op: 'upsert', id: created.id, record: created });
+            loadStatusCounts();
         } catch (error) {
             console.error('Error creating customer:', error);
             alert('שגיאה ביצירת הלקוח');
@@ -59,10 +128,11 @@ export default function Customers() {
 
     const handleUpdateCustomer = async (customerId, customerData) => {
         try {
-            await Customer.update(customerId, customerData);
+            const updated = await Customer.update(customerId, customerData);
             setShowEditModal(false);
             setEditingCustomer(null);
-            loadCustomers();
+            applyChange({ op: 'upsert', id: customerId, record: updated });
+            loadStatusCounts();
         } catch (error) {
             console.error('Error updating customer:', error);
             throw error;
@@ -77,14 +147,6 @@ export default function Customers() {
         return matchesSearch && matchesStatus;
     }) : [];
 
-    const statusCounts = {
-        all: Array.isArray(customers) ? customers.length : 0,
-        lead: Array.isArray(customers) ? customers.filter(c => c.status === 'lead').length : 0,
-        prospect: Array.isArray(customers) ? customers.filter(c => c.status === 'prospect').length : 0,
-        customer: Array.isArray(customers) ? customers.filter(c => c.status === 'customer').length : 0,
-        churned: Array.isArray(customers) ? customers.filter(c => c.status === 'churned').length : 0
-    };
-
     return (
         <div className="space-y-6">
             <div className="flex justify-between items-center">
@@ -189,6 +251,18 @@ export default function Customers() {
                 />
             )}
 
+            {nextCursor && !loading && (
+                <div className="flex justify-center">
+                    <Button
+                        variant="ghost"
+                        onClick={() => loadCustomers(nextCursor)}
+                        className="glass-hover border border-white/20 text-white"
+                    >
+                        טען עוד לקוחות
+                    </Button>
+                </div>
+            )}
+
             {filteredCustomers.length === 0 && !loading && (
                 <div className="text-center py-12">
                     <Users className="w-16 h-16 mx-auto mb-4 text-white/30" />
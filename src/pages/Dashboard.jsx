@@ -2,9 +2,8 @@
 import React, { useState, useEffect } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
-import { Agent } from '@/api/entities';
-import { Customer } from '@/api/entities';
 import { Activity } from '@/api/entities';
+import { Stats } from '@/api/entities';
 import { 
     Bot, 
     Users, 
@@ -25,7 +24,11 @@ export default function Dashboard() {
         totalAgents: 0,
         activeAgents: 0,
         totalCustomers: 0,
-        totalActivities: 0
+        newCustomers: 0,
+        totalActivities: 0,
+        interactionsToday: 0,
+        successRate: 0,
+        successRateChange: 0
     });
     const [recentActivities, setRecentActivities] = useState([]);
     const [performanceData, setPerformanceData] = useState([]);
@@ -35,30 +38,41 @@ export default function Dashboard() {
         loadDashboardData();
     }, []);
 
+    const sumDays = (days, pick) => days.reduce((sum, day) => sum + pick(day), 0);
+    const successRate = (days) => {
+        const total = sumDays(days, day => day.total);
+        return total ? Math.round(sumDays(days, day => day.status.success || 0) / total * 1000) / 10 : 0;
+    };
+
     const loadDashboardData = async () => {
         try {
-            const [agents, customers, activities] = await Promise.all([
-                Agent.list(),
-                Customer.list(),
+            // Two weeks, so this week's success rate can be compared with last week's.
+            const [counts, activities] = await Promise.all([
+                Stats.get({ days: 14 }),
                 Activity.list('-created_date', 10)
             ]);
+            const thisWeek = counts.activities.daily.slice(7);
+            const lastWeek = counts.activities.daily.slice(0, 7);
+            const rate = successRate(thisWeek);
 
             setStats({
-                totalAgents: Array.isArray(agents) ? agents.length : 0,
-                activeAgents: Array.isArray(agents) ? agents.filter(a => a.status === 'active').length : 0,
-                totalCustomers: Array.isArray(customers) ? customers.length : 0,
-                totalActivities: Array.isArray(activities) ? activities.length : 0
+                totalAgents: counts.agents.total,
+                activeAgents: counts.agents.status.active || 0,
+                totalCustomers: counts.customers.total,
+                newCustomers: sumDays(counts.customers.daily.slice(7), day => day.total),
+                totalActivities: counts.activities.total,
+                interactionsToday: thisWeek[thisWeek.length - 1].total,
+                successRate: rate,
+                successRateChange: Math.round((rate - successRate(lastWeek)) * 10) / 10
             });
 
             setRecentActivities(Array.isArray(activities) ? activities : []);
 
-            // Generate mock performance data
-            const mockData = Array.from({ length: 7 }, (_, i) => ({
-                day: new Date(Date.now() - (6 - i) * 24 * 60 * 60 * 1000).toLocaleDateString('he-IL', { weekday: 'short' }),
-                interactions: Math.floor(Math.random() * 100) + 20,
-                success_rate: Math.floor(Math.random() * 30) + 70
-            }));
-            setPerformanceData(mockData);
+            setPerformanceData(thisWeek.map(day => ({
+                day: new Date(`${day.day}T00:00:00Z`).toLocaleDateString('he-IL', { weekday: 'short' }),
+                interactions: day.total,
+                success_rate: successRate([day])
+            })));
 
         } catch (error) {
             console.error('Error loading dashboard data:', error);
@@ -128,7 +142,7 @@ export default function Dashboard() {
                                 <p className="text-2xl lg:text-3xl font-bold text-white">{stats.totalCustomers}</p>
                                 <p className="text-green-400 text-xs flex items-center gap-1">
                                     <TrendingUp className="w-3 h-3" />
-                                    +12% השבוע
+                                    +{stats.newCustomers} השבוע
                                 </p>
                             </div>
                             <div className="w-10 h-10 lg:w-12 lg:h-12 gradient-success rounded-xl flex items-center justify-center">
@@ -143,7 +157,7 @@ export default function Dashboard() {
                         <div className="flex items-center justify-between">
                             <div>
                                 <p className="text-white/70 text-xs lg:text-sm">אינטראקציות היום</p>
-                                <p className="text-2xl lg:text-3xl font-bold text-white">247</p>
+                                <p className="text-2xl lg:text-3xl font-bold text-white">{stats.interactionsToday}</p>
                                 <p className="text-blue-400 text-xs flex items-center gap-1">
                                     <Clock className="w-3 h-3" />
                                     זמן תגובה: 2.3 שניות
@@ -161,10 +175,10 @@ export default function Dashboard() {
                         <div className="flex items-center justify-between">
                             <div>
                                 <p className="text-white/70 text-xs lg:text-sm">שיעור הצלחה</p>
-                                <p className="text-2xl lg:text-3xl font-bold text-white">94.2%</p>
-                                <p className="text-green-400 text-xs flex items-center gap-1">
+                                <p className="text-2xl lg:text-3xl font-bold text-white">{stats.successRate}%</p>
+                                <p className={`${stats.successRateChange < 0 ? 'text-red-400' : 'text-green-400'} text-xs flex items-center gap-1`}>
                                     <CheckCircle className="w-3 h-3" />
-                                    +2.1% מהחודש שעבר
+                                    {stats.successRateChange >= 0 ? '+' : ''}{stats.successRateChange}% מהשבוע שעבר
                                 </p>
                             </div>
                             <div className="w-10 h-10 lg:w-12 lg:h-12 bg-green-500/20 rounded-xl flex items-center justify-center">
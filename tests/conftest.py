@@ -0,0 +1,9 @@
+"""Shared setup: the app is imported on the memory backend, with no Gemini or Google credentials."""
+import os
+import sys
+
+os.environ["STORAGE_BACKEND"] = "memory"
+for name in ("GEMINI_API_KEY", "GOOGLE_CLIENT_SECRET"):
+    os.environ.pop(name, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
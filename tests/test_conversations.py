@@ -0,0 +1,45 @@
+"""Chat history is read and written on threads, never on the event loop, and concurrent turns are all kept."""
+import asyncio
+import threading
+
+from backend.conversations import ConversationStore
+from backend.storage import MemoryRepository
+
+
+class ThreadCheckingRepository(MemoryRepository):
+    """Records which threads touched the collection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def get(self, record_id, default=None):
+        self.threads.add(threading.get_ident())
+        return super().get(record_id, default)
+
+    def __setitem__(self, record_id, obj):
+        self.threads.add(threading.get_ident())
+        super().__setitem__(record_id, obj)
+
+
+def test_turns_and_summaries_are_stored_off_the_loop(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    repo = ThreadCheckingRepository("conversations", tenant_field="user_id")
+    store = ConversationStore(repo, context_budget=200)
+
+    conversation = store.load("user-1", "agent-1", "session-1")
+    repo.threads.clear()
+
+    async def chat():
+        loop_thread = threading.get_ident()
+        await asyncio.gather(*(
+            store.append(conversation, {"sender": "user", "text": f"הודעה מספר {i} " * 10}) for i in range(12)
+        ))
+        await asyncio.gather(*store._tasks)
+        return loop_thread
+
+    loop_thread = asyncio.run(chat())
+    assert repo.threads and loop_thread not in repo.threads
+    stored = repo["agent-1:session-1"]
+    assert stored["summary"] and stored["summarized_turns"] > 0
+    assert stored["summarized_turns"] + len(stored["turns"]) == 12
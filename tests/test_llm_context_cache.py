@@ -0,0 +1,73 @@
+"""Cached content is created outside the lock, once per instruction, and only a rejection stops the retries."""
+import threading
+import time
+
+import pytest
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable, TooManyRequests
+
+from backend import llm
+
+
+class FakeCaching:
+    """Stands in for ``CachedContent.create``; blocks while ``gate`` is closed and raises what ``errors`` holds."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.errors = []
+        self.calls = []
+
+    def create(self, model, system_instruction, ttl):
+        self.calls.append(system_instruction)
+        self.gate.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"cached:{system_instruction}"
+
+
+@pytest.fixture
+def caching(monkeypatch):
+    fake = FakeCaching()
+    monkeypatch.setattr(llm.caching.CachedContent, "create", fake.create)
+    monkeypatch.setattr(llm.genai.GenerativeModel, "from_cached_content", staticmethod(lambda cached: cached))
+    monkeypatch.setattr(llm, "_plain_model", lambda model_name, system_instruction: "plain")
+    for name, empty in (("_context_models", {}), ("_context_unavailable", set()),
+                        ("_context_creating", set()), ("_context_retry_at", {})):
+        monkeypatch.setattr(llm, name, empty, raising=False)
+    return fake
+
+
+def test_a_slow_create_blocks_nobody(caching):
+    assert llm._model("gemini", "ready") == "cached:ready"
+    caching.gate.clear()
+    creating = threading.Thread(target=llm._model, args=("gemini", "slow"))
+    creating.start()
+    while not caching.calls[1:]:
+        pass
+    # Another instruction's cached model, and the same instruction uncached, come without waiting.
+    began = time.monotonic()
+    assert llm._model("gemini", "ready") == "cached:ready"
+    assert llm._model("gemini", "slow") == "plain"
+    assert time.monotonic() - began < 1
+    caching.gate.set()
+    creating.join()
+    assert llm._model("gemini", "slow") == "cached:slow"
+    assert caching.calls == ["ready", "slow"]
+
+
+@pytest.mark.parametrize("error", [TooManyRequests("quota"), ServiceUnavailable("busy"), TimeoutError()])
+def test_transient_failures_are_retried_later(caching, monkeypatch, error):
+    caching.errors.append(error)
+    assert llm._model("gemini", "prefix") == "plain"
+    assert llm._model("gemini", "prefix") == "plain"
+    assert caching.calls == ["prefix"]
+    monkeypatch.setitem(llm._context_retry_at, ("gemini", "prefix"), 0)
+    assert llm._model("gemini", "prefix") == "cached:prefix"
+
+
+def test_a_rejected_prefix_is_not_tried_again(caching, monkeypatch):
+    caching.errors.append(InvalidArgument("Cached content is too small"))
+    assert llm._model("gemini", "short") == "plain"
+    monkeypatch.setattr(llm, "CONTEXT_CACHE_RETRY_SECONDS", 0)
+    assert llm._model("gemini", "short") == "plain"
+    assert caching.calls == ["short"]
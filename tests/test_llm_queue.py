@@ -0,0 +1,46 @@
+"""The LLM dispatcher gives a call's slot back however the call is cancelled."""
+import asyncio
+
+import pytest
+
+from backend.llm_queue import Dispatcher
+
+
+def test_a_call_cancelled_after_admission_gives_its_slot_back():
+    dispatcher = Dispatcher(1, requests_per_minute=0, tokens_per_minute=0)
+
+    async def scenario():
+        admit = dispatcher._admit
+        acquiring = asyncio.ensure_future(dispatcher.acquire())
+
+        def admit_then_cancel(waiter):
+            # The result is set, but the task is cancelled before it resumes.
+            admit(waiter)
+            acquiring.cancel()
+
+        dispatcher._admit = admit_then_cancel
+        with pytest.raises(asyncio.CancelledError):
+            await acquiring
+        dispatcher._admit = admit
+        assert dispatcher.stats()["in_flight"] == 0
+        await asyncio.wait_for(dispatcher.acquire(), 1)
+        dispatcher.release()
+
+    asyncio.run(scenario())
+
+
+def test_a_call_cancelled_while_queued_leaves_the_queue():
+    dispatcher = Dispatcher(1, requests_per_minute=0, tokens_per_minute=0)
+
+    async def scenario():
+        await dispatcher.acquire()
+        queued = asyncio.ensure_future(dispatcher.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        dispatcher.release()
+        await asyncio.wait_for(dispatcher.acquire(), 1)
+        assert dispatcher.stats()["in_flight"] == 1
+
+    asyncio.run(scenario())
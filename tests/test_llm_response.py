@@ -0,0 +1,55 @@
+"""The streaming envelope parser reads malformed answers as plain text, like parse_envelope, instead of raising."""
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.llm_response import EnvelopeStream, parse_envelope
+
+# Not JSON, so parse_envelope answers with the whole text.
+NOT_JSON = [
+    '{response: "מחפש לקוח...", tool_to_call: null}',
+    '{"response": "\\uZZZZ"}',
+    '{"response": "\\x41 בדיקה", "tool_to_call": null}',
+    '{"response" "חסרות נקודתיים"}',
+    '{"resp\\qonse": "x"}',
+]
+
+
+def stream(text, chunk_size):
+    parser = EnvelopeStream()
+    tokens = []
+    for start in range(0, len(text), chunk_size):
+        tokens += [data for event, data in parser.feed(text[start:start + chunk_size]) if event == "token"]
+    return "".join(tokens)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 1000])
+@pytest.mark.parametrize("text", NOT_JSON)
+def test_answers_that_are_not_json_stream_as_plain_text(text, chunk_size):
+    assert stream(text, chunk_size) == parse_envelope(text)["response"] == text
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_a_bad_escape_mid_response_streams_the_rest_as_it_is(chunk_size):
+    assert stream('{"response": "שלום \\uZZZZ עולם"}', chunk_size) == 'שלום \\uZZZZ עולם"}'
+    # Surrogate pairs, and lone surrogates as json.loads keeps them.
+    assert stream('{"response": "a\\ud83d\\ude00b \\ud83dc"}', chunk_size) == json.loads('"a\\ud83d\\ude00b \\ud83dc"')
+
+
+def test_the_stream_endpoint_sends_no_error_for_malformed_answers(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    answer = NOT_JSON[0]
+
+    async def fake_stream(prompt, **options):
+        for start in range(0, len(answer), 4):
+            yield answer[start:start + 4]
+
+    monkeypatch.setattr(main.llm, "stream", fake_stream)
+    response = TestClient(main.app).post("/invoke-llm/stream", json={"prompt": f"שלום {uuid.uuid4().hex}"})
+    events = [line.split(": ", 1)[1] for line in response.text.splitlines() if line.startswith("event: ")]
+    assert "error" not in events and events[-1] == "done"
+    done = json.loads(response.text.rsplit("data: ", 1)[1])
+    assert done["response"] == answer and done["tool_calls"] == []
@@ -0,0 +1,25 @@
+"""Created and updated records are answered as stored, owner included."""
+import pytest
+
+from backend import main
+from backend.storage import Database, MemoryRepository, SQLiteRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def customers(request, tmp_path):
+    if request.param == "memory":
+        repo = MemoryRepository("customers", ("status",), "user_id")
+    else:
+        repo = SQLiteRepository(Database(str(tmp_path / "app.db")), "customers", ("status",), "user_id")
+    return repo.tenant("user-2")
+
+
+def test_created_and_updated_records_carry_their_owner(customers):
+    payload = main.CustomerIn(name="נועה ברק", email="noa@example.com", company="ברק ושות'")
+    created = main.create_record(customers, payload)
+    assert created["user_id"] == "user-2"
+    assert created == customers[created["id"]]
+
+    updated = main.update_record(customers, created["id"], main.CustomerIn(**{**created, "name": "נועה ברק-לוי"}))
+    assert updated["user_id"] == "user-2"
+    assert updated == customers[created["id"]]
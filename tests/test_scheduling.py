@@ -0,0 +1,55 @@
+"""A due job is run once across a leader handoff, even when the old leader stalled."""
+import time
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from backend import scheduling
+from backend.storage import Database, Lease, MemoryRepository
+
+LEASE_SECONDS = 0.2
+
+
+def jobstore(db, lease):
+    store = scheduling.SQLiteJobStore(db, lease=lease)
+    scheduler = BackgroundScheduler(jobstores={"default": store})
+    scheduler.start(paused=True)
+    return scheduler, store
+
+
+def test_a_stalled_leader_leaves_due_jobs_to_the_next_one(tmp_path):
+    db = Database(str(tmp_path / "app.db"))
+    old, new = Lease(db, "scheduler", LEASE_SECONDS), Lease(db, "scheduler", LEASE_SECONDS)
+    assert old.acquire()
+    scheduler, store = jobstore(db, old)
+    due = datetime.now(timezone.utc) - timedelta(seconds=1)
+    scheduler.add_job(scheduling.run_job, "interval", minutes=5, args=["task-1"], id="task_task-1", next_run_time=due)
+    assert [job.id for job in store.get_due_jobs(datetime.now(timezone.utc))] == ["task_task-1"]
+
+    time.sleep(LEASE_SECONDS * 1.5)  # the old leader stalls past its lease
+    assert new.acquire()
+    assert store.get_due_jobs(datetime.now(timezone.utc)) == []
+    new_scheduler, new_store = jobstore(db, new)
+    assert [job.id for job in new_store.get_due_jobs(datetime.now(timezone.utc))] == ["task_task-1"]
+    scheduler.shutdown(wait=False)
+    new_scheduler.shutdown(wait=False)
+
+
+def test_a_run_skipped_after_the_lease_lapsed_runs_once_on_the_new_leader(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "app.db"))
+    skipped = MemoryRepository("scheduler_skipped_runs")
+    old, new = scheduling.TaskScheduler(), scheduling.TaskScheduler()
+    old.lease, new.lease = Lease(db, "scheduler", LEASE_SECONDS), Lease(db, "scheduler", LEASE_SECONDS)
+    old._skipped = new._skipped = skipped
+    assert old.lease.acquire()
+    time.sleep(LEASE_SECONDS * 1.5)
+    assert new.lease.acquire()
+
+    # The old leader handed the job out before stalling; it runs only now.
+    monkeypatch.setattr(scheduling, "task_scheduler", old)
+    scheduling.run_job("task-1")
+    runs = []
+    monkeypatch.setattr(new, "run_now", lambda task_id, trigger: runs.append((task_id, trigger)))
+    new._run_skipped()
+    new._run_skipped()
+    assert runs == [("task-1", "schedule")]
@@ -0,0 +1,58 @@
+"""The search index answers like a substring scan on every field, for short queries too, and reuses deleted slots."""
+import random
+
+import pytest
+
+from backend import search_index
+from backend.search_index import SearchIndex
+
+NAMES = ["דוד כהן", "שרה לוי", "Yosi Cohen", "Dana", "אבי", "x", "ab", "Noa Barak"]
+QUERIES = ["", "a", "ab", "abc", "co", "coh", "yosi c", "ה", "כה", "לוי", "zz", "LEAD", "ust", "customers"]
+
+
+def scan(records, order, filters):
+    """What search_customers did before the index."""
+    def matches(obj):
+        return all(str(value).lower() in str(obj.get(field, "")).lower() for field, value in filters.items())
+    return [record_id for record_id in order if matches(records[record_id])]
+
+
+@pytest.fixture
+def small_compactions(monkeypatch):
+    monkeypatch.setattr(search_index, "COMPACT_MIN_SLOTS", 16)
+
+
+def test_lookups_match_a_scan_through_writes_deletes_and_compactions(small_compactions):
+    rng = random.Random(0)
+    index = SearchIndex(exact_fields=("status",), text_fields=("name",))
+    records, order = {}, []
+    for step in range(6000):
+        record_id = f"customer-{rng.randrange(200)}"
+        if rng.random() < 0.4:
+            index.update(record_id, None)
+            if records.pop(record_id, None) is not None:
+                order.remove(record_id)
+        else:
+            obj = {"status": rng.choice(["lead", "customer"]), "name": " ".join(rng.sample(NAMES, rng.randint(1, 2)))}
+            index.update(record_id, obj)
+            if record_id not in records:
+                order.append(record_id)
+            records[record_id] = obj
+        if step % 300 == 0:
+            for query in QUERIES:
+                for filters in ({"name": query}, {"name": query, "status": "lead"}, {"status": query}):
+                    assert index.lookup(filters)[0] == scan(records, order, filters), (step, filters)
+    assert index.stats()["slots"] <= 2 * max(16, len(records))
+
+
+def test_deleted_slots_are_reclaimed(small_compactions):
+    index = SearchIndex(text_fields=("name",))
+    for batch in range(50):
+        for i in range(100):
+            index.update(f"customer-{batch}-{i}", {"name": f"name {i}"})
+        for i in range(100):
+            index.update(f"customer-{batch}-{i}", None)
+    index.update("last", {"name": "last one"})
+    # 5001 slots without compaction; at most COMPACT_MIN_SLOTS empty ones are left.
+    assert index.stats()["records"] == 1 and index.stats()["slots"] <= 16 + 1
+    assert index.lookup({"name": "la"})[0] == ["last"]
@@ -0,0 +1,109 @@
+"""The memory and SQLite repositories answer the same queries the same way."""
+import random
+from datetime import datetime
+
+import pytest
+
+from backend.storage import Database, MemoryRepository, SQLiteRepository, put_and_delete
+
+INDEXED_FIELDS = ("status", "created_date")
+
+
+@pytest.fixture
+def repos(tmp_path):
+    return (
+        MemoryRepository("customers", INDEXED_FIELDS, "user_id"),
+        SQLiteRepository(Database(str(tmp_path / "app.db")), "customers", INDEXED_FIELDS, "user_id"),
+    )
+
+
+def page_through(repo, where, sort, limit=7):
+    ids, after = [], None
+    while True:
+        records, after = repo.query(where, sort=sort, limit=limit, after=after)
+        ids += [obj["id"] for obj in records]
+        if after is None:
+            return ids
+
+
+@pytest.mark.parametrize("where", [None, {"user_id": "user-1"}, {"user_id": "user-2", "status": "lead"}, {"status": "customer"}])
+@pytest.mark.parametrize("sort", ["created_date", "-created_date", "status", "-name"])
+def test_sorted_pages_match_after_random_writes(repos, where, sort):
+    rng = random.Random(0)
+    for step in range(1500):
+        record_id = f"customer-{rng.randrange(150)}"
+        obj = None if rng.random() < 0.2 else {
+            "id": record_id,
+            "user_id": f"user-{rng.randrange(3)}",
+            "name": f"name {rng.randrange(11)}",
+            "status": rng.choice(("lead", "prospect", "customer")),
+            "created_date": f"2024-01-{rng.randrange(1, 29):02d}",
+        }
+        for repo in repos:
+            if obj is None:
+                repo.pop(record_id, None)
+            else:
+                repo[record_id] = obj
+        if step % 250 == 0:
+            memory, sqlite = repos
+            assert page_through(memory, where, sort) == page_through(sqlite, where, sort)
+
+
+FILTER_RECORDS = [
+    {"id": "c1", "user_id": "user-1", "status": "lead", "visits": 3, "score": 1.5, "vip": True,
+     "manager": None, "next_call": datetime(2024, 5, 1, 9, 30), "name": "דוד"},
+    {"id": "c2", "user_id": "user-1", "status": True, "visits": "3", "score": 2, "vip": False,
+     "next_call": "2024-05-01T09:30:00", "name": "3"},
+    {"id": "c3", "user_id": "user-2", "status": 7, "visits": 30, "score": 1.5, "vip": "true",
+     "manager": "", "next_call": datetime(2024, 5, 2), "name": "true"},
+]
+
+
+@pytest.mark.parametrize("where", [
+    {"visits": 3}, {"visits": "3"}, {"score": 1.5}, {"score": 2}, {"vip": True}, {"vip": "true"}, {"vip": False},
+    {"manager": None}, {"manager": ""}, {"next_call": datetime(2024, 5, 1, 9, 30)},
+    {"next_call": "2024-05-02T00:00:00"}, {"name": 3}, {"name": True}, {"name": "דוד"},
+    {"status": True}, {"status": 7}, {"status": "lead"}, {"user_id": "user-1", "vip": True},
+])
+def test_filters_match_the_same_records_on_both_backends(repos, where):
+    memory, sqlite = repos
+    for repo in repos:
+        for obj in FILTER_RECORDS:
+            repo[obj["id"]] = obj
+    expected = [obj["id"] for obj in memory.find(**where)]
+    assert expected, "every filter matches something"
+    assert [obj["id"] for obj in sqlite.find(**where)] == expected
+    assert [obj["id"] for obj in sqlite.query(where, sort="-created_date")[0]] == expected[::-1]
+    assert sqlite.count(where) == memory.count(where) == len(expected)
+    assert [obj["id"] for obj in sqlite.tenant("user-1").find(**where)] == [
+        obj["id"] for obj in memory.tenant("user-1").find(**where)]
+
+
+@pytest.mark.parametrize("fields", [["vip"], ["status", "visits", "score"], ["manager", "next_call", "missing"]])
+def test_projections_keep_json_types_on_both_backends(repos, fields):
+    memory, sqlite = repos
+    for repo in repos:
+        for obj in FILTER_RECORDS:
+            repo[obj["id"]] = obj
+    # Compared as text: in Python, True == 1.
+    expected = memory.query_json(fields=fields)[0]
+    assert sqlite.query_json(fields=fields)[0] == expected
+    assert sqlite.query_json({"user_id": "user-1"}, fields=fields)[0] == expected[:2]
+
+
+def test_put_and_delete_commit_together_on_one_database(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "app.db"))
+    rollups, records = SQLiteRepository(db, "rollups"), SQLiteRepository(db, "records")
+    records["r1"] = {"id": "r1"}
+    assert put_and_delete(rollups, [("day", {"id": "day", "n": 1})], records, ["r1", "r2"]) == ["r1"]
+    assert rollups["day"]["n"] == 1 and "r1" not in records
+
+    records["r3"] = {"id": "r3"}
+
+    def crash(conn, record_ids):
+        raise RuntimeError("process died")
+
+    monkeypatch.setattr(records, "_delete_rows", crash)
+    with pytest.raises(RuntimeError):
+        put_and_delete(rollups, [("day", {"id": "day", "n": 2})], records, ["r3"])
+    assert rollups["day"]["n"] == 1 and "r3" in records
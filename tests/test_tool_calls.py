@@ -0,0 +1,84 @@
+"""Tool calls: independent calls of a turn run concurrently, each for the user it was made for."""
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from backend import main, workflows
+from backend.storage import MemoryRepository
+
+# More calls than asyncio's default thread pool has workers on a small machine.
+SLEEPS = [0.2, 0.3, 0.4, 0.5, 0.3, 0.2, 0.4, 0.5, 0.3, 0.2]
+
+
+def sleeping_tool(seconds: float):
+    def handler(arguments, *rest):
+        time.sleep(seconds)
+        return main.tool_result(f"slept {seconds}")
+    return handler
+
+
+@pytest.fixture
+def sleeping_tools(monkeypatch):
+    handlers = {f"sleep_{i}": sleeping_tool(seconds) for i, seconds in enumerate(SLEEPS)}
+    monkeypatch.setattr(main, "TOOL_HANDLERS", handlers)
+    return list(handlers)
+
+
+def test_turn_takes_as_long_as_the_slowest_call(sleeping_tools):
+    calls = [{"name": name, "arguments": {}} for name in sleeping_tools]
+    started = time.perf_counter()
+    outcomes = asyncio.run(main.execute_tools(calls, "user-1"))
+    elapsed = time.perf_counter() - started
+
+    assert [outcome["success"] for outcome in outcomes] == [True] * len(calls)
+    assert [outcome["result"] for outcome in outcomes] == [f"slept {seconds}" for seconds in SLEEPS]
+    assert max(SLEEPS) <= elapsed < max(SLEEPS) + 0.25, f"{elapsed:.2f}s for sleeps summing to {sum(SLEEPS):.1f}s"
+
+
+def test_slow_call_times_out_without_holding_up_the_others(sleeping_tools, monkeypatch):
+    monkeypatch.setattr(main, "TOOL_TIMEOUT_SECONDS", 0.35)
+    calls = [{"name": name, "arguments": {}} for name in sleeping_tools]
+    started = time.perf_counter()
+    outcomes = asyncio.run(main.execute_tools(calls, "user-1"))
+    elapsed = time.perf_counter() - started
+
+    assert [outcome["success"] for outcome in outcomes] == [seconds < 0.35 for seconds in SLEEPS]
+    assert elapsed < 0.35 + 0.25
+
+
+@pytest.fixture
+def other_users_customer():
+    main.customers["customer-of-user-2"] = {
+        "id": "customer-of-user-2", "user_id": "user-2", "name": "דנה מזרחי", "email": "dana@example.com",
+        "company": "מזרחי בע\"מ", "status": "lead", "created_date": datetime.utcnow(), "updated_date": datetime.utcnow(),
+    }
+    yield "customer-of-user-2"
+    main.customers.pop("customer-of-user-2", None)
+
+
+def test_tools_see_only_the_data_of_the_user_they_run_for(other_users_customer):
+    listing = {"name": "manage_crm", "arguments": {"action": "list_recent_customers"}}
+    as_owner, as_other = asyncio.run(main.execute_tools([listing], "user-2"))[0], asyncio.run(main.execute_tools([listing], "user-1"))[0]
+
+    assert other_users_customer in as_owner["result"] and "customer-1" not in as_owner["result"]
+    assert other_users_customer not in as_other["result"] and "customer-1" in as_other["result"]
+    lookup = {"action": "get_customer_by_id", "customer_id": other_users_customer}
+    assert "דנה מזרחי" not in main.execute_tool("manage_crm", lookup, "user-1")["result"]
+
+
+def test_scheduled_workflows_call_tools_for_the_task_owner(other_users_customer):
+    task = {
+        "id": "task-of-user-2", "user_id": "user-2", "workflow_type": "dag",
+        "workflow_definition": json.dumps({"steps": [
+            {"id": "leads", "type": "tool", "tool": "manage_crm", "arguments": {"action": "list_recent_customers"}},
+        ]}),
+    }
+    workflow = workflows.compile_workflow(task, list(main.TOOL_HANDLERS))
+    checkpoints = workflows.Checkpoints(MemoryRepository("checkpoints", tenant_field="user_id"))
+    result = asyncio.run(workflows.run_workflow(task, workflow, checkpoints, main.invoke_llm, main.execute_tools, "scheduled"))
+
+    assert result["error"] is None
+    assert "דנה מזרחי" in result["output"] and "דוד כהן" not in result["output"]
@@ -0,0 +1,126 @@
+"""Webhook triggers need the task's secret, which every webhook-enabled task has, and never block the event loop."""
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main, webhooks
+from backend.storage import MemoryRepository
+
+TASK = {
+    "agent_id": "agent-1", "task_name": "לידים חדשים", "workflow_definition": "סכם את האירוע",
+    "schedule_type": "daily", "webhook_trigger": True, "is_active": True,
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    ran = []
+
+    async def run_task(task_id, events):
+        ran.append(task_id)
+
+    monkeypatch.setattr(main.webhook_queue, "run_task", run_task)
+    created = []
+    with TestClient(main.app) as client:
+        client.created = created
+        yield client
+    for task_id in created:
+        main.tasks.pop(task_id, None)
+
+
+def create(client, **fields):
+    task = client.post("/scheduled-tasks", json={**TASK, **fields}).json()
+    client.created.append(task["id"])
+    return task
+
+
+def test_webhook_tasks_get_a_secret_and_keep_it_on_update(client):
+    task = create(client)
+    secret = task["webhook_secret"]
+    assert secret and len(secret) >= 32
+
+    # The panel's toggle and other edits send the task without its secret.
+    updated = client.put(f"/scheduled-tasks/{task['id']}", json={**TASK, "task_name": "שונה"}).json()
+    assert updated["webhook_secret"] == secret
+    assert main.tasks[task["id"]]["webhook_secret"] == secret
+
+    chosen = create(client, webhook_secret="chosen-by-the-client")
+    assert chosen["webhook_secret"] == "chosen-by-the-client"
+    assert create(client, webhook_trigger=False)["webhook_secret"] is None
+
+
+def test_events_need_the_secret_header(client):
+    task = create(client)
+    url = f"/webhooks/{task['id']}"
+    assert client.post(url, json={"lead": 1}).status_code == 401
+    assert client.post(url, json={"lead": 1}, headers={"X-Webhook-Secret": "wrong"}).status_code == 401
+    assert client.post(f"{url}?secret={task['webhook_secret']}", json={"lead": 1}).status_code == 401
+    assert client.post(url, json={"lead": 1}, headers={"X-Webhook-Secret": task["webhook_secret"]}).status_code == 202
+
+
+def test_tasks_stored_without_a_secret_accept_nothing(client):
+    task = create(client)
+    main.tasks[task["id"]] = {**main.tasks[task["id"]], "webhook_secret": None}
+    assert client.post(f"/webhooks/{task['id']}", json={}).status_code == 401
+    assert client.post(f"/webhooks/{task['id']}", json={}, headers={"X-Webhook-Secret": ""}).status_code == 401
+
+
+class LockedKeys(MemoryRepository):
+    """A keys collection whose writes wait, like SQLite behind another process's write lock."""
+
+    def add(self, record_id, obj):
+        time.sleep(0.3)
+        return super().add(record_id, obj)
+
+
+def test_idempotency_claims_wait_off_the_event_loop():
+    queue = webhooks.WebhookQueue(run_task=None, keys=LockedKeys("webhook_keys"), coalesce_seconds=60)
+    queue._hooks["task-1"] = "secret"
+
+    async def burst():
+        queue.start()
+        loop_thread = threading.get_ident()
+        began = time.perf_counter()
+        claimed = asyncio.ensure_future(queue.offer("task-1", {"n": 1}, "secret", idempotency_key="k"))
+        await asyncio.sleep(0)
+        # While the claim waits, events without a key are still accepted at once.
+        assert (await queue.offer("task-1", {"n": 2}, "secret"))[1] == "queued"
+        assert time.perf_counter() - began < 0.1 and threading.get_ident() == loop_thread
+        first, outcome = await claimed
+        again = await queue.offer("task-1", {"n": 1}, "secret", idempotency_key="k")
+        await queue.stop()
+        return first, outcome, again
+
+    first, outcome, again = asyncio.run(burst())
+    assert outcome == "coalesced" and again == (first, "duplicate")
+
+
+class SlowCheck(MemoryRepository):
+    """A keys collection slow to answer a lookup, which widens any gap between check and write."""
+
+    def __contains__(self, record_id):
+        found = super().__contains__(record_id)
+        time.sleep(0.01)
+        return found
+
+
+def test_concurrent_claims_of_one_key_have_one_winner():
+    queue = webhooks.WebhookQueue(run_task=None, keys=SlowCheck("webhook_keys"))
+    start = threading.Barrier(8)
+    winners = []
+
+    def claim(n):
+        start.wait()
+        event_id = f"event-{n}"
+        if queue._claim("task-1", "k", event_id) == event_id:
+            winners.append(event_id)
+
+    threads = [threading.Thread(target=claim, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(winners) == 1
@@ -0,0 +1,112 @@
+"""Scheduled workflows: failed LLM steps are redone on the next run, and checkpoints stay with their task's owner."""
+import asyncio
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main, workflows
+from backend.storage import MemoryRepository
+
+
+class FlakyGemini:
+    """Stands in for ``llm.generate``; raises for prompts containing ``failing`` while ``down``."""
+
+    def __init__(self, failing: str):
+        self.failing = failing
+        self.down = True
+        self.prompts = []
+
+    async def generate(self, prompt, **options):
+        self.prompts.append(prompt)
+        if self.down and self.failing in prompt:
+            raise ConnectionError("503 Service Unavailable")
+        return json.dumps({"response": f"answer to {prompt.splitlines()[0]}", "tool_to_call": None})
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    fake = FlakyGemini("summarize")
+    monkeypatch.setattr(main.llm, "generate", fake.generate)
+    return fake
+
+
+def test_llm_failure_mid_dag_fails_the_step_and_resume_reruns_only_it(gemini):
+    run_id = uuid.uuid4().hex  # keeps the prompts out of the response cache of other tests
+    task = {
+        "id": f"task-{run_id}", "user_id": "user-1", "workflow_type": "dag",
+        "workflow_definition": json.dumps({"steps": [
+            {"id": "leads", "type": "llm", "prompt": f"list leads {run_id}"},
+            {"id": "events", "type": "tool", "tool": "manage_calendar", "arguments": {"action": "list_events"}},
+            {"id": "summary", "type": "llm", "depends_on": ["leads", "events"],
+             "prompt": f"summarize {run_id}\n{{{{leads}}}}\n{{{{events}}}}"},
+            {"id": "email", "type": "llm", "depends_on": ["summary"], "prompt": f"draft email {run_id}\n{{{{summary}}}}"},
+        ]}),
+    }
+    workflow = workflows.compile_workflow(task, list(main.TOOL_HANDLERS))
+    checkpoints = workflows.Checkpoints(MemoryRepository("checkpoints", tenant_field="user_id"))
+
+    def run():
+        return asyncio.run(workflows.run_workflow(
+            task, workflow, checkpoints, main.generate_envelope, main.execute_tools, "scheduled",
+        ))
+
+    failed = run()
+    assert failed["output"] is None and "503" in failed["error"]
+    assert {step["id"]: step["status"] for step in failed["steps"]} == {
+        "leads": "success", "events": "success", "summary": "failed", "email": "skipped",
+    }
+    assert set(checkpoints.repo[task["id"]]["outputs"]) == {"leads", "events"}
+
+    gemini.down = False
+    gemini.prompts.clear()
+    resumed = run()
+    assert resumed["error"] is None and resumed["resumed_steps"] == 2
+    assert [prompt.splitlines()[0] for prompt in gemini.prompts] == [f"summarize {run_id}", f"draft email {run_id}"]
+    assert resumed["output"] == f"answer to draft email {run_id}"
+    assert task["id"] not in checkpoints.repo
+
+
+def test_placeholders_in_a_prompt_workflow_are_sent_as_written(gemini):
+    run_id = uuid.uuid4().hex
+    prompt = f"Email the leads {run_id}. Start with: Hi {{{{first_name}}}}, {{{{ webhook }}}}"
+    task = {"id": f"task-{run_id}", "user_id": "user-1", "workflow_type": "prompt", "workflow_definition": prompt}
+    workflow = workflows.compile_workflow(task, list(main.TOOL_HANDLERS))
+    checkpoints = workflows.Checkpoints(MemoryRepository("checkpoints", tenant_field="user_id"))
+    result = asyncio.run(workflows.run_workflow(
+        task, workflow, checkpoints, main.generate_envelope, main.execute_tools, "scheduled",
+    ))
+    assert result["error"] is None
+    assert "Hi {{first_name}}, " in gemini.prompts[-1] and "{{ webhook }}" not in gemini.prompts[-1]
+
+
+def test_invoke_llm_endpoint_still_falls_back(gemini):
+    answer = asyncio.run(main.invoke_llm({"prompt": f"summarize {uuid.uuid4().hex}", "tools": ["manage_crm"]}))
+    assert answer["tool_calls"] == [] and "manage_crm" in answer["response"]
+
+
+@pytest.fixture
+def other_users_task():
+    task = {
+        "id": "task-of-user-2", "user_id": "user-2", "agent_id": "agent-1", "task_name": "דוח שבועי",
+        "workflow_definition": "סכם את השבוע", "schedule_type": "daily", "is_active": False,
+        "created_date": datetime.utcnow(), "updated_date": datetime.utcnow(),
+    }
+    main.tasks[task["id"]] = task
+    main.workflow_checkpoints.save(task, "source", {"step": "output"})
+    yield task
+    main.tasks.pop(task["id"], None)
+    main.workflow_checkpoints.clear(task["id"])
+
+
+def test_tasks_of_other_users_cannot_be_updated_or_deleted(other_users_task):
+    client = TestClient(main.app)
+    payload = {"agent_id": "agent-1", "task_name": "נחטף", "workflow_definition": "x", "schedule_type": "daily"}
+
+    assert client.put(f"/scheduled-tasks/{other_users_task['id']}", json=payload).status_code == 404
+    assert client.delete(f"/scheduled-tasks/{other_users_task['id']}").status_code == 404
+    assert main.tasks[other_users_task["id"]]["task_name"] == "דוח שבועי"
+    assert other_users_task["id"] in main.workflow_checkpoints.repo